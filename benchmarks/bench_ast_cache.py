@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+解析とキャッシュ（.tyxast）の読み込みの比較
+
+sample/sample.tex の本文を繰り返して大きな文書を作り、解析の時間と、解析結果をキャッシュに
+保存してから読み込む時間（ファイルの読み込みと文書全体・先頭のブロックの組み立て）を比べる。
+読み込んだ木は解析した木と一致することを確認する。
+
+使い方: python benchmarks/bench_ast_cache.py [--repeat N] [--runs N]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from tyx.parser.ast_cache import ast_cache  # noqa: E402
+from tyx.parser.tex_parser_improved import ImprovedTeXParser  # noqa: E402
+from tyx.utils.labels import LabelIndex  # noqa: E402
+
+
+def signature(node):
+    """ノードの比較用の値（子孫を含む）"""
+    values = {key: value for key, value in vars(node).items() if key != 'children'}
+    return (type(node).__name__, sorted((key, repr(value)) for key, value in values.items()),
+            tuple(signature(child) for child in node.children))
+
+
+def build_document(repeat: int) -> str:
+    """sample.texの本文をrepeat回繰り返した文書"""
+    with open(os.path.join(ROOT, 'sample', 'sample.tex'), 'r', encoding='utf-8') as f:
+        sample = f.read()
+    begin = sample.index('\\begin{document}') + len('\\begin{document}')
+    end = sample.rindex('\\end{document}')
+    return sample[:begin] + sample[begin:end] * repeat + '\\end{document}\n'
+
+
+def best_of(runs: int, function) -> float:
+    """runs回のうち最短の時間（秒）"""
+    best = float('inf')
+    for _ in range(runs):
+        began = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - began)
+    return best
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=30, help="本文を繰り返す回数")
+    parser.add_argument('--runs', type=int, default=3, help="計測の回数（最短を採る）")
+    args = parser.parse_args()
+
+    text = build_document(args.repeat)
+    digest = LabelIndex.content_hash(text)
+    tex_parser = ImprovedTeXParser()
+    document = tex_parser.parse(text)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = ast_cache.cache_path(os.path.join(directory, 'document.tex'))
+        began = time.perf_counter()
+        ast_cache.save(path, document, digest, 'bench', tex_parser.problems)
+        save_time = time.perf_counter() - began
+        size = os.path.getsize(path)
+
+        if signature(ast_cache.load(path, digest, 'bench').document()) != signature(document):
+            print("cached tree differs from the parsed tree")
+            return 1
+
+        parse_time = best_of(args.runs, lambda: tex_parser.parse(text))
+        load_time = best_of(args.runs, lambda: ast_cache.load(path, digest, 'bench').document())
+        block_time = best_of(args.runs, lambda: ast_cache.load(path, digest, 'bench').block(0))
+
+    print(f"{len(text) / 1e6:.2f} MB document, {len(document.children)} blocks, "
+          f"cache {size / 1e6:.2f} MB (saved in {save_time * 1000:.0f} ms)")
+    print(f"  {'parse':16} {parse_time * 1000:9.1f} ms")
+    print(f"  {'load document':16} {load_time * 1000:9.1f} ms  ({parse_time / load_time:.1f}x)")
+    print(f"  {'load first block':16} {block_time * 1000:9.1f} ms  ({parse_time / block_time:.0f}x)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+.bibファイルの索引と引用エントリの書き出しの時間
+
+エントリを大量に含む.bibを生成し、索引（BibFile.scan）の時間、保存した索引を使う場合
+（BibIndex.load とハッシュの確認）の時間、引用キーの検証と引用されたエントリの書き出しの時間を測る。
+
+使い方: python benchmarks/bench_bibtex.py [--entries N] [--cited N] [--runs N]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from tyx.utils.bibtex import BibFile, BibIndex  # noqa: E402
+
+
+def build_bib(entries: int) -> str:
+    """entries個のエントリを含む.bibの内容"""
+    parts = ['@string{jfa = "J. Funct. Anal."}\n']
+    for i in range(entries):
+        parts.append(f"@article{{key{i},\n"
+                     f"  author = {{Author, A. and Writer, {{B}}}},\n"
+                     f"  title = {{On the {{Navier--Stokes}} equations, part {i}}},\n"
+                     f"  journal = jfa,\n  year = {{{1950 + i % 70}}},\n"
+                     f"  pages = {{{i}--{i + 20}}},\n}}\n")
+    return '\n'.join(parts)
+
+
+def best_of(runs: int, function) -> float:
+    """runs回のうち最短の時間（秒）"""
+    best = float('inf')
+    for _ in range(runs):
+        began = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - began)
+    return best
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--entries', type=int, default=15000, help="エントリの数")
+    parser.add_argument('--cited', type=int, default=300, help="引用するキーの数")
+    parser.add_argument('--runs', type=int, default=3, help="計測の回数（最短を採る）")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    cited = {f"key{i}" for i in rng.sample(range(args.entries), min(args.cited, args.entries))}
+    cited.add('missing')
+
+    with tempfile.TemporaryDirectory() as directory:
+        bib_path = os.path.join(directory, 'refs.bib')
+        index_path = os.path.join(directory, 'index.json')
+        with open(bib_path, 'w', encoding='utf-8') as f:
+            f.write(build_bib(args.entries))
+        size = os.path.getsize(bib_path)
+
+        index = BibIndex()
+        bib_file = index.get(bib_path)
+        index.save(index_path)
+        if len(bib_file.entries) != args.entries or bib_file.problems:
+            print(f"indexed {len(bib_file.entries)} entries, problems: {bib_file.problems[:3]}")
+            return 1
+
+        scan_time = best_of(args.runs, lambda: BibFile.scan(bib_path))
+        reload_time = best_of(args.runs, lambda: BibIndex.load(index_path).get(bib_path))
+        check_time = best_of(args.runs, lambda: BibIndex.undefined_keys(cited, [bib_file]))
+        extract_time = best_of(args.runs, lambda: bib_file.extract(cited))
+        undefined = BibIndex.undefined_keys(cited, [bib_file])
+
+    print(f"{size / 1e6:.2f} MB, {args.entries} entries, {len(cited)} cited keys "
+          f"({len(undefined)} undefined)")
+    print(f"  {'scan':16} {scan_time * 1000:9.1f} ms")
+    print(f"  {'reuse index':16} {reload_time * 1000:9.1f} ms  ({scan_time / reload_time:.1f}x)")
+    print(f"  {'check keys':16} {check_time * 1000:9.3f} ms")
+    print(f"  {'extract cited':16} {extract_time * 1000:9.1f} ms")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Converterのスレッド並行ストレステストとスループット比較
+
+1つのConverterを複数スレッドで共有して変換し、全結果が逐次変換と一致することを確認する。
+あわせてスレッドプールとプロセスプールのスループットを表示する。
+
+使い方: python benchmarks/bench_converter_threads.py [--jobs N] [--threads T]
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from tyx import Converter  # noqa: E402
+
+_converter = Converter()
+
+
+def convert(source: str) -> str:
+    """共有のConverterで変換"""
+    return _converter.convert(source).typst
+
+
+def make_inputs(source: str) -> List[str]:
+    """ラベル名とマクロ定義を変えた入力を用意（スレッド間の状態の混入を検出するため）"""
+    head, body = source.split('\\begin{document}', 1)
+    inputs = [source]
+    for i in range(1, 4):
+        macros = f"\\newcommand{{\\tyxvar}}{{x_{{{i}}}}}\n"
+        inputs.append(head + macros + '\\begin{document}' +
+                      body.replace('\\label{', f'\\label{{v{i}-').replace('$x$', '$\\tyxvar$'))
+    return inputs
+
+
+def run(executor, inputs: List[str], jobs: int) -> List[str]:
+    """jobs件を並行に変換"""
+    return list(executor.map(convert, [inputs[i % len(inputs)] for i in range(jobs)]))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--input', default=os.path.join(ROOT, 'sample', 'sample.tex'))
+    parser.add_argument('--jobs', type=int, default=64)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    with open(args.input, 'r', encoding='utf-8') as f:
+        inputs = make_inputs(f.read())
+
+    start = time.perf_counter()
+    expected = [convert(source) for source in inputs]
+    serial = time.perf_counter() - start
+    print(f"serial: {len(inputs) / serial:.2f} docs/s")
+
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        start = time.perf_counter()
+        results = run(executor, inputs, args.jobs)
+        elapsed = time.perf_counter() - start
+    mismatches = sum(1 for i, result in enumerate(results) if result != expected[i % len(inputs)])
+    print(f"threads x{args.threads}: {args.jobs / elapsed:.2f} docs/s, "
+          f"{mismatches} mismatches / {args.jobs}")
+
+    with ProcessPoolExecutor(max_workers=args.processes) as executor:
+        run(executor, inputs, args.processes)  # ワーカーの起動を計測から除く
+        start = time.perf_counter()
+        results = run(executor, inputs, args.jobs)
+        elapsed = time.perf_counter() - start
+    process_mismatches = sum(1 for i, result in enumerate(results) if result != expected[i % len(inputs)])
+    print(f"processes x{args.processes}: {args.jobs / elapsed:.2f} docs/s, "
+          f"{process_mismatches} mismatches / {args.jobs}")
+
+    if mismatches or process_mismatches:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
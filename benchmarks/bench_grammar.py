@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+文法による抽出と正規表現による抽出の比較
+
+- 起動: スタンドアロンのパーサーの生成（キャッシュなし）、キャッシュからの読み込み、
+  メモリ上でのLarkの文法の構築にかかる時間（それぞれ新しいプロセスで計測）
+- スループット: ImprovedTeXParser と GrammarTeXParser で同じ文書を解析する時間
+- エラーからの回復: 文書を壊した入力（`}` や `$` の削除、余分な `\\end{Lemma}`、途中での打ち切り）で
+  最後まで解析できたか、記録された問題の数、壊していない文書の要素がどれだけ残ったか
+
+使い方: python benchmarks/bench_grammar.py [--input sample/sample.tex] [--repeat N] [--corruptions N] [--seed N]
+"""
+
+import argparse
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from tyx.parser.tex_parser_grammar import GrammarTeXParser  # noqa: E402
+from tyx.parser.tex_parser_improved import ImprovedTeXParser  # noqa: E402
+
+
+# tyx自体の読み込みは除き、Larkの読み込みとパーサーの準備を計測する
+STARTUP_SCRIPT = """
+import sys, time
+sys.path.insert(0, {root!r})
+from tyx.parser import tex_parser_grammar
+start = time.perf_counter()
+{body}
+print(time.perf_counter() - start)
+"""
+STARTUP_CASES = [
+    ("standalone (generate)", "tex_parser_grammar.load_tex_grammar({cache!r})", True),
+    ("standalone (cached)", "tex_parser_grammar.load_tex_grammar({cache!r})", False),
+    ("lark (in memory)", "tex_parser_grammar._build_lark()", False),
+]
+
+
+def measure_startup() -> None:
+    print("startup (new process each)")
+    with tempfile.TemporaryDirectory() as cache:
+        for label, body, fresh in STARTUP_CASES:
+            if fresh:
+                for name in os.listdir(cache):
+                    os.remove(os.path.join(cache, name))
+            script = STARTUP_SCRIPT.format(root=ROOT, body=body.format(cache=cache))
+            output = subprocess.run([sys.executable, '-c', script], capture_output=True,
+                                    text=True, check=True).stdout
+            print(f"  {label:24} {float(output.strip().splitlines()[-1]) * 1000:8.1f} ms")
+
+
+def elements(document) -> Counter:
+    """要素の (種類, 内容) の多重集合"""
+    return Counter((child.node_type.name, child.content) for child in document.children)
+
+
+def measure_throughput(parsers, text: str, repeat: int) -> None:
+    print(f"\nthroughput ({len(text)} chars x {repeat})")
+    for name, parser in parsers:
+        parser.parse(text)  # 初回の準備を除く
+        start = time.perf_counter()
+        for _ in range(repeat):
+            document = parser.parse(text)
+        elapsed = (time.perf_counter() - start) / repeat
+        print(f"  {name:24} {elapsed * 1000:8.1f} ms  {len(text) / elapsed / 1e6:6.2f} MB/s  "
+              f"{len(document.children)} elements")
+
+
+def corrupt(text: str, rng: random.Random):
+    """(説明, 壊した入力) を1つ作る"""
+    kind = rng.choice(['delete }', 'delete $', 'stray \\end', 'truncate'])
+    if kind == 'truncate':
+        cut = rng.randrange(len(text) // 4, len(text))
+        return f"truncate at {cut}", text[:cut]
+    if kind == 'stray \\end':
+        at = rng.randrange(len(text))
+        return f"stray \\end at {at}", text[:at] + '\\end{Lemma}' + text[at:]
+    target = kind[-1]
+    positions = [i for i, char in enumerate(text) if char == target]
+    at = rng.choice(positions)
+    return f"{kind} at {at}", text[:at] + text[at + 1:]
+
+
+def measure_recovery(parsers, text: str, count: int, rng: random.Random) -> None:
+    print(f"\nerror recovery ({count} corrupted inputs)")
+    clean = {name: elements(parser.parse(text)) for name, parser in parsers}
+    cases = [corrupt(text, rng) for _ in range(count)]
+    print(f"  {'parser':24} {'completed':>10} {'problems':>9} {'retained':>9} {'worst':>7}")
+    for name, parser in parsers:
+        completed, problems, retained, worst = 0, 0, 0.0, (1.0, '')
+        for description, corrupted in cases:
+            try:
+                document = parser.parse(corrupted)
+            except Exception as exc:  # 回復できなかった入力も数える
+                worst = min(worst, (0.0, f"{description}: {type(exc).__name__}"))
+                continue
+            completed += 1
+            problems += len(parser.problems)
+            reference = clean[name]
+            kept = sum((elements(document) & reference).values()) / max(1, sum(reference.values()))
+            retained += kept
+            worst = min(worst, (kept, description))
+        print(f"  {name:24} {completed:6d}/{len(cases):<3} {problems / len(cases):9.1f} "
+              f"{retained / max(1, completed):9.1%} {worst[0]:7.1%}  {worst[1]}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--input', default=os.path.join(ROOT, 'sample', 'sample.tex'))
+    parser.add_argument('--repeat', type=int, default=5, help="スループットの計測回数")
+    parser.add_argument('--corruptions', type=int, default=40, help="壊した入力の数")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with open(args.input, 'r', encoding='utf-8') as f:
+        text = f.read()
+    parsers = [("ImprovedTeXParser", ImprovedTeXParser()), ("GrammarTeXParser", GrammarTeXParser())]
+
+    measure_startup()
+    measure_throughput(parsers, text, args.repeat)
+    measure_recovery(parsers, text, args.corruptions, random.Random(args.seed))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
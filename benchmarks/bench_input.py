@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+入力の読み込み方による最大メモリ使用量（peak RSS）の比較
+
+sample/sample.tex の本文を繰り返して大きな文書（学会の予稿集をまとめたような1ファイル）を作り、
+ファイル全体を `str` として読み込む場合と、TeXSource でメモリマップする場合について、
+行単位の前処理まで（--stage lines）、記号変換を含む前処理まで（--stage preprocess）、
+解析まで（--stage parse）の時間と peak RSS をそれぞれ新しいプロセスで計測する。
+
+使い方: python benchmarks/bench_input.py [--size MB] [--stage lines|preprocess|parse]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# 読み込み前のRSSを差し引くため、tyxを読み込んでから計測を始める
+MEASURE_SCRIPT = """
+import resource, sys, time
+sys.path.insert(0, {root!r})
+from tyx.parser.source import TeXSource
+from tyx.parser.tex_parser_improved import ImprovedTeXParser
+parser = ImprovedTeXParser()
+baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+start = time.perf_counter()
+if {mode!r} == 'read':
+    with open({path!r}, 'r', encoding='utf-8') as f:
+        content = f.read()
+    source = None
+else:
+    source = content = TeXSource.open({path!r})
+if {stage!r} == 'lines':
+    lines = content.lines() if source is not None else content.split('\\n')
+    result = len(parser._join_lines(parser.preprocessor.process(lines)))
+elif {stage!r} == 'preprocess':
+    result = len(parser._preprocess(content))
+else:
+    result = len(parser.parse(content).children)
+elapsed = time.perf_counter() - start
+if source is not None:
+    source.close()
+peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(elapsed, baseline, peak, result)
+"""
+
+
+def build_document(path: str, size: int) -> int:
+    """sample.texの本文を繰り返した文書を書き込み、バイト数を返す"""
+    with open(os.path.join(ROOT, 'sample', 'sample.tex'), 'r', encoding='utf-8') as f:
+        sample = f.read()
+    begin = sample.index('\\begin{document}') + len('\\begin{document}')
+    end = sample.rindex('\\end{document}')
+    preamble, body = sample[:begin], sample[begin:end]
+    written = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        written += f.write(preamble)
+        while written < size:
+            written += f.write(body)
+        written += f.write('\\end{document}\n')
+    return os.path.getsize(path)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--size', type=float, default=20, help="文書の大きさ（MB）")
+    parser.add_argument('--stage', choices=['lines', 'preprocess', 'parse'], default='lines',
+                        help="lines: 行単位の前処理と連結まで, preprocess: 記号変換を含む前処理まで, parse: 解析まで")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'proceedings.tex')
+        size = build_document(path, int(args.size * 1e6))
+        print(f"{size / 1e6:.1f} MB document, stage: {args.stage}")
+        print(f"  {'input':8} {'time':>9} {'peak RSS':>10} {'increase':>10}")
+        results = {}
+        for mode in ('read', 'mmap'):
+            script = MEASURE_SCRIPT.format(root=ROOT, mode=mode, path=path, stage=args.stage)
+            output = subprocess.run([sys.executable, '-c', script], capture_output=True,
+                                    text=True, check=True).stdout.split()
+            elapsed, baseline, peak = float(output[0]), int(output[1]), int(output[2])
+            results[mode] = output[3]
+            # ru_maxrss はLinuxではKB単位
+            print(f"  {mode:8} {elapsed:8.2f}s {peak / 1024:8.1f}MB {(peak - baseline) / 1024:8.1f}MB")
+        if results['read'] != results['mmap']:
+            print(f"results differ: {results}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+設定による段の省略のベンチマーク
+
+既定の設定と、段を無効にした設定（tokenSplit.variables: off など）で
+同じ文書を変換し、1文書あたりの時間を比較する。
+
+使い方: python benchmarks/bench_options.py [--repeat N] [--config path.yaml ...]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from tyx import Converter, ConverterOptions  # noqa: E402
+
+
+def measure(converter: Converter, source: str, repeat: int) -> float:
+    """1文書あたりの変換時間（最良値, 秒）"""
+    converter.convert(source)
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        converter.convert(source)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--input', default=os.path.join(ROOT, 'sample', 'sample.tex'))
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--config', action='append', default=[], help="比較する設定ファイル（YAML）")
+    args = parser.parse_args()
+
+    with open(args.input, 'r', encoding='utf-8') as f:
+        source = f.read()
+
+    variants = [
+        ("default", ConverterOptions()),
+        ("tokenSplit.variables: off", ConverterOptions.from_dict({'tokenSplit.variables': 'off'})),
+    ]
+    variants.extend((path, ConverterOptions.from_yaml(path)) for path in args.config)
+
+    baseline = None
+    for name, options in variants:
+        converter = Converter(options)
+        elapsed = measure(converter, source, args.repeat)
+        baseline = baseline or elapsed
+        print(f"{name:28s} {elapsed * 1000:8.1f} ms/doc  {elapsed / baseline:6.2f}x  "
+              f"[{options.fingerprint}] {' > '.join(converter.stages)}")
+
+
+if __name__ == '__main__':
+    main()
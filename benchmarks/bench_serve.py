@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+常駐変換サービスのベンチマーク
+
+ワーカープールを起動したサービスにローカルの負荷生成器から並行にHTTP要求を送り、
+p50/p99レイテンシとスループットを表示する。
+比較として、要求ごとにPythonを起動する従来の方式も計測する。
+
+使い方: python benchmarks/bench_serve.py [--requests N] [--concurrency C] [--workers W]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from typing import List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from tyx.server import ConversionService, run_service  # noqa: E402
+
+
+def percentile(values: List[float], q: float) -> float:
+    """q分位点（最近傍法）"""
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q * len(ordered))) - 1))
+    return ordered[index]
+
+
+async def post(port: int, body: bytes) -> dict:
+    """1要求を送信して応答を受け取る"""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(
+        f"POST /convert HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode('latin-1') + body
+    )
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    return json.loads(response.split(b'\r\n\r\n', 1)[1])
+
+
+async def load(port: int, source: str, requests: int, concurrency: int) -> None:
+    """並行に要求を送り、レイテンシを集計"""
+    body = json.dumps({'direction': 'tex2typst', 'source': source}).encode('utf-8')
+    latencies: List[float] = []
+    errors = {}
+    counter = iter(range(requests))
+
+    async def client() -> None:
+        for _ in counter:
+            start = time.perf_counter()
+            result = await post(port, body)
+            if result['ok']:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors[result['status']] = errors.get(result['status'], 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    print(f"serve: {len(latencies)} ok / {requests} requests, concurrency {concurrency}")
+    if latencies:
+        print(f"  p50 {percentile(latencies, 0.50) * 1000:.1f} ms"
+              f"  p99 {percentile(latencies, 0.99) * 1000:.1f} ms"
+              f"  throughput {len(latencies) / elapsed:.1f} req/s")
+    if errors:
+        print(f"  errors: {errors}")
+
+
+def cold_start(path: str, runs: int) -> None:
+    """要求ごとにPythonを起動する場合のレイテンシ"""
+    latencies = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-m', 'tyx.cli.main', 'tex2typst', path],
+                       cwd=ROOT, check=True, stdout=subprocess.DEVNULL)
+        latencies.append(time.perf_counter() - start)
+    print(f"cold process: {runs} runs"
+          f"  p50 {percentile(latencies, 0.50) * 1000:.1f} ms"
+          f"  max {max(latencies) * 1000:.1f} ms")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--input', default=os.path.join(ROOT, 'sample', 'sample.tex'))
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--workers', type=int, default=0)
+    parser.add_argument('--queue-size', type=int, default=64)
+    parser.add_argument('--port', type=int, default=18765)
+    parser.add_argument('--cold-runs', type=int, default=5)
+    args = parser.parse_args()
+
+    with open(args.input, 'r', encoding='utf-8') as f:
+        source = f.read()
+
+    service = ConversionService(workers=args.workers, queue_size=args.queue_size)
+    ready = asyncio.Event()
+    server = asyncio.create_task(run_service(service, port=args.port, ready=ready))
+    await ready.wait()
+    try:
+        await load(args.port, source, args.requests, args.concurrency)
+        print(f"  service: {service.status()}")
+    finally:
+        server.cancel()
+        await asyncio.gather(server, return_exceptions=True)
+
+    if args.cold_runs:
+        cold_start(args.input, args.cold_runs)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
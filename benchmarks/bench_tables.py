@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+大きな表（longtable）の変換時間
+
+数値・インライン数式・\\multicolumn・罫線を含む行を生成した longtable を変換し、
+行数ごとの変換時間と、表の変換（#table の生成）で確保したメモリの最大量を測る。
+
+使い方: python benchmarks/bench_tables.py [--rows N ...] [--runs N]
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from tyx.converter import Converter  # noqa: E402
+from tyx.parser.ast import NodeType  # noqa: E402
+from tyx.parser.tex_parser_improved import ImprovedTeXParser  # noqa: E402
+from tyx.transformer.tex_to_typst import TeXToTypstTransformer  # noqa: E402
+
+
+def build_document(rows: int) -> str:
+    """rows行の longtable を含む文書"""
+    lines = ["\\documentclass{article}", "\\begin{document}",
+             "\\begin{longtable}{r|rcl}", "\\toprule", "n & value & $x$ & label \\\\", "\\midrule",
+             "\\endhead"]
+    for i in range(rows):
+        if i % 100 == 99:
+            lines.append(f"\\multicolumn{{2}}{{c}}{{block {i // 100}}} & $\\alpha_{{{i % 7}}}$ & -- \\\\ \\hline")
+        else:
+            lines.append(f"{i} & {i * 0.5:.3f} & $x_{{{i % 7}}}^{{2}}$ & run-{i} \\\\")
+    lines += ["\\bottomrule", "\\end{longtable}", "\\end{document}", ""]
+    return '\n'.join(lines)
+
+
+def best_of(runs: int, function) -> float:
+    """runs回のうち最短の時間（秒）"""
+    best = float('inf')
+    for _ in range(runs):
+        began = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - began)
+    return best
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 50000], help="表の行数")
+    parser.add_argument('--runs', type=int, default=3, help="計測の回数（最短を採る）")
+    args = parser.parse_args()
+
+    converter = Converter()
+    for rows in args.rows:
+        text = build_document(rows)
+        table = next(node for node in ImprovedTeXParser().parse(text).children
+                     if node.node_type == NodeType.TABLE)
+        transformer = TeXToTypstTransformer()
+
+        tracemalloc.start()
+        typst = transformer._transform_table(table)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        if typst.count('\n') < rows:
+            print(f"table with {rows} rows produced {typst.count(chr(10))} lines")
+            return 1
+
+        convert_time = best_of(args.runs, lambda: converter.convert(text))
+        table_time = best_of(args.runs, lambda: transformer._transform_table(table))
+        print(f"{rows:7} rows ({len(text) / 1e6:.2f} MB): convert {convert_time * 1000:8.1f} ms, "
+              f"#table {table_time * 1000:8.1f} ms, peak {peak / 1e6:.1f} MB "
+              f"({peak / len(typst):.1f} bytes per output char)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Typstの全体の解析と編集範囲の再解析の比較
+
+tex2typstで変換した.typに対して、編集（語の挿入・削除、数式の中の書き換え、行の追加）を順に適用し、
+TypstParser.reparse で編集を含むブロックだけを解析し直す時間と、毎回全体を解析する時間を比べる。
+再解析の結果は毎回全体を解析した結果と一致することを確認する。
+
+使い方: python benchmarks/bench_typst_reparse.py [--input sample/sample.tex] [--edits N] [--seed N]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from tyx.converter import Converter  # noqa: E402
+from tyx.parser.typst_parser import TypstParser  # noqa: E402
+
+
+def signature(node):
+    """ノードの比較用の値（子孫を含む）"""
+    attributes = tuple(sorted((key, repr(value)) for key, value in node.attributes.items()
+                              if key not in ('source', 'unclosed')))
+    return (node.node_type, node.content, node.meta_comment, attributes,
+            tuple(signature(child) for child in node.children))
+
+
+def make_edit(text: str, rng: random.Random):
+    """(開始位置, 終了位置, 置き換える文字列) を1つ作る"""
+    kind = rng.choice(['insert word', 'delete', 'math', 'new line'])
+    if kind == 'math':
+        dollars = [i for i, char in enumerate(text) if char == '$']
+        at = rng.choice(dollars) + 1 if dollars else rng.randrange(len(text))
+        return at, at, rng.choice(['x + ', ' y', '^2'])
+    at = rng.randrange(len(text))
+    if kind == 'delete':
+        return at, min(len(text), at + rng.randrange(1, 8)), ''
+    if kind == 'new line':
+        at = text.find('\n', at) + 1 or len(text)
+        return at, at, rng.choice(['Hence,\n', '$u ≥ 0$\n', '@eq:DW //[ref type:eqref]\n'])
+    return at, at, rng.choice(['the ', 'and ', ' '])
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--input', default=os.path.join(ROOT, 'sample', 'sample.tex'))
+    parser.add_argument('--edits', type=int, default=200, help="編集の数")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with open(args.input, 'r', encoding='utf-8') as f:
+        text = Converter().convert(f.read()).typst
+    rng = random.Random(args.seed)
+    typst_parser = TypstParser()
+    document = typst_parser.parse(text)
+    print(f"{len(text)} chars, {len(document.children)} top-level blocks, {args.edits} edits")
+
+    full_time = reparse_time = 0.0
+    reparsed = 0
+    for _ in range(args.edits):
+        start, end, replacement = make_edit(text, rng)
+        text = text[:start] + replacement + text[end:]
+
+        began = time.perf_counter()
+        document = typst_parser.reparse(document, start, end, replacement)
+        reparse_time += time.perf_counter() - began
+        reparsed += typst_parser.reparsed[1] - typst_parser.reparsed[0]
+
+        began = time.perf_counter()
+        fresh = TypstParser().parse(text)
+        full_time += time.perf_counter() - began
+
+        if [signature(child) for child in document.children] != [signature(child) for child in fresh.children]:
+            print(f"reparse differs from a full parse after editing [{start}, {end})")
+            return 1
+
+    print(f"  {'full parse':12} {full_time / args.edits * 1000:8.2f} ms/edit")
+    print(f"  {'reparse':12} {reparse_time / args.edits * 1000:8.2f} ms/edit  "
+          f"({reparsed / args.edits:.0f} chars reparsed on average)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
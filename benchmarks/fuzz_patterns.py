@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+正規表現の登録簿の耐性試験
+
+登録されたすべてのパターンに対して、バックトラックを誘発しやすい入力
+（断片の長い繰り返し、閉じのない開き、長い空白を挟んだ組み合わせなど）を生成し、
+1回の呼び出しが時間予算（予算の打ち切り＋代替処理の分として予算の2倍）を超えたら失敗とする。
+また、短いランダムな入力で代替の走査器と正規表現の結果（位置と群）が一致することを確かめる。
+パターンはすべて tyx/utils/patterns.py で登録されるため、ここで読み込むだけで全件が対象になる。
+
+使い方: python benchmarks/fuzz_patterns.py [--length N] [--pairs N] [--samples N] [--seed N]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from tyx.utils.patterns import patterns  # noqa: E402
+
+
+# 入力の断片（区切り・括弧・空白・数式の記号）
+FRAGMENTS = [
+    '\\begin{Lemma}', '\\end{Lemma}', '\\begin{proof}', '\\begin{align}', '\\end{align}',
+    '\\begin{align*}', '\\begin{equation}', '\\begin{abstract}', '\\[', '\\]', '$',
+    '\\section{', '\\label{a}', '[', ']', '{', '}', '(', ')', '(a)', '(a', '∫_{',
+    '\\|', '\\|_{', '\\bigg|', '\\Big|', '\\big|', '|', '\\,', '\\;', '_', 'a', 'ab1',
+    ' ', '\t', '\n', '\\', '\\frac{', '\\sqrt{', '\\mathrm{', '\\operatorname*{', '\\sup _',
+    '\\bibliography{', '\\end{', '∫_((', '∫^{', 'Σ_{', '^{', '^', 'x(', '//[', '"', '\\"',
+]
+# 結果の比較に使う短い入力の断片
+SAMPLE_FRAGMENTS = FRAGMENTS + ['b', 'Z9', '{}', '[]', '\\!', '\\:', '\\x', '}{', ')\\s', '\u3000']
+FILLERS = [' ', 'a', '\n', '\\,', '(']
+
+
+def generate(length: int, pairs: int, rng: random.Random):
+    """(説明, 入力) を生成"""
+    for fragment in FRAGMENTS:
+        yield f"{fragment!r}*", fragment * (length // len(fragment))
+    for _ in range(pairs):
+        first, second = rng.sample(FRAGMENTS, 2)
+        count = length // (len(first) + len(second))
+        yield f"({first!r}{second!r})*", (first + second) * count
+        yield f"{first!r}*+{second!r}*", first * (count // 2 or 1) + second * (count // 2 or 1)
+    for fragment in FRAGMENTS:
+        for filler in FILLERS:
+            body = filler * (length // len(filler))
+            yield f"{fragment!r}+{filler!r}*", fragment + body
+            yield f"{fragment!r}+{filler!r}*+{fragment!r}", fragment + body + fragment
+
+
+def spans(found):
+    """一致の位置と群の位置（Noneは一致なし）"""
+    if found is None:
+        return None
+    count = len(found.groups())
+    return tuple(found.span(group) for group in range(count + 1))
+
+
+def compare(pattern, text: str):
+    """代替の走査器と正規表現の結果が異なる操作（一致すればNone）"""
+    timeout = pattern.timeout_for(text) * 10
+    for operation in ('search', 'match', 'finditer'):
+        expected = getattr(pattern.compiled, operation)(text, timeout=timeout)
+        actual = getattr(pattern.fallback, operation)(text)
+        if operation == 'finditer':
+            expected, actual = [spans(m) for m in expected], [spans(m) for m in actual]
+        else:
+            expected, actual = spans(expected), spans(actual)
+        if expected != actual:
+            return f"{operation}: regex {expected} != fallback {actual}"
+    if pattern.compiled.sub('<\\g<0>>', text, timeout=timeout) != pattern.fallback.sub('<\\g<0>>', text):
+        return "sub"
+    return None
+
+
+def run_call(pattern, operation: str, text: str) -> float:
+    start = time.perf_counter()
+    if operation == 'sub':
+        pattern.sub('', text)
+    else:
+        getattr(pattern, operation)(text)
+    return time.perf_counter() - start
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--length', type=int, default=20000, help="入力の長さ（文字数）")
+    parser.add_argument('--pairs', type=int, default=60, help="断片の組み合わせの数")
+    parser.add_argument('--samples', type=int, default=3000, help="結果を比較する短い入力の数")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    cases = list(generate(args.length, args.pairs, rng))
+    samples = [''.join(rng.choices(SAMPLE_FRAGMENTS, k=rng.randint(1, 12))) for _ in range(args.samples)]
+    failures = []
+    for pattern in patterns:
+        for text in samples:
+            difference = compare(pattern, text)
+            if difference:
+                failures.append(f"{pattern.name}: fallback differs on {text!r} ({difference})")
+                break
+    print(f"{len(cases)} inputs x {len(patterns.names())} patterns")
+    print(f"{'pattern':36} {'budget':>8} {'worst':>8} {'timeouts':>9}  worst input")
+    for pattern in patterns:
+        worst, worst_case = 0.0, ''
+        before = patterns.stats.timeouts.get(pattern.name, 0)
+        for description, text in cases:
+            limit = 2 * pattern.timeout_for(text)
+            for operation in ('search', 'match', 'finditer', 'sub'):
+                elapsed = run_call(pattern, operation, text)
+                if elapsed > worst:
+                    worst, worst_case = elapsed, f"{operation} {description}"
+                if elapsed > limit:
+                    failures.append(f"{pattern.name}: {operation} {description} "
+                                    f"took {elapsed:.3f}s (limit {limit:.3f}s)")
+        timeouts = patterns.stats.timeouts.get(pattern.name, 0) - before
+        print(f"{pattern.name:36} {pattern.budget:8.3f} {worst:8.3f} {timeouts:9d}  {worst_case[:60]}")
+
+    if failures:
+        print(f"\n{len(failures)} calls exceeded their budget:")
+        for failure in failures[:20]:
+            print(f"  {failure}")
+        return 1
+    print("\nall patterns stayed within budget")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
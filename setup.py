@@ -25,6 +25,7 @@ setup(
     python_requires=">=3.8",
     install_requires=[
         "lark>=1.1.0",
+        "numpy>=1.22",
         "pyparsing>=3.0.0",
         "regex>=2023.0.0",
         "pyyaml>=6.0",
@@ -43,6 +44,7 @@ setup(
     },
     entry_points={
         "console_scripts": [
+            "tyx=tyx.cli.main:cli",
             "tex2typst=tyx.cli.main:tex2typst",
             "typst2tex=tyx.cli.main:typst2tex",
             "roundtrip_check=tyx.cli.main:roundtrip_check",
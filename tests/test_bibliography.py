@@ -0,0 +1,84 @@
+"""
+参考文献（\\bibliography の変換と引用キーの検証）
+"""
+
+import os
+
+from tyx.project import TeXProject
+
+
+DOCUMENT = r"""\documentclass{article}
+\begin{document}
+See \cite{known,unknown}.
+\bibliography{refs,missing}
+\end{document}
+"""
+
+BIB = """@article{known,
+  title = {Known},
+}
+"""
+
+
+def build(tmp_path, bib_names):
+    for name in bib_names:
+        (tmp_path / f'{name}.bib').write_text(BIB, encoding='utf-8')
+    source = tmp_path / 'main.tex'
+    source.write_text(DOCUMENT, encoding='utf-8')
+    project = TeXProject([str(source)], str(tmp_path / 'out'))
+    project.build(validate=False)
+    return project, str(source)
+
+
+def test_bibliography_command_is_converted(tmp_path):
+    project, source = build(tmp_path, ['refs', 'missing'])
+    typst = (tmp_path / 'out' / 'main.typ').read_text(encoding='utf-8')
+    assert '#bibliography(("refs.cited.bib", "missing.cited.bib"))' in typst
+    assert project.undefined_citations == {'unknown'}
+
+
+def test_missing_bibliography_skips_key_validation(tmp_path):
+    project, source = build(tmp_path, ['refs'])
+    assert project.undefined_citations == set()
+    problems = project.problems[source]
+    assert any(problem.startswith('Bibliography file not found:') for problem in problems)
+    assert not any('Citation key' in problem for problem in problems)
+
+
+def test_output_in_source_directory_keeps_input_bib(tmp_path):
+    bib = tmp_path / 'refs.bib'
+    bib.write_text(BIB + '@article{other,\n  title = {Other},\n}\n', encoding='utf-8')
+    source = tmp_path / 'main.tex'
+    source.write_text(DOCUMENT.replace('refs,missing', 'refs'), encoding='utf-8')
+    TeXProject([str(source)], str(tmp_path)).build(validate=False)
+    assert '@article{other' in bib.read_text(encoding='utf-8')
+    cited = (tmp_path / 'refs.cited.bib').read_text(encoding='utf-8')
+    assert '@article{known' in cited and 'other' not in cited
+
+
+def test_bibliographies_in_other_directories_get_distinct_names(tmp_path):
+    (tmp_path / 'shared').mkdir()
+    (tmp_path / 'shared' / 'refs.bib').write_text(BIB, encoding='utf-8')
+    (tmp_path / 'refs.bib').write_text(BIB, encoding='utf-8')
+    source = tmp_path / 'main.tex'
+    source.write_text(DOCUMENT.replace('refs,missing', 'refs,shared/refs'), encoding='utf-8')
+    project = TeXProject([str(source)], str(tmp_path / 'out'))
+    project.build(validate=False)
+    assert sorted(os.path.basename(path) for path in project.bibliography_files) == \
+        ['refs.cited.bib', 'shared.refs.cited.bib']
+    typst = (tmp_path / 'out' / 'main.typ').read_text(encoding='utf-8')
+    assert '#bibliography(("refs.cited.bib", "shared.refs.cited.bib"))' in typst
+
+
+def test_same_output_name_is_not_overwritten(tmp_path):
+    sources = []
+    for directory in ('a', 'b'):
+        (tmp_path / directory).mkdir()
+        (tmp_path / directory / 'refs.bib').write_text(BIB, encoding='utf-8')
+        source = tmp_path / directory / f'{directory}.tex'
+        source.write_text(DOCUMENT.replace('refs,missing', 'refs'), encoding='utf-8')
+        sources.append(str(source))
+    project = TeXProject(sources, str(tmp_path / 'out'))
+    project.build(validate=False)
+    assert len(project.bibliography_files) == 1
+    assert any('map to the same output' in problem for problem in project.problems[sources[1]])
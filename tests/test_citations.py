@@ -0,0 +1,51 @@
+"""
+複数キーの引用（\\cite{a,b} → 「,」の行で区切った参照 → Typstの解析で元のキー）
+"""
+
+import re
+
+import pytest
+
+from tyx.converter import Converter
+from tyx.parser.ast import NodeType
+from tyx.parser.typst_parser import TypstParser
+
+
+PARAGRAPH = r"""\documentclass{article}
+\begin{document}
+As shown in \cite{a,b}, the bound holds by \eqref{eq:x}. See also \cite{c, d,e}.
+\end{document}
+"""
+
+THEOREM = r"""\documentclass{article}
+\begin{document}
+\begin{lemma}
+By \cite{a,b}, it holds by \eqref{eq:x}. See also \cite{c, d,e}.
+\end{lemma}
+\end{document}
+"""
+
+
+def citations(node):
+    """解析した木の引用を \\cite{...} に戻す"""
+    found = []
+    if node.node_type == NodeType.CITE:
+        found.append('\\cite{' + ','.join(node.get_attribute('keys')) + '}')
+    for child in node.children:
+        found.extend(citations(child))
+    return found
+
+
+@pytest.mark.parametrize('document', [PARAGRAPH, THEOREM])
+def test_multi_key_cite_round_trip(document):
+    typst = Converter().convert(document).typst
+    assert '@a //[ref type:cite]\n,\n@b //[ref type:cite]\n' in typst
+    # 参照の行末コメントの後に本文が続かない
+    assert not re.search(r'//\[ref type:\w+\][^\n]', typst)
+    assert citations(TypstParser().parse(typst)) == ['\\cite{a,b}', '\\cite{c,d,e}']
+
+
+def test_text_after_citation_is_kept():
+    document = TypstParser().parse(Converter().convert(PARAGRAPH).typst)
+    texts = [child.content for child in document.children if child.node_type == NodeType.TEXT]
+    assert ', the bound holds by' in texts
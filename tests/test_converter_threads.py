@@ -0,0 +1,37 @@
+"""
+変換器の共有（1つの Converter を複数スレッドから使っても結果は1スレッドと同じ）
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from tyx.converter import Converter
+
+
+SAMPLE = os.path.join(os.path.dirname(__file__), os.pardir, 'sample', 'sample.tex')
+
+SMALL = r"""\documentclass{article}
+\newcommand{\R}{\mathbb{R}}
+\begin{document}
+\begin{lemma}\label{lem:a}
+For $x \in \R$, $\|x\|_{L^2} \le |x|$ by \cite{a,b}.
+\end{lemma}
+\begin{align}
+a &= b \label{eq:ab}
+\end{align}
+See \eqref{eq:ab} and \ref{lem:a}.
+\end{document}
+"""
+
+
+def test_shared_converter_matches_single_thread():
+    with open(SAMPLE, encoding='utf-8') as f:
+        documents = [f.read(), SMALL, SMALL.replace('lemma', 'theorem')]
+    converter = Converter()
+    expected = [(result.typst, result.problems)
+                for result in map(converter.convert, documents)]
+
+    jobs = documents * 8
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(converter.convert, jobs))
+    assert [(result.typst, result.problems) for result in results] == expected * 8
@@ -0,0 +1,49 @@
+"""
+ラベル索引の位置（前処理後の文字列ではなく入力ファイルでの位置）
+"""
+
+from tyx.converter import Converter
+from tyx.parser.source import TeXSource
+from tyx.utils.labels import LabelIndex
+
+
+DOCUMENT = r"""\documentclass{article}
+\newcommand{\R}{\mathbb{R}}
+\newcommand{\seeA}{\eqref{eq:a}}
+\begin{document}
+% \label{eq:commented}
+\section{Intro} \label{sec:intro} % \ref{eq:commented}
+Let $x \in \R$. See \eqref{eq:a} and \cite{k1,k2}.
+\begin{equation}
+\alpha + \beta \label{eq:a}
+\end{equation}
+By $\R$ and \seeA, done.
+\end{document}
+"""
+
+
+def index_of(source) -> LabelIndex:
+    index = LabelIndex()
+    Converter().convert(source, index, 'main.tex')
+    return index
+
+
+def assert_source_offsets(index: LabelIndex) -> None:
+    assert DOCUMENT.startswith('\\label{eq:a}', index.get_definition('eq:a').offset)
+    assert DOCUMENT.startswith('\\label{sec:intro}', index.get_definition('sec:intro').offset)
+    # マクロの展開で生じた参照は使用箇所の位置
+    refs = {offset for _, offset in index.referrers['eq:a']}
+    assert DOCUMENT.index('\\eqref{eq:a} and') in refs
+    assert DOCUMENT.index('\\seeA,') in refs
+    cite = DOCUMENT.index('\\cite{k1,k2}')
+    assert index.citations['k1'] == index.citations['k2'] == {('main.tex', cite)}
+
+
+def test_offsets_are_source_positions():
+    assert_source_offsets(index_of(DOCUMENT))
+
+
+def test_offsets_from_mapped_file(tmp_path):
+    path = tmp_path / 'main.tex'
+    path.write_text(DOCUMENT, encoding='utf-8')
+    assert_source_offsets(index_of(TeXSource.open(str(path))))
@@ -0,0 +1,28 @@
+"""
+マクロ展開の上限（メモ化した結果の再利用も展開回数・長さに数える）
+"""
+
+from tyx.parser.macros import MacroExpander
+
+
+# 各段が前の段を10回使う入れ子の繰り返し（\m8 は 10^8 文字）
+CHAIN = '\\newcommand{\\mzero}{xxxxxxxxxx}\n' + '\n'.join(
+    f'\\newcommand{{\\m{name}}}{{' + f'\\m{previous}' * 10 + '}'
+    for previous, name in zip(['zero', 'a', 'b', 'c', 'd', 'e', 'f'], ['a', 'b', 'c', 'd', 'e', 'f', 'g']))
+
+
+def test_nested_repetition_is_capped():
+    expander = MacroExpander(max_expanded_length=100000)
+    expander.parse_definitions(CHAIN)
+    assert expander.expand('\\mc') == 'x' * 10000
+    assert expander.expand('\\mg') == '\\mg'
+    assert any('expanded text too long' in problem for problem in expander.problems)
+
+
+def test_cached_expansions_are_charged():
+    expander = MacroExpander(max_expansions=15)
+    expander.parse_definitions(CHAIN)
+    assert expander.expand('\\ma') == 'x' * 100
+    # \mb は \ma を10回再利用する（1 + 10 回で上限を超える）
+    assert expander.expand('\\mb') == '\\mb'
+    assert any('expansion budget exceeded' in problem for problem in expander.problems)
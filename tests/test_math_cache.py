@@ -0,0 +1,33 @@
+"""
+数式変換のキャッシュ（空白の正規化と変換器での共有）
+"""
+
+from tyx.converter import Converter
+from tyx.transformer.math_cache import MathCache, normalize_math
+
+
+DOCUMENT = r"""\documentclass{article}
+\begin{document}
+Let $a  +  b$ and $a + b$, and $\mathrm{a  b}$.
+\end{document}
+"""
+
+
+def test_whitespace_variants_share_an_entry():
+    assert normalize_math('a  +  b') == normalize_math('a + b') == 'a + b'
+    assert normalize_math('x  \n  y') == 'x\n  y'
+    assert normalize_math('\t  x\n') == '\t  x\n'
+    assert normalize_math('\\mathrm{a  b}') == '\\mathrm{a  b}'
+    cache = MathCache()
+    results = [cache.convert('math', source, str.upper) for source in ('a  +  b', 'a + b')]
+    assert results == ['A + B', 'A + B']
+    assert (cache.stats.hits, cache.stats.misses) == (1, 1)
+
+
+def test_cache_is_shared_across_contexts():
+    converter = Converter()
+    first = converter.convert(DOCUMENT).typst
+    assert first.count('$a + b$') == 2
+    misses = converter.math_cache.stats.misses
+    assert converter.convert(DOCUMENT).typst == first
+    assert converter.math_cache.stats.misses == misses
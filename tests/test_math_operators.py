@@ -0,0 +1,33 @@
+"""
+\\DeclareMathOperator・\\operatorname の変換
+"""
+
+from tyx.converter import Converter
+
+
+DOCUMENT = r"""\documentclass{article}
+\DeclareMathOperator{\dist}{dist}
+\begin{document}
+Inline $\dist(x,y) \le 1$ and $\operatorname{Tr} A$.
+\[ \dist(x,y) + \operatorname*{argmax}_x f + \mathrm{for} \]
+\end{document}
+"""
+
+
+def convert(text: str) -> str:
+    return Converter().convert(text).typst
+
+
+def test_operatorname_in_inline_math():
+    typst = convert(DOCUMENT)
+    assert '$op("dist")(x,y)' in typst
+    assert '$op("Tr") A$' in typst
+    assert '\\operatorname' not in typst
+
+
+def test_operatorname_in_display_math_is_not_split():
+    typst = convert(DOCUMENT)
+    assert 'op("dist")(x,y) + limits(op("argmax"))_x f' in typst
+    # 文字列の中は変数分離しない
+    assert '"for"' in typst
+    assert 'd i s t' not in typst
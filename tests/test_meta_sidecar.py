@@ -0,0 +1,56 @@
+"""
+メタコメントのサイドカー（.typ.tyxmeta への退避とTypstの解析での復元）
+"""
+
+from tyx.converter import Converter
+from tyx.options import ConverterOptions
+from tyx.parser.ast import NodeType
+from tyx.parser.typst_parser import TypstParser
+from tyx.utils.meta_comments import MetaCommentParser, meta_sidecar
+
+
+DOCUMENT = r"""\documentclass{article}
+\begin{document}
+\begin{lemma}
+By \cite{a,b}, we have $x$.
+\end{lemma}
+\begin{align}
+a &= b \label{eq:ab}
+\end{align}
+See \eqref{eq:ab}.
+\end{document}
+"""
+
+
+def node_types(document):
+    return [child.node_type for child in document.children]
+
+
+def test_sidecar_round_trip(tmp_path):
+    inline = Converter().convert(DOCUMENT).typst
+    result = Converter(ConverterOptions(meta_mode="sidecar")).convert(DOCUMENT)
+    assert '//[' not in result.typst
+
+    path = tmp_path / 'main.typ'
+    path.write_text(result.typst, encoding='utf-8')
+    meta_sidecar.save(meta_sidecar.sidecar_path(str(path)), result.meta_entries)
+
+    document = TypstParser().parse_file(str(path))
+    assert document.get_attribute('source') == inline
+    assert node_types(document) == node_types(TypstParser().parse(inline))
+    assert NodeType.LEMMA in node_types(document)
+
+
+def test_sidecar_follows_shifted_lines():
+    typst, entries = meta_sidecar.split("a\n@x //[ref type:cite]\nb\n@x //[ref type:cite]")
+    edited = "new\n" + typst
+    assert meta_sidecar.merge(edited, entries) == "new\na\n@x //[ref type:cite]\nb\n@x //[ref type:cite]"
+
+
+def test_interned_comments_are_bounded():
+    parser = MetaCommentParser(max_interned=2)
+    first = parser.parse_meta_comment('//[ref type:cite]')
+    for i in range(5):
+        parser.parse_meta_comment(f'//[formula type:t{i}]')
+    assert len(parser._interned) == 2
+    assert parser.parse_meta_comment('//[ref type:cite]') == first
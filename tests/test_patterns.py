@@ -0,0 +1,46 @@
+"""
+正規表現の登録簿（代替の走査器が正規表現と同じ結果を返すこと）
+"""
+
+import random
+
+import pytest
+
+from tyx.utils.patterns import Scanner, patterns
+
+
+FRAGMENTS = ['\\begin{Lemma}', '\\end{Lemma}', '\\label{a}', '[t]', '\\[', '\\]', '$', '\\section{',
+             '{', '}', '(', ')', '∫_{', '∫_((', 'Σ_{', '^{', '^', '_', '\\|', '\\|_{', '\\bigg|', '|',
+             '\\,', '\\frac{', '\\operatorname*{', '//[', ']', '"', '\\"', 'x(', 'a', 'b1', ' ', '\n', '\\']
+
+
+def spans(found):
+    if found is None:
+        return None
+    return tuple(found.span(group) for group in range(len(found.groups()) + 1))
+
+
+def samples(count: int = 400):
+    rng = random.Random(0)
+    return [''.join(rng.choices(FRAGMENTS, k=rng.randint(1, 10))) for _ in range(count)]
+
+
+@pytest.mark.parametrize('name', patterns.names())
+def test_fallback_matches_regex(name):
+    pattern = patterns[name]
+    assert isinstance(pattern.fallback, Scanner)
+    for text in samples():
+        assert spans(pattern.fallback.search(text)) == spans(pattern.compiled.search(text)), text
+        assert spans(pattern.fallback.match(text)) == spans(pattern.compiled.match(text)), text
+        assert pattern.fallback.sub('<\\g<0>>', text) == pattern.compiled.sub('<\\g<0>>', text), text
+
+
+def test_theorem_header_does_not_read_body():
+    match = patterns['parser.theorem_header'].match('\\begin{Lemma}[Main]\\label{lem:a} body \\end{Lemma}')
+    assert match.groups() == ('Lemma', 'Main', 'lem:a')
+    assert match.end() == len('\\begin{Lemma}[Main]\\label{lem:a}')
+
+
+def test_command_registers_once():
+    assert patterns.command('frac', 2) is patterns['command.frac']
+    assert patterns.command('mathbf').sub(r'bold(\1)', '\\mathbf{x} + \\mathbf{') == 'bold(x) + \\mathbf{'
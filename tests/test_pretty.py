@@ -0,0 +1,21 @@
+"""
+整形（変換器が組み立てた文書をプリンターで描画）
+"""
+
+from tyx.options import PrettyOptions
+from tyx.transformer.pretty import Block, Concat, PrettyPrinter, lines, markup
+
+
+def test_block_gets_blank_lines_and_indent():
+    doc = Concat((markup('before'), Block(lines('#lemma['), markup('\tbody'), lines('] //[theorem]')),
+                  markup('after')))
+    printer = PrettyPrinter(PrettyOptions(indent=2, blank_lines=1))
+    assert printer.render(doc) == 'before\n\n#lemma[\n  body\n] //[theorem]\n\nafter'
+
+
+def test_long_text_is_wrapped():
+    text = ', '.join(f'word{i}' for i in range(30))
+    rendered = PrettyPrinter(PrettyOptions(line_length=40)).render(markup(text))
+    assert len(rendered.split('\n')) > 1
+    assert all(len(line) <= 40 for line in rendered.split('\n'))
+    assert rendered.replace('\n\t', ' ').replace('\n', ' ') == text
@@ -0,0 +1,27 @@
+"""
+プロジェクトの再ビルド（変更のないファイルの問題の報告）
+"""
+
+from tyx.project import TeXProject
+
+
+DOCUMENT = r"""\documentclass{article}
+\def\pair#1.{(#1)}
+\begin{document}
+Text.
+\end{document}
+"""
+
+
+def test_skipped_file_keeps_problems(tmp_path):
+    source = tmp_path / 'main.tex'
+    source.write_text(DOCUMENT, encoding='utf-8')
+    project = TeXProject([str(source)], str(tmp_path / 'out'))
+    project.build(validate=False)
+    problems = project.problems[str(source)]
+    assert any('delimited parameters' in problem for problem in problems)
+
+    project = TeXProject([str(source)], str(tmp_path / 'out'))
+    project.build(validate=False)
+    assert project.converted_files == []
+    assert project.problems[str(source)] == problems
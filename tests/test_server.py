@@ -0,0 +1,81 @@
+"""
+常駐変換サービス（Content-Lengthの検証・変換方向・Unixソケットの作成）
+"""
+
+import asyncio
+import os
+import socket
+import stat
+
+import pytest
+
+from tyx.server import ConversionService
+
+
+async def exchange(request: bytes, max_payload: int = 1024) -> bytes:
+    """要求を送り、接続が閉じられるまでの応答を返す"""
+    service = ConversionService(workers=1, max_payload=max_payload)
+    server = await service.serve_http(port=0)
+    port = server.sockets[0].getsockname()[1]
+    try:
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(request)
+        await writer.drain()
+        response = await asyncio.wait_for(reader.read(), timeout=5)
+        writer.close()
+        return response
+    finally:
+        server.close()
+        await server.wait_closed()
+
+
+@pytest.mark.parametrize('length', ['abc', '-1', '1e3', ''])
+def test_invalid_content_length_is_rejected(length):
+    request = f"POST /convert HTTP/1.1\r\nContent-Length: {length}\r\n\r\n{{}}".encode('latin-1')
+    response = asyncio.run(exchange(request))
+    assert response.startswith(b'HTTP/1.1 400 Bad Request\r\n')
+    assert b'invalid Content-Length' in response
+    assert b'Connection: close' in response
+
+
+def test_oversized_content_length_is_rejected():
+    request = b"POST /convert HTTP/1.1\r\nContent-Length: 4096\r\n\r\n"
+    response = asyncio.run(exchange(request))
+    assert response.startswith(b'HTTP/1.1 413 Payload Too Large\r\n')
+
+
+def test_malformed_body_keeps_connection_usable():
+    request = (b"POST /convert HTTP/1.1\r\nContent-Length: 3\r\n\r\n{{{"
+               b"GET /nothing HTTP/1.1\r\nConnection: close\r\n\r\n")
+    response = asyncio.run(exchange(request))
+    assert response.startswith(b'HTTP/1.1 400 Bad Request\r\n')
+    assert b'HTTP/1.1 404 Not Found\r\n' in response
+
+
+def test_typst_direction_is_rejected():
+    service = ConversionService(workers=1)
+    response = asyncio.run(service.handle_request({'direction': 'typst2tex', 'source': '$x$'}))
+    assert response['status'] == 400
+    assert 'unsupported direction' in response['error']
+
+
+def test_serve_unix_keeps_regular_file(tmp_path):
+    path = tmp_path / 'notes.txt'
+    path.write_text('keep me', encoding='utf-8')
+    with pytest.raises(FileExistsError):
+        asyncio.run(ConversionService(workers=1).serve_unix(str(path)))
+    assert path.read_text(encoding='utf-8') == 'keep me'
+
+
+def test_serve_unix_replaces_stale_socket(tmp_path):
+    path = str(tmp_path / 'tyx.sock')
+    stale = socket.socket(socket.AF_UNIX)
+    stale.bind(path)
+    stale.close()
+
+    async def serve() -> None:
+        server = await ConversionService(workers=1).serve_unix(path)
+        server.close()
+        await server.wait_closed()
+    asyncio.run(serve())
+    assert stat.S_ISSOCK(os.stat(path).st_mode)
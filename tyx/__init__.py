@@ -7,3 +7,7 @@ TeX ⇄ Typst 変換器
 
 __version__ = "1.0.0"
 __author__ = "tyx project"
+
+from .converter import Converter, ConversionResult
+from .options import ConverterOptions, OptionsError
+from .parser.handlers import HandlerRegistry
@@ -0,0 +1,5 @@
+"""
+コマンドラインインターフェース
+
+tex2typst変換と常駐変換サービスを提供する。
+"""
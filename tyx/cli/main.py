@@ -0,0 +1,112 @@
+"""
+tyxコマンド
+"""
+
+import asyncio
+import sys
+from typing import Optional
+
+import click
+
+from ..converter import Converter
+from ..options import ConverterOptions, OptionsError
+from ..parser.source import TeXSource
+from ..server import ConversionService, run_service
+from ..utils.meta_comments import meta_sidecar
+from ..utils.output import write_if_changed
+
+
+def _load_options(config: Optional[str]) -> ConverterOptions:
+    """設定ファイルを読み込み（省略時は既定値）"""
+    if not config:
+        return ConverterOptions()
+    try:
+        return ConverterOptions.from_yaml(config)
+    except OptionsError as e:
+        raise click.BadParameter(str(e), param_hint='--config')
+
+
+@click.group()
+def cli() -> None:
+    """TeX ⇄ Typst 変換器"""
+
+
+@click.command()
+@click.argument('source', type=click.Path(dir_okay=False, allow_dash=True))
+@click.option('-o', '--output', type=click.Path(dir_okay=False, allow_dash=True), default='-',
+              help="出力先（省略時は標準出力、内容が変わらない場合は書き込まない）")
+@click.option('--config', type=click.Path(exists=True, dir_okay=False), help="設定ファイル（YAML）")
+@click.option('--stats', is_flag=True, help="書き換えパスの実行・省略回数と数式キャッシュの命中率を標準エラーに出力")
+def tex2typst(source: str, output: str, config: Optional[str], stats: bool) -> None:
+    """TeXファイルをTypstに変換（- は標準入力）"""
+    options = _load_options(config)
+    # sidecarモードのメタコメントは出力ファイルの隣に書き出すため、標準出力には出力できない
+    if options.meta_mode == "sidecar" and output == '-':
+        raise click.UsageError("metaMode: sidecar には -o で出力ファイルを指定してください")
+    context = Converter(options).context()
+    if source == '-':
+        result = context.convert(click.get_text_stream('stdin', encoding='utf-8').read())
+    else:
+        try:
+            with TeXSource.open(source) as tex_source:
+                result = context.convert(tex_source)
+        except OSError as e:
+            raise click.BadParameter(str(e), param_hint='SOURCE')
+    if output == '-':
+        click.echo(result.typst, nl=False)
+    else:
+        try:
+            write_if_changed(output, result.typst)
+            if options.meta_mode == "sidecar":
+                meta_sidecar.save(meta_sidecar.sidecar_path(output), result.meta_entries)
+        except OSError as e:
+            raise click.BadParameter(str(e), param_hint='--output')
+    for problem in result.problems:
+        click.echo(f"warning: {problem}", err=True)
+    if stats:
+        click.echo(context.transformer.pass_stats.summary(), err=True)
+        click.echo(context.transformer.math_cache.stats.summary(), err=True)
+
+
+@click.command()
+@click.option('--socket', 'unix_path', type=click.Path(dir_okay=False),
+              help="Unixソケットのパス（1行1要求のJSON）")
+@click.option('--port', type=int, help="localhostのHTTPポート")
+@click.option('--host', default="127.0.0.1", show_default=True, help="HTTPの待ち受けアドレス")
+@click.option('--workers', type=int, default=0, help="ワーカー数（0はCPU数-1）")
+@click.option('--queue-size', type=int, default=64, show_default=True, help="待機できる要求数")
+@click.option('--timeout', type=float, default=10.0, show_default=True, help="既定の締め切り（秒）")
+@click.option('--config', type=click.Path(exists=True, dir_okay=False), help="設定ファイル（YAML）")
+def serve(unix_path: Optional[str], port: Optional[int], host: str, workers: int,
+          queue_size: int, timeout: float, config: Optional[str]) -> None:
+    """常駐変換サービスを起動"""
+    if not unix_path and port is None:
+        raise click.UsageError("--socket または --port を指定してください")
+    service = ConversionService(workers=workers, queue_size=queue_size, timeout=timeout,
+                                options=_load_options(config))
+    endpoints = [f"unix:{unix_path}"] if unix_path else []
+    if port is not None:
+        endpoints.append(f"http://{host}:{port}")
+    click.echo(f"tyx serve: {', '.join(endpoints)} ({service.workers} workers)", err=True)
+    try:
+        asyncio.run(run_service(service, unix_path=unix_path, host=host, port=port))
+    except FileExistsError as e:
+        raise click.ClickException(str(e))
+    except KeyboardInterrupt:
+        pass
+
+
+@click.command()
+def lsp() -> None:
+    """言語サーバー（LSP over stdio）を起動"""
+    from ..lsp import main
+    sys.exit(main())
+
+
+cli.add_command(tex2typst)
+cli.add_command(serve)
+cli.add_command(lsp)
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,151 @@
+"""
+変換器オブジェクト
+
+変換の設定と変換表を保持し、複数スレッドから共有できる。
+解析中に変化する状態（問題の記録・マクロ定義・メタコメントの退避など）は
+呼び出しごとのコンテキストに閉じ込める。
+"""
+
+import hashlib
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple, Union
+
+from . import __version__
+from .options import ConverterOptions
+from .parser.ast import DocumentNode
+from .parser.ast_cache import IndexRecorder, ast_cache
+from .parser.handlers import HandlerRegistry
+from .parser.source import TeXSource
+from .parser.tex_parser_improved import ImprovedTeXParser
+from .transformer.math_cache import MathCache
+from .transformer.tex_to_typst import TeXToTypstTransformer
+from .utils.labels import LabelIndex
+from .utils.meta_comments import MetaSidecarEntry
+
+
+@dataclass
+class ConversionResult:
+    """変換結果"""
+    typst: str
+    problems: List[str] = field(default_factory=list)
+    meta_entries: List[MetaSidecarEntry] = field(default_factory=list)
+
+
+class ConversionContext:
+    """1回の変換の作業領域
+
+    パーサーと変換器を専有するため、同じスレッド内でのみ使い回せる。
+    """
+
+    def __init__(self, options: ConverterOptions, handlers: Optional[HandlerRegistry] = None,
+                 math_cache: Optional[MathCache] = None):
+        self.options = options
+        self.handlers = handlers or HandlerRegistry()
+        if options.parser == "grammar":
+            from .parser.tex_parser_grammar import GrammarTeXParser
+            self.parser = GrammarTeXParser(options.max_macro_depth, options.max_macro_expansions,
+                                           handlers=self.handlers)
+        else:
+            self.parser = ImprovedTeXParser(options.max_macro_depth, options.max_macro_expansions,
+                                            self.handlers)
+        self.transformer = TeXToTypstTransformer(meta_mode=options.meta_mode,
+                                                 split_variables=options.token_split.variables,
+                                                 pretty=options.pretty, math_cache=math_cache)
+
+    def convert(self, tex_content: Union[str, TeXSource], label_index: Optional[LabelIndex] = None,
+                file_path: str = "") -> ConversionResult:
+        """TeXをTypstに変換（tex_contentは文字列またはTeXSource）"""
+        ast, problems = self.parse(tex_content, label_index, file_path)
+        typst_content = self.transformer.transform(ast)
+        return ConversionResult(typst_content, problems, list(self.transformer.meta_entries))
+
+    @property
+    def parser_key(self) -> str:
+        """解析結果を左右する設定（解析結果のキャッシュキー用）"""
+        options = self.options
+        key = (f"tyx {__version__} parser:{options.parser} maxMacroDepth:{options.max_macro_depth} "
+               f"maxMacroExpansions:{options.max_macro_expansions}")
+        return f"{key} handlers:{self.handlers.signature}" if self.handlers else key
+
+    def parse(self, tex_content: Union[str, TeXSource], label_index: Optional[LabelIndex] = None,
+              file_path: str = "") -> Tuple[DocumentNode, List[str]]:
+        """TeXを解析し、(AST, 問題) を返す
+
+        astCache が有効でファイルから読み込んだ入力の場合、内容と解析器の設定が一致する
+        .tyxast があれば解析せずに読み込み、なければ解析して保存する。
+        """
+        path = tex_content.path if isinstance(tex_content, TeXSource) else ""
+        if not (self.options.ast_cache and path):
+            ast = self.parser.parse(tex_content, label_index=label_index, file_path=file_path)
+            return ast, list(self.parser.problems)
+
+        digest = tex_content.content_hash()
+        cache_path = ast_cache.cache_path(path)
+        cached = ast_cache.load(cache_path, digest, self.parser_key)
+        if cached is not None:
+            if label_index is not None:
+                cached.index_recorder().replay(label_index, file_path)
+            return cached.document(), cached.problems
+
+        recorder = IndexRecorder()
+        ast = self.parser.parse(tex_content, label_index=recorder, file_path=file_path)
+        problems = list(self.parser.problems)
+        try:
+            ast_cache.save(cache_path, ast, digest, self.parser_key, problems, recorder.entries)
+        except (OSError, TypeError):
+            pass  # 保存できない場合はキャッシュなしで続ける
+        if label_index is not None:
+            recorder.replay(label_index, file_path)
+        return ast, problems
+
+
+class Converter:
+    """TeX → Typst 変換器
+
+    設定は変更不可で、変換中の状態は呼び出しごとのコンテキストが持つため、
+    1つのインスタンスを複数スレッドで共有できる。
+    handlersには研究室ごとのマクロのハンドラーを登録する（作成後は登録を変更しないこと）。
+    """
+
+    def __init__(self, options: Optional[ConverterOptions] = None,
+                 handlers: Optional[HandlerRegistry] = None):
+        self.options = options or ConverterOptions()
+        self.handlers = handlers or HandlerRegistry()
+        # 数式変換のキャッシュ（結果は設定だけで決まるため、すべてのコンテキストで共有）
+        self.math_cache = MathCache()
+
+    @classmethod
+    def from_yaml(cls, path: str) -> 'Converter':
+        """YAMLの設定ファイルから作成"""
+        return cls(ConverterOptions.from_yaml(path))
+
+    @property
+    def fingerprint(self) -> str:
+        """設定の指紋（変換結果のキャッシュキー用、ハンドラーの登録も含む）"""
+        if not self.handlers:
+            return self.options.fingerprint
+        combined = f"{self.options.fingerprint} {self.handlers.signature}"
+        return hashlib.sha256(combined.encode('utf-8')).hexdigest()[:16]
+
+    @property
+    def stages(self) -> List[str]:
+        """実行される段の名前"""
+        names = ['parse', 'transform']
+        if self.options.token_split.variables:
+            names.append('transform.tokenSplit.variables')
+        names.append('pretty')
+        if self.options.meta_mode == "sidecar":
+            names.append('meta.sidecar')
+        return names
+
+    def context(self) -> ConversionContext:
+        """呼び出しごとの作業領域を作成"""
+        return ConversionContext(self.options, self.handlers, self.math_cache)
+
+    def convert(self, tex_content: Union[str, TeXSource], label_index: Optional[LabelIndex] = None,
+                file_path: str = "") -> ConversionResult:
+        """TeXをTypstに変換（tex_contentは文字列またはTeXSource）
+
+        label_indexを共有する場合は、呼び出し側で排他制御すること。
+        """
+        return self.context().convert(tex_content, label_index, file_path)
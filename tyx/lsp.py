@@ -0,0 +1,348 @@
+"""
+言語サーバー（LSP over stdio）
+
+文書ごとに状態を保持し、didChangeの差分編集を適用する。
+本文をトップレベルのブロック（環境の外の空行区切り）に分割し、
+変更されたブロックのみを再解析してTypstのプレビューを更新する。
+プレビューはカスタム要求 tyx/preview で返し、
+未変換のマクロと未解決のラベル参照を診断として通知する。
+"""
+
+import json
+import re
+import sys
+from bisect import bisect_right
+from dataclasses import dataclass, field
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple
+
+from .parser.tex_parser_improved import ImprovedTeXParser
+from .transformer.tex_to_typst import TeXToTypstTransformer
+from .utils.labels import label_extractor
+
+
+# 診断の重要度（LSP DiagnosticSeverity）
+SEVERITY_ERROR = 1
+SEVERITY_WARNING = 2
+
+# 本文の区切りに関わるトークン（\\ と \% を先に読み飛ばす）
+_BLOCK_TOKEN = re.compile(r'\\\\|\\%|(?P<comment>%)|\\(?P<kind>begin|end)\{[^}]*\}|\\\[|\\\]|\$\$')
+# 変換後に残ったコマンド
+_LEFTOVER_COMMAND = re.compile(r'\\([a-zA-Z]+)')
+# 未変換でも診断の対象外とするコマンド（環境と参照は別に扱う）
+_IGNORED_COMMANDS = {'begin', 'end', 'label', 'ref', 'eqref', 'cite'}
+
+
+@dataclass
+class BlockResult:
+    """ブロック単位の変換結果（位置はブロック先頭からのオフセット）"""
+    typst: str
+    problems: List[str] = field(default_factory=list)
+    labels: List[str] = field(default_factory=list)
+    references: List[Tuple[str, int, int]] = field(default_factory=list)
+    unknown_commands: List[Tuple[str, int, int]] = field(default_factory=list)
+
+
+@dataclass
+class Block:
+    """トップレベルのブロック"""
+    start_line: int
+    text: str
+    result: Optional[BlockResult] = None
+
+
+class DocumentState:
+    """開いている文書の状態"""
+
+    def __init__(self, uri: str, text: str, version: int = 0):
+        self.uri = uri
+        self.version = version
+        self.text = text
+        self.parser = ImprovedTeXParser()
+        self.transformer = TeXToTypstTransformer()
+        self.blocks: List[Block] = []
+        self.preamble = ""
+        self.reparsed_blocks = 0
+        # ブロック本文をキーにした変換結果（preambleが変わると破棄）
+        self._cache: Dict[str, BlockResult] = {}
+        self._line_starts: List[int] = [0]
+        self.update()
+
+    def apply_change(self, change: Dict[str, Any]) -> None:
+        """didChangeの1件の変更を適用（rangeがなければ全文置換）"""
+        if 'range' not in change:
+            self.text = change['text']
+            self._index_lines()
+            return
+        start = self._offset(change['range']['start'])
+        end = self._offset(change['range']['end'])
+        self.text = self.text[:start] + change['text'] + self.text[end:]
+        self._index_lines()
+
+    def update(self) -> None:
+        """ブロックに分割し、変更されたブロックのみ再解析"""
+        self._index_lines()
+        preamble, blocks = self._split_blocks()
+        if preamble != self.preamble:
+            # preambleのマクロ定義が変わった場合は全ブロックを再解析
+            # （preambleのブロックが先頭にあるため、先に定義が読み込まれる）
+            self.preamble = preamble
+            self._cache = {}
+
+        self.reparsed_blocks = 0
+        cache: Dict[str, BlockResult] = {}
+        for block in blocks:
+            result = self._cache.get(block.text) or cache.get(block.text)
+            if result is None:
+                result = self._convert_block(block.text, block.start_line == 0 and bool(preamble))
+                self.reparsed_blocks += 1
+            block.result = result
+            cache[block.text] = result
+        self._cache = cache
+        self.blocks = blocks
+
+    def preview(self) -> str:
+        """文書全体のTypst"""
+        lines = self.transformer.document_header()
+        lines.extend(block.result.typst for block in self.blocks if block.result.typst)
+        return '\n'.join(lines)
+
+    def diagnostics(self) -> List[Dict[str, Any]]:
+        """未変換のマクロ・未解決の参照・マクロ展開の問題"""
+        defined = {label for block in self.blocks for label in block.result.labels}
+        diagnostics = []
+        for block in self.blocks:
+            result = block.result
+            for label, start, end in result.references:
+                if label not in defined:
+                    diagnostics.append(self._diagnostic(
+                        block, start, end, SEVERITY_ERROR, f"Unresolved reference: {label}"))
+            for name, start, end in result.unknown_commands:
+                diagnostics.append(self._diagnostic(
+                    block, start, end, SEVERITY_WARNING, f"Unknown macro \\{name} left unconverted"))
+            for problem in result.problems:
+                diagnostics.append(self._diagnostic(block, 0, 0, SEVERITY_WARNING, problem))
+        return diagnostics
+
+    def _convert_block(self, text: str, is_preamble: bool) -> BlockResult:
+        """1ブロックを変換"""
+        ast = self.parser.parse(text, body_only=not is_preamble)
+        typst = self.transformer.transform_body(ast)
+        result = BlockResult(typst=typst, problems=list(self.parser.problems))
+        for record in label_extractor.scan_tex(text):
+            if record.kind == 'label':
+                result.labels.append(record.target)
+            elif record.kind in ('ref', 'eqref'):
+                result.references.append((record.target, record.start, record.end))
+        if not is_preamble:
+            # コメントを除いた変換結果に残ったコマンドを、元のTeXの位置に対応付ける
+            leftover = {match.group(1) for match in _LEFTOVER_COMMAND.finditer(
+                '\n'.join(line.split('//', 1)[0] for line in typst.split('\n')))}
+            for name in sorted(leftover - _IGNORED_COMMANDS):
+                for match in re.finditer(r'\\' + name + r'(?![a-zA-Z])', text):
+                    result.unknown_commands.append((name, match.start(), match.end()))
+        return result
+
+    def _split_blocks(self) -> Tuple[str, List[Block]]:
+        """preambleと本文のトップレベルブロックに分割"""
+        lines = self.text.split('\n')
+        body_start = 0
+        for i, line in enumerate(lines):
+            if '\\begin{document}' in line:
+                body_start = i + 1
+                break
+        preamble = '\n'.join(lines[:body_start])
+        blocks = [Block(0, preamble)] if body_start else []
+
+        depth = 0
+        display = False
+        start = body_start
+        for i in range(body_start, len(lines)):
+            line = lines[i]
+            if not line.strip():
+                if depth == 0 and not display and i > start and lines[i - 1].strip():
+                    blocks.append(Block(start, '\n'.join(lines[start:i + 1])))
+                    start = i + 1
+                continue
+            if '\\' not in line and '$' not in line:
+                continue
+            for match in _BLOCK_TOKEN.finditer(line):
+                token = match.group(0)
+                if match.group('comment'):
+                    break
+                if match.group('kind') == 'begin' or token == '\\[':
+                    depth += 1
+                elif match.group('kind') == 'end' or token == '\\]':
+                    depth = max(0, depth - 1)
+                elif token == '$$':
+                    display = not display
+        if start < len(lines):
+            blocks.append(Block(start, '\n'.join(lines[start:])))
+        return preamble, blocks
+
+    def _index_lines(self) -> None:
+        """行頭のオフセットを更新"""
+        starts = [0]
+        find = self.text.find
+        pos = find('\n')
+        while pos != -1:
+            starts.append(pos + 1)
+            pos = find('\n', pos + 1)
+        self._line_starts = starts
+
+    def _offset(self, position: Dict[str, int]) -> int:
+        """LSPの位置（UTF-16単位）を文字列のオフセットに変換"""
+        line = min(position['line'], len(self._line_starts) - 1)
+        start = self._line_starts[line]
+        end = self._line_starts[line + 1] - 1 if line + 1 < len(self._line_starts) else len(self.text)
+        units = position['character']
+        offset = start
+        while offset < end and units > 0:
+            units -= 2 if ord(self.text[offset]) > 0xFFFF else 1
+            offset += 1
+        return offset
+
+    def _diagnostic(self, block: Block, start: int, end: int, severity: int,
+                    message: str) -> Dict[str, Any]:
+        """ブロック内オフセットから診断を作成"""
+        return {
+            'range': {'start': self._position(block, start), 'end': self._position(block, end)},
+            'severity': severity,
+            'source': 'tyx',
+            'message': message,
+        }
+
+    def _position(self, block: Block, offset: int) -> Dict[str, int]:
+        """ブロック内オフセットをLSPの位置に変換"""
+        base = self._line_starts[block.start_line] if block.start_line < len(self._line_starts) else 0
+        absolute = base + offset
+        line = bisect_right(self._line_starts, absolute) - 1
+        prefix = self.text[self._line_starts[line]:absolute]
+        character = len(prefix) + sum(1 for char in prefix if ord(char) > 0xFFFF)
+        return {'line': line, 'character': character}
+
+
+class LanguageServer:
+    """stdio上のJSON-RPCでLSPを処理"""
+
+    def __init__(self, reader: BinaryIO, writer: BinaryIO):
+        self.reader = reader
+        self.writer = writer
+        self.documents: Dict[str, DocumentState] = {}
+        self._shutdown = False
+        self._handlers = {
+            'initialize': self._initialize,
+            'shutdown': self._shutdown_request,
+            'textDocument/didOpen': self._did_open,
+            'textDocument/didChange': self._did_change,
+            'textDocument/didClose': self._did_close,
+            'tyx/preview': self._preview,
+        }
+
+    def serve(self) -> int:
+        """exit通知まで要求を処理し、終了コードを返す"""
+        while True:
+            message = self._read_message()
+            if message is None:
+                return 1
+            method = message.get('method')
+            if method == 'exit':
+                return 0 if self._shutdown else 1
+            self._handle(message)
+
+    def _handle(self, message: Dict[str, Any]) -> None:
+        """要求・通知を処理"""
+        method = message.get('method')
+        handler = self._handlers.get(method)
+        is_request = 'id' in message
+        if handler is None:
+            if is_request:
+                self._send({'jsonrpc': '2.0', 'id': message['id'],
+                            'error': {'code': -32601, 'message': f"Method not found: {method}"}})
+            return
+        try:
+            result = handler(message.get('params') or {})
+        except Exception as e:  # 1件の失敗でサーバーを止めない
+            if is_request:
+                self._send({'jsonrpc': '2.0', 'id': message['id'],
+                            'error': {'code': -32603, 'message': f"{type(e).__name__}: {e}"}})
+            return
+        if is_request:
+            self._send({'jsonrpc': '2.0', 'id': message['id'], 'result': result})
+
+    def _initialize(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            'capabilities': {
+                # 2 = Incremental
+                'textDocumentSync': {'openClose': True, 'change': 2},
+                'experimental': {'tyxPreview': True},
+            },
+            'serverInfo': {'name': 'tyx'},
+        }
+
+    def _shutdown_request(self, params: Dict[str, Any]) -> None:
+        self._shutdown = True
+        return None
+
+    def _did_open(self, params: Dict[str, Any]) -> None:
+        document = params['textDocument']
+        state = DocumentState(document['uri'], document['text'], document.get('version', 0))
+        self.documents[state.uri] = state
+        self._publish_diagnostics(state)
+
+    def _did_change(self, params: Dict[str, Any]) -> None:
+        document = params['textDocument']
+        state = self.documents.get(document['uri'])
+        if state is None:
+            return
+        for change in params['contentChanges']:
+            state.apply_change(change)
+        state.version = document.get('version', state.version)
+        state.update()
+        self._publish_diagnostics(state)
+
+    def _did_close(self, params: Dict[str, Any]) -> None:
+        uri = params['textDocument']['uri']
+        self.documents.pop(uri, None)
+        self._send({'jsonrpc': '2.0', 'method': 'textDocument/publishDiagnostics',
+                    'params': {'uri': uri, 'diagnostics': []}})
+
+    def _preview(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """カスタム要求: 現在の文書のTypst"""
+        uri = params['textDocument']['uri']
+        state = self.documents.get(uri)
+        if state is None:
+            raise KeyError(f"document is not open: {uri}")
+        return {'uri': uri, 'version': state.version, 'typst': state.preview(),
+                'reparsedBlocks': state.reparsed_blocks}
+
+    def _publish_diagnostics(self, state: DocumentState) -> None:
+        self._send({'jsonrpc': '2.0', 'method': 'textDocument/publishDiagnostics',
+                    'params': {'uri': state.uri, 'version': state.version,
+                               'diagnostics': state.diagnostics()}})
+
+    def _read_message(self) -> Optional[Dict[str, Any]]:
+        """Content-Lengthヘッダ付きのメッセージを1件読み取り"""
+        length = None
+        while True:
+            header = self.reader.readline()
+            if not header:
+                return None
+            header = header.strip()
+            if not header:
+                break
+            name, _, value = header.decode('ascii').partition(':')
+            if name.strip().lower() == 'content-length':
+                length = int(value.strip())
+        if length is None:
+            return None
+        return json.loads(self.reader.read(length).decode('utf-8'))
+
+    def _send(self, message: Dict[str, Any]) -> None:
+        body = json.dumps(message, ensure_ascii=False).encode('utf-8')
+        self.writer.write(f"Content-Length: {len(body)}\r\n\r\n".encode('ascii') + body)
+        self.writer.flush()
+
+
+def main() -> int:
+    """標準入出力でLSPを起動"""
+    return LanguageServer(sys.stdin.buffer, sys.stdout.buffer).serve()
@@ -0,0 +1,137 @@
+"""
+変換の設定
+
+README §12 の設定項目を型付きで保持し、YAMLから読み込む。
+キーはREADMEと同じ camelCase のドット区切り（`tokenSplit.variables`）または入れ子の辞書で指定する。
+"""
+
+import hashlib
+import json
+import re
+from dataclasses import asdict, dataclass, field, fields
+from typing import Any, Dict, Union
+
+import yaml
+
+
+class OptionsError(ValueError):
+    """設定値の誤り"""
+
+
+@dataclass(frozen=True)
+class TokenSplitOptions:
+    """トークン分割の設定"""
+    variables: bool = True  # 変数の空白分離
+
+
+@dataclass(frozen=True)
+class PrettyOptions:
+    """整形の設定"""
+    indent: Union[str, int] = "tab"  # tab または スペース数
+    blank_lines: int = 0  # 環境前後の空行
+    line_length: int = 80  # 折り返し目安
+    break_priority: str = "punctuation"  # 折り返し位置の優先
+
+
+@dataclass(frozen=True)
+class ConverterOptions:
+    """変換の設定"""
+    meta_mode: str = "inline"  # inline: 行末コメント, sidecar: .typ.tyxmeta に退避
+    parser: str = "regex"  # regex: 正規表現による抽出, grammar: Larkの文法による抽出
+    max_macro_depth: int = 16
+    max_macro_expansions: int = 100000
+    ast_cache: bool = False  # 解析結果を入力ファイルの隣の .tyxast に保存して再利用
+    token_split: TokenSplitOptions = field(default_factory=TokenSplitOptions)
+    pretty: PrettyOptions = field(default_factory=PrettyOptions)
+
+    def __post_init__(self):
+        if self.meta_mode not in ("inline", "sidecar"):
+            raise OptionsError(f"metaMode must be 'inline' or 'sidecar': {self.meta_mode!r}")
+        if self.parser not in ("regex", "grammar"):
+            raise OptionsError(f"parser must be 'regex' or 'grammar': {self.parser!r}")
+        indent = self.pretty.indent
+        if indent != "tab" and not (isinstance(indent, int) and not isinstance(indent, bool) and indent > 0):
+            raise OptionsError(f"pretty.indent must be 'tab' or a positive number: {indent!r}")
+        if self.pretty.break_priority not in ("punctuation", "none"):
+            raise OptionsError(f"pretty.breakPriority must be 'punctuation' or 'none': "
+                               f"{self.pretty.break_priority!r}")
+        for name, value in (("maxMacroDepth", self.max_macro_depth),
+                            ("maxMacroExpansions", self.max_macro_expansions),
+                            ("pretty.lineLength", self.pretty.line_length)):
+            if value <= 0:
+                raise OptionsError(f"{name} must be positive: {value!r}")
+        if self.pretty.blank_lines < 0:
+            raise OptionsError(f"pretty.blankLines must not be negative: {self.pretty.blank_lines!r}")
+
+    @property
+    def fingerprint(self) -> str:
+        """設定の指紋（変換結果のキャッシュキー用）"""
+        canonical = json.dumps(asdict(self), sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()[:16]
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'ConverterOptions':
+        """辞書から作成（入れ子の辞書とドット区切りのキーの両方を受け付ける）"""
+        nested: Dict[str, Any] = {}
+        for key, value in (data or {}).items():
+            target = nested
+            parts = str(key).split('.')
+            for part in parts[:-1]:
+                target = target.setdefault(part, {})
+            if isinstance(value, dict) and isinstance(target.get(parts[-1]), dict):
+                target[parts[-1]].update(value)
+            else:
+                target[parts[-1]] = value
+        return _build(cls, nested, "")
+
+    @classmethod
+    def from_yaml(cls, path: str) -> 'ConverterOptions':
+        """YAMLファイルから読み込み"""
+        with open(path, 'r', encoding='utf-8') as f:
+            data = yaml.safe_load(f)
+        if data is not None and not isinstance(data, dict):
+            raise OptionsError(f"{path}: top level must be a mapping")
+        return cls.from_dict(data or {})
+
+
+def _snake_case(name: str) -> str:
+    """camelCase を snake_case に変換"""
+    return re.sub(r'(?<=[a-z0-9])([A-Z])', r'_\1', name).lower()
+
+
+def _build(cls, data: Dict[str, Any], prefix: str):
+    """辞書から設定のdataclassを作成"""
+    if not isinstance(data, dict):
+        raise OptionsError(f"{prefix.rstrip('.')} must be a mapping")
+    known = {item.name: item for item in fields(cls)}
+    values = {}
+    for key, value in data.items():
+        name = _snake_case(key)
+        if name not in known:
+            raise OptionsError(f"unknown option: {prefix}{key}")
+        default = known[name].default_factory() if callable(known[name].default_factory) \
+            else known[name].default
+        if hasattr(default, '__dataclass_fields__'):
+            values[name] = _build(type(default), value, f"{prefix}{key}.")
+        else:
+            values[name] = _coerce(value, default, f"{prefix}{key}")
+    return cls(**values)
+
+
+def _coerce(value: Any, default: Any, key: str) -> Any:
+    """既定値の型に合わせて変換（on/off は真偽値として扱う）"""
+    if isinstance(default, bool):
+        if isinstance(value, bool):
+            return value
+        if isinstance(value, str) and value.lower() in ("on", "off", "true", "false", "yes", "no"):
+            return value.lower() in ("on", "true", "yes")
+        raise OptionsError(f"{key} must be on/off: {value!r}")
+    if isinstance(default, int):
+        if isinstance(value, int) and not isinstance(value, bool):
+            return value
+        raise OptionsError(f"{key} must be an integer: {value!r}")
+    if key.endswith("indent") and isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        return value
+    raise OptionsError(f"{key} must be a string: {value!r}")
@@ -50,6 +50,9 @@ class NodeType(Enum):
     NORM = "norm"
     ABS = "abs"
     
+    # 表
+    TABLE = "table"
+    
     # その他
     TEXT = "text"
     UNKNOWN = "unknown"
@@ -265,6 +268,17 @@ class AbsNode(ASTNode):
             self.node_type = NodeType.ABS
 
 
+@dataclass
+class TableNode(ASTNode):
+    """表ノード（tabular・longtable など、contentは環境の本文）"""
+    environment: str = "tabular"
+    columns: str = ""  # 列指定
+    width: Optional[str] = None  # tabular*・tabularx の幅
+    
+    def __post_init__(self):
+        self.node_type = NodeType.TABLE
+
+
 @dataclass
 class UnknownNode(ASTNode):
     """未知ノード（退避用）"""
@@ -278,5 +292,6 @@ class UnknownNode(ASTNode):
 ASTNodeType = Union[
     DocumentNode, SectionNode, MathNode, TheoremNode, ReferenceNode,
     AccentNode, FunctionNode, SymbolNode, VariableNode, OperatorNode,
-    FractionNode, SubscriptNode, SuperscriptNode, NormNode, AbsNode, TextNode, UnknownNode
+    FractionNode, SubscriptNode, SuperscriptNode, NormNode, AbsNode, TableNode, TextNode,
+    UnknownNode
 ]
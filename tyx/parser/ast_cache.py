@@ -0,0 +1,407 @@
+"""
+解析結果のキャッシュ
+
+同じ.texを変換・ラベル検査・往復検査・統計で何度も解析しないよう、DocumentNode の木を
+ソースの隣の `.tyxast` に保存する。pickleは使わず、固定長のノード表（structで詰める）と
+文字列プール（ノード種別・クラス名も同じプールに1回だけ持つ）からなる独自の形式とする。
+ヘッダーに形式の版・内容のハッシュ・解析器のキーを持ち、どれかが一致しない場合は使わない。
+読み込みはヘッダーとブロック（文書直下の子ノード）の表だけを読み、ノードはブロック単位で必要になった時に組み立てる。
+"""
+
+import gc
+import os
+import struct
+import sys
+from array import array
+from dataclasses import fields
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from . import ast as ast_nodes
+from .ast import ASTNode, DocumentNode, NodeType
+from ..utils.labels import LabelRecord
+
+
+# ヘッダー: 識別子, 形式の版, 内容のハッシュ（SHA-1）, 解析器のキー, 各表の要素数
+_HEADER = struct.Struct('<4sH20sI11I')
+# ノード: クラス, 種別, 追加の値の数, 本文, メタコメント（-1はNone）, 子孫の数, 追加の値の開始位置
+_NODE = struct.Struct('<BBHiiII')
+# 追加の値（フィールドと属性）: 名前, 値の型, 値（型ごとに a・b の意味が異なる）
+_EXTRA = struct.Struct('<IBii')
+# ラベル・参照の抽出結果: kind, target, start, end
+_RECORD = struct.Struct('<IIii')
+# ラベル索引への登録: ラベル定義か, 名前, 種別, 位置
+_INDEX_ENTRY = struct.Struct('<BIIi')
+
+_MAGIC = b'TYXA'
+_NONE = -1
+
+# 値の型（ATTRIBUTE のビットが立つものは attributes の値）
+_VALUE_NONE, _VALUE_STR, _VALUE_INT, _VALUE_BOOL, _VALUE_STRS, _VALUE_INTS, _VALUE_RECORDS = range(7)
+_ATTRIBUTE = 0x80
+
+# 全ノードが持つフィールド（ノード表に直接持つ）
+_BASE_FIELDS = frozenset(('node_type', 'content', 'children', 'attributes', 'meta_comment'))
+
+
+def _u32_array(data: bytes) -> array:
+    """リトルエンディアンの符号なし32ビット整数の列"""
+    values = array('I')
+    values.frombytes(data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+class IndexRecorder:
+    """解析中のラベル索引への登録を記録（LabelIndex の代わりに解析器に渡す）"""
+
+    def __init__(self):
+        # (ラベル定義か, 名前, 種別, 位置)
+        self.entries: List[Tuple[bool, str, str, int]] = []
+
+    def add_label(self, label: str, label_type: str, file_path: str, offset: int) -> None:
+        self.entries.append((True, label, label_type, offset))
+
+    def add_reference(self, label: str, file_path: str, offset: int, ref_type: str = 'ref') -> None:
+        self.entries.append((False, label, ref_type, offset))
+
+    def replay(self, label_index, file_path: str) -> None:
+        """記録した登録をラベル索引に適用"""
+        for is_label, label, kind, offset in self.entries:
+            if is_label:
+                label_index.add_label(label, kind, file_path, offset)
+            else:
+                label_index.add_reference(label, file_path, offset, kind)
+
+
+class _Writer:
+    """キャッシュの各表を組み立てる"""
+
+    def __init__(self):
+        self.strings: Dict[str, int] = {}
+        self.classes: Dict[type, int] = {}
+        self.types: Dict[NodeType, int] = {}
+        self.nodes: List[bytes] = []
+        self.extras: List[bytes] = []
+        self.items = array('i')
+        self.records: List[bytes] = []
+        self.blocks = array('I')
+
+    def intern(self, text: str) -> int:
+        """文字列プールの番号（同じ文字列は1回だけ持つ）"""
+        number = self.strings.get(text)
+        if number is None:
+            number = self.strings[text] = len(self.strings)
+        return number
+
+    def add_tree(self, node: ASTNode) -> int:
+        """ノードと子孫を前順に追加し、子孫の数を返す"""
+        index = len(self.nodes)
+        self.nodes.append(b'')
+        extras = [(item.name, getattr(node, item.name), 0) for item in fields(node)
+                  if item.name not in _BASE_FIELDS]
+        extras.extend((key, value, _ATTRIBUTE) for key, value in node.attributes.items())
+        extra_start = len(self.extras)
+        for name, value, flag in extras:
+            kind, a, b = self._value(name, value)
+            self.extras.append(_EXTRA.pack(self.intern(name), kind | flag, a, b))
+
+        descendants = 0
+        for child in node.children:
+            descendants += 1 + self.add_tree(child)
+        class_id = self.classes.setdefault(type(node), len(self.classes))
+        type_id = self.types.setdefault(node.node_type, len(self.types))
+        meta = _NONE if node.meta_comment is None else self.intern(node.meta_comment)
+        self.nodes[index] = _NODE.pack(class_id, type_id, len(extras), self.intern(node.content),
+                                       meta, descendants, extra_start)
+        return descendants
+
+    def _value(self, name: str, value: Any) -> Tuple[int, int, int]:
+        """値を (型, a, b) に変換"""
+        if value is None:
+            return _VALUE_NONE, 0, 0
+        if isinstance(value, str):
+            return _VALUE_STR, self.intern(value), 0
+        if isinstance(value, bool):
+            return _VALUE_BOOL, int(value), 0
+        if isinstance(value, int):
+            return _VALUE_INT, value, 0
+        if isinstance(value, list):
+            start = len(self.items)
+            if value and all(isinstance(item, LabelRecord) for item in value):
+                start = len(self.records)
+                for record in value:
+                    self.records.append(_RECORD.pack(self.intern(record.kind), self.intern(record.target),
+                                                     record.start, record.end))
+                return _VALUE_RECORDS, start, len(value)
+            if all(isinstance(item, str) for item in value):
+                self.items.extend(self.intern(item) for item in value)
+                return _VALUE_STRS, start, len(value)
+            if all(isinstance(item, int) and not isinstance(item, bool) for item in value):
+                self.items.extend(value)
+                return _VALUE_INTS, start, len(value)
+        raise TypeError(f"cannot serialize {name!r} value of type {type(value).__name__}")
+
+    def tobytes(self, document: DocumentNode, digest: str, key: str,
+                problems: Sequence[str], index_entries: Sequence[Tuple[bool, str, str, int]]) -> bytes:
+        """文書をキャッシュの形式に変換"""
+        for child in document.children:
+            self.blocks.append(len(self.nodes))
+            self.add_tree(child)
+        key_id = self.intern(key)
+        class_names = array('I', (self.intern(cls.__name__) for cls in self.classes))
+        type_names = array('I', (self.intern(node_type.value) for node_type in self.types))
+        problem_ids = array('I', (self.intern(problem) for problem in problems))
+        entries = [_INDEX_ENTRY.pack(is_label, self.intern(label), self.intern(kind), offset)
+                   for is_label, label, kind, offset in index_entries]
+
+        # 文字列プールは連結した本文と各文字列の終了位置（文字数）
+        pool = ''.join(self.strings)
+        offsets = array('I', [0])
+        end = 0
+        for text in self.strings:
+            end += len(text)
+            offsets.append(end)
+        pool_bytes = pool.encode('utf-8')
+
+        tables = [offsets, class_names, type_names, problem_ids, self.blocks, self.items]
+        if sys.byteorder == 'big':
+            for table in tables:
+                table.byteswap()
+        header = _HEADER.pack(_MAGIC, ASTCache.FORMAT_VERSION, bytes.fromhex(digest), key_id,
+                              len(self.strings), len(pool_bytes), len(class_names), len(type_names),
+                              len(problem_ids), len(self.blocks), len(self.nodes), len(self.extras),
+                              len(self.items), len(self.records), len(entries))
+        return b''.join([header, offsets.tobytes(), pool_bytes, class_names.tobytes(),
+                         type_names.tobytes(), problem_ids.tobytes(), self.blocks.tobytes(),
+                         b''.join(self.nodes), b''.join(self.extras), self.items.tobytes(),
+                         b''.join(self.records), b''.join(entries)])
+
+
+class CachedAST:
+    """読み込んだキャッシュ（ノードはブロック単位で必要になった時に組み立てる）"""
+
+    def __init__(self, data: bytes):
+        (magic, self.version, digest, key_id, string_count, pool_size, class_count, type_count,
+         problem_count, block_count, node_count, extra_count, item_count, record_count,
+         entry_count) = _HEADER.unpack_from(data)
+        if magic != _MAGIC or self.version != ASTCache.FORMAT_VERSION:
+            raise ValueError("not an AST cache of this format version")
+        self.digest = digest.hex()
+        self._data = data
+        position = _HEADER.size
+
+        def table(size: int) -> Tuple[int, int]:
+            nonlocal position
+            start, position = position, position + size
+            if position > len(data):
+                raise ValueError("truncated AST cache")
+            return start, position
+
+        start, end = table(4 * (string_count + 1))
+        self._offsets = _u32_array(data[start:end])
+        start, end = table(pool_size)
+        self._pool = data[start:end].decode('utf-8')
+        self._strings: List[Optional[str]] = [None] * string_count
+        self.key = self.string(key_id)
+
+        start, end = table(4 * class_count)
+        self._classes = [getattr(ast_nodes, self.string(number)) for number in _u32_array(data[start:end])]
+        if not all(isinstance(cls, type) and issubclass(cls, ASTNode) for cls in self._classes):
+            raise ValueError("unknown node class in AST cache")
+        start, end = table(4 * type_count)
+        self._types = [NodeType(self.string(number)) for number in _u32_array(data[start:end])]
+        start, end = table(4 * problem_count)
+        self._problem_ids = _u32_array(data[start:end])
+        start, end = table(4 * block_count)
+        self._blocks = _u32_array(data[start:end])
+        self._nodes, _ = table(_NODE.size * node_count)
+        self._extras, _ = table(_EXTRA.size * extra_count)
+        start, end = table(4 * item_count)
+        self._items = array('i')
+        self._items.frombytes(data[start:end])
+        if sys.byteorder == 'big':
+            self._items.byteswap()
+        self._records, _ = table(_RECORD.size * record_count)
+        self._entries, _ = table(_INDEX_ENTRY.size * entry_count)
+        self._entry_count = entry_count
+        self._node_count = node_count
+        self._decoded: List[Optional[ASTNode]] = [None] * block_count
+
+    def string(self, number: int) -> str:
+        """文字列プールの文字列"""
+        text = self._strings[number]
+        if text is None:
+            text = self._strings[number] = self._pool[self._offsets[number]:self._offsets[number + 1]]
+        return text
+
+    @property
+    def problems(self) -> List[str]:
+        """解析時の問題"""
+        return [self.string(number) for number in self._problem_ids]
+
+    def index_recorder(self) -> IndexRecorder:
+        """解析時のラベル索引への登録"""
+        recorder = IndexRecorder()
+        for is_label, label, kind, offset in _INDEX_ENTRY.iter_unpack(
+                self._data[self._entries:self._entries + _INDEX_ENTRY.size * self._entry_count]):
+            recorder.entries.append((bool(is_label), self.string(label), self.string(kind), offset))
+        return recorder
+
+    def __len__(self) -> int:
+        """ブロックの数"""
+        return len(self._blocks)
+
+    def block(self, index: int) -> ASTNode:
+        """index番目のブロック（文書直下の子ノード）"""
+        node = self._decoded[index]
+        if node is None:
+            root = self._blocks[index]
+            size = _NODE.unpack_from(self._data, self._nodes + _NODE.size * root)[5] + 1
+            node = self._decoded[index] = self._build(root, root + size)[0]
+        return node
+
+    def blocks(self) -> Iterator[ASTNode]:
+        for index in range(len(self._blocks)):
+            yield self.block(index)
+
+    def document(self) -> DocumentNode:
+        """文書全体を組み立てる（まだ組み立てていない場合はノード表を1回で読む）"""
+        document = DocumentNode(node_type=NodeType.DOCUMENT, content="")
+        if not any(self._decoded):
+            self._decoded = self._build(0, self._node_count)
+        document.children = list(self.blocks())
+        return document
+
+    def _build(self, first: int, end: int) -> List[ASTNode]:
+        """ノード表の [first, end) を組み立て、根（ブロック）の列を返す
+
+        作るオブジェクトはすべて木から参照されるため、組み立て中は循環参照のGCを止める。
+        """
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return self._build_nodes(first, end)
+        finally:
+            if enabled:
+                gc.enable()
+
+    def _build_nodes(self, first: int, end: int) -> List[ASTNode]:
+        data, string, strings = self._data, self.string, self._strings
+        classes, types, value = self._classes, self._types, self._value
+        rows = _NODE.iter_unpack(data[self._nodes + _NODE.size * first:self._nodes + _NODE.size * end])
+        # 範囲内の追加の値は前順に並んでいるため、まとめて読む
+        extra_first = extra_end = 0
+        if end > first:
+            extra_first = _NODE.unpack_from(data, self._nodes + _NODE.size * first)[6]
+            last = _NODE.unpack_from(data, self._nodes + _NODE.size * (end - 1))
+            extra_end = last[6] + last[2]
+        extras = list(_EXTRA.iter_unpack(data[self._extras + _EXTRA.size * extra_first:
+                                              self._extras + _EXTRA.size * extra_end]))
+
+        roots: List[ASTNode] = []
+        # (ノード, 部分木の終わりの番号)
+        stack: List[Tuple[ASTNode, int]] = []
+        for index, (class_id, type_id, extra_count, content, meta, descendants, extra_start) \
+                in enumerate(rows, start=first):
+            node = object.__new__(classes[class_id])
+            children: List[ASTNode] = []
+            attributes: Dict[str, Any] = {}
+            values = {'node_type': types[type_id], 'content': strings[content] or string(content),
+                      'children': children, 'attributes': attributes,
+                      'meta_comment': None if meta == _NONE else string(meta)}
+            if extra_count:
+                offset = extra_start - extra_first
+                for name, kind, a, b in extras[offset:offset + extra_count]:
+                    target = values
+                    if kind & _ATTRIBUTE:
+                        target, kind = attributes, kind & ~_ATTRIBUTE
+                    # 多い型（None・文字列）はここで戻す
+                    if kind == _VALUE_NONE:
+                        target[strings[name] or string(name)] = None
+                    elif kind == _VALUE_STR:
+                        target[strings[name] or string(name)] = strings[a] or string(a)
+                    else:
+                        target[strings[name] or string(name)] = value(kind, a, b)
+            node.__dict__ = values
+
+            while stack and stack[-1][1] <= index:
+                stack.pop()
+            if stack:
+                stack[-1][0].children.append(node)
+            else:
+                roots.append(node)
+            if descendants:
+                stack.append((node, index + 1 + descendants))
+        return roots
+
+    def _value(self, kind: int, a: int, b: int) -> Any:
+        """(型, a, b) を値に戻す"""
+        if kind == _VALUE_NONE:
+            return None
+        if kind == _VALUE_STR:
+            return self.string(a)
+        if kind == _VALUE_INT:
+            return a
+        if kind == _VALUE_BOOL:
+            return bool(a)
+        if not b and kind in (_VALUE_STRS, _VALUE_INTS, _VALUE_RECORDS):
+            return []
+        if kind == _VALUE_STRS:
+            return [self.string(number) for number in self._items[a:a + b]]
+        if kind == _VALUE_INTS:
+            return self._items[a:a + b].tolist()
+        if kind == _VALUE_RECORDS:
+            start = self._records + _RECORD.size * a
+            return [LabelRecord(self.string(record_kind), self.string(target), record_start, record_end)
+                    for record_kind, target, record_start, record_end
+                    in _RECORD.iter_unpack(self._data[start:start + _RECORD.size * b])]
+        return None
+
+
+class ASTCache:
+    """`.tyxast` の読み書き
+
+    キャッシュは内容のハッシュ（TeXSource.content_hash）と解析器のキー（解析器の種類と設定）が
+    一致する場合だけ使う。壊れたファイルや古い版のファイルは無視する。
+    """
+
+    FORMAT_VERSION = 3
+    SUFFIX = ".tyxast"
+
+    def cache_path(self, source_path: str) -> str:
+        """キャッシュファイルのパス"""
+        return source_path + self.SUFFIX
+
+    def dumps(self, document: DocumentNode, digest: str, key: str, problems: Sequence[str] = (),
+              index_entries: Sequence[Tuple[bool, str, str, int]] = ()) -> bytes:
+        """文書をキャッシュの形式に変換"""
+        return _Writer().tobytes(document, digest, key, problems, index_entries)
+
+    def save(self, path: str, document: DocumentNode, digest: str, key: str, problems: Sequence[str] = (),
+             index_entries: Sequence[Tuple[bool, str, str, int]] = ()) -> None:
+        """キャッシュファイルを保存（書き込み途中のファイルを読まないよう置き換える）"""
+        data = self.dumps(document, digest, key, problems, index_entries)
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, 'wb') as f:
+            f.write(data)
+        os.replace(temporary, path)
+
+    def load(self, path: str, digest: str, key: str) -> Optional[CachedAST]:
+        """キャッシュファイルを読み込み（存在しない・一致しない・壊れている場合はNone）"""
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        try:
+            cached = CachedAST(data)
+        except (ValueError, struct.error, UnicodeDecodeError, IndexError, AttributeError):
+            return None
+        if cached.digest != digest or cached.key != key:
+            return None
+        return cached
+
+
+# グローバルインスタンス
+ast_cache = ASTCache()
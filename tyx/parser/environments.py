@@ -0,0 +1,180 @@
+"""
+環境の木
+
+`\\begin{X}` と `\\end{X}` の対を構造文字の索引（structure.py）から求めてスタックにより対応付け、
+位置と入れ子の深さを持つ環境の木を作る。各段階は本文を再走査せずにこの木を参照する。
+定理型の環境名は既定の名前に加え、preambleの `\\newtheorem` から学習する。
+"""
+
+import re
+from bisect import bisect_left
+from dataclasses import dataclass, field
+from typing import Dict, FrozenSet, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from .structure import StructuralIndex
+
+
+# 既定の定理型の環境名
+DEFAULT_THEOREM_ENVIRONMENTS = frozenset([
+    'Theorem', 'Lemma', 'Proposition', 'Corollary', 'Definition', 'Remark', 'Example', 'Proof',
+    'theorem', 'lemma', 'proposition', 'corollary', 'definition', 'remark', 'example', 'proof',
+])
+
+# \newtheorem{name}[counter]{Title} / \newtheorem*{name}{Title}
+_NEWTHEOREM = re.compile(r'\\(?:newtheorem\*?\s*\{([^{}]+)\}|[\\%])|%[^\n]*')
+
+
+@dataclass
+class Environment:
+    """環境（位置は元の文字列での位置）"""
+    name: str
+    start: int        # \begin{ の位置
+    body_start: int   # \begin{name} の直後
+    body_end: int     # \end{name} の位置（閉じがない場合は親の終わりまたは文字列の末尾）
+    end: int          # \end{name} の直後
+    depth: int
+    closed: bool = False
+    parent: Optional['Environment'] = field(default=None, repr=False, compare=False)
+    children: List['Environment'] = field(default_factory=list, repr=False, compare=False)
+
+    def walk(self) -> Iterator['Environment']:
+        """子孫を開始位置の順に返す"""
+        for child in self.children:
+            yield child
+            yield from child.walk()
+
+
+def learn_theorem_names(tex_content: str) -> FrozenSet[str]:
+    """既定の定理型の環境名に、\\newtheoremで定義された名前を加える"""
+    names = set(DEFAULT_THEOREM_ENVIRONMENTS)
+    if '\\newtheorem' in tex_content:
+        for match in _NEWTHEOREM.finditer(tex_content):
+            if match.group(1):
+                names.add(match.group(1).strip())
+    return frozenset(names)
+
+
+class EnvironmentTree:
+    """`\\begin`/`\\end` の対から作る環境の木"""
+
+    def __init__(self, text: str, theorem_names: Optional[Iterable[str]] = None,
+                 index: Optional[StructuralIndex] = None):
+        self.text = text
+        # 構造文字の索引（数式の範囲の検出など、ほかの段と共有）
+        self.index = StructuralIndex(text) if index is None else index
+        self.theorem_names: FrozenSet[str] = (DEFAULT_THEOREM_ENVIRONMENTS if theorem_names is None
+                                              else frozenset(theorem_names))
+        self.roots: List[Environment] = []
+        # 開始位置の順
+        self.environments: List[Environment] = []
+        self._starts: List[int] = []
+        self._by_start: Dict[int, Environment] = {}
+        self._build()
+
+    def _tokens(self) -> Iterator[Tuple[str, str, int, int]]:
+        """環境の境界 (begin/end, 環境名, 開始位置, 終了位置) を位置の順に返す
+
+        エスケープされていない `\\begin{`・`\\end{` のうちコメントの外にあるもの。
+        環境名は次の `}` までで、`{` と改行を含まないもの（環境名の中の `%` はコメントにしない）。
+        """
+        index = self.index
+        closes = index.raw('}')
+        starts, kinds, name_starts = [], [], []
+        for kind in ('begin', 'end'):
+            found = index.commands_starting(kind + '{')
+            starts.append(found)
+            kinds.append(np.full(len(found), kind == 'begin'))
+            name_starts.append(found + len(kind) + 2)
+        starts, kinds, name_starts = (np.concatenate(arrays) for arrays in (starts, kinds, name_starts))
+        order = np.argsort(starts, kind='stable')
+        starts, kinds, name_starts = starts[order], kinds[order], name_starts[order]
+
+        found = np.searchsorted(closes, name_starts)
+        valid = found < len(closes)
+        starts, kinds, name_starts = starts[valid], kinds[valid], name_starts[valid]
+        name_ends = closes[found[valid]]
+        # 環境名の途中に `{` や改行があるものを除く
+        valid = ((self._next(index.raw('{'), name_starts) > name_ends)
+                 & (self._next(index.raw('\n'), name_starts) > name_ends))
+        starts, kinds, name_starts, name_ends = (array[valid] for array in (starts, kinds, name_starts, name_ends))
+        live = ~index.in_comment(starts, index.comments_outside(name_starts, name_ends))
+
+        text = self.text
+        for start, begin, name_start, name_end in zip(starts[live].tolist(), kinds[live].tolist(),
+                                                      name_starts[live].tolist(), name_ends[live].tolist()):
+            yield 'begin' if begin else 'end', text[name_start:name_end], start, name_end + 1
+
+    @staticmethod
+    def _next(positions: np.ndarray, starts: np.ndarray) -> np.ndarray:
+        """各開始位置以降で最初の位置（なければ無限大）"""
+        found = np.searchsorted(positions, starts)
+        following = np.full(len(starts), np.iinfo(np.intp).max, dtype=np.intp)
+        inside = found < len(positions)
+        following[inside] = positions[found[inside]]
+        return following
+
+    def _build(self) -> None:
+        text = self.text
+        stack: List[Environment] = []
+        for kind, name, start, end in self._tokens():
+            if kind == 'begin':
+                parent = stack[-1] if stack else None
+                environment = Environment(name, start, end, len(text), len(text),
+                                          depth=len(stack), parent=parent)
+                (parent.children if parent else self.roots).append(environment)
+                self.environments.append(environment)
+                stack.append(environment)
+                continue
+
+            # 同名の開いた環境を内側から探す（見つからない\endは無視）
+            for index in range(len(stack) - 1, -1, -1):
+                if stack[index].name == name:
+                    break
+            else:
+                continue
+            # 内側の閉じていない環境は外側の\endで打ち切る
+            for unclosed in stack[index + 1:]:
+                unclosed.body_end = unclosed.end = start
+            environment = stack[index]
+            environment.body_end = start
+            environment.end = end
+            environment.closed = True
+            del stack[index:]
+
+        self._starts = [environment.start for environment in self.environments]
+        self._by_start = {environment.start: environment for environment in self.environments}
+
+    def at(self, pos: int) -> Optional[Environment]:
+        """位置posから始まる環境"""
+        return self._by_start.get(pos)
+
+    def body(self, environment: Environment) -> str:
+        """環境の本文"""
+        return self.text[environment.body_start:environment.body_end]
+
+    def select(self, names: Iterable[str], start: int = 0, end: Optional[int] = None,
+               outermost: bool = False) -> List[Environment]:
+        """範囲[start, end)に収まる、閉じた指定名の環境を開始位置の順に返す
+
+        outermostが真の場合は、選んだ環境の内側にあるものを除く。
+        """
+        names = names if isinstance(names, (set, frozenset)) else frozenset(names)
+        end = len(self.text) if end is None else end
+        selected: List[Environment] = []
+        last_end = start
+        for index in range(bisect_left(self._starts, start), len(self.environments)):
+            environment = self.environments[index]
+            if environment.start >= end:
+                break
+            if (environment.name not in names or not environment.closed or environment.end > end
+                    or (outermost and environment.start < last_end)):
+                continue
+            selected.append(environment)
+            last_end = environment.end
+        return selected
+
+    def theorems(self, start: int = 0, end: Optional[int] = None) -> List[Environment]:
+        """定理型の環境"""
+        return self.select(self.theorem_names, start, end)
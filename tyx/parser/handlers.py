@@ -0,0 +1,108 @@
+"""
+コマンド・環境の変換ハンドラー
+
+研究室ごとのマクロ（`\\norm`・`\\inner`・`\\R` など）を、変換器を改変せずに書き換えるための登録口。
+登録したコマンド名・環境名はマクロ展開器の認識集合（本文を1回走査する正規表現）に組み込まれ、
+ユーザー定義マクロと同じ走査の中で名前から辞書でハンドラーを引いて呼び出す。書き換えパスは増えない。
+
+ハンドラーはTeXの断片を返し、結果は記号変換・数式変換など以降の段をそのまま通る。
+同じ引数の結果はメモ化するため、ハンドラーは引数だけで結果が決まる関数であること。
+"""
+
+import re
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional
+
+
+_NAME = re.compile(r'[a-zA-Z]+\*?')
+_COMMAND_NAME = re.compile(r'[a-zA-Z]+')
+
+
+@dataclass(frozen=True)
+class CommandHandler:
+    """コマンドのハンドラー（function(*args) がTeXの断片を返す）"""
+    name: str
+    function: Callable[..., str]
+    num_args: int = 0
+    default: Optional[str] = None  # 省略可能な第1引数の既定値
+
+
+@dataclass(frozen=True)
+class EnvironmentHandler:
+    """環境のハンドラー（function(body, *args) がTeXの断片を返す）"""
+    name: str
+    function: Callable[..., str]
+    num_args: int = 0
+    default: Optional[str] = None  # 省略可能な第1引数の既定値
+
+
+class HandlerRegistry:
+    """コマンド・環境のハンドラーの登録簿
+
+    登録は変換の前に行い、変換中は読み取りだけにする（Converterを複数スレッドで共有するため）。
+
+        handlers = HandlerRegistry()
+
+        @handlers.command('inner', num_args=2)
+        def inner(a, b):
+            return f'\\\\langle {a}, {b} \\\\rangle'
+
+        handlers.add_command('R', lambda: '\\\\mathbb{R}')
+        converter = Converter(handlers=handlers)
+    """
+
+    def __init__(self):
+        self.commands: Dict[str, CommandHandler] = {}
+        self.environments: Dict[str, EnvironmentHandler] = {}
+
+    def __bool__(self) -> bool:
+        return bool(self.commands or self.environments)
+
+    def add_command(self, name: str, function: Callable[..., str], num_args: int = 0,
+                    default: Optional[str] = None) -> CommandHandler:
+        """`\\name` のハンドラーを登録（defaultを指定すると第1引数は省略可能な [..]）"""
+        name = name.lstrip('\\')
+        if not _COMMAND_NAME.fullmatch(name):
+            raise ValueError(f"invalid command name: {name!r}")
+        self._check_arguments(name, num_args, default is not None)
+        handler = self.commands[name] = CommandHandler(name, function, num_args, default)
+        return handler
+
+    def add_environment(self, name: str, function: Callable[..., str], num_args: int = 0,
+                        default: Optional[str] = None) -> EnvironmentHandler:
+        """`\\begin{name}...\\end{name}` のハンドラーを登録（引数は \\begin{name} の直後に読む）"""
+        if not _NAME.fullmatch(name):
+            raise ValueError(f"invalid environment name: {name!r}")
+        self._check_arguments(name, num_args, default is not None)
+        handler = self.environments[name] = EnvironmentHandler(name, function, num_args, default)
+        return handler
+
+    def command(self, name: str, num_args: int = 0, default: Optional[str] = None):
+        """add_command のデコレーター版"""
+        def register(function: Callable[..., str]) -> Callable[..., str]:
+            self.add_command(name, function, num_args, default)
+            return function
+        return register
+
+    def environment(self, name: str, num_args: int = 0, default: Optional[str] = None):
+        """add_environment のデコレーター版"""
+        def register(function: Callable[..., str]) -> Callable[..., str]:
+            self.add_environment(name, function, num_args, default)
+            return function
+        return register
+
+    @property
+    def signature(self) -> str:
+        """登録内容の要約（設定の指紋・解析結果のキャッシュキー用）"""
+        def describe(handler) -> str:
+            function = handler.function
+            return (f"{handler.name}/{handler.num_args}[{handler.default!r}]:"
+                    f"{getattr(function, '__module__', '')}.{getattr(function, '__qualname__', '')}")
+        commands = ','.join(describe(self.commands[name]) for name in sorted(self.commands))
+        environments = ','.join(describe(self.environments[name]) for name in sorted(self.environments))
+        return f"commands[{commands}] environments[{environments}]"
+
+    @staticmethod
+    def _check_arguments(name: str, num_args: int, optional: bool) -> None:
+        if not 0 <= num_args <= 9 or (optional and num_args == 0):
+            raise ValueError(f"invalid argument count for {name!r}: {num_args!r}")
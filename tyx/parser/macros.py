@@ -0,0 +1,445 @@
+"""
+ユーザー定義マクロの展開
+
+preambleの\\newcommand, \\def, \\DeclareMathOperatorを解析し、
+本文中のマクロを数式変換の前に展開する。
+"""
+
+import re
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set, Tuple, Union
+
+from .handlers import CommandHandler, EnvironmentHandler, HandlerRegistry
+from .structure import StructuralIndex
+
+
+_CONTROL_SEQUENCE = re.compile(r'\\(?:[a-zA-Z@]+|.)')
+_MACRO_NAME = re.compile(r'\\[a-zA-Z]+')
+
+
+@dataclass
+class MacroDefinition:
+    """ユーザー定義マクロ"""
+    name: str
+    num_args: int = 0
+    default: Optional[str] = None  # 省略可能な第1引数の既定値
+    body: str = ""
+
+
+# 展開の対象（ユーザー定義マクロと登録したハンドラー）
+Expandable = Union[MacroDefinition, CommandHandler, EnvironmentHandler]
+
+
+# 1文書で展開したマクロの結果の合計の長さ（文字数）の上限の既定値
+DEFAULT_MAX_EXPANDED_LENGTH = 10_000_000
+
+
+class MacroExpansionError(Exception):
+    """再帰の深さ・展開回数・展開結果の長さの上限超過"""
+
+
+class MacroExpander:
+    """ユーザー定義マクロの展開器
+
+    展開結果は (マクロ名, 引数) ごとにメモ化する。
+    再帰の深さ・展開回数（メモ化した結果の再利用も1回と数える）・展開結果の合計の長さに上限を設け、
+    扱えないマクロは展開せずに残して problems に記録する。
+    handlersに登録したコマンド・環境も同じ走査で展開する（同名のユーザー定義マクロより優先）。
+    """
+
+    # 展開対象外とする複雑な定義（マクロ定義・条件分岐・内部コマンドなど）
+    COMPLEX_PATTERN = re.compile(
+        r'\\(?:[egx]?def|newcommand|renewcommand|let|csname|expandafter|futurelet'
+        r'|if(?:x|num|dim|case|cat|defined|mmode|vmode|hmode|odd)?|else|fi)(?![a-zA-Z])'
+        r'|\\[a-zA-Z]*@|##'
+    )
+
+    def __init__(self, max_depth: int = 16, max_expansions: int = 100000,
+                 handlers: Optional[HandlerRegistry] = None,
+                 max_expanded_length: int = DEFAULT_MAX_EXPANDED_LENGTH):
+        self.max_depth = max_depth
+        self.max_expansions = max_expansions
+        self.max_expanded_length = max_expanded_length
+        self.definitions: Dict[str, MacroDefinition] = {}
+        self.handlers = handlers or HandlerRegistry()
+        self.problems: List[str] = []
+
+        # 定義コマンドの検出
+        self.definition_pattern = re.compile(
+            r'\\(?:(?P<newcommand>newcommand|renewcommand|providecommand)\*?'
+            r'|(?P<operator>DeclareMathOperator)(?P<star>\*?)'
+            r'|(?P<def>def))(?![a-zA-Z])'
+        )
+        self.param_pattern = re.compile(r'#([1-9])')
+        self.def_params_pattern = re.compile(r'(?:#[1-9])*')
+
+        self._usage_pattern: Optional['re.Pattern'] = None
+        self._environment_pattern: Optional['re.Pattern'] = None
+        self._environment_ends: Dict[str, 're.Pattern'] = {}
+        self._cache: Dict[Tuple[object, Tuple[str, ...]], str] = {}
+        self._failed: Set[str] = set()
+        self._expansions = 0
+        # 本文に書き出した展開結果の長さの合計
+        self._expanded_length = 0
+        # 読み込み中のpreambleの構造文字の索引（括弧の対応を索引から求める）
+        self._structure: Optional[StructuralIndex] = None
+
+    def reset(self) -> None:
+        """定義とキャッシュを破棄"""
+        self.definitions.clear()
+        self.problems = []
+        self._usage_pattern = None
+        self._cache.clear()
+        self._failed.clear()
+        self._expansions = 0
+        self._expanded_length = 0
+
+    def parse_definitions(self, preamble: str) -> None:
+        """preambleからマクロ定義を読み込み"""
+        preamble = StructuralIndex(preamble).strip_comments()
+        self._structure = StructuralIndex(preamble)
+        try:
+            self._read_definitions(preamble)
+        finally:
+            self._structure = None
+        self._usage_pattern = None
+
+    def _read_definitions(self, preamble: str) -> None:
+        """コメントを除いたpreambleから定義を順に読み取り"""
+        pos = 0
+        while True:
+            match = self.definition_pattern.search(preamble, pos)
+            if not match:
+                break
+            if match.group('newcommand'):
+                definition, pos = self._parse_newcommand(preamble, match.end())
+            elif match.group('operator'):
+                definition, pos = self._parse_math_operator(preamble, match.end(), match.group('star'))
+            else:
+                definition, pos = self._parse_def(preamble, match.end())
+            pos = max(pos, match.end())
+            if definition is not None and self._check_definition(definition):
+                self.definitions[definition.name] = definition
+
+    def expand(self, text: str, spans: Optional[List[Tuple[int, int, int]]] = None) -> str:
+        """本文中のマクロを展開
+
+        spansを指定すると、展開結果とtextの同じ文字の区間 (展開結果での位置, textでの位置, 長さ) と、
+        マクロの展開結果の先頭に長さ0の区間 (展開結果での位置, 使用箇所の位置, 0) を追加する。
+        """
+        if not self.definitions and not self.handlers:
+            if spans is not None:
+                spans.append((0, 0, len(text)))
+            return text
+        if self._usage_pattern is None:
+            names = sorted(set(self.definitions) | set(self.handlers.commands), key=len, reverse=True)
+            alternatives = [r'(?P<escape>\\[\\%])', r'(?P<comment>%[^\n]*)']
+            if names:
+                alternatives.append(r'\\(?P<name>' + '|'.join(re.escape(name) for name in names)
+                                    + r')(?![a-zA-Z])')
+            if self.handlers.environments:
+                alternatives.append(r'\\begin\{(?P<environment>'
+                                    + '|'.join(re.escape(name) for name in self.handlers.environments)
+                                    + r')\}')
+            self._usage_pattern = re.compile('|'.join(alternatives))
+        return self._expand_text(text, 0, spans)
+
+    def open_environments(self, text: str) -> int:
+        """登録した環境の \\begin と \\end の数の差（行をまとめて展開する範囲の判定用）"""
+        if not self.handlers.environments or '\\begin' not in text and '\\end' not in text:
+            return 0
+        if self._environment_pattern is None:
+            self._environment_pattern = re.compile(
+                r'\\(begin|end)\{(?:' + '|'.join(re.escape(name) for name in self.handlers.environments)
+                + r')\}')
+        return sum(1 if match.group(1) == 'begin' else -1
+                   for match in self._environment_pattern.finditer(text))
+
+    def _expand_text(self, text: str, depth: int, spans: Optional[List[Tuple[int, int, int]]] = None) -> str:
+        """テキスト中のマクロ使用箇所を展開"""
+        parts = []
+        pos = 0
+        # spansを記録する場合の、直前の展開の後から続くそのままの部分の開始位置（textと展開結果）
+        copied = written = 0
+        while True:
+            match = self._usage_pattern.search(text, pos)
+            if not match:
+                break
+            kind = match.lastgroup
+            name = match.group(kind)
+            key = f"begin{{{name}}}" if kind == 'environment' else name
+            if kind not in ('name', 'environment') or key in self._failed:
+                # エスケープ・コメント・展開に失敗したマクロはそのまま
+                parts.append(text[pos:match.end()])
+                pos = match.end()
+                continue
+
+            definition: Expandable
+            if kind == 'environment':
+                definition = self.handlers.environments[name]
+            else:
+                definition = self.handlers.commands.get(name) or self.definitions[name]
+            parsed = self._read_arguments(definition, text, match.end())
+            if parsed is not None and kind == 'environment':
+                parsed = self._read_environment_body(name, parsed, text)
+            if parsed is None:
+                parts.append(text[pos:match.end()])
+                pos = match.end()
+                continue
+            args, end = parsed
+
+            parts.append(text[pos:match.start()])
+            if depth == 0:
+                try:
+                    expanded = self._expand_macro(definition, args, depth)
+                except MacroExpansionError as e:
+                    self._failed.add(key)
+                    self.problems.append(f"Macro \\{key} left unexpanded: {e}")
+                    # 使用箇所はそのまま残す（直前の文字と続けて対応付ける）
+                    parts[-1] = text[pos:end]
+                    pos = end
+                    continue
+                if spans is not None:
+                    spans.append((written, copied, match.start() - copied))
+                    written += match.start() - copied
+                    spans.append((written, match.start(), 0))
+                    written += len(expanded)
+                    copied = end
+                parts.append(expanded)
+            else:
+                parts.append(self._expand_macro(definition, args, depth))
+            pos = end
+        if spans is not None:
+            spans.append((written, copied, len(text) - copied))
+        parts.append(text[pos:])
+        return ''.join(parts)
+
+    def _read_environment_body(self, name: str, parsed: Tuple[Tuple[str, ...], int],
+                               text: str) -> Optional[Tuple[Tuple[str, ...], int]]:
+        """環境の本文を対応する \\end{name} まで読み取り、(本文, 引数...) と終了位置を返す"""
+        pattern = self._environment_ends.get(name)
+        if pattern is None:
+            pattern = self._environment_ends[name] = re.compile(
+                r'\\(begin|end)\{' + re.escape(name) + r'\}')
+        args, pos = parsed
+        nesting = 1
+        for match in pattern.finditer(text, pos):
+            nesting += 1 if match.group(1) == 'begin' else -1
+            if nesting == 0:
+                return (text[pos:match.start()],) + args, match.end()
+        return None
+
+    def _expand_macro(self, definition: Expandable, args: Tuple[str, ...], depth: int) -> str:
+        """マクロを1つ展開（メモ化）"""
+        key = (definition.name, args) if isinstance(definition, MacroDefinition) else (definition, args)
+        cached = self._cache.get(key)
+        if cached is None and depth >= self.max_depth:
+            raise MacroExpansionError(f"recursion depth exceeded ({self.max_depth})")
+        # メモ化した結果の再利用も数える（入れ子の繰り返しで展開結果が指数的に増えるのを止める）
+        self._expansions += 1
+        if self._expansions > self.max_expansions:
+            raise MacroExpansionError(f"expansion budget exceeded ({self.max_expansions})")
+        if cached is not None:
+            return self._charge_length(cached, depth)
+
+        if isinstance(definition, MacroDefinition):
+            body = self.param_pattern.sub(lambda m: args[int(m.group(1)) - 1], definition.body)
+        else:
+            try:
+                body = definition.function(*args)
+            except Exception as e:
+                raise MacroExpansionError(f"handler raised {type(e).__name__}: {e}") from e
+            if not isinstance(body, str):
+                raise MacroExpansionError(f"handler returned {type(body).__name__}, not str")
+        result = self._expand_text(body, depth + 1)
+        self._cache[key] = result
+        return self._charge_length(result, depth)
+
+    def _charge_length(self, result: str, depth: int) -> str:
+        """展開結果の長さを上限と照合し、本文に書き出す結果（depth 0）の長さを合計に加える"""
+        length = self._expanded_length + len(result)
+        if length > self.max_expanded_length:
+            raise MacroExpansionError(f"expanded text too long ({self.max_expanded_length} characters)")
+        if depth == 0:
+            self._expanded_length = length
+        return result
+
+    def _read_arguments(self, definition: Expandable, text: str,
+                        pos: int) -> Optional[Tuple[Tuple[str, ...], int]]:
+        """マクロの引数を読み取り"""
+        args = []
+        remaining = definition.num_args
+        if definition.default is not None:
+            optional = self._read_optional(text, self._skip_spaces(text, pos))
+            if optional is not None:
+                value, pos = optional
+                args.append(value)
+            else:
+                args.append(definition.default)
+            remaining -= 1
+        for _ in range(remaining):
+            argument = self._read_argument(text, pos)
+            if argument is None:
+                return None
+            value, pos = argument
+            args.append(value)
+        return tuple(args), pos
+
+    def _parse_newcommand(self, text: str, pos: int) -> Tuple[Optional[MacroDefinition], int]:
+        """\\newcommand{\\name}[n][default]{body} を解析"""
+        pos = self._skip_spaces(text, pos)
+        if text.startswith('{', pos):
+            group = self._read_group(text, pos)
+            if group is None:
+                return None, pos
+            name_text, pos = group
+            name_text = name_text.strip()
+        else:
+            name_text, pos = self._read_control_sequence(text, pos)
+        if not _MACRO_NAME.fullmatch(name_text):
+            return None, pos
+
+        num_args = 0
+        default = None
+        pos = self._skip_spaces(text, pos)
+        optional = self._read_optional(text, pos)
+        if optional is not None:
+            count, pos = optional
+            if not count.strip().isdigit():
+                self.problems.append(f"Macro {name_text} has an invalid argument count")
+                return None, pos
+            num_args = int(count)
+            optional = self._read_optional(text, self._skip_spaces(text, pos))
+            if optional is not None:
+                default, pos = optional
+
+        group = self._read_group(text, self._skip_spaces(text, pos))
+        if group is None:
+            self.problems.append(f"Macro {name_text} has no body")
+            return None, pos
+        body, pos = group
+        return MacroDefinition(name_text[1:], num_args, default, body), pos
+
+    def _parse_math_operator(self, text: str, pos: int, star: str) -> Tuple[Optional[MacroDefinition], int]:
+        """\\DeclareMathOperator{\\name}{text} を解析"""
+        name_group = self._read_group(text, self._skip_spaces(text, pos))
+        if name_group is None:
+            return None, pos
+        name_text, pos = name_group
+        name_text = name_text.strip()
+        body_group = self._read_group(text, self._skip_spaces(text, pos))
+        if body_group is None or not _MACRO_NAME.fullmatch(name_text):
+            return None, pos
+        operator_text, pos = body_group
+        return MacroDefinition(name_text[1:], 0, None, f"\\operatorname{star}{{{operator_text}}}"), pos
+
+    def _parse_def(self, text: str, pos: int) -> Tuple[Optional[MacroDefinition], int]:
+        """\\def\\name#1#2{body} を解析（区切り付き引数は対象外）"""
+        name_text, pos = self._read_control_sequence(text, self._skip_spaces(text, pos))
+        brace = text.find('{', pos)
+        if brace == -1 or not _MACRO_NAME.fullmatch(name_text):
+            return None, pos
+        params = text[pos:brace].strip()
+        group = self._read_group(text, brace)
+        if group is None:
+            return None, pos
+        body, end = group
+        if not self.def_params_pattern.fullmatch(params) or \
+                params != ''.join(f"#{i}" for i in range(1, len(params) // 2 + 1)):
+            self.problems.append(f"Macro {name_text} uses delimited parameters; left unexpanded")
+            return None, end
+        return MacroDefinition(name_text[1:], len(params) // 2, None, body), end
+
+    def _check_definition(self, definition: MacroDefinition) -> bool:
+        """展開可能な定義かチェック"""
+        if definition.num_args > 9:
+            self.problems.append(f"Macro \\{definition.name} has too many arguments")
+            return False
+        complex_match = self.COMPLEX_PATTERN.search(definition.body)
+        if complex_match:
+            self.problems.append(f"Macro \\{definition.name} is too complex "
+                                 f"({complex_match.group(0)}); left unexpanded")
+            return False
+        for match in self.param_pattern.finditer(definition.body):
+            if int(match.group(1)) > definition.num_args:
+                self.problems.append(f"Macro \\{definition.name} refers to undefined argument #{match.group(1)}")
+                return False
+        return True
+
+    @staticmethod
+    def _skip_spaces(text: str, pos: int) -> int:
+        """空白を読み飛ばす"""
+        while pos < len(text) and text[pos] in ' \t\n':
+            pos += 1
+        return pos
+
+    def _read_group(self, text: str, pos: int) -> Optional[Tuple[str, int]]:
+        """{...} を括弧のバランスを考慮して読み取り"""
+        if not text.startswith('{', pos):
+            return None
+        structure = self._structure
+        if structure is not None and structure.text is text:
+            end = structure.matching_brace(pos)
+            return (text[pos + 1:end], end + 1) if end != -1 else None
+        # 本文の短い断片では索引を作らずに文字をたどる
+        depth = 0
+        i = pos
+        while i < len(text):
+            char = text[i]
+            if char == '\\':
+                i += 2
+                continue
+            if char == '{':
+                depth += 1
+            elif char == '}':
+                depth -= 1
+                if depth == 0:
+                    return text[pos + 1:i], i + 1
+            i += 1
+        return None
+
+    def _read_optional(self, text: str, pos: int) -> Optional[Tuple[str, int]]:
+        """[...] を読み取り（波括弧内の]は無視）"""
+        if not text.startswith('[', pos):
+            return None
+        structure = self._structure
+        if structure is not None and structure.text is text:
+            end = structure.closing_bracket(pos + 1)
+            return (text[pos + 1:end], end + 1) if end != -1 else None
+        depth = 0
+        i = pos + 1
+        while i < len(text):
+            char = text[i]
+            if char == '\\':
+                i += 2
+                continue
+            if char == '{':
+                depth += 1
+            elif char == '}':
+                depth -= 1
+            elif char == ']' and depth == 0:
+                return text[pos + 1:i], i + 1
+            i += 1
+        return None
+
+    @staticmethod
+    def _read_control_sequence(text: str, pos: int) -> Tuple[str, int]:
+        """\\name を読み取り"""
+        match = _CONTROL_SEQUENCE.match(text, pos)
+        if not match:
+            return '', pos
+        return match.group(0), match.end()
+
+    def _read_argument(self, text: str, pos: int) -> Optional[Tuple[str, int]]:
+        """必須引数（{...}・コマンド・1文字）を読み取り"""
+        pos = self._skip_spaces(text, pos)
+        if pos >= len(text):
+            return None
+        if text[pos] == '{':
+            return self._read_group(text, pos)
+        if text[pos] == '\\':
+            name, end = self._read_control_sequence(text, pos)
+            return (name, end) if name else None
+        if text[pos] == '}':
+            return None
+        return text[pos], pos + 1
@@ -0,0 +1,306 @@
+"""
+行単位の前処理
+
+preamble・本文・abstract・複数行メタデータの状態を持つ状態機械として、
+入力行を1行ずつ分類し、処理済みの行を逐次返す。
+OffsetMap を渡すと、処理済みの行を改行で連結した文字列での位置から
+入力（改行で連結した行）での位置への対応を記録する。
+"""
+
+import re
+from bisect import bisect_right
+from enum import Enum
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from .macros import MacroExpander
+
+
+class PreprocessState(Enum):
+    """前処理の状態"""
+    PREAMBLE = "preamble"
+    BODY = "body"
+    ABSTRACT = "abstract"
+    METADATA = "metadata"  # 複数行にわたるメタデータコマンドの途中
+
+
+# preambleでコメントアウトするコマンド
+PREAMBLE_COMMANDS = [
+    'documentclass', 'usepackage', 'mathtoolsset', 'newtheorem',
+    'newcommand', 'renewcommand', 'providecommand', 'def', 'DeclareMathOperator',
+]
+
+# 本文でもコメントアウトするメタデータコマンド
+METADATA_COMMANDS = [
+    'title', 'author', 'address', 'email', 'subjclass', 'keywords', 'maketitle',
+]
+
+# 行頭の分類（1回のmatchで行コメント・preambleコマンド・メタデータコマンドを判定）
+_LINE_PREFIX = re.compile(
+    r'\s*(?:(?P<comment>%)'
+    r'|\\(?P<metadata>' + '|'.join(METADATA_COMMANDS) + r')'
+    r'|\\(?P<preamble>' + '|'.join(PREAMBLE_COMMANDS) + r'))'
+)
+# document・abstract環境の境界
+_ENVIRONMENT = re.compile(r'\\(?P<kind>begin|end)\{(?P<name>document|abstract)\}')
+# エスケープされていない%（\%や\\%の直後の%を正しく扱う）
+_COMMENT = re.compile(r'\\.|(%)')
+# エスケープされていない波括弧（コメント以降は数えない）
+_BRACE = re.compile(r'\\.|([{}%])')
+
+# 同じ文字の区間 (変換後の位置, 変換前の位置, 長さ) の列
+Spans = List[Tuple[int, int, int]]
+
+
+class OffsetMap:
+    """前処理後の文字列での位置 → 入力での位置 の対応
+
+    前処理後の [start, start + length) と入力の [source, source + length) が同じ文字である区間を
+    開始位置の昇順に持つ。区間の後ろの文字（マクロの展開結果・コメントにした行の「// 」など）の
+    位置は直前の区間の終わり（マクロの展開結果は使用箇所の先頭）に対応付ける。
+    """
+
+    def __init__(self):
+        self._starts: List[int] = []
+        self._sources: List[int] = []
+        self._lengths: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self._starts)
+
+    def add(self, start: int, source: int, length: int) -> None:
+        """区間を追加（直前の区間に続く場合はつなげる）"""
+        if self._starts:
+            last = len(self._starts) - 1
+            if self._starts[last] + self._lengths[last] == start and \
+                    self._sources[last] + self._lengths[last] == source:
+                self._lengths[last] += length
+                return
+            if self._starts[last] == start:
+                # 長さ0の区間は同じ位置から始まる区間で置き換える
+                self._sources[last] = source
+                self._lengths[last] = length
+                return
+        self._starts.append(start)
+        self._sources.append(source)
+        self._lengths.append(length)
+
+    def translate(self, position: int) -> int:
+        """前処理後の位置を入力での位置に変換"""
+        index = bisect_right(self._starts, position) - 1
+        if index < 0:
+            return self._sources[0] if self._sources else position
+        return self._sources[index] + min(position - self._starts[index], self._lengths[index])
+
+
+class TeXPreprocessor:
+    """状態機械による行単位の前処理
+
+    入力は文字列のリストやファイルオブジェクトなど任意の行のイテラブル。
+    出力行は改行を含まない。
+    """
+
+    def __init__(self, macro_expander: Optional[MacroExpander] = None):
+        self.macro_expander = macro_expander
+        self.state = PreprocessState.PREAMBLE
+        self._resume_state = PreprocessState.BODY
+        self._brace_count = 0
+
+    def process(self, lines: Iterable[str], in_body: bool = False,
+                offsets: Optional[OffsetMap] = None) -> Iterator[str]:
+        """行を前処理して逐次返す
+
+        in_bodyが真の場合は本文の断片として扱い、読み込み済みのマクロ定義で展開する。
+        offsetsを指定すると、返した行を改行で連結した文字列での位置の対応を記録する。
+        """
+        self.state = PreprocessState.BODY if in_body else PreprocessState.PREAMBLE
+        self._resume_state = PreprocessState.BODY
+        self._brace_count = 0
+        if in_body and self.macro_expander is not None:
+            self.macro_expander.problems = []
+        preamble: List[str] = []
+
+        output = 0
+        if offsets is None:
+            for chunk_lines, _ in self._body_lines(lines, preamble):
+                for line in chunk_lines:
+                    yield self._process_line(line)[0]
+            return
+        for chunk_lines, chunk_spans in self._body_lines(lines, preamble, True):
+            starts = [span[0] for span in chunk_spans]
+            position = 0
+            for line in chunk_lines:
+                processed, line_spans = self._process_line(line)
+                # 行末の改行は展開後の行の改行に対応する
+                if line_spans is None:
+                    line_spans = [(0, 0, len(line) + 1)]
+                else:
+                    line_spans.append((len(processed), len(line), 1))
+                for start, line_position, length in line_spans:
+                    self._map_span(offsets, output + start, position + line_position, length,
+                                   starts, chunk_spans)
+                position += len(line) + 1
+                output += len(processed) + 1
+                yield processed
+
+    @staticmethod
+    def _map_span(offsets: OffsetMap, start: int, position: int, length: int,
+                  starts: List[int], chunk_spans: Spans) -> None:
+        """展開後の文字列での区間 [position, position + length) を入力での位置に変換して登録"""
+        index = max(bisect_right(starts, position) - 1, 0)
+        end = position + length
+        while index < len(chunk_spans):
+            chunk_start, source, chunk_length = chunk_spans[index]
+            if chunk_start >= end and chunk_start > position:
+                break
+            low = max(position, chunk_start)
+            high = min(end, chunk_start + chunk_length)
+            offsets.add(start + low - position, source + min(low - chunk_start, chunk_length),
+                        max(high - low, 0))
+            index += 1
+
+    def _body_lines(self, lines: Iterable[str], preamble: List[str],
+                    track: bool = False) -> Iterator[Tuple[Sequence[str], Optional[Spans]]]:
+        """改行を除去し、本文のユーザー定義マクロを展開した行をまとまりごとに返す
+
+        trackが真の場合、まとまりの行を改行で連結した文字列での位置 → 入力での位置 の区間も返す。
+        """
+        expander = self.macro_expander
+        pending: List[str] = []
+        pending_source = 0
+        depth = environments = 0
+        source = 0
+
+        for line in lines:
+            if line.endswith('\n'):
+                line = line[:-1]
+            line_source = source
+            source += len(line) + 1
+
+            if self.state == PreprocessState.PREAMBLE or expander is None:
+                if self.state == PreprocessState.PREAMBLE:
+                    preamble.append(line)
+                    if expander is not None and '\\begin{document}' in line:
+                        # preambleを読み終えた時点でマクロ定義を読み込む
+                        expander.reset()
+                        expander.parse_definitions('\n'.join(preamble[:-1]))
+                yield (line,), [(0, line_source, len(line))] if track else None
+                continue
+
+            # 引数が複数行にわたる場合に備え、波括弧が閉じるまでまとめて展開
+            # （ハンドラーを登録した環境は \\end までまとめる）
+            if not pending:
+                pending_source = line_source
+            pending.append(line)
+            depth += self._brace_delta(line)
+            environments += expander.open_environments(line)
+            if depth > 0 or environments > 0:
+                continue
+            yield self._expand_chunk(pending, pending_source, track)
+            pending = []
+            depth = environments = 0
+
+        if pending:
+            yield self._expand_chunk(pending, pending_source, track)
+
+    def _expand_chunk(self, lines: List[str], source: int, track: bool) -> Tuple[List[str], Optional[Spans]]:
+        """行のまとまりのマクロを展開"""
+        if not track:
+            return self.macro_expander.expand('\n'.join(lines)).split('\n'), None
+        spans: Spans = []
+        expanded = self.macro_expander.expand('\n'.join(lines), spans)
+        return expanded.split('\n'), [(start, source + position, length) for start, position, length in spans]
+
+    def _process_line(self, line: str) -> Tuple[str, Optional[Spans]]:
+        """1行を現在の状態に応じて処理し、処理後の行と元の行の同じ文字の区間（変更がなければNone）を返す"""
+        environment = _ENVIRONMENT.search(line) if '\\' in line else None
+        if environment and environment.group('name') == 'document':
+            if environment.group('kind') == 'begin':
+                # \begin{document}までをpreambleとして扱う
+                self.state = PreprocessState.BODY
+                return self._comment_out(line)
+            return line, None
+
+        prefix = _LINE_PREFIX.match(line)
+        if self.state == PreprocessState.PREAMBLE:
+            if prefix and prefix.group('comment'):
+                return self._comment_marker(line)
+            if prefix and (prefix.group('preamble') or prefix.group('metadata')):
+                return self._comment_out(line)
+            return line, None
+
+        if prefix and prefix.group('metadata'):
+            # メタデータコマンドは{}ブロックが閉じるまでコメントアウト
+            self._brace_count += self._brace_delta(line)
+            if self._brace_count > 0:
+                if self.state != PreprocessState.METADATA:
+                    self._resume_state = self.state
+                self.state = PreprocessState.METADATA
+            else:
+                self._brace_count = 0
+                if self.state == PreprocessState.METADATA:
+                    self.state = self._resume_state
+            return self._comment_out(line)
+
+        if environment and environment.group('name') == 'abstract':
+            if environment.group('kind') == 'begin':
+                self.state = PreprocessState.ABSTRACT
+            elif self.state == PreprocessState.ABSTRACT:
+                self.state = PreprocessState.BODY
+            else:
+                self._resume_state = PreprocessState.BODY
+            return self._comment_out(line)
+
+        if self.state == PreprocessState.ABSTRACT:
+            return self._comment_out(line)
+
+        if self.state == PreprocessState.METADATA:
+            self._brace_count += self._brace_delta(line)
+            if self._brace_count <= 0:
+                self._brace_count = 0
+                self.state = self._resume_state
+            return '// ' + line, [(3, 0, len(line))]
+
+        if prefix and prefix.group('comment'):
+            return self._comment_marker(line)
+        # 行内コメントを除去（\%は本文として残す）
+        if '%' in line:
+            for match in _COMMENT.finditer(line):
+                if match.group(1):
+                    return line[:match.start()], [(0, 0, match.start())]
+        return line, None
+
+    @staticmethod
+    def _comment_out(line: str) -> Tuple[str, Spans]:
+        """行を「// 」でコメントにする（\\\\ は \\ にする）"""
+        if '\\\\' not in line:
+            return '// ' + line, [(3, 0, len(line))]
+        spans = []
+        start = 3
+        position = 0
+        for piece in line.split('\\\\'):
+            spans.append((start, position, len(piece)))
+            start += len(piece) + 1
+            position += len(piece) + 2
+        return '// ' + line.replace('\\\\', '\\'), spans
+
+    @staticmethod
+    def _comment_marker(line: str) -> Tuple[str, Spans]:
+        """行全体のコメントの % を「// %」にする"""
+        index = line.index('%')
+        return line.replace('%', '// %', 1), [(0, 0, index), (index + 3, index, len(line) - index)]
+
+    @staticmethod
+    def _brace_delta(line: str) -> int:
+        """エスケープされていない波括弧の開閉の差"""
+        if '{' not in line and '}' not in line:
+            return 0
+        delta = 0
+        for match in _BRACE.finditer(line):
+            brace = match.group(1)
+            if brace == '{':
+                delta += 1
+            elif brace == '}':
+                delta -= 1
+            elif brace == '%':
+                break
+        return delta
@@ -0,0 +1,160 @@
+"""
+入力ファイル
+
+ファイルをメモリマップし、`\\begin{document}`・`\\end{document}` と行の境界をバイト列のまま探す。
+文字列に復号するのは各段に渡す範囲だけで、全体を1つの `str` として持たない。
+文字コードの判定（UTF-8のBOMの除去、UTF-8でない場合の代替）は開くときに1回だけ行う。
+"""
+
+import codecs
+import hashlib
+import mmap
+from typing import Iterator, List, Optional, Union
+
+
+# 行をまとめて復号する単位（バイト数、行の途中では切らない）
+CHUNK_SIZE = 1 << 20
+# UTF-8として復号できない場合の代替（どのバイト列も復号でき、ASCIIの位置が変わらない）
+FALLBACK_ENCODING = 'latin-1'
+
+_BEGIN_DOCUMENT = b'\\begin{document}'
+_END_DOCUMENT = b'\\end{document}'
+# バイト列のまま境界を探せない文字コードのBOM（UTF-32を先に判定）
+_WIDE_BOMS = ((codecs.BOM_UTF32_LE, 'utf-32'), (codecs.BOM_UTF32_BE, 'utf-32'),
+              (codecs.BOM_UTF16_LE, 'utf-16'), (codecs.BOM_UTF16_BE, 'utf-16'))
+
+
+class TeXSource:
+    """メモリマップした.texファイル
+
+    行の列は `text.split('\\n')` と同じ（改行は \\r\\n・\\r も \\n として扱う）。
+    """
+
+    def __init__(self, data: Union[bytes, mmap.mmap], path: str = ""):
+        self.path = path
+        self._data = data
+        self._mmap = data if isinstance(data, mmap.mmap) else None
+        # 文字コードの判定（1回だけ）
+        self.start = len(codecs.BOM_UTF8) if data[:len(codecs.BOM_UTF8)] == codecs.BOM_UTF8 else 0
+        self.encoding = 'utf-8' if self._is_utf8() else FALLBACK_ENCODING
+        self._has_cr = data.find(b'\r', self.start) != -1
+        # 文書の境界（バイト位置、見つからない場合は-1）
+        self.begin_document = data.find(_BEGIN_DOCUMENT, self.start)
+        self.end_document = data.find(_END_DOCUMENT, max(self.begin_document, self.start))
+
+    @classmethod
+    def open(cls, path: str) -> 'TeXSource':
+        """ファイルを開く（with文で閉じる）"""
+        with open(path, 'rb') as f:
+            if f.seek(0, 2) == 0:
+                return cls(b'', path)  # 空のファイルはマップできない
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        for bom, encoding in _WIDE_BOMS:
+            if data[:len(bom)] == bom:
+                # UTF-16/32はUTF-8に変換して持つ（メモリマップの利点はない）
+                try:
+                    text = data[:].decode(encoding)
+                finally:
+                    data.close()
+                return cls(text.encode('utf-8'), path)
+        return cls(data, path)
+
+    def close(self) -> None:
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._data = b''
+
+    def __enter__(self) -> 'TeXSource':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        """本文のバイト数（BOMを除く）"""
+        return len(self._data) - self.start
+
+    def _is_utf8(self) -> bool:
+        """UTF-8として復号できるか（復号結果は持たずに区切って確認）"""
+        data = self._data
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        try:
+            for position in range(self.start, len(data), CHUNK_SIZE):
+                decoder.decode(data[position:position + CHUNK_SIZE])
+            decoder.decode(b'', final=True)
+        except UnicodeDecodeError:
+            return False
+        return True
+
+    def decode(self, start: int, end: Optional[int] = None) -> str:
+        """範囲 [start, end) を復号（改行は \\n にそろえる）"""
+        end = len(self._data) if end is None else end
+        text = self._data[max(start, self.start):end].decode(self.encoding)
+        if self._has_cr:
+            text = text.replace('\r\n', '\n').replace('\r', '\n')
+        return text
+
+    def _chunks(self, start: int, end: int) -> Iterator[str]:
+        """改行の直前で区切って復号した断片（断片の間の \\n は含まない）"""
+        data = self._data
+        position = start
+        while position + CHUNK_SIZE < end:
+            cut = data.find(b'\n', position + CHUNK_SIZE, end)
+            if cut == -1:
+                break
+            yield self.decode(position, self._before_newline(cut))
+            position = cut + 1
+        yield self.decode(position, end)
+
+    def lines(self, start: Optional[int] = None, end: Optional[int] = None) -> Iterator[str]:
+        """範囲の行を順に返す（一度に復号するのはCHUNK_SIZE程度）"""
+        start = self.start if start is None else start
+        end = len(self._data) if end is None else end
+        for chunk in self._chunks(start, end):
+            yield from chunk.split('\n')
+
+    def _before_newline(self, end: int) -> int:
+        """改行の位置endの直前に\rがあればその位置（\r\nを1つの改行として扱う）"""
+        if self._has_cr and end > self.start and self._data[end - 1:end] == b'\r':
+            return end - 1
+        return end
+
+    def line_start(self, position: int) -> int:
+        """位置を含む行の先頭"""
+        return self._data.rfind(b'\n', self.start, position) + 1 or self.start
+
+    def line_end(self, position: int) -> int:
+        """位置を含む行の末尾（改行の位置）"""
+        end = self._data.find(b'\n', position)
+        return len(self._data) if end == -1 else end
+
+    def preamble(self) -> str:
+        """\\begin{document} の行までを復号（見つからない場合は空文字列）"""
+        if self.begin_document == -1:
+            return ""
+        return self.decode(self.start, self._before_newline(self.line_end(self.begin_document)))
+
+    def lines_containing(self, needle: bytes, start: Optional[int] = None) -> List[str]:
+        """needleを含む行だけを復号"""
+        data = self._data
+        found: List[str] = []
+        position = data.find(needle, self.start if start is None else start)
+        while position != -1:
+            end = self.line_end(position)
+            found.append(self.decode(self.line_start(position), self._before_newline(end)))
+            position = data.find(needle, end)
+        return found
+
+    def content_hash(self) -> str:
+        """内容のハッシュ（復号した文字列に対する LabelIndex.content_hash と同じ値）"""
+        digest = hashlib.sha1()
+        if self.encoding == 'utf-8' and not self._has_cr:
+            for position in range(self.start, len(self._data), CHUNK_SIZE):
+                digest.update(self._data[position:position + CHUNK_SIZE])
+        else:
+            first = True
+            for chunk in self._chunks(self.start, len(self._data)):
+                digest.update((chunk if first else '\n' + chunk).encode('utf-8'))
+                first = False
+        return digest.hexdigest()
@@ -0,0 +1,278 @@
+"""
+構造文字の索引
+
+TeXの各段が繰り返し探す構造文字（`\\`・`$`・`{`・`}`・`[`・`]`・`%`・`&`・改行）の位置を、
+本文を1回だけ数値の配列に変換し、NumPyの一括比較で求めて昇順の配列として持つ（simdjsonの第1段に相当）。
+エスケープ（奇数個の `\\` の直後の文字）も連続する `\\` の位置から一括で判定する。
+位置は文字列の添字（ASCII以外を含む場合はUTF-32に変換して求める）。
+"""
+
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+
+# 索引を作る構造文字
+STRUCTURAL_CHARACTERS = '\\$%{}[]&\n'
+
+_BACKSLASH = ord('\\')
+
+
+def _encode(text: str) -> np.ndarray:
+    """文字列を符号位置の配列に変換（添字は文字列の添字と一致）"""
+    if text.isascii():
+        return np.frombuffer(text.encode('ascii'), dtype=np.uint8)
+    return np.frombuffer(text.encode('utf-32-le'), dtype='<u4')
+
+
+def _escaping_backslashes(backslashes: np.ndarray) -> np.ndarray:
+    """次の文字をエスケープする `\\`（連続する `\\` の中で偶数番目）"""
+    if not len(backslashes):
+        return backslashes
+    run_starts = np.zeros(len(backslashes), dtype=np.intp)
+    breaks = np.flatnonzero(np.diff(backslashes) != 1) + 1
+    run_starts[breaks] = breaks
+    np.maximum.accumulate(run_starts, out=run_starts)
+    offsets = np.arange(len(backslashes)) - run_starts
+    return backslashes[offsets % 2 == 0]
+
+
+class StructuralIndex:
+    """構造文字の位置の索引
+
+    - positions(c): エスケープされていない c の位置（`\\` はコマンド・エスケープの開始位置）
+    - raw(c): エスケープを考慮しない c の位置
+    - コメントは行ごとに最初のエスケープされていない `%` から改行まで
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        codes = _encode(text)
+        length = len(text)
+        self._codes = codes
+
+        raw = {char: np.flatnonzero(codes == ord(char)) for char in STRUCTURAL_CHARACTERS}
+        escaping = _escaping_backslashes(raw['\\'])
+        escaped = np.zeros(length + 1, dtype=bool)
+        escaped[escaping + 1] = True
+        self._escaped = escaped
+
+        positions = {}
+        for char, found in raw.items():
+            # 改行はエスケープされない（`\` の直後の改行も改行として扱う）
+            positions[char] = found if char == '\n' else found[~escaped[found]]
+        self._raw: Dict[str, np.ndarray] = raw
+        self._positions: Dict[str, np.ndarray] = positions
+
+        # 改行 `\\`（エスケープする `\` の直後が `\`）の位置
+        following = escaping + 1
+        inside = following < length
+        self.line_breaks = escaping[inside][codes[following[inside]] == _BACKSLASH]
+
+        # コメント（行ごとに最初の % から改行まで）
+        self.comment_starts, self.comment_ends = self._first_per_line(positions['%'])
+        self._brace_matches: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return len(self.text)
+
+    def positions(self, char: str) -> np.ndarray:
+        """エスケープされていない構造文字の位置"""
+        return self._positions[char]
+
+    def raw(self, char: str) -> np.ndarray:
+        """エスケープを考慮しない構造文字の位置"""
+        return self._raw[char]
+
+    def between(self, char: str, start: int, end: int) -> np.ndarray:
+        """範囲 [start, end) のエスケープされていない構造文字の位置"""
+        found = self._positions[char]
+        return found[np.searchsorted(found, start):np.searchsorted(found, end)]
+
+    def count(self, char: str, start: int, end: int) -> int:
+        """範囲 [start, end) のエスケープされていない構造文字の数"""
+        found = self._positions[char]
+        return int(np.searchsorted(found, end) - np.searchsorted(found, start))
+
+    def next(self, char: str, pos: int, end: Optional[int] = None) -> int:
+        """pos以降で最初のエスケープされていない構造文字の位置（なければ-1）"""
+        found = self._positions[char]
+        index = np.searchsorted(found, pos)
+        if index == len(found) or (end is not None and found[index] >= end):
+            return -1
+        return int(found[index])
+
+    def is_escaped(self, pos: int) -> bool:
+        """posの文字が奇数個の `\\` の直後にあるか"""
+        return bool(self._escaped[pos])
+
+    def commands_starting(self, prefix: str, start: int = 0, end: Optional[int] = None) -> np.ndarray:
+        """`\\` の直後がprefixで始まる、エスケープされていないコマンドの位置"""
+        commands = self.between('\\', start, len(self.text) if end is None else end)
+        codes = self._codes
+        for offset, char in enumerate(prefix, start=1):
+            commands = commands[commands + offset < len(codes)]
+            commands = commands[codes[commands + offset] == ord(char)]
+        return commands
+
+    # コメント
+
+    def _first_per_line(self, percents: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """各行で最初の `%` の位置とその行の改行の位置"""
+        newlines = self._raw['\n']
+        line_ends = np.append(newlines, len(self.text))[np.searchsorted(newlines, percents)]
+        first = np.ones(len(percents), dtype=bool)
+        first[1:] = line_ends[1:] != line_ends[:-1]
+        return percents[first], line_ends[first]
+
+    def comments_outside(self, starts: np.ndarray, ends: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """範囲 [starts, ends)（昇順で重ならない）の中の `%` を数えない場合のコメントの範囲"""
+        percents = self._positions['%']
+        inside = np.searchsorted(starts, percents, side='right') - 1
+        skipped = inside >= 0
+        skipped[skipped] = percents[skipped] < ends[inside[skipped]]
+        return self._first_per_line(percents[~skipped])
+
+    def in_comment(self, positions: np.ndarray,
+                   comments: Optional[Tuple[np.ndarray, np.ndarray]] = None) -> np.ndarray:
+        """各位置がコメントの中にあるか（commentsは (開始位置, 終了位置)、省略時は索引のコメント）"""
+        starts, ends = (self.comment_starts, self.comment_ends) if comments is None else comments
+        index = np.searchsorted(starts, positions, side='right') - 1
+        inside = index >= 0
+        inside[inside] = positions[inside] < ends[index[inside]]
+        return inside
+
+    def comments(self) -> Iterator[Tuple[int, int]]:
+        """コメントの範囲 (%の位置, 改行の位置)"""
+        return zip(self.comment_starts.tolist(), self.comment_ends.tolist())
+
+    def strip_comments(self) -> str:
+        """コメントを除いた本文（改行は残す）"""
+        if not len(self.comment_starts):
+            return self.text
+        parts: List[str] = []
+        last = 0
+        for start, end in self.comments():
+            parts.append(self.text[last:start])
+            last = end
+        parts.append(self.text[last:])
+        return ''.join(parts)
+
+    # 波括弧の対応
+
+    def matching_brace(self, pos: int) -> int:
+        """posの `{` に対応する `}` の位置（なければ-1）
+
+        posから深さを数えて最初に0に戻る `}`（エスケープされた括弧は数えない）。
+        """
+        opens = self._positions['{']
+        index = np.searchsorted(opens, pos)
+        if index < len(opens) and opens[index] == pos:
+            if self._brace_matches is None:
+                self._brace_matches = self._match_braces()
+            return int(self._brace_matches[index])
+        # エスケープされた `{` から数える場合
+        return self._scan_braces(pos + 1, 1)
+
+    def _match_braces(self) -> np.ndarray:
+        """すべての `{` に対応する `}` の位置を一括で求める
+
+        `{` の直後の深さがDの場合、対応する `}` はそれ以降で最初に深さがD-1になる `}`。
+        """
+        opens, closes = self._positions['{'], self._positions['}']
+        matches = np.full(len(opens), -1, dtype=np.intp)
+        if not len(opens) or not len(closes):
+            return matches
+        events = np.concatenate([opens, closes])
+        deltas = np.concatenate([np.ones(len(opens), dtype=np.intp), np.full(len(closes), -1, dtype=np.intp)])
+        order = np.argsort(events, kind='stable')
+        depth = np.empty(len(events), dtype=np.intp)
+        depth[order] = np.cumsum(deltas[order])
+        open_depth, close_depth = depth[:len(opens)], depth[len(opens):]
+
+        # (深さ, 位置) の順に並べた `}` から、深さD-1で位置が `{` より後の最初のものを探す
+        lowest = min(int(open_depth.min()) - 1, int(close_depth.min()))
+        stride = len(self.text) + 1
+        close_keys = (close_depth - lowest).astype(np.int64) * stride + closes
+        close_order = np.argsort(close_keys, kind='stable')
+        close_keys = close_keys[close_order]
+        wanted = open_depth - 1
+        found = np.searchsorted(close_keys, (wanted - lowest).astype(np.int64) * stride + opens, side='right')
+        valid = found < len(close_keys)
+        candidates = close_order[found[valid]]
+        same_depth = close_depth[candidates] == wanted[valid]
+        matches[np.flatnonzero(valid)[same_depth]] = closes[candidates[same_depth]]
+        return matches
+
+    def _scan_braces(self, start: int, depth: int) -> int:
+        """startから波括弧の位置だけをたどって深さが0になる `}` を探す"""
+        opens, closes = self._positions['{'], self._positions['}']
+        open_index, close_index = np.searchsorted(opens, start), np.searchsorted(closes, start)
+        while close_index < len(closes):
+            if open_index < len(opens) and opens[open_index] < closes[close_index]:
+                depth += 1
+                open_index += 1
+                continue
+            depth -= 1
+            if depth == 0:
+                return int(closes[close_index])
+            close_index += 1
+        return -1
+
+    def brace_depth(self, start: int, end: int) -> int:
+        """範囲 [start, end) の `{` と `}` の数の差"""
+        return self.count('{', start, end) - self.count('}', start, end)
+
+    def closing_bracket(self, start: int) -> int:
+        """start以降で、startからの波括弧の深さが0の位置にある最初の `]`（なければ-1）"""
+        brackets = self.between(']', start, len(self.text))
+        if not len(brackets):
+            return -1
+        opens, closes = self._positions['{'], self._positions['}']
+        depths = ((np.searchsorted(opens, brackets) - np.searchsorted(opens, start))
+                  - (np.searchsorted(closes, brackets) - np.searchsorted(closes, start)))
+        found = np.flatnonzero(depths == 0)
+        return int(brackets[found[0]]) if len(found) else -1
+
+    # 数式の範囲（エスケープは考慮しない。正規表現 `\$([^$]++)\$`・`\\\[(.*?)\\\]` と同じ範囲）
+
+    def inline_math(self) -> List[Tuple[int, int]]:
+        """`$...$` の範囲 [開始位置, 終了位置)
+
+        `$` を前から順に対にし、隣り合う `$$` は対にせず後ろの `$` から数え直す。
+        """
+        dollars = self._raw['$']
+        if len(dollars) < 2:
+            return []
+        # 間が空いている隣の `$` との対のうち、連続する対の中で偶数番目のもの
+        pairs = np.flatnonzero(np.diff(dollars) > 1)
+        run_starts = np.zeros(len(pairs), dtype=np.intp)
+        if len(pairs):
+            breaks = np.flatnonzero(np.diff(pairs) != 1) + 1
+            run_starts[breaks] = breaks
+            np.maximum.accumulate(run_starts, out=run_starts)
+        pairs = pairs[(np.arange(len(pairs)) - run_starts) % 2 == 0]
+        return list(zip(dollars[pairs].tolist(), (dollars[pairs + 1] + 1).tolist()))
+
+    def display_math(self) -> List[Tuple[int, int]]:
+        """`\\[...\\]` の範囲 [開始位置, 終了位置)（最初の `\\]` で閉じる）"""
+        opens = self._commands_raw('[')
+        closes = self._commands_raw(']')
+        regions = []
+        position = 0
+        while True:
+            index = np.searchsorted(opens, position)
+            if index == len(opens):
+                return regions
+            start = int(opens[index])
+            index = np.searchsorted(closes, start + 2)
+            if index == len(closes):
+                return regions
+            position = int(closes[index]) + 2
+            regions.append((start, position))
+
+    def _commands_raw(self, char: str) -> np.ndarray:
+        """エスケープを考慮せず、`\\` の直後がcharである位置"""
+        backslashes = self._raw['\\']
+        backslashes = backslashes[backslashes + 1 < len(self._codes)]
+        return backslashes[self._codes[backslashes + 1] == ord(char)]
@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+"""
+文法によるTeXパーサー
+
+tyxが扱うTeXの部分集合（環境・グループ・引数付きコマンド・数式モード・コメント）を
+LarkのLALR文法で解析し、構文木から要素を抜き出す。要素からASTノードを作る処理は
+ImprovedTeXParserと共通のため、同じ `tyx.parser.ast` のノードを返す。
+
+文法から生成したスタンドアロンのパーサーはディスクにキャッシュし、
+2回目以降の起動ではLarkの読み込みと文法のコンパイルを省く。
+"""
+
+import hashlib
+import importlib.machinery
+import importlib.util
+import io
+import os
+import py_compile
+import sys
+import tempfile
+from collections import deque
+from functools import lru_cache
+from typing import Any, Callable, Deque, Iterable, Iterator, List, Optional, Tuple
+
+from .handlers import HandlerRegistry
+from .tex_parser_improved import ImprovedTeXParser, MATH_ENVIRONMENTS, TABLE_ENVIRONMENTS
+from ..utils.labels import LabelRecord
+
+
+# TeXの部分集合の文法
+# - コマンドの直後の { } と [ ] は引数として読む（シフト優先でLALRの競合を解消）
+# - 数式環境（align など）と $ \[ の中は数式モード（[ ] は括弧、引数を取らない）
+# - \begin{X} と \end{X} の名前の対応は字句解析の後処理（EnvironmentBalancer）で取る
+TEX_GRAMMAR = r'''
+start: _text*
+
+_text: environment | math_block | display_math | inline_math | group | command | _plain
+_plain: TEXT | ESCAPE | COMMENT | LSQB | RSQB
+
+environment: BEGIN _text* END
+group: LBRACE _text* RBRACE
+command: COMMAND _argument*
+_argument: group | option
+option: LSQB (_option_text | option)* RSQB
+_option_text: environment | inline_math | group | command | TEXT | ESCAPE | COMMENT
+
+math_block: MATH_BEGIN _math* MATH_END
+display_math: DISPLAY_OPEN _math* DISPLAY_CLOSE
+inline_math: DOLLAR _math* DOLLAR
+_math: math_environment | math_group | COMMAND | TEXT | ESCAPE | COMMENT | LSQB | RSQB
+math_environment: BEGIN _math* END
+math_group: LBRACE (_math | inline_math)* RBRACE
+
+MATH_BEGIN.3: /\\begin\{(?:align|equation|gather|multline|eqnarray|displaymath)\*?\}/
+MATH_END.3: /\\end\{(?:align|equation|gather|multline|eqnarray|displaymath)\*?\}/
+BEGIN.2: /\\begin\{[^{}\n]*\}/
+END.2: /\\end\{[^{}\n]*\}/
+DISPLAY_OPEN.2: "\\["
+DISPLAY_CLOSE.2: "\\]"
+COMMAND: /\\[a-zA-Z@]+\*?/
+ESCAPE: /\\[^a-zA-Z@\[\]]|\\\Z/
+COMMENT: /%[^\n]*/
+DOLLAR: "$"
+LBRACE: "{"
+RBRACE: "}"
+LSQB: "["
+RSQB: "]"
+TEXT: /[^\\$%{}\[\]]+/
+'''
+
+# 開き記号と対応する閉じ記号（エラー回復で閉じ忘れを補う）
+_CLOSERS = {'BEGIN': 'END', 'MATH_BEGIN': 'MATH_END', 'DISPLAY_OPEN': 'DISPLAY_CLOSE',
+            'DOLLAR': 'DOLLAR', 'LSQB': 'RSQB', 'LBRACE': 'RBRACE'}
+# 閉じる終端記号の補完を試す上限（入れ子の深さ）
+_MAX_CLOSERS = 64
+
+# LALRの表と、すべての記号を常に同じ終端記号として読む字句解析（要素の範囲のため位置を保持）
+_LARK_OPTIONS = dict(parser='lalr', lexer='basic', propagate_positions=True)
+
+SECTION_COMMANDS = ('\\section', '\\subsection', '\\subsubsection')
+
+
+def _cache_directory() -> str:
+    """スタンドアロンのパーサーを置くディレクトリ"""
+    configured = os.environ.get('TYX_CACHE_DIR')
+    if configured:
+        return configured
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'tyx')
+
+
+def _grammar_digest() -> str:
+    """文法とLarkのインストールから作るキャッシュのキー
+
+    Larkを読み込まずに済むよう、バージョンの代わりにパッケージの場所と更新時刻を使う。
+    """
+    spec = importlib.util.find_spec('lark')
+    installed = 'unknown'
+    if spec is not None and spec.origin:
+        stat = os.stat(spec.origin)
+        installed = f"{spec.origin}:{stat.st_size}:{stat.st_mtime_ns}"
+    key = f"{installed}\n{_LARK_OPTIONS}\n{TEX_GRAMMAR}"
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]
+
+
+def _build_lark(**options):
+    from lark import Lark
+    return Lark(TEX_GRAMMAR, **_LARK_OPTIONS, **options)
+
+
+def _load_module(path: str, digest: str):
+    """キャッシュしたパーサーを読み込む（コンパイル済みのコードがあればそれを使う）"""
+    name = f'tyx_tex_grammar_{digest}'
+    compiled = path + 'c'
+    if os.path.exists(compiled):
+        loader = importlib.machinery.SourcelessFileLoader(name, compiled)
+    else:
+        loader = importlib.machinery.SourceFileLoader(name, path)
+    spec = importlib.util.spec_from_loader(name, loader)
+    module = importlib.util.module_from_spec(spec)
+    loader.exec_module(module)
+    sys.modules[name] = module
+    return module
+
+
+def _write_atomically(path: str, write: Callable[[str], None]) -> None:
+    """一時ファイルに書いてから置き換える（並行して生成しても壊れない）"""
+    fd, temporary = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    os.close(fd)
+    try:
+        write(temporary)
+        os.replace(temporary, path)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+
+@lru_cache(maxsize=None)
+def load_tex_grammar(cache_dir: Optional[str] = None) -> Tuple[Callable[..., Any], type]:
+    """文法のパーサーを作る関数と、そのパーサーが使うTokenクラスを返す
+
+    キャッシュにスタンドアロンのパーサーがあれば読み込むだけで済む（Larkは読み込まない）。
+    なければ生成してソースとコンパイル済みのコード（PYTHONDONTWRITEBYTECODEでも使えるよう自前で保存）を書き込み、
+    書き込めない場合はメモリ上でLarkのパーサーを作る。
+    """
+    cache_dir = cache_dir or _cache_directory()
+    digest = _grammar_digest()
+    path = os.path.join(cache_dir, f'tex_grammar_{digest}.py')
+
+    if os.path.exists(path):
+        try:
+            module = _load_module(path, digest)
+            return module.Lark_StandAlone, module.Token
+        except Exception:
+            pass  # 壊れたキャッシュ・別のPythonのコードは作り直す
+
+    try:
+        from lark.tools.standalone import gen_standalone
+        source = io.StringIO()
+        gen_standalone(_build_lark(), out=source)
+        os.makedirs(cache_dir, exist_ok=True)
+
+        def write_source(temporary: str) -> None:
+            with open(temporary, 'w', encoding='utf-8') as f:
+                f.write(source.getvalue())
+        _write_atomically(path, write_source)
+        _write_atomically(path + 'c', lambda temporary: py_compile.compile(
+            path, cfile=temporary, doraise=True,
+            invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH))
+        module = _load_module(path, digest)
+        return module.Lark_StandAlone, module.Token
+    except (OSError, py_compile.PyCompileError):
+        from lark import Token
+        return _build_lark, Token
+
+
+class EnvironmentBalancer:
+    """字句解析の後処理：\\begin{X} と \\end{X} を名前で対応付ける
+
+    LALRの文法は環境名を区別できないため、トークン列の段階で
+    - 開いていない環境の \\end はテキストにする
+    - 外側の環境の \\end の前に、閉じていない内側の環境の閉じ（値が空のトークン）を補う
+    - 入力の終わりで閉じていない環境を閉じる
+    （環境の木 EnvironmentTree と同じ対応付け）。
+    """
+
+    always_accept = ()
+
+    def __init__(self, parser: 'GrammarTeXParser'):
+        self.parser = parser
+        # エラーからの回復のたびにprocessが呼び直されるため、状態は呼び出しをまたいで保つ
+        self._stack: List[Tuple[str, str]] = []  # (環境名, 閉じのトークン種別)
+        self._pending: Deque[Any] = deque()
+
+    def reset(self) -> None:
+        self._stack.clear()
+        self._pending.clear()
+
+    def process(self, stream: Iterable[Any]) -> Iterator[Any]:
+        pending = self._pending
+        stream = iter(stream)
+        while True:
+            while pending:
+                yield pending.popleft()
+            token = next(stream, None)
+            if token is None:
+                break
+            pending.extend(self._balance(token))
+
+        for name, closer in reversed(self._stack):
+            self.parser.problems.append(f"Grammar: \\begin{{{name}}} is not closed")
+            pending.append(self._synthetic(closer, len(self.parser._text), None))
+        self._stack.clear()
+        while pending:
+            yield pending.popleft()
+
+    def _balance(self, token) -> List[Any]:
+        """トークンの前に補う閉じとトークン自身"""
+        kind = token.type
+        stack = self._stack
+        if kind == 'BEGIN' or kind == 'MATH_BEGIN':
+            stack.append((token[len('\\begin{'):-1], 'END' if kind == 'BEGIN' else 'MATH_END'))
+            return [token]
+        if kind != 'END' and kind != 'MATH_END':
+            return [token]
+
+        name = token[len('\\end{'):-1]
+        index = next((i for i in range(len(stack) - 1, -1, -1) if stack[i][0] == name), None)
+        if index is None:
+            self.parser.problems.append(f"Grammar: \\end{{{name}}} without \\begin at line {token.line}; kept as text")
+            return [self.parser.token_class.new_borrow_pos('TEXT', str(token), token)]
+
+        tokens = []
+        for inner, closer in reversed(stack[index + 1:]):
+            self.parser.problems.append(f"Grammar: \\begin{{{inner}}} is not closed before line {token.line}")
+            tokens.append(self._synthetic(closer, token.start_pos, token))
+        del stack[index:]
+        tokens.append(token)
+        return tokens
+
+    def _synthetic(self, token_type: str, position: int, at: Optional[Any]):
+        """補った閉じのトークン（値が空）"""
+        line = at.line if at is not None else None
+        column = at.column if at is not None else None
+        return self.parser.token_class(token_type, '', start_pos=position, end_pos=position,
+                                       line=line, column=column, end_line=line, end_column=column)
+
+
+class GrammarTeXParser(ImprovedTeXParser):
+    """文法によるTeXパーサー
+
+    要素の抽出をLarkの構文木で行い、それ以外（前処理・ラベル・ASTノードの作成）は
+    ImprovedTeXParserと共通。環境名の対応は字句解析の後処理で、それ以外の構文エラーは
+    閉じ忘れを補うか余分な記号を読み飛ばして回復し、problemsに記録する。
+    """
+
+    def __init__(self, max_macro_depth: int = 16, max_macro_expansions: int = 100000,
+                 cache_dir: Optional[str] = None, handlers: Optional[HandlerRegistry] = None):
+        super().__init__(max_macro_depth, max_macro_expansions, handlers)
+        make_parser, self.token_class = load_tex_grammar(cache_dir)
+        self._balancer = EnvironmentBalancer(self)
+        self.grammar = make_parser(postlex=self._balancer)
+        self._text = ""
+
+    def parse_tree(self, content: str):
+        """構文木を返す（構文エラーは回復してproblemsに記録）"""
+        self._text = content
+        self._balancer.reset()
+        try:
+            return self.grammar.parse(content, on_error=self._recover)
+        finally:
+            self._text = ""
+
+    def _extract_elements(self, content: str,
+                          records: List[LabelRecord]) -> List[Tuple[str, str, int]]:
+        """構文木から主要な要素を抽出"""
+        tree = self.parse_tree(content)
+        spans = self._element_spans(tree)
+        spans.extend(self._reference_spans(records))
+        return self._collect_elements(content, spans)
+
+    def _element_spans(self, tree) -> List[Tuple[str, int, int]]:
+        """定理・数式・表・セクションの範囲（要素の内側には降りない）"""
+        spans = []
+        theorem_names = self.theorem_names
+        stack = [tree]
+        while stack:
+            node = stack.pop()
+            data = getattr(node, 'data', None)
+            if data is None:
+                continue
+            children = node.children
+
+            if data == 'environment':
+                name = self._environment_name(children)
+                if name is not None and name in theorem_names:
+                    spans.append(('theorem', node.meta.start_pos, node.meta.end_pos))
+                    continue
+                if name is not None and name in TABLE_ENVIRONMENTS:
+                    spans.append(('table', node.meta.start_pos, node.meta.end_pos))
+                    continue
+            elif data == 'math_block':
+                name = self._environment_name(children)
+                if name is not None and name in MATH_ENVIRONMENTS:
+                    spans.append(('math', node.meta.start_pos, node.meta.end_pos))
+                # 他の数式環境（gather など）はテキストとして残す
+                continue
+            elif data in ('display_math', 'inline_math'):
+                if children and children[-1].end_pos > children[-1].start_pos:
+                    spans.append(('math', node.meta.start_pos, node.meta.end_pos))
+                continue
+            elif data == 'command':
+                if (children[0] in SECTION_COMMANDS and len(children) > 1
+                        and getattr(children[1], 'data', None) == 'group'):
+                    spans.append(('section', node.meta.start_pos, children[1].meta.end_pos))
+                    continue
+
+            stack.extend(reversed(children))
+        return spans
+
+    @staticmethod
+    def _environment_name(children) -> Optional[str]:
+        """\\begin と \\end の名前が一致する場合の環境名（閉じ忘れを補った場合はNone）"""
+        begin, end = children[0], children[-1]
+        name = begin[len('\\begin{'):-1]
+        if end != '\\end{' + name + '}':
+            return None
+        return name
+
+    def _recover(self, error) -> bool:
+        """構文エラーからの回復（Trueを返すと解析を続ける）"""
+        token = getattr(error, 'token', None)
+        parser = getattr(error, 'interactive_parser', None)
+        if token is None or parser is None:
+            # 字句解析のエラー：1文字読み飛ばす
+            self.problems.append(f"Grammar: unexpected character at line {getattr(error, 'line', '?')}")
+            return True
+
+        at_end = token.type == '$END'
+        closers = self._closers_for(parser, token.type)
+        if closers is None:
+            # 閉じても受け付けられない記号（余分な } や \end など）は読み飛ばす
+            self.problems.append(f"Grammar: unexpected {token!s} at line {token.line}; skipped")
+            return True
+
+        position = len(self._text) if at_end else token.start_pos
+        for closer in closers:
+            parser.feed_token(self.token_class(closer, '', start_pos=position, end_pos=position,
+                                               line=token.line, column=token.column,
+                                               end_line=token.line, end_column=token.column))
+        where = "end of input" if at_end else f"line {token.line}"
+        self.problems.append(f"Grammar: closed {len(closers)} unterminated group(s) before {where}")
+        if not at_end:
+            parser.feed_token(token)
+        return True
+
+    def _closers_for(self, parser, token_type: str) -> Optional[List[str]]:
+        """記号を受け付けられるようになるまでに補う閉じ記号の列（補っても無理ならNone）"""
+        trial = parser.copy()
+        closers: List[str] = []
+        for _ in range(_MAX_CLOSERS):
+            accepts = trial.accepts()
+            if closers and token_type in accepts:
+                return closers
+            closer = self._innermost_closer(trial.parser_state.value_stack, len(closers))
+            if closer is None or closer not in accepts:
+                return None
+            trial.feed_token(self.token_class(closer, ''))
+            closers.append(closer)
+        return None
+
+    def _innermost_closer(self, value_stack, closed: int) -> Optional[str]:
+        """まだ閉じていない最も内側の開き記号に対応する閉じ記号
+
+        値スタックを上から見て、補った閉じ記号（値が空）を飛ばし、
+        補った数（closed）だけ内側の開き記号を閉じたものとして数える。
+        """
+        for value in reversed(value_stack):
+            if not isinstance(value, self.token_class) or value == '':
+                continue
+            closer = _CLOSERS.get(value.type)
+            if closer is None:
+                continue
+            if closed == 0:
+                return closer
+            closed -= 1
+        return None
@@ -4,17 +4,41 @@
 """
 
 import re
-from typing import List, Optional, Tuple
+from bisect import bisect_left
+from dataclasses import replace
+from typing import Iterable, List, Optional, Tuple, Union
 from .ast import (
     ASTNode, DocumentNode, SectionNode, MathNode, TheoremNode, 
-    ReferenceNode, TextNode, NormNode, AbsNode, NodeType
+    ReferenceNode, TextNode, NormNode, AbsNode, TableNode, NodeType
 )
+from .environments import DEFAULT_THEOREM_ENVIRONMENTS, EnvironmentTree, learn_theorem_names
+from .handlers import HandlerRegistry
+from .macros import MacroExpander
+from .preprocessor import OffsetMap, TeXPreprocessor
+from .source import FALLBACK_ENCODING, TeXSource
+from ..utils.labels import LabelIndex, LabelRecord, infer_label_type, label_extractor
+from ..utils.patterns import patterns
+
+
+# 要素として抜き出す数式環境
+MATH_ENVIRONMENTS = frozenset(['align', 'align*', 'equation'])
+# 定理の本文中で変換する数式環境
+ALIGN_ENVIRONMENTS = frozenset(['align', 'align*'])
+# 表として変換する環境（幅の引数を持つものは TABLE_WIDTH_ENVIRONMENTS）
+TABLE_ENVIRONMENTS = frozenset(['tabular', 'tabular*', 'tabularx', 'longtable'])
+TABLE_WIDTH_ENVIRONMENTS = frozenset(['tabular*', 'tabularx'])
+
+# 表の環境の開始と引数（{幅}・[位置]・{列指定}、列指定の波括弧は2段まで）
+_TABLE_BEGIN = re.compile(r'\\begin\{([^}]+)\}')
+_TABLE_GROUP = re.compile(r'\s*\{((?:[^{}]|\{(?:[^{}]|\{[^{}]*\})*\})*)\}')
+_TABLE_OPTION = re.compile(r'\s*\[[^\]]*\]')
 
 
 class ImprovedTeXParser:
     """改良されたTeXパーサー"""
     
-    def __init__(self):
+    def __init__(self, max_macro_depth: int = 16, max_macro_expansions: int = 100000,
+                 handlers: Optional[HandlerRegistry] = None):
         # 数式記号のUnicodeマッピング（前処理で使用）
         self.math_symbols = {
             'alpha': 'α', 'beta': 'β', 'gamma': 'γ', 'delta': 'δ',
@@ -43,25 +67,95 @@ class ImprovedTeXParser:
             'ln': 'ln', 'exp': 'exp', 'max': 'max', 'min': 'min',
             'sup': 'sup', 'inf': 'inf'
         }
+        
+        # 解析中のラベル索引（parse()の引数で指定）
+        self.label_index: Optional[LabelIndex] = None
+        self.file_path = ""
+        # 前処理で求めたラベル・参照の入力ファイルでの位置（label_indexを指定した場合）
+        self._source_positions: List[Tuple[int, int]] = []
+        
+        # ユーザー定義マクロと登録したコマンド・環境のハンドラーの展開器
+        self.macro_expander = MacroExpander(max_macro_depth, max_macro_expansions, handlers)
+        self.preprocessor = TeXPreprocessor(self.macro_expander)
+        
+        # 継続可能な問題（README §11 の Problems ログ）
+        self.problems: List[str] = []
+        
+        # 定理型の環境名（文書全体を解析したときに\newtheoremから学習）と解析中の環境の木
+        self.theorem_names = DEFAULT_THEOREM_ENVIRONMENTS
+        self.environments: Optional[EnvironmentTree] = None
     
-    def parse(self, tex_content: str) -> DocumentNode:
-        """TeXコンテンツを解析してASTに変換"""
+    def parse(self, tex_content: Union[str, TeXSource], label_index: Optional[LabelIndex] = None,
+              file_path: str = "", body_only: bool = False) -> DocumentNode:
+        """TeXコンテンツを解析してASTに変換
+        
+        tex_contentは文字列またはメモリマップした入力ファイル（TeXSource）。
+        label_indexを指定すると、解析パス中にラベル定義と参照を登録する。
+        body_onlyが真の場合、本文の断片として解析し、直前に読み込んだマクロ定義を使う。
+        """
         document = DocumentNode(node_type=NodeType.DOCUMENT, content="")
+        self.label_index = label_index
+        self.file_path = file_path
+        self.problems = []
+        if isinstance(tex_content, TeXSource) and tex_content.encoding == FALLBACK_ENCODING:
+            self.problems.append(f"Input is not valid UTF-8; decoded as {FALLBACK_ENCODING}")
         
         # 前処理：不要な部分を除去
-        cleaned_content = self._preprocess(tex_content)
+        cleaned_content = self._preprocess(tex_content, body_only)
+        
+        # 構造文字の索引と環境の木を構築（要素抽出・定理本文の数式処理で共有）
+        if not body_only:
+            self.theorem_names = learn_theorem_names(self._theorem_definitions(tex_content))
+        self.environments = EnvironmentTree(cleaned_content, self.theorem_names)
+        
+        # ラベル・参照・引用を1パスで抽出（要素抽出・索引・変換器で共有）
+        records = label_extractor.scan_tex(cleaned_content)
+        record_starts = [record.start for record in records]
+        # 索引には入力ファイルでの位置を登録する（前処理の記録した位置の対応で変換）
+        located = records
+        if self.label_index is not None:
+            located = self._source_records(records)
         
         # 主要な構造を抽出
-        elements = self._extract_elements(cleaned_content)
+        elements = self._extract_elements(cleaned_content, records)
         
         # 各要素をASTノードに変換
         for element in elements:
-            node = self._parse_element(element)
+            _, content, offset = element
+            lo = bisect_left(record_starts, offset)
+            hi = bisect_left(record_starts, offset + len(content))
+            element_records = records[lo:hi]
+            node = self._parse_element(element, element_records)
             if node:
                 document.add_child(node)
+                if self.label_index is not None:
+                    self._index_element(element, node, located[lo:hi])
         
+        self.label_index = None
+        self.environments = None
         return document
     
+    def _index_element(self, element: Tuple[str, str, int], node: ASTNode,
+                       records: List[LabelRecord]) -> None:
+        """要素内のラベル定義と参照を索引に登録"""
+        element_type = element[0]
+        if element_type == 'section':
+            return
+        
+        own_label = node.label if element_type == 'theorem' else None
+        default_type = {'text': 'section', 'table': 'table'}.get(element_type, 'eq')
+        for record in records:
+            if record.kind != 'label':
+                self.label_index.add_reference(record.target, self.file_path,
+                                               record.start, record.kind)
+            elif record.target == own_label:
+                self.label_index.add_label(record.target, node.theorem_type.lower(),
+                                           self.file_path, record.start)
+                own_label = None
+            else:
+                self.label_index.add_label(record.target, infer_label_type(record.target, default_type),
+                                           self.file_path, record.start)
+    
     def _parse_norm_expression(self, content: str) -> List[ASTNode]:
         """ノルム記号を解析してASTノードに変換（拡張版）"""
         nodes = []
@@ -93,13 +187,8 @@ class ImprovedTeXParser:
         # ノルム記号の内容を抽出
         norm_content = content[start_pos:norm_end]
         
-        # スペース系コマンドを無視するパターン
-        _WS = r'(?:\s|\\[,;:!])*'
-        
-        # \| ... \|_{...} のパターンを解析（下付きあり、省略波括弧対応）
-        norm_match_with_sub = re.match(
-            rf'\\\|{_WS}(.*?){_WS}\\\|{_WS}_(?:\{{\s*(.*?)\s*\}}|([A-Za-z0-9]+)){_WS}$',
-            norm_content, re.DOTALL)
+        # \| ... \|_{...} のパターンを解析（下付きあり、省略波括弧対応、スペース系コマンドは無視）
+        norm_match_with_sub = patterns['parser.norm_with_subscript'].match(norm_content)
         if norm_match_with_sub:
             inner_content = norm_match_with_sub.group(1).strip()
             subscript = (norm_match_with_sub.group(2) or norm_match_with_sub.group(3) or "").strip()
@@ -119,9 +208,7 @@ class ImprovedTeXParser:
             nodes.append(norm_node)
         else:
             # \| ... \| のパターンを解析（下付きなし）
-            norm_match_without_sub = re.match(
-                rf'\\\|{_WS}(.*?){_WS}\\\|{_WS}$',
-                norm_content, re.DOTALL)
+            norm_match_without_sub = patterns['parser.norm'].match(norm_content)
             if norm_match_without_sub:
                 inner_content = norm_match_without_sub.group(1).strip()
                 
@@ -169,8 +256,7 @@ class ImprovedTeXParser:
         nodes = []
         
         # \bigg| ... \bigg| パターンを検索（最優先）
-        pattern = r'\\bigg\s*\|(.*?)\\bigg\s*\|'
-        match = re.search(pattern, content, re.DOTALL)
+        match = patterns['parser.abs_bigg'].search(content)
         if match:
             inner_content = match.group(1).strip()
             abs_node = AbsNode()
@@ -179,8 +265,7 @@ class ImprovedTeXParser:
             return nodes
         
         # \Big| ... \Big| パターンを検索
-        pattern = r'\\Big\s*\|(.*?)\\Big\s*\|'
-        match = re.search(pattern, content, re.DOTALL)
+        match = patterns['parser.abs_Big'].search(content)
         if match:
             inner_content = match.group(1).strip()
             abs_node = AbsNode()
@@ -189,8 +274,7 @@ class ImprovedTeXParser:
             return nodes
         
         # \big| ... \big| パターンを検索
-        pattern = r'\\big\s*\|(.*?)\\big\s*\|'
-        match = re.search(pattern, content, re.DOTALL)
+        match = patterns['parser.abs_big'].search(content)
         if match:
             inner_content = match.group(1).strip()
             abs_node = AbsNode()
@@ -199,8 +283,7 @@ class ImprovedTeXParser:
             return nodes
         
         # 通常の | ... | パターンを検索（最後）
-        pattern = r'(?<!\\)\|(.*?)(?<!\\)\|'
-        match = re.search(pattern, content, re.DOTALL)
+        match = patterns['parser.abs'].search(content)
         if match:
             inner_content = match.group(1).strip()
             abs_node = AbsNode()
@@ -257,122 +340,63 @@ class ImprovedTeXParser:
         
         return -1
     
-    def _preprocess(self, tex_content: str) -> str:
+    @staticmethod
+    def _theorem_definitions(tex_content: Union[str, TeXSource]) -> str:
+        """\\newtheoremを探す範囲（入力ファイルの場合は該当する行だけを復号）"""
+        if isinstance(tex_content, TeXSource):
+            return '\n'.join(tex_content.lines_containing(b'\\newtheorem'))
+        return tex_content
+    
+    def _preprocess(self, tex_content: Union[str, TeXSource], body_only: bool = False) -> str:
         """前処理：preambleをコメントアウトして保持"""
-        lines = tex_content.split('\n')
-        processed_lines = []
-        in_preamble = True
-        in_abstract = False
-        in_multiline_command = False
-        brace_count = 0
-        
-        for line in lines:
-            # \begin{document}までをpreambleとして扱う
-            if '\\begin{document}' in line:
-                in_preamble = False
-                fixed_line = line.replace('\\\\', '\\')
-                processed_lines.append('// ' + fixed_line)
-                continue
-            
-            # \end{document}の処理
-            if '\\end{document}' in line:
-                processed_lines.append(line)
-                continue
-            
-            # preamble内の処理
-            if in_preamble:
-                # 行コメントをTypstコメントに変換
-                if line.strip().startswith('%'):
-                    # %を// %に変換
-                    typst_comment = line.replace('%', '// %', 1)
-                    processed_lines.append(typst_comment)
-                else:
-                    # preambleコマンドをコメントアウト
-                    preamble_commands = [
-                        '\\documentclass',
-                        '\\usepackage',
-                        '\\mathtoolsset',
-                        '\\newtheorem',
-                        '\\title',
-                        '\\author',
-                        '\\address',
-                        '\\email',
-                        '\\subjclass',
-                        '\\keywords',
-                        '\\maketitle',
-                    ]
-                    
-                    is_preamble_command = any(line.strip().startswith(cmd) for cmd in preamble_commands)
-                    if is_preamble_command:
-                        # \\を\に修正してコメントアウト
-                        fixed_line = line.replace('\\\\', '\\')
-                        processed_lines.append('// ' + fixed_line)
-                    else:
-                        processed_lines.append(line)
-            else:
-                # document内の処理
-                # メタデータコマンドをコメントアウト
-                metadata_commands = [
-                    '\\title',
-                    '\\author',
-                    '\\address',
-                    '\\email',
-                    '\\subjclass',
-                    '\\keywords',
-                    '\\maketitle',
-                ]
-                
-                is_metadata_command = any(line.strip().startswith(cmd) for cmd in metadata_commands)
-                if is_metadata_command:
-                    # \\を\に修正してコメントアウト
-                    fixed_line = line.replace('\\\\', '\\')
-                    processed_lines.append('// ' + fixed_line)
-                    # {}ブロックの開始を検出
-                    brace_count += line.count('{') - line.count('}')
-                    if brace_count > 0:
-                        in_multiline_command = True
-                    else:
-                        in_multiline_command = False
-                # abstract環境の処理
-                elif '\\begin{abstract}' in line:
-                    in_abstract = True
-                    fixed_line = line.replace('\\\\', '\\')
-                    processed_lines.append('// ' + fixed_line)
-                elif '\\end{abstract}' in line:
-                    in_abstract = False
-                    fixed_line = line.replace('\\\\', '\\')
-                    processed_lines.append('// ' + fixed_line)
-                elif in_abstract:
-                    fixed_line = line.replace('\\\\', '\\')
-                    processed_lines.append('// ' + fixed_line)
-                elif in_multiline_command:
-                    # 複数行コマンドの内容をコメントアウト
-                    processed_lines.append('// ' + line)
-                    # {}ブロックの終了を検出
-                    brace_count += line.count('{') - line.count('}')
-                    if brace_count <= 0:
-                        in_multiline_command = False
-                        brace_count = 0
-                else:
-                    # 行コメントをTypstコメントに変換
-                    if line.strip().startswith('%'):
-                        # %を// %に変換
-                        typst_comment = line.replace('%', '// %', 1)
-                        processed_lines.append(typst_comment)
-                        continue
-                    # 行内コメントを除去
-                    if '%' in line:
-                        line = line[:line.index('%')]
-                    processed_lines.append(line)
+        # 行単位の状態機械で処理（本文のユーザー定義マクロもここで展開）
+        # 入力ファイルは区切って復号した行を渡し、全体を1つの文字列・行のリストとして持たない
+        offsets = OffsetMap() if self.label_index is not None else None
+        lines = self.preprocessor.process(self._source_lines(tex_content), in_body=body_only,
+                                          offsets=offsets)
+        processed_content = self._join_lines(lines)
+        self.problems.extend(self.macro_expander.problems)
+        if offsets is not None:
+            # 記号変換で位置がずれる前に、ラベル・参照の入力ファイルでの位置を求める
+            self._source_positions = [(offsets.translate(record.start), offsets.translate(record.end))
+                                      for record in label_extractor.scan_tex(processed_content)]
         
         # 記号変換を前処理として実施
-        processed_content = '\n'.join(processed_lines)
-        
         # 数式環境を先に抽出してから記号変換を適用
         processed_content = self._convert_math_symbols(processed_content)
         
         return processed_content
     
+    def _source_records(self, records: List[LabelRecord]) -> List[LabelRecord]:
+        """前処理後の文字列でのレコードを入力ファイルでの位置に置き換える
+
+        記号変換はラベル・参照のコマンドを増減させないため、記号変換の前に求めた位置と順に対応する。
+        """
+        positions = self._source_positions
+        self._source_positions = []
+        # 数が合わない場合、残りのレコードは最後の位置とする
+        positions += [positions[-1] if positions else (0, 0)] * (len(records) - len(positions))
+        return [replace(record, start=start, end=end) for record, (start, end) in zip(records, positions)]
+    
+    @staticmethod
+    def _source_lines(tex_content: Union[str, TeXSource]) -> Iterable[str]:
+        """入力の行（改行を含まない）"""
+        return tex_content.lines() if isinstance(tex_content, TeXSource) else tex_content.split('\n')
+    
+    @staticmethod
+    def _join_lines(lines: Iterable[str], block_size: int = 4096) -> str:
+        """行を連結（'\\n'.join と同じ結果、行のリストを全体では持たずに区切って連結）"""
+        blocks: List[str] = []
+        block: List[str] = []
+        for line in lines:
+            block.append(line)
+            if len(block) == block_size:
+                blocks.append('\n'.join(block))
+                block = []
+        if block or not blocks:
+            blocks.append('\n'.join(block))
+        return '\n'.join(blocks)
+    
     def _convert_math_symbols(self, content: str) -> str:
         """数式記号をUnicodeに変換（前処理として実施）"""
         # 基本的な数式記号の変換（数式モードの判定を行わず直接置換）
@@ -394,7 +418,7 @@ class ImprovedTeXParser:
             if tex_operator == 'sup':
                 # sup _{...} のパターンを特別に処理
                 # \sup _{...} → sup_{...}
-                content = re.sub(r'\\sup\s*_\{([^}]+)\}', r'sup_{\1}', content)
+                content = patterns['parser.sup_subscript'].sub(r'sup_{\1}', content)
                 # \sup _... → sup_...
                 content = re.sub(r'\\sup\s*_([a-zA-Z0-9])', r'sup_\1', content)
                 # その他の\sup → sup
@@ -429,18 +453,18 @@ class ImprovedTeXParser:
         
         
         # \sqrt の処理（\fracより先に処理）
-        content = re.sub(r'\\sqrt\{([^}]+)\}', r'sqrt(\1)', content)
+        content = patterns['command.sqrt'].sub(r'sqrt(\1)', content)
         
         # \frac の処理
-        content = re.sub(r'\\frac\{([^}]+)\}\{([^}]+)\}', r'(\1)/(\2)', content)
+        content = patterns['command.frac'].sub(r'(\1)/(\2)', content)
         
         # 数式アクセントの処理（前処理で）
-        content = re.sub(r'\\ddot\{([^}]+)\}', r'dot.double(\1)', content)
-        content = re.sub(r'\\dot\{([^}]+)\}', r'dot(\1)', content)
-        content = re.sub(r'\\hat\{([^}]+)\}', r'hat(\1)', content)
-        content = re.sub(r'\\bar\{([^}]+)\}', r'bar(\1)', content)
-        content = re.sub(r'\\tilde\{([^}]+)\}', r'tilde(\1)', content)
-        content = re.sub(r'\\vec\{([^}]+)\}', r'arrow(\1)', content)
+        content = patterns['command.ddot'].sub(r'dot.double(\1)', content)
+        content = patterns['command.dot'].sub(r'dot(\1)', content)
+        content = patterns['command.hat'].sub(r'hat(\1)', content)
+        content = patterns['command.bar'].sub(r'bar(\1)', content)
+        content = patterns['command.tilde'].sub(r'tilde(\1)', content)
+        content = patterns['command.vec'].sub(r'arrow(\1)', content)
         
         # \mathfrak の変換（A-Z、波括弧付き対応）
         content = re.sub(r'\\mathfrak\s*\{A\}', '𝔄', content)
@@ -612,108 +636,111 @@ class ImprovedTeXParser:
         
         return content
     
-    def _extract_elements(self, content: str) -> List[str]:
+    def _extract_elements(self, content: str,
+                          records: List[LabelRecord]) -> List[Tuple[str, str, int]]:
         """主要な要素を抽出"""
-        elements = []
-        
-        # 定理環境を抽出
-        theorem_pattern = r'\\begin\{(Theorem|Lemma|Proposition|Corollary|Definition|Remark|Example|Proof|theorem|lemma|proposition|corollary|definition|remark|example|proof)\}(.*?)\\end\{\1\}'
-        theorem_matches = list(re.finditer(theorem_pattern, content, re.DOTALL))
+        # 定理環境・数式環境を環境の木から抽出
+        environments = self.environments
+        if environments is None or environments.text is not content:
+            environments = EnvironmentTree(content, self.theorem_names)
+        environment_matches = environments.select(environments.theorem_names | MATH_ENVIRONMENTS
+                                                  | TABLE_ENVIRONMENTS)
         
         # セクションを抽出
-        section_pattern = r'\\(section|subsection|subsubsection)\{([^}]+)\}'
-        section_matches = list(re.finditer(section_pattern, content))
-        
-        # 数式環境を抽出
-        math_patterns = [
-            r'\\begin\{align\}(.*?)\\end\{align\}',
-            r'\\begin\{align\*\}(.*?)\\end\{align\*\}',
-            r'\\begin\{equation\}(.*?)\\end\{equation\}',
-            r'\\\[(.*?)\\\]',
-            r'\$([^$]+)\$',
-        ]
-        
-        math_matches = []
-        for pattern in math_patterns:
-            math_matches.extend(list(re.finditer(pattern, content, re.DOTALL)))
-        
-        # 参照を抽出
-        ref_pattern = r'\\(ref|eqref|cite)\{([^}]+)\}'
-        ref_matches = list(re.finditer(ref_pattern, content))
-        
-        # すべてのマッチを位置順にソート
-        all_matches = []
-        for match in theorem_matches:
-            all_matches.append(('theorem', match.start(), match.end(), match))
+        section_matches = patterns['parser.section'].finditer(content)
+        
+        # 数式（\[...\] と $...$）を環境の木と共有する構造文字の索引から抽出
+        math_regions = environments.index.display_math() + environments.index.inline_math()
+        
+        # すべてのマッチを集める
+        spans = []
+        for environment in environment_matches:
+            if environment.name in environments.theorem_names:
+                element_type = 'theorem'
+            elif environment.name in TABLE_ENVIRONMENTS:
+                element_type = 'table'
+            else:
+                element_type = 'math'
+            spans.append((element_type, environment.start, environment.end))
         for match in section_matches:
-            all_matches.append(('section', match.start(), match.end(), match))
-        for match in math_matches:
-            all_matches.append(('math', match.start(), match.end(), match))
-        for match in ref_matches:
-            all_matches.append(('ref', match.start(), match.end(), match))
+            spans.append(('section', match.start(), match.end()))
+        for start, end in math_regions:
+            spans.append(('math', start, end))
+        spans.extend(self._reference_spans(records))
         
-        all_matches.sort(key=lambda x: x[1])
+        return self._collect_elements(content, spans)
+    
+    @staticmethod
+    def _reference_spans(records: List[LabelRecord]) -> List[Tuple[str, int, int]]:
+        """参照の範囲（抽出済みのレコードを使用、複数キーの引用は1要素）"""
+        spans = []
+        for record in records:
+            if record.kind != 'label' and (not spans or spans[-1][1] != record.start):
+                spans.append(('ref', record.start, record.end))
+        return spans
+    
+    def _collect_elements(self, content: str,
+                          spans: List[Tuple[str, int, int]]) -> List[Tuple[str, str, int]]:
+        """要素の範囲を位置順に並べ、重複を除いて間のテキストを補う"""
+        elements = []
+        spans = sorted(spans, key=lambda x: x[1])
         
         # 要素を抽出（重複を避ける）
         last_end = 0
-        processed_positions = set()
         
-        for element_type, start, end, match in all_matches:
-            # 重複チェック：既に処理済みの位置範囲と重複していないか確認
-            if any(pos >= start and pos < end for pos in processed_positions):
+        for element_type, start, end in spans:
+            # 重複チェック：開始位置の順に並んでいるため、直前の要素の終わりと比べれば足りる
+            if start < last_end:
                 continue
                 
             # 前の要素との間のテキスト
             if start > last_end:
-                text_between = content[last_end:start].strip()
-                if text_between:
-                    elements.append(('text', text_between))
+                self._append_text_element(elements, content, last_end, start)
             
             # 現在の要素
-            if element_type == 'theorem':
-                theorem_content = match.group(0)
-                elements.append(('theorem', theorem_content))
-            elif element_type == 'section':
-                elements.append(('section', match.group(0)))
-            elif element_type == 'math':
-                elements.append(('math', match.group(0)))
-            elif element_type == 'ref':
-                elements.append(('ref', match.group(0)))
-            
-            # 処理済み位置を記録
-            for pos in range(start, end):
-                processed_positions.add(pos)
-            
+            elements.append((element_type, content[start:end], start))
             last_end = end
         
         # 最後の要素以降のテキスト
         if last_end < len(content):
-            text_after = content[last_end:].strip()
-            if text_after:
-                elements.append(('text', text_after))
+            self._append_text_element(elements, content, last_end, len(content))
         
         return elements
     
-    def _parse_element(self, element: Tuple[str, str]) -> Optional[ASTNode]:
+    def _append_text_element(self, elements: List[Tuple[str, str, int]], content: str,
+                             start: int, end: int) -> None:
+        """要素間のテキストを位置付きで追加"""
+        raw = content[start:end]
+        text = raw.strip()
+        if text:
+            elements.append(('text', text, start + len(raw) - len(raw.lstrip())))
+    
+    def _parse_element(self, element: Tuple[str, str, int],
+                       records: Optional[List[LabelRecord]] = None) -> Optional[ASTNode]:
         """要素をASTノードに変換"""
-        element_type, content = element
+        element_type, content, offset = element
+        # 要素内の相対位置に変換したレコード
+        local_records = [replace(record, start=record.start - offset, end=record.end - offset)
+                         for record in records or []]
         
         if element_type == 'section':
             return self._parse_section(content)
         elif element_type == 'theorem':
-            return self._parse_theorem(content)
+            return self._parse_theorem(content, offset)
         elif element_type == 'math':
             return self._parse_math(content)
+        elif element_type == 'table':
+            return self._parse_table(content)
         elif element_type == 'ref':
-            return self._parse_reference(content)
+            return self._parse_reference(content, local_records)
         elif element_type == 'text':
-            return self._parse_text(content)
+            return self._parse_text(content, local_records)
         
         return None
     
     def _parse_section(self, content: str) -> SectionNode:
         """セクションを解析"""
-        match = re.match(r'\\(section|subsection|subsubsection)\{([^}]+)\}', content)
+        match = patterns['parser.section'].match(content)
         if match:
             level_cmd, title = match.groups()
             level = self._get_section_level(level_cmd)
@@ -725,18 +752,31 @@ class ImprovedTeXParser:
             )
         return SectionNode(node_type=NodeType.SECTION, level=1, title="", content="")
     
-    def _parse_theorem(self, content: str) -> TheoremNode:
-        """定理環境を解析"""
+    def _parse_theorem(self, content: str, offset: Optional[int] = None) -> TheoremNode:
+        """定理環境を解析（offsetは解析中の文書での位置）"""
         # \begin{Theorem}[title]\label{label}...\end{Theorem}
-        theorem_match = re.match(r'\\begin\{([^}]+)\}(?:\[([^\]]*)\])?(?:\\label\{([^}]+)\})?(.*?)\\end\{\1\}', content, re.DOTALL)
+        theorem_match = patterns['parser.theorem_header'].match(content)
+        body_end = -1
+        environment = None
         if theorem_match:
-            theorem_type, title, label, body = theorem_match.groups()
+            # 環境の木で対応付けた\endまでを本文とする（同名の環境が入れ子になっている場合）
+            environment = self.environments.at(offset) if offset is not None and self.environments else None
+            if environment is not None and environment.closed:
+                body_end = environment.body_end - offset
+            else:
+                body_end = content.find(f'\\end{{{theorem_match.group(1)}}}', theorem_match.end())
+        if body_end >= 0:
+            theorem_type, title, label = theorem_match.groups()
+            body = content[theorem_match.end():body_end]
             
             # 定理タイプに応じてNodeTypeを設定
             node_type = self._get_theorem_node_type(theorem_type)
             
             # Lemma内の数式環境を処理
-            processed_body = self._process_math_in_content(body.strip())
+            body_offset = None
+            if environment is not None:
+                body_offset = offset + theorem_match.end() + len(body) - len(body.lstrip())
+            processed_body = self._process_math_in_content(body.strip(), body_offset)
             
             return TheoremNode(
                 node_type=node_type,
@@ -770,39 +810,46 @@ class ImprovedTeXParser:
         else:
             return NodeType.THEOREM  # デフォルト
     
-    def _process_math_in_content(self, content: str) -> str:
-        """コンテンツ内の数式環境を処理"""
-        # \begin{align*}...\end{align*} を処理（先に処理する）
-        content = re.sub(r'\\begin\{align\*\}(.*?)\\end\{align\*\}', 
-                        lambda m: self._process_align_content(m.group(1), 'align*'), 
-                        content, flags=re.DOTALL)
-        
-        # \begin{align}...\end{align} を処理
-        content = re.sub(r'\\begin\{align\}(.*?)\\end\{align\}', 
-                        lambda m: self._process_align_content(m.group(1), 'align'), 
-                        content, flags=re.DOTALL)
+    def _process_math_in_content(self, content: str, offset: Optional[int] = None) -> str:
+        """コンテンツ内の数式環境を処理
+        
+        offsetを指定すると解析中の環境の木を参照し、指定しない場合はcontentから木を作る。
+        """
+        tree = self.environments
+        if offset is None or tree is None:
+            tree, offset = EnvironmentTree(content, self.theorem_names), 0
+        
+        # \begin{align}...\end{align}・\begin{align*}...\end{align*} を処理
+        pieces = []
+        last = 0
+        for environment in tree.select(ALIGN_ENVIRONMENTS, offset, offset + len(content), outermost=True):
+            pieces.append(content[last:environment.start - offset])
+            pieces.append(self._process_align_content(tree.body(environment), environment.name))
+            last = environment.end - offset
+        if pieces:
+            pieces.append(content[last:])
+            content = ''.join(pieces)
         
         # \[...\] を処理
-        content = re.sub(r'\\\[(.*?)\\\]', 
-                        lambda m: f'$ {self._parse_math_content(m.group(1))} $ //[formula type:display]', 
-                        content, flags=re.DOTALL)
+        content = patterns['parser.math_display'].sub(
+            lambda m: f'$ {self._parse_math_content(m.group(1))} $ //[formula type:display]', content)
         
         return content
     
     def _process_align_content(self, content: str, align_type: str) -> str:
         """align環境の内容を処理してlabelを抽出"""
         # \label{...}を抽出
-        label_match = re.search(r'\\label\{([^}]+)\}', content)
+        label_match = patterns['command.label'].search(content)
         label_name = label_match.group(1) if label_match else None
         
         # \tag{...}を抽出
-        tag_match = re.search(r'\\tag\{([^}]+)\}', content)
+        tag_match = patterns['command.tag'].search(content)
         tag_name = tag_match.group(1) if tag_match else None
         
         # \label{...}を除去
-        content = re.sub(r'\\label\{[^}]+\}', '', content)
+        content = patterns['command.label'].sub('', content)
         # \tag{...}を除去
-        content = re.sub(r'\\tag\{[^}]+\}', '', content)
+        content = patterns['command.tag'].sub('', content)
         # 空行を除去
         content = re.sub(r'\n\s*\n', '\n', content)
         
@@ -825,11 +872,11 @@ class ImprovedTeXParser:
         # 基本的な数式処理（簡易版）
         content = content.replace('\\label{eq2}', '').strip()
         # \label{...}を除去
-        content = re.sub(r'\\label\{[^}]+\}', '', content)
+        content = patterns['command.label'].sub('', content)
         # \tag{...}を除去
-        content = re.sub(r'\\tag\{[^}]+\}', '', content)
+        content = patterns['command.tag'].sub('', content)
         # \mbox{...}を"..."に変換
-        content = re.sub(r'\\mbox\{([^}]+)\}', r'"\1"', content)
+        content = patterns['command.mbox'].sub(r'"\1"', content)
         return content
     
     def _parse_math(self, content: str) -> MathNode:
@@ -845,19 +892,19 @@ class ImprovedTeXParser:
             
             # \label{...}を抽出して除去
             import re
-            label_match = re.search(r'\\label\{([^}]+)\}', math_content)
+            label_match = patterns['command.label'].search(math_content)
             label_name = label_match.group(1) if label_match else None
-            math_content = re.sub(r'\\label\{[^}]+\}', '', math_content)
+            math_content = patterns['command.label'].sub('', math_content)
             
             # \tag{...}を抽出して除去
-            tag_match = re.search(r'\\tag\{([^}]+)\}', math_content)
+            tag_match = patterns['command.tag'].search(math_content)
             tag_name = tag_match.group(1) if tag_match else None
-            math_content = re.sub(r'\\tag\{[^}]+\}', '', math_content)
+            math_content = patterns['command.tag'].sub('', math_content)
             
             # 残った}を除去
             math_content = re.sub(r'^}\s*', '', math_content)
             # \mbox{...}を"..."に変換
-            math_content = re.sub(r'\\mbox\{([^}]+)\}', r'"\1"', math_content)
+            math_content = patterns['command.mbox'].sub(r'"\1"', math_content)
             # ノルム記号と絶対値記号を解析して子ノードに変換
             child_nodes = self._parse_norm_expression(math_content)
             abs_nodes = self._parse_abs_expression(math_content)
@@ -888,15 +935,15 @@ class ImprovedTeXParser:
             
             # \label{...}を抽出して除去
             import re
-            label_match = re.search(r'\\label\{([^}]+)\}', math_content)
+            label_match = patterns['command.label'].search(math_content)
             label_name = label_match.group(1) if label_match else None
-            math_content = re.sub(r'\\label\{[^}]+\}', '', math_content)
+            math_content = patterns['command.label'].sub('', math_content)
             # \tag{...}も除去
-            math_content = re.sub(r'\\tag\{[^}]+\}', '', math_content)
+            math_content = patterns['command.tag'].sub('', math_content)
             # 残った}を除去
             math_content = re.sub(r'^}\s*', '', math_content)
             # \mbox{...}を"..."に変換
-            math_content = re.sub(r'\\mbox\{([^}]+)\}', r'"\1"', math_content)
+            math_content = patterns['command.mbox'].sub(r'"\1"', math_content)
             # ノルム記号と絶対値記号を解析して子ノードに変換
             child_nodes = self._parse_norm_expression(math_content)
             abs_nodes = self._parse_abs_expression(math_content)
@@ -924,17 +971,17 @@ class ImprovedTeXParser:
             
             # \label{...}を抽出して除去
             import re
-            label_match = re.search(r'\\label\{([^}]+)\}', math_content)
+            label_match = patterns['command.label'].search(math_content)
             label_name = label_match.group(1) if label_match else None
-            math_content = re.sub(r'\\label\{[^}]+\}', '', math_content)
+            math_content = patterns['command.label'].sub('', math_content)
             # \tag{...}を抽出して除去
-            tag_match = re.search(r'\\tag\{([^}]+)\}', math_content)
+            tag_match = patterns['command.tag'].search(math_content)
             tag_name = tag_match.group(1) if tag_match else None
-            math_content = re.sub(r'\\tag\{[^}]+\}', '', math_content)
+            math_content = patterns['command.tag'].sub('', math_content)
             # 残った}を除去
             math_content = re.sub(r'^}\s*', '', math_content)
             # \mbox{...}を"..."に変換
-            math_content = re.sub(r'\\mbox\{([^}]+)\}', r'"\1"', math_content)
+            math_content = patterns['command.mbox'].sub(r'"\1"', math_content)
             # ノルム記号と絶対値記号を解析して子ノードに変換
             child_nodes = self._parse_norm_expression(math_content)
             abs_nodes = self._parse_abs_expression(math_content)
@@ -999,7 +1046,8 @@ class ImprovedTeXParser:
             return math_node
         return MathNode(node_type=NodeType.MATH_INLINE, content=content, math_type="inline")
     
-    def _parse_reference(self, content: str) -> ReferenceNode:
+    def _parse_reference(self, content: str,
+                         records: Optional[List[LabelRecord]] = None) -> ReferenceNode:
         """参照を解析"""
         match = re.match(r'\\(ref|eqref|cite)\{([^}]+)\}', content)
         if match:
@@ -1014,19 +1062,50 @@ class ImprovedTeXParser:
             else:
                 node_type = NodeType.REF
             
-            return ReferenceNode(
+            reference = ReferenceNode(
                 node_type=node_type,
                 ref_type=ref_type,
                 target=target
             )
+            # 複数キーの引用はキーごとに分割して保持
+            if ref_type == "cite":
+                keys = [record.target for record in records] if records else \
+                    [key.strip() for key in target.split(',') if key.strip()]
+                reference.set_attribute('keys', keys)
+            return reference
         return ReferenceNode(node_type=NodeType.REF, ref_type="ref", target="")
     
-    def _parse_text(self, content: str) -> TextNode:
+    def _parse_table(self, content: str) -> ASTNode:
+        """表の環境を解析（本文は変換器が行ごとに読む）"""
+        begin = _TABLE_BEGIN.match(content)
+        name = begin.group(1)
+        position = begin.end()
+        width = None
+        if name in TABLE_WIDTH_ENVIRONMENTS:
+            group = _TABLE_GROUP.match(content, position)
+            if group:
+                width, position = group.group(1).strip(), group.end()
+        option = _TABLE_OPTION.match(content, position)
+        if option:
+            position = option.end()
+        group = _TABLE_GROUP.match(content, position)
+        end = content.rfind('\\end{')
+        if group is None or end < group.end():
+            self.problems.append(f"Table environment '{name}' has no column specification; kept as text")
+            return self._parse_text(content)
+        return TableNode(node_type=NodeType.TABLE, content=content[group.end():end], environment=name,
+                         columns=group.group(1), width=width)
+    
+    def _parse_text(self, content: str, records: Optional[List[LabelRecord]] = None) -> TextNode:
         """テキストを解析"""
-        return TextNode(
+        text_node = TextNode(
             node_type=NodeType.TEXT,
             content=content
         )
+        # 抽出済みのラベル・参照を変換器に引き渡す
+        if records is not None:
+            text_node.set_attribute('label_records', records)
+        return text_node
     
     def _get_section_level(self, section_command: str) -> int:
         """セクションレベルを取得"""
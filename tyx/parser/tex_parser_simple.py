@@ -14,19 +14,48 @@ from .ast import (
     VariableNode, OperatorNode, FractionNode, SubscriptNode, 
     SuperscriptNode, TextNode, UnknownNode, NodeType
 )
+from .environments import EnvironmentTree, learn_theorem_names
 from ..utils.labels import label_extractor
 from ..utils.unicode import unicode_converter
 
 
+# ドキュメントクラス、パッケージ、メタデータ（読み飛ばす）
+_SKIP_PATTERNS = tuple(re.compile(pattern, re.DOTALL) for pattern in (
+    r'\\documentclass(?:\[[^\]]*\])?\{[^}]*\}',
+    r'\\usepackage.*?(?=\n|$)',
+    r'\\mathtoolsset\{[^}]*\}',
+    r'\\newtheorem\*?\{[^}]*\}(?:\[[^\]]*\])?\{[^}]*\}(?:\[[^\]]*\])?',
+    r'\\begin\{document\}',
+    r'\\end\{document\}',
+    r'\\title\{[^}]*\}',
+    r'\\author(?:\[[^\]]*\])?\{[^}]*\}',
+    r'\\address(?:\[[^\]]*\])?\{[^}]*\}',
+    r'\\email\{[^}]*\}',
+    r'\\subjclass\{[^}]*\}',
+    r'\\keywords\{[^}]*\}',
+    r'\\maketitle',
+    r'\\begin\{abstract\}.*?\\end\{abstract\}',
+))
+
+_WHITESPACE = re.compile(r'\s*')
+_COMMENT = re.compile(r'%[^\n]*')
+# 要素にならない部分：特殊文字（\ $ %）以外の連続、エスケープ、未知のコマンド、その他の1文字
+_TEXT_RUN = re.compile(r'(?:[^\\$%]|\\[$%&#_{}])+|\\[a-zA-Z]+\*?|\\.|.', re.DOTALL)
+
+
 @dataclass
 class ParseResult:
-    """解析結果"""
-    node: ASTNode
-    remaining_text: str
+    """解析結果（nodeがNoneの場合は読み飛ばした部分）"""
+    node: Optional[ASTNode]
+    end: int
 
 
 class SimpleTeXParser:
-    """簡易TeXパーサー"""
+    """簡易TeXパーサー
+
+    入力を切り出さずに位置（カーソル）を進め、各位置で要素のパターンを
+    match(text, pos) で試す。どの要素にもならない部分はまとめて1つのテキストにする。
+    """
     
     def __init__(self):
         # 正規表現パターン
@@ -34,9 +63,6 @@ class SimpleTeXParser:
             'section': re.compile(r'\\(section|subsection|subsubsection)\{([^}]+)\}'),
             'math_inline': re.compile(r'\$([^$]+)\$'),
             'math_display': re.compile(r'\\\[([^\]]+)\\\]'),
-            'math_align': re.compile(r'\\begin\{align\}(.*?)\\end\{align\}', re.DOTALL),
-            'math_align_star': re.compile(r'\\begin\{align\*\}(.*?)\\end\{align\*\}', re.DOTALL),
-            'theorem': re.compile(r'\\begin\{(Theorem|Lemma|Proposition|Corollary|Definition|Remark|Example|Proof|theorem|lemma|proposition|corollary|definition|remark|example|proof)\}(.*?)\\end\{\1\}', re.DOTALL),
             'reference': re.compile(r'\\(ref|eqref|cite)\{([^}]+)\}'),
             'accent': re.compile(r'\\(dot|ddot|hat|bar|tilde|vec)\{([^}]+)\}'),
             'symbol': re.compile(r'\\(alpha|beta|gamma|delta|epsilon|zeta|eta|theta|iota|kappa|lambda|mu|nu|xi|omicron|pi|rho|sigma|tau|upsilon|phi|chi|psi|omega|infty|partial|nabla|pm|mp|times|div|leq|geq|neq|approx|equiv|propto)'),
@@ -47,78 +73,78 @@ class SimpleTeXParser:
             'operator': re.compile(r'\\(sum|int|prod|lim|max|min)'),
             'unknown_command': re.compile(r'\\([a-zA-Z]+)\{([^}]*)\}'),
         }
+        # 数式（パターン名, ノード種別, 数式の種類）
+        self.math_patterns = (
+            ('math_inline', NodeType.MATH_INLINE, "inline"),
+            ('math_display', NodeType.MATH_DISPLAY, "display"),
+        )
+        # 数式環境（環境名 → ノード種別）
+        self.math_environments = {
+            'align': NodeType.MATH_ALIGN,
+            'align*': NodeType.MATH_ALIGN_STAR,
+        }
+        # 解析中の環境の木
+        self.environments: Optional[EnvironmentTree] = None
     
     def parse(self, tex_content: str) -> DocumentNode:
         """TeXコンテンツを解析"""
         document = DocumentNode(node_type=NodeType.DOCUMENT)
-        remaining_text = tex_content.strip()
+        text = tex_content
+        length = len(text)
+        self.environments = EnvironmentTree(text, learn_theorem_names(text))
+        pos = _WHITESPACE.match(text).end()
+        # 未確定のテキストの開始位置
+        text_start = None
         
-        while remaining_text:
-            result = self._parse_next_element(remaining_text)
-            if result:
-                document.add_child(result.node)
-                remaining_text = result.remaining_text.strip()
+        while pos < length:
+            if text[pos] == '%':
+                result = ParseResult(None, _COMMENT.match(text, pos).end())
             else:
-                # 解析できない部分はテキストとして処理
-                if remaining_text:
-                    text_node = TextNode(
-                        node_type=NodeType.TEXT,
-                        content=remaining_text[:100]  # 最初の100文字のみ
-                    )
-                    document.add_child(text_node)
-                break
+                result = self._parse_next_element(text, pos)
+            
+            if result is None:
+                # 要素にならない部分はテキストとしてまとめる
+                if text_start is None:
+                    text_start = pos
+                pos = _TEXT_RUN.match(text, pos).end()
+                continue
+            
+            if text_start is not None:
+                self._add_text(document, text[text_start:pos])
+                text_start = None
+            if result.node is not None:
+                document.add_child(result.node)
+            pos = _WHITESPACE.match(text, result.end).end()
+        
+        if text_start is not None:
+            self._add_text(document, text[text_start:])
         
+        self.environments = None
         return document
     
-    def _parse_next_element(self, text: str) -> Optional[ParseResult]:
-        """次の要素を解析"""
-        # コメントをスキップ
-        if text.strip().startswith('%'):
-            # コメント行をスキップ
-            lines = text.split('\n')
-            non_comment_lines = []
-            for line in lines:
-                if line.strip().startswith('%'):
-                    continue
-                non_comment_lines.append(line)
-            if non_comment_lines:
-                return ParseResult(TextNode(node_type=NodeType.TEXT, content=""), '\n'.join(non_comment_lines))
-            else:
-                return ParseResult(TextNode(node_type=NodeType.TEXT, content=""), "")
-        
+    @staticmethod
+    def _add_text(document: DocumentNode, content: str) -> None:
+        content = content.strip()
+        if content:
+            document.add_child(TextNode(node_type=NodeType.TEXT, content=content))
+    
+    def _parse_next_element(self, text: str, pos: int) -> Optional[ParseResult]:
+        """位置posから始まる要素を解析（要素でなければNone）"""
         # ドキュメントクラス、パッケージ、メタデータをスキップ
-        skip_patterns = [
-            r'\\documentclass\[[^\]]*\]\{[^}]*\}',
-            r'\\usepackage.*?(?=\n|$)',
-            r'\\mathtoolsset\{[^}]*\}',
-            r'\\newtheorem\{[^}]*\}\{[^}]*\}(?:\[[^\]]*\])?',
-            r'\\begin\{document\}',
-            r'\\end\{document\}',
-            r'\\title\{[^}]*\}',
-            r'\\author(?:\[[^\]]*\])?\{[^}]*\}',
-            r'\\address(?:\[[^\]]*\])?\{[^}]*\}',
-            r'\\email\{[^}]*\}',
-            r'\\subjclass\{[^}]*\}',
-            r'\\keywords\{[^}]*\}',
-            r'\\maketitle',
-            r'\\begin\{abstract\}.*?\\end\{abstract\}',
-        ]
-        
-        for pattern in skip_patterns:
-            match = re.search(pattern, text, re.DOTALL)
+        for pattern in _SKIP_PATTERNS:
+            match = pattern.match(text, pos)
             if match:
-                # スキップされた要素は残りのテキストを処理
-                return self._parse_next_element(text[match.end():])
+                return ParseResult(None, match.end())
         
         # 定理（最優先）
-        theorem_match = self._find_theorem_environment(text)
+        theorem_match = self._find_theorem_environment(text, pos)
         if theorem_match:
             theorem_type, content, end_pos = theorem_match
             theorem_node = self._parse_theorem(theorem_type, content)
-            return ParseResult(theorem_node, text[end_pos:])
+            return ParseResult(theorem_node, end_pos)
         
         # セクション
-        match = self.patterns['section'].search(text)
+        match = self.patterns['section'].match(text, pos)
         if match:
             level_cmd, title = match.groups()
             level = self._get_section_level(level_cmd)
@@ -128,60 +154,24 @@ class SimpleTeXParser:
                 title=title,
                 content=title
             )
-            return ParseResult(section, text[match.end():])
-        
-        # 数式（インライン）
-        match = self.patterns['math_inline'].search(text)
-        if match:
-            content = match.group(1)
-            math_node = MathNode(
-                node_type=NodeType.MATH_INLINE,
-                content=content,
-                math_type="inline"
-            )
-            # 数式内容を解析
-            self._parse_math_content(math_node, content)
-            return ParseResult(math_node, text[match.end():])
+            return ParseResult(section, match.end())
         
-        # 数式（ディスプレイ）
-        match = self.patterns['math_display'].search(text)
-        if match:
-            content = match.group(1)
-            math_node = MathNode(
-                node_type=NodeType.MATH_DISPLAY,
-                content=content,
-                math_type="display"
-            )
-            self._parse_math_content(math_node, content)
-            return ParseResult(math_node, text[match.end():])
-        
-        # 数式（align）
-        match = self.patterns['math_align'].search(text)
-        if match:
-            content = match.group(1)
-            math_node = MathNode(
-                node_type=NodeType.MATH_ALIGN,
-                content=content,
-                math_type="align"
-            )
-            self._parse_math_content(math_node, content)
-            return ParseResult(math_node, text[match.end():])
-        
-        # 数式（align*）
-        match = self.patterns['math_align_star'].search(text)
-        if match:
-            content = match.group(1)
-            math_node = MathNode(
-                node_type=NodeType.MATH_ALIGN_STAR,
-                content=content,
-                math_type="align*"
-            )
-            self._parse_math_content(math_node, content)
-            return ParseResult(math_node, text[match.end():])
+        # 数式（インライン・ディスプレイ）
+        for name, node_type, math_type in self.math_patterns:
+            match = self.patterns[name].match(text, pos)
+            if match:
+                content = match.group(1)
+                return ParseResult(self._make_math_node(node_type, math_type, content), match.end())
         
+        # 数式環境（align・align*）
+        environment = self.environments.at(pos) if self.environments else None
+        if environment and environment.closed and environment.name in self.math_environments:
+            content = self.environments.body(environment)
+            node_type = self.math_environments[environment.name]
+            return ParseResult(self._make_math_node(node_type, environment.name, content), environment.end)
         
         # 参照
-        match = self.patterns['reference'].search(text)
+        match = self.patterns['reference'].match(text, pos)
         if match:
             ref_type, target = match.groups()
             ref_node = ReferenceNode(
@@ -190,20 +180,20 @@ class SimpleTeXParser:
                 target=target,
                 content=match.group(0)
             )
-            return ParseResult(ref_node, text[match.end():])
-        
-        # テキスト（最初の単語）
-        words = text.split()
-        if words:
-            word = words[0]
-            text_node = TextNode(
-                node_type=NodeType.TEXT,
-                content=word
-            )
-            return ParseResult(text_node, text[len(word):])
+            return ParseResult(ref_node, match.end())
         
         return None
     
+    def _make_math_node(self, node_type: NodeType, math_type: str, content: str) -> MathNode:
+        """数式ノードを作成して内容を解析"""
+        math_node = MathNode(
+            node_type=node_type,
+            content=content,
+            math_type=math_type
+        )
+        self._parse_math_content(math_node, content)
+        return math_node
+    
     def _parse_math_content(self, math_node: MathNode, content: str) -> None:
         """数式内容を解析"""
         # アクセント
@@ -311,46 +301,15 @@ class SimpleTeXParser:
         
         return theorem_node
     
-    def _find_theorem_environment(self, text: str) -> Optional[Tuple[str, str, int]]:
-        """定理環境を検索（ネストした環境に対応）"""
-        theorem_types = ['Theorem', 'Lemma', 'Proposition', 'Corollary', 'Definition', 'Remark', 'Example', 'Proof',
-                        'theorem', 'lemma', 'proposition', 'corollary', 'definition', 'remark', 'example', 'proof']
-        
-        for theorem_type in theorem_types:
-            begin_pattern = f'\\\\begin\\{{{theorem_type}\\}}'
-            end_pattern = f'\\\\end\\{{{theorem_type}\\}}'
-            
-            begin_match = re.search(begin_pattern, text)
-            if begin_match:
-                start_pos = begin_match.start()
-                # 対応する\end{theorem_type}を検索
-                search_start = begin_match.end()
-                brace_count = 0
-                pos = search_start
-                
-                while pos < len(text):
-                    if text[pos:pos+len(f'\\end{{{theorem_type}}}')] == f'\\end{{{theorem_type}}}':
-                        if brace_count == 0:
-                            # 対応する\endが見つかった
-                            content = text[search_start:pos]
-                            end_pos = pos + len(f'\\end{{{theorem_type}}}')
-                            return theorem_type, content, end_pos
-                    elif text[pos:pos+len('\\begin{')] == '\\begin{':
-                        # ネストした環境の開始
-                        brace_count += 1
-                        pos += len('\\begin{')
-                    elif text[pos:pos+len('\\end{')] == '\\end{':
-                        # ネストした環境の終了
-                        brace_count -= 1
-                        pos += len('\\end{')
-                    else:
-                        pos += 1
-                
-                # 対応する\endが見つからない場合は、最初のマッチを返す
-                content = text[search_start:]
-                return theorem_type, content, len(text)
-        
-        return None
+    def _find_theorem_environment(self, text: str, pos: int = 0) -> Optional[Tuple[str, str, int]]:
+        """位置posから始まる定理環境を環境の木から検索（閉じがない場合は残りすべてを本文とする）"""
+        tree = self.environments
+        if tree is None or tree.text is not text:
+            tree = EnvironmentTree(text, learn_theorem_names(text))
+        environment = tree.at(pos)
+        if environment is None or environment.name not in tree.theorem_names:
+            return None
+        return environment.name, tree.body(environment), environment.end
     
     def _get_section_level(self, section_command: str) -> int:
         """セクションレベルを取得"""
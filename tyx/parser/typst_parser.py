@@ -0,0 +1,382 @@
+"""
+Typstの解析（逆方向の変換用）
+
+変換器が出力した.typ（`$...$` と行末の `//[formula type:...]`、`#lemma(...)[...] //[Lemma]`、
+`@label //[ref type:...]`、`<label>` の行）を解析し、TeX側と同じ tyx.parser.ast のノードを作る。
+各ノードは属性 `span` に文字列での範囲 (開始位置, 終了位置) を持つ。
+metaMode: sidecar で出力した.typは、parse_file が隣の .typ.tyxmeta のメタコメントを戻してから解析する。
+
+編集の再解析では、編集範囲の直前のトップレベルのブロックから解析し直し、
+編集範囲より後で元の木のブロックと同じ位置・同じ範囲のブロックが得られた時点で打ち切って、
+残りは元の木のブロックを位置をずらして使う。
+"""
+
+import re
+from typing import Iterator, List, Optional, Tuple
+
+from .ast import (
+    ASTNode, DocumentNode, MathNode, NodeType, ReferenceNode, SectionNode, TextNode, TheoremNode
+)
+from ..utils.meta_comments import MetaComment, meta_comment_parser, meta_sidecar
+
+
+# 定理型の関数名 → ノードの種類（変換器の出力する関数）
+THEOREM_FUNCTIONS = {
+    'theorem': NodeType.THEOREM,
+    'lemma': NodeType.LEMMA,
+    'proposition': NodeType.PROPOSITION,
+    'corollary': NodeType.COROLLARY,
+    'definition': NodeType.DEFINITION,
+    'remark': NodeType.REMARK,
+    'example': NodeType.EXAMPLE,
+    'proof': NodeType.PROOF,
+}
+
+# トップレベルのブロックの開始（見出し・コメント・ラベル・#importは行頭のみ、
+# 行の途中のコメントとエスケープはテキストとして読み飛ばす）
+_BLOCK_TOKEN = re.compile(
+    r'^[ \t]*(?:(?P<heading>=+)[ \t]|(?P<comment>//)|(?P<label><(?P<name>[\w:.\-]+)>)[ \t]*(?=\n|\Z)'
+    r'|(?P<import>#import\b))'
+    r'|(?P<skip>\\.|(?<!:)//[^\n]*)'
+    r'|(?P<math>\$)'
+    r'|(?<![\w@])(?P<ref>@(?P<target>[\w:.\-]*[\w\-]))'
+    r'|(?P<theorem>#(?P<function>' + '|'.join(THEOREM_FUNCTIONS) + r'))(?=[(\[])',
+    re.MULTILINE | re.DOTALL)
+# 数式の中（文字列・コメント・エスケープの中の $ は閉じとしない、文字列は1行まで）
+_MATH_TOKEN = re.compile(r'\\.|"(?:[^"\\\n]|\\.)*"|//[^\n]*|(?P<close>\$)', re.DOTALL)
+# 定理の本文の中（数式は読み飛ばす、URLの // はコメントとしない）
+_BRACKET_TOKEN = re.compile(r'\\.|(?<!:)//[^\n]*|(?P<math>\$)|(?P<open>\[)|(?P<close>\])', re.DOTALL)
+# 定理の引数の中
+_PAREN_TOKEN = re.compile(r'"(?:[^"\\\n]|\\.)*"|(?P<open>\()|(?P<close>\))')
+_ARGUMENT = re.compile(r'(\w+)\s*:\s*"((?:[^"\\\n]|\\.)*)"')
+# 閉じの直後の行末メタコメント
+_TRAILING_META = re.compile(r'[ \t]*(//\[[^\]\n]*\])')
+# ディスプレイ数式の次の行のラベル
+_LABEL_AFTER = re.compile(r'[ \t]*\n[ \t]*<([\w:.\-]+)>[ \t]*(?=\n|\Z)')
+# 複数キーの引用の区切り（「,」だけの行）
+_CITE_SEPARATOR = re.compile(r'[ \t]*\n[ \t]*,[ \t]*\n[ \t]*')
+_REFERENCE = re.compile(r'@([\w:.\-]*[\w\-])')
+
+# メタコメントの種類 → (ノードの種類, math_type)
+_MATH_TYPES = {
+    ('formula', 'display'): (NodeType.MATH_DISPLAY, "display"),
+    ('formula', 'align*'): (NodeType.MATH_ALIGN_STAR, "align*"),
+    ('environment', 'align'): (NodeType.MATH_ALIGN, "align"),
+    ('environment', 'equation'): (NodeType.MATH_DISPLAY, "equation"),
+}
+_DISPLAY_TYPES = (NodeType.MATH_DISPLAY, NodeType.MATH_ALIGN, NodeType.MATH_ALIGN_STAR)
+
+
+class TypstParser:
+    """Typstパーサー
+
+    problems には直前の parse / reparse で解析した範囲の問題を記録する。
+    閉じのない `$`・`#lemma[` などはテキストとして扱い、その位置を文書の属性 `unclosed` に持つ
+    （後ろの編集で閉じる可能性があるため、再解析はその位置から行う）。
+    """
+
+    def __init__(self):
+        self.problems: List[str] = []
+        self._unclosed: List[int] = []
+        # 直前の reparse で解析し直した範囲（編集後の文字列での位置）
+        self.reparsed: Tuple[int, int] = (0, 0)
+
+    def parse(self, typst_content: str) -> DocumentNode:
+        """Typstを解析してASTに変換"""
+        self.problems = []
+        self._unclosed = []
+        document = DocumentNode(node_type=NodeType.DOCUMENT, content="")
+        document.children = list(self._blocks(typst_content, 0, len(typst_content)))
+        document.set_attribute('source', typst_content)
+        document.set_attribute('unclosed', self._unclosed)
+        document.set_attribute('span', (0, len(typst_content)))
+        self.reparsed = (0, len(typst_content))
+        return document
+
+    def parse_file(self, typst_path: str) -> DocumentNode:
+        """.typファイルを解析（隣にサイドカー .typ.tyxmeta があればメタコメントを戻してから解析）"""
+        with open(typst_path, 'r', encoding='utf-8') as f:
+            typst_content = f.read()
+        entries = meta_sidecar.load(meta_sidecar.sidecar_path(typst_path))
+        if entries:
+            typst_content = meta_sidecar.merge(typst_content, entries)
+        return self.parse(typst_content)
+
+    def reparse(self, document: DocumentNode, start: int, end: int, replacement: str) -> DocumentNode:
+        """範囲 [start, end) をreplacementに置き換え、編集を含むブロックだけを解析し直す
+
+        documentは parse / reparse の結果で、子ノードを差し替えて返す。
+        """
+        self.problems = []
+        self._unclosed = []
+        old = document.get_attribute('source')
+        text = old[:start] + replacement + old[end:]
+        delta = len(replacement) - (end - start)
+        edit_end = start + len(replacement)
+        children = document.children
+        spans = [child.get_attribute('span') for child in children]
+
+        # ブロックの先読みは2行先まで（ラベルの行、「,」の行で区切られた引用）のため、
+        # 編集範囲の2行前までに終わるブロックのうち、直前の1つを除いて残す
+        # 編集範囲より前に閉じのない位置があれば、そのブロックから解析し直す
+        limit = old.rfind('\n', 0, start) + 1
+        for _ in range(2):
+            limit = old.rfind('\n', 0, max(limit - 1, 0)) + 1
+        unclosed = document.get_attribute('unclosed')
+        limit = min([limit] + [pos for pos in unclosed if pos < start])
+        before = 0
+        while before < len(children) and spans[before][1] < limit:
+            before += 1
+        keep = max(before - 1, 0)
+        position = spans[keep][0] if keep < before else 0
+        # 行頭のトークン（見出しなど）を認識できるよう、行頭の空白から解析する
+        while position > 0 and text[position - 1] in ' \t':
+            position -= 1
+
+        # 編集範囲より後のブロック（位置は編集後に合わせる）
+        following = before
+        while following < len(children) and spans[following][0] <= end:
+            following += 1
+
+        nodes: List[ASTNode] = []
+        resumed = len(children)
+        for node in self._blocks(text, position, len(text)):
+            node_start, node_end = node.get_attribute('span')
+            while following < len(children) and spans[following][0] + delta < node_start:
+                following += 1
+            if (following < len(children) and node_start >= edit_end
+                    and text.rfind('\n', 0, node_start) + 1 >= edit_end
+                    and spans[following] == (node_start - delta, node_end - delta)
+                    and children[following].node_type == node.node_type):
+                resumed = following
+                break
+            nodes.append(node)
+
+        reparsed_end = spans[resumed][0] + delta if resumed < len(children) else len(text)
+        for child in children[resumed:]:
+            self._shift(child, delta)
+        document.children = children[:keep] + nodes + children[resumed:]
+        document.set_attribute('source', text)
+        document.set_attribute('unclosed', [pos for pos in unclosed if pos < position] + self._unclosed
+                               + [pos + delta for pos in unclosed if pos + delta >= reparsed_end])
+        document.set_attribute('span', (0, len(text)))
+        self.reparsed = (position, reparsed_end)
+        return document
+
+    def _shift(self, node: ASTNode, delta: int) -> None:
+        """ノードと子孫の範囲をずらす"""
+        if delta:
+            node_start, node_end = node.get_attribute('span')
+            node.set_attribute('span', (node_start + delta, node_end + delta))
+            for child in node.children:
+                self._shift(child, delta)
+
+    # ブロック
+
+    def _blocks(self, text: str, start: int, end: int) -> Iterator[ASTNode]:
+        """範囲 [start, end) のブロックを位置の順に返す（ブロックの間はテキスト）"""
+        pos = text_start = start
+        while True:
+            match = _BLOCK_TOKEN.search(text, pos, end)
+            if match is None:
+                break
+            if match.group('import'):
+                # 文書先頭の #import の行は読み飛ばす
+                yield from self._text(text, text_start, match.start())
+                pos = text_start = self._line_end(text, match.end(), end)
+                continue
+            node = None if match.group('skip') else self._block(text, match, end)
+            if node is None:
+                pos = match.end()
+                continue
+            yield from self._text(text, text_start, match.start())
+            yield node
+            pos = text_start = node.get_attribute('span')[1]
+        yield from self._text(text, text_start, end)
+
+    def _block(self, text: str, match: 're.Match', end: int) -> Optional[ASTNode]:
+        """トークンから始まるブロック（閉じがない場合はNone）"""
+        if match.group('math'):
+            return self._math(text, match.start(), end)
+        if match.group('ref'):
+            return self._reference(text, match.start('ref'), end)
+        if match.group('theorem'):
+            return self._theorem(text, match, end)
+        if match.group('heading'):
+            line_end = self._line_end(text, match.end(), end)
+            level = len(match.group('heading'))
+            title = text[match.end():line_end].strip()
+            node = SectionNode(node_type=NodeType.SECTION, level=min(level, 3), title=title, content=title)
+            return self._at(node, match.start('heading'), line_end)
+        if match.group('comment'):
+            line_end = self._line_end(text, match.end(), end)
+            node = TextNode(node_type=NodeType.TEXT, content=text[match.start('comment'):line_end])
+            node.set_attribute('comment', True)
+            return self._at(node, match.start('comment'), line_end)
+        # ディスプレイ数式に付かない <label> の行
+        node = TextNode(node_type=NodeType.TEXT, content=match.group('label'))
+        node.set_attribute('label', match.group('name'))
+        return self._at(node, match.start('label'), match.end('label'))
+
+    def _text(self, text: str, start: int, end: int) -> Iterator[TextNode]:
+        """ブロックの間のテキスト（前後の空白を除く）"""
+        raw = text[start:end]
+        content = raw.strip()
+        if content:
+            node_start = start + len(raw) - len(raw.lstrip())
+            yield self._at(TextNode(node_type=NodeType.TEXT, content=content),
+                           node_start, node_start + len(content))
+
+    def _math(self, text: str, start: int, end: int) -> Optional[MathNode]:
+        """`$...$`（内側の両端が空白ならディスプレイ数式）"""
+        close = self._math_end(text, start + 1, end)
+        if close == -1:
+            self._unclosed_at(text, start, "Unclosed $")
+            return None
+        body = text[start + 1:close]
+        node_end = close + 1
+        meta = _TRAILING_META.match(text, node_end, end)
+        meta_comment = self._meta(meta)
+        display = body[:1].isspace() and body[-1:].isspace()
+
+        node_type, math_type = (NodeType.MATH_DISPLAY, "display") if display else (NodeType.MATH_INLINE, "inline")
+        if meta_comment is not None:
+            node_type, math_type = _MATH_TYPES.get((meta_comment.comment_type, meta_comment.subtype),
+                                                   (node_type, math_type))
+        node = MathNode(node_type=node_type, content=body.strip() if display else body, math_type=math_type)
+        if meta_comment is not None:
+            node.meta_comment = meta.group(1)
+            node.tag = meta_comment.attributes.get('tag')
+            node_end = meta.end()
+        if node_type in _DISPLAY_TYPES:
+            label = _LABEL_AFTER.match(text, node_end, end)
+            if label:
+                node.label = label.group(1)
+                node_end = label.end()
+        return self._at(node, start, node_end)
+
+    def _reference(self, text: str, start: int, end: int) -> Optional[ReferenceNode]:
+        """`@label //[ref type:...]`（「,」の行で区切られた引用は1つのノードにまとめる）"""
+        node, node_end = self._reference_at(text, start, end)
+        if node.ref_type == "cite":
+            keys = [node.target]
+            while True:
+                separator = _CITE_SEPARATOR.match(text, node_end, end)
+                if not separator or not _REFERENCE.match(text, separator.end(), end):
+                    break
+                following, following_end = self._reference_at(text, separator.end(), end)
+                if following.ref_type != "cite":
+                    break
+                keys.append(following.target)
+                node_end = following_end
+            node.set_attribute('keys', keys)
+        return self._at(node, start, node_end)
+
+    def _reference_at(self, text: str, start: int, end: int) -> Tuple[ReferenceNode, int]:
+        """1つの参照とその終了位置"""
+        match = _REFERENCE.match(text, start, end)
+        node_end = match.end()
+        meta = _TRAILING_META.match(text, node_end, end)
+        meta_comment = self._meta(meta)
+        ref_type = "ref"
+        if meta_comment is not None and meta_comment.comment_type == 'ref':
+            ref_type = meta_comment.subtype if meta_comment.subtype in ('ref', 'eqref', 'cite') else "ref"
+        node_type = {'ref': NodeType.REF, 'eqref': NodeType.EQREF, 'cite': NodeType.CITE}[ref_type]
+        node = ReferenceNode(node_type=node_type, ref_type=ref_type, target=match.group(1),
+                             supplement=meta_comment.supplement if meta_comment is not None else None)
+        if meta is not None:
+            node.meta_comment = meta.group(1)
+            node_end = meta.end()
+        return node, node_end
+
+    def _theorem(self, text: str, match: 're.Match', end: int) -> Optional[TheoremNode]:
+        """`#lemma(title: "...", id: "...")[...] //[Lemma]`"""
+        function = match.group('function')
+        pos = match.end()
+        arguments = {}
+        if text.startswith('(', pos):
+            close = self._closing(_PAREN_TOKEN, text, pos + 1, end)
+            if close == -1:
+                self._unclosed_at(text, match.start(), f"Unclosed arguments of #{function}")
+                return None
+            arguments = dict(_ARGUMENT.findall(text, pos + 1, close))
+            pos = close + 1
+        if not text.startswith('[', pos):
+            return None
+        close = self._closing(_BRACKET_TOKEN, text, pos + 1, end)
+        if close == -1:
+            self._unclosed_at(text, match.start(), f"Unclosed #{function}")
+            return None
+
+        node_end = close + 1
+        meta = _TRAILING_META.match(text, node_end, end)
+        meta_comment = self._meta(meta)
+        node = TheoremNode(
+            node_type=THEOREM_FUNCTIONS[function],
+            theorem_type=meta_comment.comment_type if meta_comment is not None else function,
+            title=arguments.get('title', ""),
+            label=arguments.get('id', ""),
+            content=text[pos + 1:close].strip()
+        )
+        node.children = list(self._blocks(text, pos + 1, close))
+        if meta is not None:
+            node.meta_comment = meta.group(1)
+            node_end = meta.end()
+        return self._at(node, match.start(), node_end)
+
+    # 閉じの検索
+
+    def _math_end(self, text: str, pos: int, end: int) -> int:
+        """数式を閉じる $ の位置（なければ-1）"""
+        while True:
+            token = _MATH_TOKEN.search(text, pos, end)
+            if token is None:
+                return -1
+            if token.group('close'):
+                return token.start()
+            pos = token.end()
+
+    def _closing(self, pattern: 're.Pattern', text: str, pos: int, end: int) -> int:
+        """開き括弧の直後posから、対応する閉じ括弧の位置（なければ-1）"""
+        depth = 0
+        while True:
+            token = pattern.search(text, pos, end)
+            if token is None:
+                return -1
+            pos = token.end()
+            if token.groupdict().get('math'):
+                close = self._math_end(text, pos, end)
+                if close == -1:
+                    return -1
+                pos = close + 1
+            elif token.group('open'):
+                depth += 1
+            elif token.group('close'):
+                if depth == 0:
+                    return token.start()
+                depth -= 1
+
+    # 補助
+
+    @staticmethod
+    def _at(node: ASTNode, start: int, end: int) -> ASTNode:
+        node.set_attribute('span', (start, end))
+        return node
+
+    @staticmethod
+    def _meta(match: Optional['re.Match']) -> Optional[MetaComment]:
+        return meta_comment_parser.parse_meta_comment(match.group(1)) if match else None
+
+    @staticmethod
+    def _line_end(text: str, pos: int, end: int) -> int:
+        line_end = text.find('\n', pos, end)
+        return end if line_end == -1 else line_end
+
+    def _unclosed_at(self, text: str, pos: int, message: str) -> None:
+        self._unclosed.append(pos)
+        line = text.count('\n', 0, pos) + 1
+        self.problems.append(f"{message} at line {line}")
+
+
+# グローバルインスタンス
+typst_parser = TypstParser()
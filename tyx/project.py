@@ -0,0 +1,201 @@
+"""
+プロジェクト変換
+
+複数の.texファイルからなるプロジェクトをまとめてTypstに変換する。
+ラベル索引を出力先に保存し、再実行時は変更されたファイルのみを再索引する。
+"""
+
+import os
+import re
+from typing import Dict, List, Optional, Set, Tuple
+
+from .converter import Converter
+from .options import ConverterOptions
+from .parser.handlers import HandlerRegistry
+from .parser.source import TeXSource
+from .utils.bibtex import BibIndex, bibliography_file, cited_bibliography_name
+from .utils.labels import LabelIndex
+from .utils.meta_comments import meta_sidecar
+from .utils.output import OutputWriter
+
+
+# \bibliography{a,b}（行頭の % でコメントアウトされたものは対象外）
+_BIBLIOGRAPHY = re.compile(r'[ \t]*\\bibliography\{([^}]*)\}')
+
+
+class TeXProject:
+    """複数ファイルからなるTeXプロジェクト"""
+
+    INDEX_FILENAME = ".tyx-labels.json"
+    # 前回の変換に使った設定の指紋（変わった場合は全ファイルを再変換）
+    OPTIONS_FILENAME = ".tyx-options"
+    # .bibファイルのエントリ位置の索引
+    BIB_INDEX_FILENAME = ".tyx-bib.json"
+    # 出力ファイルのブロックのハッシュ（内容が変わらないファイルは書き込まない）
+    OUTPUT_MANIFEST_FILENAME = ".tyx-outputs.json"
+
+    def __init__(self, source_files: List[str], output_dir: str, meta_mode: str = "inline",
+                 options: Optional[ConverterOptions] = None, handlers: Optional[HandlerRegistry] = None):
+        self.source_files = [os.path.normpath(path) for path in source_files]
+        self.output_dir = output_dir
+        # meta_mode="sidecar" の場合、メタコメントは .typ.tyxmeta に書き出す
+        self.converter = Converter(options or ConverterOptions(meta_mode=meta_mode), handlers)
+        self.label_index: Optional[LabelIndex] = None
+        # 直前のbuild()で再変換されたファイル
+        self.converted_files: List[str] = []
+        # 直前のbuild()で実際に書き込んだ出力ファイル（内容が同じファイルはmtimeも変えない）
+        self.written_files: List[str] = []
+        # ファイルごとの継続可能な問題（Problems ログ）
+        self.problems: Dict[str, List[str]] = {}
+        # 直前のbuild()で書き出した.bibファイルと、どの.bibファイルにもない引用キー
+        self.bibliography_files: List[str] = []
+        self.undefined_citations: Set[str] = set()
+
+    @property
+    def index_path(self) -> str:
+        """ラベル索引ファイルのパス"""
+        return os.path.join(self.output_dir, self.INDEX_FILENAME)
+
+    def output_path(self, source_file: str) -> str:
+        """ソースファイルに対応する出力パス"""
+        name = os.path.splitext(os.path.basename(source_file))[0] + ".typ"
+        return os.path.join(self.output_dir, name)
+
+    def build(self, validate: bool = True) -> LabelIndex:
+        """変更されたファイルを変換し、ラベル索引を更新
+
+        validateが真の場合、未解決の参照があればUnresolvedReferenceErrorを送出する。
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        index = LabelIndex.load(self.index_path)
+        index.retain_files(self.source_files)
+        self.converted_files = []
+        self.written_files = []
+        self.problems = {}
+        writer = OutputWriter(os.path.join(self.output_dir, self.OUTPUT_MANIFEST_FILENAME))
+        context = self.converter.context()
+        options_path = os.path.join(self.output_dir, self.OPTIONS_FILENAME)
+        options_changed = self._read_text(options_path) != self.converter.fingerprint
+
+        # .bibファイルのパス → 参照するソースファイル・出力先のファイル名
+        bibliographies: Dict[str, List[str]] = {}
+        bibliography_names: Dict[str, str] = {}
+        for source_file in self.source_files:
+            # 入力はメモリマップし、変換が必要な場合だけ復号する
+            with TeXSource.open(source_file) as source:
+                digest = source.content_hash()
+                for path, name in self._bibliography_paths(source, source_file):
+                    bibliographies.setdefault(path, []).append(source_file)
+                    bibliography_names.setdefault(path, name)
+                output_path = self.output_path(source_file)
+                if not options_changed and index.is_file_current(source_file, digest) \
+                        and os.path.exists(output_path):
+                    # 再変換しないファイルは前回の変換時の問題を報告する
+                    problems = index.get_problems(source_file)
+                    if problems:
+                        self.problems[source_file] = problems
+                    continue
+
+                index.begin_file(source_file, digest)
+                result = context.convert(source, label_index=index, file_path=source_file)
+            index.set_problems(source_file, result.problems)
+            if result.problems:
+                self.problems[source_file] = list(result.problems)
+            if writer.write(output_path, result.typst).written:
+                self.written_files.append(output_path)
+            if self.converter.options.meta_mode == "sidecar":
+                sidecar_path = meta_sidecar.sidecar_path(output_path)
+                if meta_sidecar.save(sidecar_path, result.meta_entries):
+                    self.written_files.append(sidecar_path)
+            self.converted_files.append(source_file)
+
+        index.save(self.index_path)
+        self._write_bibliographies(index, bibliographies, bibliography_names, writer)
+        writer.save()
+        if options_changed:
+            with open(options_path, 'w', encoding='utf-8') as f:
+                f.write(self.converter.fingerprint)
+        self.label_index = index
+        if validate:
+            index.validate()
+        return index
+
+    @staticmethod
+    def _bibliography_paths(source: TeXSource, source_file: str) -> List[Tuple[str, str]]:
+        """\\bibliography{...} が指す.bibファイルのパスと出力先のファイル名（コメントアウトされた行は除く）"""
+        paths = []
+        for line in source.lines_containing(b'\\bibliography{'):
+            match = _BIBLIOGRAPHY.match(line)
+            if match:
+                paths.extend((bibliography_file(name.strip(), os.path.dirname(source_file)),
+                              cited_bibliography_name(name.strip()))
+                             for name in match.group(1).split(',') if name.strip())
+        return paths
+
+    def _write_bibliographies(self, index: LabelIndex, bibliographies: Dict[str, List[str]],
+                              names: Dict[str, str], writer: OutputWriter) -> None:
+        """引用されたエントリだけを含む.bibを出力先に書き出し、引用キーを検証
+
+        入力の.bib・.texを上書きする書き出しと、別の.bibと同じ出力先への書き出しは行わない。
+        """
+        bib_index = BibIndex.load(os.path.join(self.output_dir, self.BIB_INDEX_FILENAME))
+        bib_index.retain_files(bibliographies)
+        self.bibliography_files = []
+        bib_files = []
+        missing = False
+        inputs = {os.path.realpath(path) for path in [*bibliographies, *self.source_files]}
+        written: Dict[str, str] = {}  # 出力先 → 書き出した.bibファイル
+        for path, source_files in bibliographies.items():
+            try:
+                bib_file = bib_index.get(path)
+            except OSError:
+                for source_file in source_files:
+                    self.problems.setdefault(source_file, []).append(f"Bibliography file not found: {path}")
+                missing = True
+                continue
+            bib_files.append(bib_file)
+            for problem in bib_file.problems:
+                self.problems.setdefault(source_files[0], []).append(problem)
+            output_path = os.path.join(self.output_dir, names[path])
+            if os.path.realpath(output_path) in inputs:
+                self.problems.setdefault(source_files[0], []).append(
+                    f"Bibliography output {output_path} would overwrite an input file; not written")
+                continue
+            if output_path in written:
+                self.problems.setdefault(source_files[0], []).append(
+                    f"Bibliography files {written[output_path]} and {path} map to the same output "
+                    f"{output_path}; only the first is written")
+                continue
+            written[output_path] = path
+            if writer.write(output_path, bib_file.extract(index.citations)).written:
+                self.written_files.append(output_path)
+            self.bibliography_files.append(output_path)
+
+        # 引用キーの検証（.bibファイルがすべて読めた場合のみ、索引のキーとの1回の集合演算）
+        # 読めないファイルがある場合はそのファイルの不在だけを報告する
+        self.undefined_citations = BibIndex.undefined_keys(index.citations.keys(), bib_files) \
+            if bibliographies and not missing else set()
+        for key in sorted(self.undefined_citations):
+            for source_file in sorted({file_path for file_path, _ in index.citations[key]}):
+                self.problems.setdefault(source_file, []).append(
+                    f"Citation key '{key}' is not in any bibliography file")
+        if bibliographies:
+            bib_index.save(os.path.join(self.output_dir, self.BIB_INDEX_FILENAME))
+
+    @staticmethod
+    def _read_text(path: str) -> Optional[str]:
+        """ファイルがあれば内容を読み込み"""
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read().strip()
+
+    def report(self) -> Dict[str, List[str]]:
+        """未定義参照・未使用ラベル・重複ラベルの一覧"""
+        index = self.label_index or LabelIndex.load(self.index_path)
+        return {
+            'undefined': sorted(index.get_undefined_references()),
+            'unused': sorted(index.get_unused_labels()),
+            'conflicts': sorted(index.get_conflicts()),
+            'undefined_citations': sorted(self.undefined_citations),
+        }
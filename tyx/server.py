@@ -0,0 +1,345 @@
+"""
+常駐変換サービス
+
+asyncioでUnixソケットまたはlocalhostのHTTPを待ち受け、
+初期化済みのワーカープールに変換要求を振り分ける。
+要求はキューで順番待ちし、キューが満杯の場合は即座に拒否する（バックプレッシャー）。
+各要求には締め切りを設け、超過した要求はタイムアウトとして応答する。
+"""
+
+import asyncio
+import json
+import os
+import stat
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from .converter import Converter
+from .options import ConverterOptions
+
+
+# 変換方向（Typst→TeXの逆変換は変換器がないため受け付けない）
+DIRECTIONS = ("tex2typst",)
+
+# HTTPステータスの説明
+HTTP_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+    504: "Gateway Timeout",
+}
+
+
+def _content_length(headers: Dict[str, str]) -> Optional[int]:
+    """Content-Lengthの値（ヘッダーがなければ0、数字の列でなければNone）"""
+    value = headers.get('content-length', '0')
+    if not (value.isascii() and value.isdigit()):
+        return None
+    return int(value)
+
+
+def _remove_socket(path: str) -> None:
+    """Unixソケットを削除（存在しなければ何もしない、ソケット以外のファイルは FileExistsError）"""
+    try:
+        mode = os.stat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise FileExistsError(f"{path} exists and is not a socket")
+    os.unlink(path)
+
+
+# ワーカープロセス内の変換器（プロセス起動時に1回だけ初期化）
+_worker_converter: Optional[Converter] = None
+
+
+def _init_worker(options: Optional[ConverterOptions] = None) -> None:
+    """ワーカープロセスの初期化"""
+    global _worker_converter
+    _worker_converter = Converter(options)
+
+
+def _convert(direction: str, source: str) -> Tuple[str, List[str]]:
+    """ワーカープロセスで変換を実行"""
+    if _worker_converter is None:
+        _init_worker()
+    result = _worker_converter.convert(source)
+    return result.typst, result.problems
+
+
+def _warm_up(_: int) -> int:
+    """ワーカーの暖機（小さな文書を1回変換）"""
+    _convert("tex2typst", "\\begin{document}\n$x$\n\\end{document}\n")
+    return os.getpid()
+
+
+class ServiceError(Exception):
+    """HTTPステータス付きの要求エラー"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+@dataclass
+class ConversionJob:
+    """キューで待機中の変換要求"""
+    direction: str
+    source: str
+    deadline: float  # loop.time()基準の締め切り
+    future: asyncio.Future = field(repr=False)
+
+
+class ConversionService:
+    """ワーカープール・要求キュー・締め切りを管理する変換サービス"""
+
+    def __init__(self, workers: int = 0, queue_size: int = 64, timeout: float = 10.0,
+                 max_payload: int = 16 * 1024 * 1024, options: Optional[ConverterOptions] = None):
+        self.workers = workers or max(1, (os.cpu_count() or 1) - 1)
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.max_payload = max_payload
+        self.options = options or ConverterOptions()
+        self.stats = {'completed': 0, 'failed': 0, 'rejected': 0, 'timed_out': 0}
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._dispatchers: List[asyncio.Task] = []
+
+    async def start(self) -> None:
+        """ワーカープールを起動して暖機"""
+        loop = asyncio.get_running_loop()
+        self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                             initargs=(self.options,))
+        await asyncio.gather(*(
+            loop.run_in_executor(self._executor, _warm_up, i) for i in range(self.workers)
+        ))
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._dispatchers = [loop.create_task(self._dispatch()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        """ワーカープールを停止"""
+        for task in self._dispatchers:
+            task.cancel()
+        await asyncio.gather(*self._dispatchers, return_exceptions=True)
+        self._dispatchers = []
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    async def convert(self, direction: str, source: str,
+                      timeout: Optional[float] = None) -> Tuple[str, List[str]]:
+        """変換要求をキューに入れ、結果を待つ"""
+        if direction not in DIRECTIONS:
+            raise ServiceError(400, f"unsupported direction: {direction} (supported: {', '.join(DIRECTIONS)})")
+        if self._queue is None:
+            raise ServiceError(503, "service is not running")
+
+        loop = asyncio.get_running_loop()
+        job = ConversionJob(direction, source, loop.time() + (timeout or self.timeout),
+                            loop.create_future())
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.stats['rejected'] += 1
+            raise ServiceError(503, "conversion queue is full")
+        return await job.future
+
+    async def _dispatch(self) -> None:
+        """キューから要求を取り出し、空いているワーカーで変換"""
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self._queue.get()
+            try:
+                remaining = job.deadline - loop.time()
+                if job.future.done():
+                    # 待機中にクライアントが切断
+                    continue
+                if remaining <= 0:
+                    self.stats['timed_out'] += 1
+                    job.future.set_exception(ServiceError(504, "deadline exceeded while queued"))
+                    continue
+
+                future = loop.run_in_executor(self._executor, _convert, job.direction, job.source)
+                done, _ = await asyncio.wait({future}, timeout=remaining)
+                if not done:
+                    self.stats['timed_out'] += 1
+                    if not job.future.done():
+                        job.future.set_exception(ServiceError(504, "deadline exceeded"))
+                    # 実行中の変換は中断できないため、ワーカーが空くまで次の要求を取らない
+                    await asyncio.wait({future})
+                    future.exception()
+                    continue
+                if job.future.done():
+                    continue
+                error = future.exception()
+                if error is None:
+                    self.stats['completed'] += 1
+                    job.future.set_result(future.result())
+                else:
+                    self.stats['failed'] += 1
+                    job.future.set_exception(ServiceError(500, f"{type(error).__name__}: {error}"))
+            finally:
+                self._queue.task_done()
+
+    def status(self) -> Dict[str, Any]:
+        """稼働状況"""
+        return {
+            'workers': self.workers,
+            'options': self.options.fingerprint,
+            'queued': self._queue.qsize() if self._queue is not None else 0,
+            'queue_size': self.queue_size,
+            **self.stats,
+        }
+
+    async def handle_request(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """JSON要求を処理して応答を返す
+
+        要求: {"direction": "tex2typst", "source": "...", "timeout": 秒（省略可）}
+        """
+        try:
+            source = request.get('source')
+            if not isinstance(source, str):
+                raise ServiceError(400, "'source' must be a string")
+            timeout = request.get('timeout')
+            if timeout is not None and (not isinstance(timeout, (int, float)) or timeout <= 0):
+                raise ServiceError(400, "'timeout' must be a positive number")
+            output, problems = await self.convert(request.get('direction', 'tex2typst'),
+                                                  source, timeout)
+        except ServiceError as e:
+            return {'ok': False, 'status': e.status, 'error': str(e)}
+        return {'ok': True, 'status': 200, 'output': output, 'problems': problems}
+
+    async def serve_unix(self, path: str) -> asyncio.AbstractServer:
+        """Unixソケットで待ち受け（1行1要求のJSON）
+
+        前回のソケットが残っていれば削除する。ソケット以外のファイルがある場合は削除せずに FileExistsError。
+        """
+        _remove_socket(path)
+        server = await asyncio.start_unix_server(self._handle_lines, path=path,
+                                                 limit=self.max_payload)
+        os.chmod(path, 0o600)
+        return server
+
+    async def serve_http(self, host: str = "127.0.0.1", port: int = 8765) -> asyncio.AbstractServer:
+        """localhostのHTTPで待ち受け（POST /convert, GET /status）"""
+        return await asyncio.start_server(self._handle_http, host=host, port=port)
+
+    async def _handle_lines(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """1行1要求のJSONプロトコル"""
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except (asyncio.LimitOverrunError, ValueError):
+                    response = {'ok': False, 'status': 413, 'error': "payload too large"}
+                    writer.write(json.dumps(response).encode('utf-8') + b'\n')
+                    break
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError("request must be an object")
+                except ValueError as e:
+                    response = {'ok': False, 'status': 400, 'error': f"invalid JSON: {e}"}
+                else:
+                    response = await self.handle_request(request)
+                writer.write(json.dumps(response, ensure_ascii=False).encode('utf-8') + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _handle_http(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """最小限のHTTP/1.1（Content-Length付きの要求のみ、keep-alive対応）"""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                parts = request_line.decode('latin-1').split()
+                headers = {}
+                while True:
+                    header = await reader.readline()
+                    if header in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = header.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                # 本文の長さが読めない要求の後は、次の要求の始まりが分からないため接続を閉じる
+                keep_alive = (headers.get('connection', '').lower() != 'close'
+                              and _content_length(headers) is not None)
+
+                status, body = await self._route_http(parts, headers, reader)
+                payload = json.dumps(body, ensure_ascii=False).encode('utf-8')
+                writer.write(
+                    f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}\r\n"
+                    f"Content-Type: application/json; charset=utf-8\r\n"
+                    f"Content-Length: {len(payload)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode('latin-1')
+                    + payload
+                )
+                await writer.drain()
+                if not keep_alive or status == 413:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _route_http(self, parts: List[str], headers: Dict[str, str],
+                          reader: asyncio.StreamReader) -> Tuple[int, Dict[str, Any]]:
+        """HTTP要求を振り分け"""
+        if len(parts) != 3:
+            return 400, {'ok': False, 'status': 400, 'error': "malformed request line"}
+        method, path, _ = parts
+        length = _content_length(headers)
+        if length is None:
+            return 400, {'ok': False, 'status': 400, 'error': "invalid Content-Length"}
+        if length > self.max_payload:
+            return 413, {'ok': False, 'status': 413, 'error': "payload too large"}
+        body = await reader.readexactly(length) if length else b''
+
+        if path == '/status':
+            return 200, {'ok': True, 'status': 200, **self.status()}
+        if path != '/convert':
+            return 404, {'ok': False, 'status': 404, 'error': f"no route for {path}"}
+        if method != 'POST':
+            return 405, {'ok': False, 'status': 405, 'error': "use POST"}
+        try:
+            request = json.loads(body)
+            if not isinstance(request, dict):
+                raise ValueError("request must be an object")
+        except ValueError as e:
+            return 400, {'ok': False, 'status': 400, 'error': f"invalid JSON: {e}"}
+        response = await self.handle_request(request)
+        return response['status'], response
+
+
+async def run_service(service: ConversionService, unix_path: Optional[str] = None,
+                      host: str = "127.0.0.1", port: Optional[int] = None,
+                      ready: Optional[asyncio.Event] = None) -> None:
+    """サービスを起動し、キャンセルされるまで待ち受け"""
+    await service.start()
+    servers = []
+    listening = False  # Unixソケットを作成したか（作成前の失敗では既存のファイルに触れない）
+    try:
+        if unix_path:
+            servers.append(await service.serve_unix(unix_path))
+            listening = True
+        if port is not None:
+            servers.append(await service.serve_http(host, port))
+        if ready is not None:
+            ready.set()
+        await asyncio.gather(*(server.serve_forever() for server in servers))
+    finally:
+        for server in servers:
+            server.close()
+        await service.stop()
+        if listening:
+            _remove_socket(unix_path)
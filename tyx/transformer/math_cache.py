@@ -0,0 +1,111 @@
+"""
+数式変換のキャッシュ
+
+解析の論文では同じ数式（`$u$`、`$\\|u\\|_{L^2}$`、`$t>0$` など）が何百回も現れる。
+数式の種類と本文（記号は前処理で正規化済み）をキーに変換結果を上限付きのLRUで保持し、
+同じ数式は文書の中でも文書をまたいでも1回だけ書き換えパスを通す。
+キャッシュは Converter が1つ持ち、その変換器で変換するすべての文書（スレッドを含む）で共有する。
+本文は空白を正規化してから変換するため、空白だけが違う数式は同じキーになる。
+変換結果は設定と正規化した本文だけで決まるため、キャッシュの有無で出力は変わらない。
+"""
+
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Hashable, Tuple
+
+
+# 変換器ごとに保持する数式の数の既定値
+DEFAULT_MATH_CACHE_SIZE = 4096
+
+# 行の途中の連続する空白（行頭の字下げと \\ の直後は除く）と行末の空白
+_SPACE_RUN = re.compile(r'(?<=[^\s\\]) {2,}(?=\S)')
+_TRAILING_SPACE = re.compile(r'(?<=[^\s\\])[ \t]+(?=\n)')
+# 空白が文字列の一部になる数式（\\mathrm・\\operatorname は "..." に変換される）
+_STRING_SOURCE = re.compile(r'"|\\mathrm|\\operatorname')
+
+
+def normalize_math(source: str) -> str:
+    """数式の本文の空白を正規化（行の途中の連続する空白は1つに、行末の空白は除く）
+
+    Typstの数式では意味を持たない違いだけをまとめる。文字列になる部分を含む本文はそのまま。
+    """
+    if '  ' not in source and ' \n' not in source and '\t\n' not in source:
+        return source
+    if _STRING_SOURCE.search(source):
+        return source
+    return _TRAILING_SPACE.sub('', _SPACE_RUN.sub(' ', source))
+
+
+@dataclass
+class CacheStatistics:
+    """キャッシュの命中・失敗・追い出しの回数"""
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+    @property
+    def lookups(self) -> int:
+        return self.hits + self.misses
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / self.lookups if self.lookups else 0.0
+
+    def reset(self) -> None:
+        self.hits = self.misses = self.evictions = 0
+
+    def summary(self) -> str:
+        return (f"math cache: {self.hits} hits, {self.misses} misses ({self.hit_rate:.0%} hit rate), "
+                f"{self.evictions} evictions")
+
+
+class MathCache:
+    """(数式の種類, 本文) → 変換結果 のLRU（本文は文字列または子ノードの内容のタプル）
+
+    本文は normalize_math で正規化してから引き、変換にも正規化した本文を渡す。
+    maxsizeが0の場合は保持せず、毎回変換する。複数スレッドから共有できる。
+    """
+
+    def __init__(self, maxsize: int = DEFAULT_MATH_CACHE_SIZE):
+        if maxsize < 0:
+            raise ValueError(f"maxsize must not be negative: {maxsize!r}")
+        self.maxsize = maxsize
+        self.stats = CacheStatistics()
+        self._entries: 'OrderedDict[Tuple[str, Hashable], str]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def convert(self, kind: str, source: Hashable, converter: Callable[[Any], str]) -> str:
+        """キャッシュにあれば変換結果を返し、なければconverter(正規化した本文)で変換して保持"""
+        if isinstance(source, str):
+            source = normalize_math(source)
+        elif isinstance(source, tuple):
+            source = tuple(normalize_math(part) for part in source)
+        if not self.maxsize:
+            return converter(source)
+        key = (kind, source)
+        entries = self._entries
+        with self._lock:
+            result = entries.get(key)
+            if result is not None:
+                entries.move_to_end(key)
+                self.stats.hits += 1
+                return result
+            self.stats.misses += 1
+
+        # 変換はロックの外で行う（同じ数式を同時に変換しても結果は同じ）
+        result = converter(source)
+        with self._lock:
+            entries[key] = result
+            if len(entries) > self.maxsize:
+                entries.popitem(last=False)
+                self.stats.evictions += 1
+        return result
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,380 @@
+"""
+数式の書き換えパス
+
+TeXToTypstTransformer._transform_math_content の
+書き換えを、従来と同じ順序のパスの列として定義する。
+"""
+
+import re
+from functools import lru_cache
+from typing import List, Tuple
+
+from ..utils.patterns import patterns
+from .passes import PassManager, RewritePass, function_pass, regex_pass
+
+
+# 変数分離で分離しない予約関数名
+RESERVED_FUNCTIONS = ['sin', 'cos', 'tan', 'cot', 'sec', 'csc', 'arcsin', 'arccos', 'arctan',
+                      'sinh', 'cosh', 'tanh', 'coth', 'sech', 'csch', 'log', 'ln', 'exp',
+                      'max', 'min', 'sup', 'inf', 'lim', 'limsup', 'liminf', 'gcd', 'lcm',
+                      'det', 'rank', 'trace', 'dim', 'ker', 'im', 'span', 'norm', 'abs', 'cases',
+                      'command', 'type', 'if', 'then', 'else', 'and', 'or', 'not', 'quad', 'FUNC']
+
+_INT_SUB_OPEN_PATTERN = re.compile(r'∫_([^{}]+)')
+_TAB_SPACE_PATTERN = re.compile(r'\t +')
+# 変数分離の対象（ASCII英字、または英字を含まないメタコメント）
+_LETTER_OR_COMMENT = re.compile(r'[a-zA-Z]|//\[')
+# 変数分離の間に数式中の文字列を保護するプレースホルダー
+_STRING_PLACEHOLDER = '\x00'
+_STRING_RESTORE = re.compile(r'\x00(\d+)\x00')
+
+
+def _integral_dot_double(content: str) -> str:
+    """∫_{ℂ dot.double(f) を ∫_(ℂ) dot.double(f) に変換"""
+    if '∫_{' in content and 'dot.double(' in content:
+        # ∫_{ から dot.double( の前までを () で囲む
+        start = content.find('∫_{')
+        dot_start = content.find('dot.double(')
+        if start != -1 and dot_start != -1 and dot_start > start:
+            inner_content = content[start+3:dot_start-1]  # 空白を除く
+            content = content[:start+2] + '(' + inner_content + ') ' + content[dot_start:]
+    return content
+
+
+def _integral_subscript_braces(content: str) -> str:
+    """積分記号の下付き文字の {} を () に変換（特別な処理の後は除外）"""
+    if '∫_{' not in content or 'dot.double(' not in content:
+        content = patterns['math.int.subscript'].sub(r'∫_(\1)', content)
+    return content
+
+
+def _integral_subscript_open(content: str) -> str:
+    """∫_(ℂ) dot.double(f) の状態以外で下付き文字を () で囲む"""
+    if not (content.count('∫_(') == 1 and 'dot.double(' in content):
+        content = _INT_SUB_OPEN_PATTERN.sub(r'∫_(\1)', content)
+    return content
+
+
+def _find_norm_end(text: str, start_pos: int) -> int:
+    """ノルム記号の終了位置を検索（括弧のバランスを考慮）"""
+    pos = start_pos + 2  # \| の後
+    brace_count = 0
+    in_subscript = False
+
+    while pos < len(text):
+        if text[pos:pos+2] == '\\|' and brace_count == 0:
+            # ノルム記号の終了を発見
+            pos += 2
+            # 下付き文字の開始を検索
+            while pos < len(text) and text[pos] in ' \t':
+                pos += 1
+            if pos < len(text) and text[pos] == '_':
+                pos += 1
+                while pos < len(text) and text[pos] in ' \t':
+                    pos += 1
+                if pos < len(text) and text[pos] == '{':
+                    pos += 1
+                    brace_count = 1
+                    in_subscript = True
+                    while pos < len(text) and brace_count > 0:
+                        if text[pos] == '{':
+                            brace_count += 1
+                        elif text[pos] == '}':
+                            brace_count -= 1
+                        pos += 1
+                    return pos
+            return pos
+        elif text[pos] == '{' and not in_subscript:
+            brace_count += 1
+        elif text[pos] == '}' and not in_subscript:
+            brace_count -= 1
+        pos += 1
+
+    return -1
+
+
+def _norm_balanced(text: str) -> str:
+    """\\| ... \\|_{...} を norm(...)_(...) に変換（括弧バランス考慮）"""
+    # 変換が起こらなくなるまで繰り返す
+    prev_text = ""
+    current_text = text
+
+    while prev_text != current_text:
+        prev_text = current_text
+
+        # ノルム記号の開始位置を検索
+        start_pos = current_text.find('\\|')
+        if start_pos == -1:
+            break
+
+        # ノルム記号の終了位置を検索（括弧のバランスを考慮）
+        norm_end = _find_norm_end(current_text, start_pos)
+        if norm_end == -1:
+            break
+
+        # \| ... \|_{...} のパターンを解析
+        norm_match = patterns['math.norm'].match(current_text[start_pos:norm_end])
+        if norm_match:
+            inner = norm_match.group(1).strip()
+            subscript = norm_match.group(2).strip()
+            replacement = f'norm({inner})_({subscript})'
+            current_text = current_text[:start_pos] + replacement + current_text[norm_end:]
+
+    return current_text
+
+
+def _integral_subscript_to_last_brace(content: str) -> str:
+    """∫_{ から最後の } までを () に変換"""
+    if '∫_{' in content:
+        start = content.find('∫_{')
+        if start != -1:
+            # 最後の } を見つける
+            end = content.rfind('}')
+            if end != -1 and end > start:
+                inner_content = content[start+3:end]
+                content = content[:start+2] + '(' + inner_content + ')' + content[end+1:]
+            else:
+                # } がない場合は、∫_{ の後のすべてを () で囲む
+                inner_content = content[start+3:]
+                content = content[:start+2] + '(' + inner_content + ')'
+    return content
+
+
+def normalize_tab_spaces(content: str) -> str:
+    """タブ+スペースをタブに正規化（タブに続く空白をまとめて1回で除去）"""
+    return _TAB_SPACE_PATTERN.sub('\t', content)
+
+
+def separate_variables(content: str) -> str:
+    """変数の空白分離：予約関数名以外の連続するアルファベットを空白で分離"""
+    # コマンド内のテキストを保護してから変数分離を実行
+    # \mathrm{...}, \mathbf{...} などのコマンド内のテキストを一時的に置換
+    command_placeholders = {}
+    placeholder_counter = 0
+
+    def protect_command_content(match):
+        nonlocal placeholder_counter
+        placeholder = f"__CMD_{placeholder_counter}__"
+        command_placeholders[placeholder] = match.group(0)
+        placeholder_counter += 1
+        return placeholder
+
+    content = patterns['math.protect.command'].sub(protect_command_content, content)
+
+    # 連続するアルファベットを空白で分離（予約関数名は除く）
+    def separate(match):
+        text = match.group(0)
+        # プレースホルダーは変数分離しない
+        if text.startswith('__CMD_') or text.startswith('__FUNC_') or text.startswith('__COMMENT_'):
+            return text
+        # 改行文字を含む場合は、改行文字を除いてチェック
+        clean_text = text.replace('\n', '').replace('\r', '')
+        if clean_text in RESERVED_FUNCTIONS:
+            return text
+        return ' '.join(text)
+
+    # コメント部分を保護してから変数分離
+    comment_placeholders = {}
+    comment_counter = 0
+
+    def protect_comment(match):
+        nonlocal comment_counter
+        placeholder = f"__COMMENT_{comment_counter}__"
+        comment_placeholders[placeholder] = match.group(0)
+        comment_counter += 1
+        return placeholder
+
+    # //[...] 形式のコメントを保護
+    content = patterns['math.protect.comment'].sub(protect_comment, content)
+
+    # "..." 形式の文字列（\mathrm・\operatorname の変換結果）を保護（英字を含まないプレースホルダー）
+    strings = []
+
+    def protect_string(match):
+        strings.append(match.group(0))
+        return f"{_STRING_PLACEHOLDER}{len(strings) - 1}{_STRING_PLACEHOLDER}"
+
+    if '"' in content:
+        content = patterns['math.string'].sub(protect_string, content)
+
+    # cases(, sin(, cos( などの関数呼び出しパターンを保護（従来どおり6回適用）
+    for _ in range(6):
+        content = patterns['math.protect.function'].sub(r'__FUNC_\1__(', content)
+
+    # 通常の変数分離（プレースホルダーと関数呼び出しパターンを除外）
+    def enhanced_separate(match):
+        text = match.group(0)
+        # __で囲まれたプレースホルダーは分離しない
+        if text.startswith('__') and text.endswith('__'):
+            return text
+        return separate(match)
+
+    content = re.sub(r'[a-zA-Z]{2,}(?!\()', enhanced_separate, content)
+
+    # 関数呼び出しパターンと変数分離された関数名を元に戻す（従来どおり6回適用）
+    for _ in range(6):
+        content = re.sub(r'__FUNC_([a-zA-Z\s]+)__\(', lambda m: m.group(1).replace(' ', '') + '(', content)
+
+    # 保護した文字列を元に戻す
+    if strings:
+        content = _STRING_RESTORE.sub(lambda match: strings[int(match.group(1))], content)
+
+    # 保護したコメントを元に戻す
+    for placeholder, original in comment_placeholders.items():
+        content = content.replace(placeholder, original)
+
+    # 保護したコマンドを元に戻す
+    for placeholder, original in command_placeholders.items():
+        content = content.replace(placeholder, original)
+
+    return content
+
+
+def _operatorname(match: 're.Match') -> str:
+    """\\operatorname{name} を op("name") に（\\operatorname* は添字を上下に置く limits(...) で囲む）"""
+    name = match.group(2).strip().replace('\\', '\\\\').replace('"', '\\"')
+    return f'limits(op("{name}"))' if match.group(1) else f'op("{name}")'
+
+
+def operatorname_pass(name: str) -> RewritePass:
+    """\\operatorname の変換（数式のパスとインライン数式のテキストの子ノードのパスで共有）"""
+    return regex_pass(name, patterns['command.operatorname'], _operatorname, '\\operatorname')
+
+
+def _accent_passes(accents: Tuple[Tuple[str, str], ...], prefix: str) -> List[RewritePass]:
+    """数式アクセントの変換"""
+    return [regex_pass(f"{prefix}.{tex_accent}", patterns.command(tex_accent),
+                       typst_accent + r'(\1)', '\\' + tex_accent + '{')
+            for tex_accent, typst_accent in accents]
+
+
+def _delimiter_passes(open_command: str, close_command: str) -> List[RewritePass]:
+    """\\bigg( や \\left( \\right) などの区切り記号の変換"""
+    passes = []
+    for opening, closing in ('()', '[]', '{}'):
+        passes.append(regex_pass(f"{open_command}{opening}", r'\\' + open_command + re.escape(opening),
+                                 opening + ' //[command type:' + open_command + ']\n\t',
+                                 '\\' + open_command + opening))
+        passes.append(regex_pass(f"{close_command}{closing}", r'\\' + close_command + re.escape(closing),
+                                 closing + ' //[command type:' + close_command + ']\n',
+                                 '\\' + close_command + closing))
+    return passes
+
+
+@lru_cache(maxsize=None)
+def math_pass_manager(accents: Tuple[Tuple[str, str], ...], functions: Tuple[Tuple[str, str], ...],
+                      split_variables: bool = True) -> PassManager:
+    """数式内容の書き換えパス（表と設定ごとに1回だけ作成）"""
+    passes: List[RewritePass] = []
+
+    # 数式アクセントの変換（最初に実行）
+    passes += _accent_passes(accents, "accent")
+
+    # 残存する積分記号のみ処理（その他の演算子は前処理で変換済み）
+    for command, symbol in (('int', '∫'), ('iint', '∬'), ('iiint', '∭'), ('oint', '∮')):
+        passes.append(regex_pass(f"operator.{command}", r'\\' + command + r'(?![a-zA-Z])',
+                                 symbol, '\\' + command))
+
+    passes += [
+        # 特別な処理：∫_{ℂ dot.double(f) を ∫_(ℂ) dot.double(f) に変換（最初に処理）
+        function_pass("integral.dot_double", _integral_dot_double, '∫_{'),
+        function_pass("integral.subscript_braces", _integral_subscript_braces, '∫_{'),
+        function_pass("integral.subscript_open", _integral_subscript_open, '∫_'),
+        # 余分な括弧を修正：∫_((ℋ_+) hat(f)) → ∫_(ℋ_+) hat(f)
+        regex_pass("integral.double_paren", patterns['math.integral.double_paren'], r'∫_(\1) \2', '∫_(('),
+        regex_pass("sum.subscript", patterns['math.sum.subscript'], r'Σ_(\1)', 'Σ_{'),
+        function_pass("norm.balanced", _norm_balanced, '\\|'),
+        # 残存する下付き文字の {} を () に変換（複雑な内容に対応）
+        regex_pass("integral.subscript_nested", patterns['math.integral_subscript_nested'], r'∫_(\1)',
+                   '∫_{'),
+        regex_pass("integral.subscript_simple", patterns['math.int.subscript'], r'∫_(\1)', '∫_{'),
+        function_pass("integral.subscript_last_brace", _integral_subscript_to_last_brace, '∫_{'),
+    ]
+    for symbol, name in (('∬', 'iint'), ('∭', 'iiint'), ('∮', 'oint')):
+        passes.append(regex_pass(f"{name}.subscript", patterns[f'math.{name}.subscript'], symbol + r'_(\1)',
+                                 symbol + '_{'))
+    # 単一文字の下付き文字も処理（Unicode文字を含む）
+    passes += [
+        regex_pass("oint.subscript_char", r'∮_([A-Za-zΑ-Ωα-ω])', r'∮_(\1)', '∮_'),
+        regex_pass("integral.subscript_char", r'∫_([A-Za-zΑ-Ωα-ω])', r'∫_(\1)', '∫_'),
+    ]
+    # 上付き文字の処理（単一文字を先に処理）
+    for symbol, name in (('∫', 'int'), ('∬', 'iint'), ('∭', 'iiint'), ('∮', 'oint')):
+        passes.append(regex_pass(f"{name}.superscript_char", symbol + r'\^([a-zA-Z0-9∞])',
+                                 symbol + r'^(\1)', symbol + '^'))
+    for symbol, name in (('∫', 'int'), ('∬', 'iint'), ('∭', 'iiint'), ('∮', 'oint')):
+        passes.append(regex_pass(f"{name}.superscript", patterns[f'math.{name}.superscript'],
+                                 symbol + r'^(\1)', symbol + '^{'))
+    # 一般的な上付き文字の {} を () に変換
+    passes.append(regex_pass("superscript.braces", patterns['math.superscript.braces'], r'^(\1)', '^{'))
+
+    # 数式アクセントの変換（下付き文字の処理より前に実行）
+    passes += _accent_passes(accents, "accent.late")
+
+    passes += [
+        # 残存する\fracと\sqrtを処理
+        regex_pass("frac", patterns['command.frac'], r'(\1)/(\2)', '\\frac{'),
+        regex_pass("sqrt", patterns['command.sqrt'], r'sqrt(\1)', '\\sqrt{'),
+        regex_pass("quad", r'\\quad', 'quad', '\\quad'),
+        regex_pass("mathrm", patterns['command.mathrm'], r'"\1"', '\\mathrm{'),
+        operatorname_pass("operatorname"),
+    ]
+    # \label{...} を <...> に変換（従来どおり4回適用）
+    for i in range(4):
+        passes.append(regex_pass(f"label.{i + 1}", patterns['command.label'], r'<\1>', '\\label{'))
+
+    # cases環境の変換（コマンド保護処理より前）
+    passes += [
+        regex_pass("cases.begin", r'\\begin\{cases\}', 'cases(', '\\begin{cases}'),
+        regex_pass("cases.end", r'\\end\{cases\}', ') //[command type:cases]', '\\end{cases}'),
+        regex_pass("cases.end_incomplete", r'\\end\{cases', ') //[command type:cases]', '\\end{cases'),
+        regex_pass("cases.newline_before", r'\ncases\(', '\ncases(', '\ncases('),
+        regex_pass("cases.newline_after", r'cases\(\n', 'cases(\n', 'cases(\n'),
+    ]
+    # 改行文字を含むcasesを保護（従来どおり6回適用）
+    for i in range(6):
+        passes += [
+            regex_pass(f"cases.protect_before.{i + 1}", r'\ncases\(', '__CASES_START__', '\ncases('),
+            regex_pass(f"cases.protect_after.{i + 1}", r'cases\(\n', '__CASES_START__', 'cases(\n'),
+        ]
+
+    # 残存する\biggと\left/rightを処理
+    passes += _delimiter_passes('bigg', 'bigg')
+    passes += _delimiter_passes('left', 'right')
+
+    passes += [
+        # 上付き文字・下付き文字の変換
+        regex_pass("superscript.group", patterns['math.superscript.group'], r'\1^(\2)', '^{'),
+        regex_pass("superscript.char", patterns['math.superscript.char'], r'\1^(\2)', '^'),
+        regex_pass("subscript.group", patterns['math.subscript.group'], r'\1_(\2)', '_{'),
+        regex_pass("subscript.char", patterns['math.subscript.char'], r'\1_(\2)', '_'),
+        # &= = の重複を修正
+        regex_pass("align.duplicate_eq", r'&=\s*=', '&=', '&='),
+    ]
+
+    # 数式関数の変換
+    for tex_func, typst_func in functions:
+        passes.append(regex_pass(f"function.{tex_func}", r'\\' + re.escape(tex_func) + r'\(',
+                                 typst_func + r'(', '\\' + tex_func + '('))
+
+    passes.append(function_pass("whitespace.tab_space", normalize_tab_spaces, '\t '))
+
+    # 変数の空白分離（tokenSplit.variables: off の場合はパス自体を置かない）
+    if split_variables:
+        passes.append(function_pass("tokenSplit.variables", separate_variables, _LETTER_OR_COMMENT))
+
+    passes += [
+        # 保護したcasesを元に戻す
+        function_pass("cases.restore", lambda content: content.replace('__CASES_START__', 'cases('),
+                      '__CASES_START__'),
+        # 最後の処理：^と_の後の(?)や{?}を?にする変換（1文字の場合のみ）
+        regex_pass("script.single_paren", r'([\^_])\((.)\)', r'\1\2', ('^(', '_(')),
+        regex_pass("script.single_brace", r'([\^_])\{(.)\}', r'\1\2', ('^{', '_{')),
+    ]
+    return PassManager(passes)
+
+
+# インライン数式のテキストの子ノードの書き換えパス（テキスト内容のパスの後に実行）
+INLINE_MATH_TEXT_PASSES = PassManager([
+    operatorname_pass("inline.operatorname"),
+])
@@ -0,0 +1,219 @@
+"""
+行列環境の変換
+
+`pmatrix`・`bmatrix`・`Bmatrix`・`vmatrix`・`Vmatrix`・`matrix`・`smallmatrix`・`array` を
+Typstの `mat(delim: ..., ...)` に変換する。
+
+環境の本文は1回だけ走査して行・セルに分け（`&`・`\\\\` は波括弧と入れ子の環境の外側のものだけ）、
+セルは1つずつ数式として変換する（同じセルは数式キャッシュで1回だけ変換される）。
+変換した行列は数式の残りの書き換えパスから保護するため、英数字を含まない1文字の
+プレースホルダーに置き換えておき、パスの実行後に戻す。元の環境はメタコメントに記録する。
+"""
+
+import re
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Tuple
+
+
+# 環境名 → mat の delim（Noneは区切りなし）
+MATRIX_DELIMITERS = {
+    'pmatrix': '"("',
+    'bmatrix': '"["',
+    'Bmatrix': '"{"',
+    'vmatrix': '"|"',
+    'Vmatrix': '"||"',
+    'matrix': None,
+    'smallmatrix': None,
+    'array': None,
+}
+
+# 行列の変換が必要かの判定に使う文字列
+MATRIX_TRIGGER = '\\begin{'
+
+_ENVIRONMENT = re.compile(r'\\(begin|end)\{(' + '|'.join(MATRIX_DELIMITERS) + r')\}')
+# array の位置指定 [t] と列指定 {cc}
+_ARRAY_ARGUMENTS = re.compile(r'\s*(?:\[[^\]]*\])?\s*\{((?:[^{}]|\{[^{}]*\})*)\}')
+# 本文の字句（行区切り・環境の開始と終了・エスケープ・波括弧・セル区切り）
+_BODY_TOKEN = re.compile(r'\\\\(?:\s*\[[^\]]*\])?|\\begin\{[^}]*\}|\\end\{[^}]*\}|\\hline|\\.|[{}&]')
+# 変換後のセルの字句（メタコメント・文字列・エスケープ・括弧・引数の区切り）
+_CELL_TOKEN = re.compile(r'//\[[^\]]*\]|"(?:[^"\\]|\\.)*"|\\.|[()\[\]{},;]')
+_COLUMN = re.compile(r'[lcrpmbX](?:\{[^{}]*\})?|\|')
+
+# プレースホルダー（補助私用領域の文字、書き換えパスの対象にならない）
+_PLACEHOLDER_BASE = 0xF0000
+
+
+@dataclass
+class MatrixEnvironment:
+    """数式中の行列環境（位置は数式の本文での文字位置）"""
+    name: str
+    start: int
+    end: int
+    body: str
+    columns: Optional[str] = None  # array の列指定
+
+
+def find_matrices(content: str) -> List[MatrixEnvironment]:
+    """最も外側の行列環境（入れ子の環境はセルの変換で処理する）"""
+    matrices = []
+    depth = 0
+    opening = None
+    for match in _ENVIRONMENT.finditer(content):
+        if match.group(1) == 'begin':
+            if depth == 0:
+                opening = match
+            depth += 1
+        elif depth:
+            depth -= 1
+            if depth == 0:
+                if match.group(2) != opening.group(2):
+                    # 開始と終了の環境名が合わない場合は変換しない
+                    continue
+                matrices.append(_environment(content, opening, match))
+    return matrices
+
+
+def _environment(content: str, opening: 're.Match', closing: 're.Match') -> MatrixEnvironment:
+    name = opening.group(2)
+    body_start = opening.end()
+    columns = None
+    if name == 'array':
+        arguments = _ARRAY_ARGUMENTS.match(content, body_start, closing.start())
+        if arguments:
+            columns = re.sub(r'\s+', '', arguments.group(1))
+            body_start = arguments.end()
+    return MatrixEnvironment(name, opening.start(), closing.end(),
+                             content[body_start:closing.start()], columns)
+
+
+def split_cells(body: str) -> List[List[str]]:
+    """本文を1回走査して行・セルに分ける（波括弧・入れ子の環境の内側の & と \\\\ は区切りにしない）"""
+    rows: List[List[str]] = []
+    cells: List[str] = []
+    parts: List[str] = []
+    depth = 0
+    position = 0
+    for match in _BODY_TOKEN.finditer(body):
+        token = match.group(0)
+        char = token[0]
+        if char == '{' or token.startswith('\\begin{'):
+            depth += 1
+        elif char == '}' or token.startswith('\\end{'):
+            depth -= 1
+        elif depth == 0 and (char == '&' or token.startswith('\\\\') or token == '\\hline'):
+            parts.append(body[position:match.start()])
+            position = match.end()
+            if token == '\\hline':
+                continue
+            cells.append(''.join(parts).strip())
+            parts = []
+            if char != '&':
+                rows.append(cells)
+                cells = []
+    cells.append((''.join(parts) + body[position:]).strip())
+    # 最後の \\ の後の空の行は除く
+    if cells != [''] or not rows:
+        rows.append(cells)
+    return rows
+
+
+def escape_separators(cell: str) -> str:
+    """変換後のセルの括弧の外側の , と ; を mat の引数の区切りにならないようエスケープ"""
+    if ',' not in cell and ';' not in cell:
+        return cell
+    parts = []
+    depth = 0
+    position = 0
+    for match in _CELL_TOKEN.finditer(cell):
+        token = match.group(0)
+        if token in '([{':
+            depth += 1
+        elif token in ')]}':
+            depth -= 1
+        elif token in ',;' and depth <= 0:
+            parts.append(cell[position:match.start()] + '\\' + token)
+            position = match.end()
+    parts.append(cell[position:])
+    return ''.join(parts)
+
+
+def _column_arguments(columns: str) -> List[str]:
+    """array の列指定から mat の align・augment の引数"""
+    arguments = []
+    letters = []
+    bars = []
+    for match in _COLUMN.finditer(columns):
+        if match.group(0) == '|':
+            bars.append(len(letters))
+        else:
+            letters.append(match.group(0)[0])
+    if letters and all(letter == 'l' for letter in letters):
+        arguments.append('align: #left')
+    elif letters and all(letter == 'r' for letter in letters):
+        arguments.append('align: #right')
+    # 列の間の縦線（両端の縦線は区切りとして扱わない）
+    lines = sorted({bar for bar in bars if 0 < bar < len(letters)})
+    if len(lines) == 1:
+        arguments.append(f'augment: #{lines[0]}')
+    elif lines:
+        arguments.append(f"augment: #(vline: ({', '.join(map(str, lines))}))")
+    return arguments
+
+
+def format_matrix(matrix: MatrixEnvironment, rows: List[List[str]]) -> str:
+    """変換済みのセルから mat(...) とメタコメント（本文が複数行の場合は1行に1行ずつ）"""
+    delimiter = MATRIX_DELIMITERS[matrix.name]
+    arguments = [f'delim: {delimiter}' if delimiter else 'delim: #none']
+    meta = f'//[matrix env:{matrix.name}'
+    if matrix.columns is not None:
+        arguments += _column_arguments(matrix.columns)
+        meta += f' cols:{matrix.columns}'
+    meta += ']'
+    cells = [', '.join(escape_separators(cell) or '#none' for cell in row) for row in rows]
+    if '\n' not in matrix.body:
+        return f"mat({', '.join(arguments)}, {'; '.join(cells)}) {meta}\n"
+    rows_text = ';\n'.join('\t' + row for row in cells)
+    return f"mat({', '.join(arguments)},\n{rows_text}\n) {meta}\n"
+
+
+class MatrixConverter:
+    """数式中の行列環境を mat(...) に変換（convert_cellはセル1つを数式として変換する関数）"""
+
+    def __init__(self, convert_cell: Callable[[str], str]):
+        self.convert_cell = convert_cell
+
+    def protect(self, content: str) -> Tuple[str, List[str]]:
+        """行列環境を変換してプレースホルダーに置き換え（変換結果の列を返す）"""
+        if MATRIX_TRIGGER not in content:
+            return content, []
+        matrices = find_matrices(content)
+        if not matrices:
+            return content, []
+        parts = []
+        converted = []
+        position = 0
+        for matrix in matrices:
+            rows = [[self.convert_cell(cell) if cell else '' for cell in row]
+                    for row in split_cells(matrix.body)]
+            parts.append(content[position:matrix.start])
+            # 直前のコマンド名・変数名と続けて読まれないよう空白を挟む（\det\begin{vmatrix} など）
+            if matrix.start and content[matrix.start - 1].isalnum():
+                parts.append(' ')
+            parts.append(chr(_PLACEHOLDER_BASE + len(converted)))
+            converted.append(format_matrix(matrix, rows))
+            position = matrix.end
+        parts.append(content[position:])
+        return ''.join(parts), converted
+
+    @staticmethod
+    def restore(content: str, converted: List[str]) -> str:
+        """プレースホルダーを変換した行列に戻す"""
+        for number, matrix in enumerate(converted):
+            content = content.replace(chr(_PLACEHOLDER_BASE + number), matrix)
+        return content
+
+    def convert(self, content: str, rest: Callable[[str], str]) -> str:
+        """行列環境を変換し、残りの本文をrestで変換"""
+        content, converted = self.protect(content)
+        content = rest(content)
+        return self.restore(content, converted) if converted else content
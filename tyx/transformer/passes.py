@@ -0,0 +1,127 @@
+"""
+書き換えパスの管理
+
+正規表現による書き換えを名前付きのパスの列として表し、
+各パスが宣言したトリガー（必ず含まれるはずの部分文字列・文字種）が
+現在の内容に現れない場合はパスを実行せずに飛ばす。
+トリガーの判定結果は内容が変わるまで共有するため、同じトリガーを持つパスが続いても走査は1回で済む。
+"""
+
+import re
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+
+# トリガー：部分文字列または正規表現（いずれか1つでも現れればパスを実行）
+Trigger = Union[str, 're.Pattern']
+
+
+@dataclass(frozen=True)
+class RewritePass:
+    """名前付きの書き換えパス"""
+    name: str
+    apply: Callable[[str], str]
+    # Noneの場合は常に実行
+    triggers: Optional[Tuple[Trigger, ...]] = None
+
+
+def regex_pass(name: str, pattern, replacement, triggers: Union[Trigger, Iterable[Trigger]],
+               flags: int = 0) -> RewritePass:
+    """正規表現の置換による書き換えパス
+
+    patternは文字列（作成時にコンパイル）または登録簿のパターン（時間予算付き）。
+    """
+    compiled = re.compile(pattern, flags) if isinstance(pattern, str) else pattern
+
+    def apply(content: str) -> str:
+        return compiled.sub(replacement, content)
+    return RewritePass(name, apply, _normalize_triggers(triggers))
+
+
+def function_pass(name: str, function: Callable[[str], str],
+                  triggers: Union[None, Trigger, Iterable[Trigger]] = None) -> RewritePass:
+    """任意の関数による書き換えパス"""
+    return RewritePass(name, function, _normalize_triggers(triggers))
+
+
+def _normalize_triggers(triggers) -> Optional[Tuple[Trigger, ...]]:
+    if triggers is None:
+        return None
+    if isinstance(triggers, (str, re.Pattern)):
+        return (triggers,)
+    return tuple(triggers)
+
+
+@dataclass
+class PassStatistics:
+    """パスの実行・省略回数"""
+    executed: Dict[str, int] = field(default_factory=dict)
+    skipped: Dict[str, int] = field(default_factory=dict)
+
+    @property
+    def total_executed(self) -> int:
+        return sum(self.executed.values())
+
+    @property
+    def total_skipped(self) -> int:
+        return sum(self.skipped.values())
+
+    def reset(self) -> None:
+        self.executed.clear()
+        self.skipped.clear()
+
+    def summary(self, limit: int = 10) -> str:
+        """集計の要約（省略の多いパスから順に）"""
+        total = self.total_executed + self.total_skipped
+        lines = [f"passes: {self.total_executed} executed, {self.total_skipped} skipped"
+                 + (f" ({self.total_skipped / total:.0%})" if total else "")]
+        for name, count in sorted(self.skipped.items(), key=lambda item: -item[1])[:limit]:
+            lines.append(f"  {name}: skipped {count}, executed {self.executed.get(name, 0)}")
+        return '\n'.join(lines)
+
+
+class PassManager:
+    """書き換えパスを順番に実行"""
+
+    def __init__(self, passes: Iterable[RewritePass]):
+        self.passes: Tuple[RewritePass, ...] = tuple(passes)
+        names = [rewrite_pass.name for rewrite_pass in self.passes]
+        duplicates = {name for name in names if names.count(name) > 1}
+        if duplicates:
+            raise ValueError(f"duplicate pass names: {sorted(duplicates)}")
+
+    def run(self, content: str, stats: Optional[PassStatistics] = None) -> str:
+        """全パスを順に適用（トリガーが現れないパスは飛ばす）"""
+        present: Dict[Trigger, bool] = {}
+        for rewrite_pass in self.passes:
+            triggers = rewrite_pass.triggers
+            if triggers is not None and not self._triggered(triggers, content, present):
+                if stats is not None:
+                    stats.skipped[rewrite_pass.name] = stats.skipped.get(rewrite_pass.name, 0) + 1
+                continue
+            if stats is not None:
+                stats.executed[rewrite_pass.name] = stats.executed.get(rewrite_pass.name, 0) + 1
+
+            result = rewrite_pass.apply(content)
+            if result is not content and result != content:
+                # 内容が変わったのでトリガーの判定をやり直す
+                present.clear()
+            content = result
+        return content
+
+    @staticmethod
+    def _triggered(triggers: Tuple[Trigger, ...], content: str, present: Dict[Trigger, bool]) -> bool:
+        for trigger in triggers:
+            found = present.get(trigger)
+            if found is None:
+                if isinstance(trigger, str):
+                    found = trigger in content
+                else:
+                    found = trigger.search(content) is not None
+                present[trigger] = found
+            if found:
+                return True
+        return False
+
+    def names(self) -> List[str]:
+        return [rewrite_pass.name for rewrite_pass in self.passes]
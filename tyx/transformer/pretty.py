@@ -0,0 +1,519 @@
+"""
+出力の整形（README §10）
+
+Wadler/Oppen流の文書代数（Text・Line・HardLine・Nest・Fill・Block）と、それを描画するプリンター。
+変換器の各ノードの変換は文字列ではなく文書を返し、プリンターは文書の木からインデント・空行・行長の規則を適用して描画する。
+本文（マークアップ）の断片は markup() で文書にし、その断片の中の文脈（マークアップ・コード・数式・raw・コメント）から
+折り返し候補を求める。折り返しはマークアップ中の空白と句読点の直後でのみ行い、数式・コード・文字列・コメント・rawの中では行わない。
+見出し・ディスプレイ数式・参照などの折り返さない行は lines() で文書にする。
+"""
+
+import re
+import unicodedata
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple, Union
+
+from ..options import PrettyOptions
+
+
+# タブの表示幅（行長の計算用）
+TAB_WIDTH = 4
+
+# 折り返し位置の優先度
+PRIORITY_SPACE = 0
+PRIORITY_PUNCTUATION = 1
+
+# 直後で折り返せる全角の句読点（空白なしで折り返す）
+_CJK_PUNCTUATION = frozenset('。、，．！？：；）」』】')
+# 直後の空白を優先して折り返す半角の句読点
+_ASCII_PUNCTUATION = frozenset(',.;:!?')
+
+# 各文脈で走査を止める文字（それ以外は読み飛ばす）
+_MARKUP_SPECIAL = re.compile(r'[\\$`#\[\] /。、，．！？：；）」』】]')
+_CODE_SPECIAL = re.compile(r'[\\"$`()\[\]{}/]')
+_MATH_SPECIAL = re.compile(r'[\\"$/]')
+_IDENTIFIER = re.compile(r'[A-Za-z_][\w-]*(?:\.[A-Za-z_][\w-]*)*')
+# 行末までが1つの式になるキーワード
+_STATEMENT_KEYWORDS = frozenset(('let', 'set', 'show', 'import', 'include', 'if', 'for', 'while',
+                                 'return', 'context'))
+
+# 行頭に来ると意味が変わる記法（見出し・リスト・用語リスト・番号付きリスト）
+_LINE_MARKER = re.compile(r'(=+|[-+/]|\d+\.)(\s|$)')
+
+
+@dataclass(frozen=True)
+class Text:
+    """そのまま出力する文字列（改行を含まない）"""
+    text: str
+
+
+@dataclass(frozen=True)
+class Line:
+    """折り返し可能な位置（Fill の中でのみ使い、折り返さない場合は flat を出力）"""
+    flat: str = " "
+    priority: int = PRIORITY_SPACE
+
+
+@dataclass(frozen=True)
+class HardLine:
+    """必ず改行する位置"""
+
+
+@dataclass(frozen=True)
+class Verbatim:
+    """rawの中の行（インデントを変えず、行末の空白も含めてそのまま出力する）"""
+    text: str
+
+
+@dataclass(frozen=True)
+class Nest:
+    """改行後のインデントを levels 段深くする"""
+    levels: int
+    doc: 'Doc'
+
+
+@dataclass(frozen=True)
+class Fill:
+    """内容と Line を交互に並べ、次の内容が収まらない Line だけを折り返す（段落の詰め込み）"""
+    parts: Tuple['Doc', ...]
+
+
+@dataclass(frozen=True)
+class Concat:
+    """文書の連結"""
+    parts: Tuple['Doc', ...]
+
+
+@dataclass(frozen=True)
+class Block:
+    """内容ブロックを持つ環境（blankLines の指定に従って開始行の前と終了行の後に空行を入れる）"""
+    open: 'Doc'
+    body: 'Doc'
+    close: 'Doc'
+
+
+Doc = Union[Text, Line, HardLine, Verbatim, Nest, Fill, Concat, Block]
+
+
+def display_width(text: str) -> int:
+    """表示幅（全角は2桁、タブは TAB_WIDTH 桁）"""
+    if text.isascii():
+        return len(text) + (TAB_WIDTH - 1) * text.count('\t')
+    width = 0
+    for char in text:
+        if char == '\t':
+            width += TAB_WIDTH
+        elif unicodedata.east_asian_width(char) in ('W', 'F'):
+            width += 2
+        else:
+            width += 1
+    return width
+
+
+@dataclass
+class LineLayout:
+    """1行の構造"""
+    levels: int  # 行頭のタブの数
+    text: str  # インデントを除いた内容
+    breaks: List[Tuple[int, int, int]] = field(default_factory=list)  # (開始, 終了, 優先度)
+    hanging: bool = False  # リスト項目（継続行を1段深くする）
+    verbatim: bool = False  # rawの中の行（そのまま出力）
+
+    @property
+    def blank(self) -> bool:
+        return not self.text and not self.verbatim
+
+
+class MarkupScanner:
+    """Typstの文脈を行をまたいで追跡し、各行の折り返し可能な位置を求める
+
+    文脈はスタックで持つ：markup / code / math / raw / comment（ブロックコメント）。
+    """
+
+    def __init__(self):
+        self.stack: List[Tuple[str, str]] = [('markup', '')]
+
+    def scan(self, line: str) -> LineLayout:
+        """1行を走査"""
+        stripped = line.lstrip('\t')
+        levels = len(line) - len(stripped)
+        context = self.stack[-1][0]
+        if context == 'raw':
+            # raw の中は行末の空白も含めて保持し、インデントも変えない
+            self._advance(line, 0, [])
+            return LineLayout(0, line, verbatim=True)
+
+        text = stripped.rstrip()
+        layout = LineLayout(levels, text)
+        if not text:
+            return layout
+        breaks: List[Tuple[int, int, int]] = []
+        marker = _LINE_MARKER.match(text) if context == 'markup' else None
+        comment = self._advance(text, 0, breaks)
+
+        if marker and marker.group(1).startswith('='):
+            # 見出しは改行で終わるため折り返さない
+            return layout
+        layout.hanging = marker is not None
+        layout.breaks = [
+            (start, end, priority) for start, end, priority in breaks
+            # 行頭の空白・行末コメントの直前では折り返さない
+            if 0 < start and end < len(text) and (comment is None or end < comment)
+            # 継続行の先頭が見出しやリストの記法にならないようにする
+            and not _LINE_MARKER.match(text, end)
+        ]
+        return layout
+
+    def _advance(self, text: str, index: int, breaks: List[Tuple[int, int, int]]) -> Optional[int]:
+        """文脈を進めながら折り返し候補を集め、行コメントの開始位置を返す"""
+        length = len(text)
+        while index < length:
+            context, closer = self.stack[-1]
+            if context == 'raw':
+                end = text.find(closer, index)
+                if end < 0:
+                    return None
+                self.stack.pop()
+                index = end + len(closer)
+                continue
+            if context == 'comment':
+                close = text.find('*/', index)
+                open_ = text.find('/*', index)
+                if 0 <= open_ < close or (close < 0 <= open_):
+                    self.stack.append(('comment', ''))
+                    index = open_ + 2
+                    continue
+                if close < 0:
+                    return None
+                self.stack.pop()
+                index = close + 2
+                continue
+
+            pattern = _MARKUP_SPECIAL if context == 'markup' else \
+                _CODE_SPECIAL if context == 'code' else _MATH_SPECIAL
+            match = pattern.search(text, index)
+            if match is None:
+                return None
+            index = match.start()
+            char = text[index]
+
+            if char == '/':
+                following = text[index + 1:index + 2]
+                if following == '/' and not (context == 'markup' and text[index - 1:index] == ':'):
+                    return index  # 行コメント（https:// などのリンクは除く）
+                if following == '*':
+                    self.stack.append(('comment', ''))
+                    index += 2
+                    continue
+                index += 1
+                continue
+            if char == '\\':
+                index += 2
+                continue
+            if char == '"':
+                index = self._skip_string(text, index + 1)
+                continue
+            if char == '`':
+                run = len(text) - index - len(text[index:].lstrip('`'))
+                self.stack.append(('raw', '`' * run))
+                index += run
+                continue
+            if char == '$':
+                if context == 'math':
+                    self.stack.pop()
+                else:
+                    self.stack.append(('math', ''))
+                index += 1
+                continue
+
+            if context == 'markup':
+                index = self._advance_markup(text, index, char, breaks)
+            else:
+                index = self._advance_code(text, index, char)
+        return None
+
+    def _advance_markup(self, text: str, index: int, char: str,
+                        breaks: List[Tuple[int, int, int]]) -> int:
+        if char == ' ':
+            end = index + 1
+            while end < len(text) and text[end] == ' ':
+                end += 1
+            before = text[index - 1:index]
+            priority = PRIORITY_PUNCTUATION if before and (
+                before in _ASCII_PUNCTUATION or before in _CJK_PUNCTUATION) else PRIORITY_SPACE
+            breaks.append((index, end, priority))
+            return end
+        if char in _CJK_PUNCTUATION:
+            following = text[index + 1:index + 2]
+            if following and following != ' ' and following not in _CJK_PUNCTUATION:
+                breaks.append((index + 1, index + 1, PRIORITY_PUNCTUATION))
+            return index + 1
+        if char == '#':
+            identifier = _IDENTIFIER.match(text, index + 1)
+            if identifier and identifier.group(0) in _STATEMENT_KEYWORDS:
+                # 行末まで折り返さない
+                return len(text)
+            end = identifier.end() if identifier else index + 1
+            return self._open_arguments(text, end)
+        if char == '[':
+            self.stack.append(('markup', ']'))
+            return index + 1
+        if char == ']':
+            if self.stack[-1][1] == ']':
+                self.stack.pop()
+                return self._open_arguments(text, index + 1)
+            return index + 1
+        return index + 1
+
+    def _advance_code(self, text: str, index: int, char: str) -> int:
+        if char in '([{':
+            if char == '[':
+                self.stack.append(('markup', ']'))
+            else:
+                self.stack.append(('code', ')' if char == '(' else '}'))
+            return index + 1
+        if char in ')]}':
+            if self.stack[-1][1] == char and len(self.stack) > 1:
+                self.stack.pop()
+                if char == ')':
+                    return self._open_arguments(text, index + 1)
+        return index + 1
+
+    def _open_arguments(self, text: str, index: int) -> int:
+        """関数呼び出しの引数（`(...)`）・内容ブロック（`[...]`）の開始"""
+        following = text[index:index + 1]
+        if following == '(':
+            self.stack.append(('code', ')'))
+            return index + 1
+        if following == '{':
+            self.stack.append(('code', '}'))
+            return index + 1
+        if following == '[':
+            self.stack.append(('markup', ']'))
+            return index + 1
+        return index
+
+    @staticmethod
+    def _skip_string(text: str, index: int) -> int:
+        while index < len(text):
+            char = text[index]
+            if char == '\\':
+                index += 2
+            elif char == '"':
+                return index + 1
+            else:
+                index += 1
+        return index
+
+
+def markup(text: str) -> Doc:
+    """本文（マークアップ）の断片を文書にする（各行の折り返し候補は Fill の Line になる）"""
+    scanner = MarkupScanner()
+    return Concat(tuple(_line_document(scanner.scan(line)) for line in text.split('\n')))
+
+
+def lines(text: str) -> Doc:
+    """折り返さない行（見出し・数式・参照など）を文書にする
+    行頭のタブはインデントの段数とし、タブの後の空白は捨てる（タブのない行の空白はそのまま）。"""
+    parts: List[Doc] = []
+    for line in text.split('\n'):
+        stripped = line.lstrip('\t')
+        levels = len(line) - len(stripped)
+        content = stripped.strip() if levels else stripped.rstrip()
+        parts.append(Nest(levels, Concat((HardLine(), Text(content)))) if content else HardLine())
+    return Concat(tuple(parts))
+
+
+def _line_document(layout: LineLayout) -> Doc:
+    """走査した1行を文書にする"""
+    if layout.verbatim:
+        return Concat((HardLine(), Verbatim(layout.text)))
+    if layout.blank:
+        return HardLine()
+    text = layout.text
+    if not layout.breaks:
+        body: Doc = Text(text)
+    else:
+        items: List[Doc] = []
+        last = 0
+        for start, end, priority in layout.breaks:
+            items.append(Text(text[last:start]))
+            items.append(Line(text[start:end], priority))
+            last = end
+        items.append(Text(text[last:]))
+        body = Fill(tuple(items))
+        if layout.hanging:
+            body = Nest(1, body)
+    return Nest(layout.levels, Concat((HardLine(), body)))
+
+
+@dataclass
+class _OutputLine:
+    """描画する1行（HardLine から次の HardLine までの内容）"""
+    levels: int
+    parts: List[Tuple[int, Doc]] = field(default_factory=list)  # (インデントの段数, Text・Fill・Verbatim)
+    block_open: bool = False
+    block_close: bool = False
+
+    @property
+    def blank(self) -> bool:
+        return not any(isinstance(node, (Fill, Verbatim)) or (isinstance(node, Text) and node.text)
+                       for _, node in self.parts)
+
+
+# Block の開始・終了の目印（文書の走査用）
+_OPEN_MARK = object()
+_CLOSE_MARK = object()
+
+
+class PrettyPrinter:
+    """文書を描画するプリンター"""
+
+    def __init__(self, options: Optional[PrettyOptions] = None):
+        self.options = options or PrettyOptions()
+        if self.options.indent == "tab":
+            self.indent_unit, self.indent_width = '\t', TAB_WIDTH
+        else:
+            self.indent_unit, self.indent_width = ' ' * self.options.indent, self.options.indent
+        self.width = self.options.line_length
+        self.prioritize = self.options.break_priority == "punctuation"
+
+    def render(self, doc: Doc) -> str:
+        """文書を描画（空行の規則は行の並びに、行長の規則は Fill に適用）"""
+        out: List[str] = []
+        state = _RenderState(self)
+        blank_lines = self.options.blank_lines
+        blank_run = 0
+        pending_blank = 0  # 直前の環境の終了後に必要な空行
+        previous: Optional[_OutputLine] = None
+        for line in self._lines(doc):
+            if line.blank:
+                blank_run += 1
+                continue
+
+            # 連続する空行は1行（blankLines がそれより多い場合はその行数）にまとめる
+            blanks = min(blank_run, max(1, blank_lines))
+            if blank_lines and previous is not None and not line.block_close:
+                if line.block_open and not previous.block_open:
+                    blanks = max(blanks, blank_lines)
+                blanks = max(blanks, pending_blank)
+            for _ in range(blanks):
+                state.newline(out, 0)
+            state.newline(out, line.levels)
+            for levels, node in line.parts:
+                if isinstance(node, Fill):
+                    self._render_fill(node, levels, out, state)
+                else:
+                    state.write(out, node.text)
+            pending_blank = blank_lines if line.block_close else 0
+            blank_run = 0
+            previous = line
+        if blank_run and previous is not None:
+            # 末尾の空行（最後の改行）は保持
+            for _ in range(min(blank_run, max(1, blank_lines))):
+                state.newline(out, 0)
+        # 先頭の行の前の改行を除く
+        return ''.join(out)[1:] if out and out[0] == '\n' else ''.join(out)
+
+    @staticmethod
+    def _lines(doc: Doc) -> List[_OutputLine]:
+        """文書を行に分ける（HardLine で新しい行を始め、その位置の Nest の段数を行のインデントにする）"""
+        result: List[_OutputLine] = []
+        opening = False
+        stack: List[Tuple[int, object]] = [(0, doc)]
+        while stack:
+            levels, node = stack.pop()
+            if isinstance(node, HardLine):
+                result.append(_OutputLine(levels, block_open=opening))
+                opening = False
+            elif isinstance(node, Concat):
+                stack.extend((levels, part) for part in reversed(node.parts))
+            elif isinstance(node, Nest):
+                stack.append((levels + node.levels, node.doc))
+            elif isinstance(node, Block):
+                stack.extend(((levels, _CLOSE_MARK), (levels, node.close), (levels, node.body),
+                              (levels, node.open), (levels, _OPEN_MARK)))
+            elif node is _OPEN_MARK:
+                opening = True
+            elif node is _CLOSE_MARK:
+                if result:
+                    result[-1].block_close = True
+            else:
+                if not result:
+                    result.append(_OutputLine(levels, block_open=opening))
+                    opening = False
+                if isinstance(node, Line):
+                    # Fill の外の Line は折り返さない
+                    node = Text(node.flat)
+                result[-1].parts.append((levels, node))
+        return result
+
+    def _render_fill(self, node: Fill, levels: int, out: List[str], state: '_RenderState') -> None:
+        """Fill の描画（句読点の位置では、次の句が収まらない場合に先に折り返す）"""
+        contents = [self._flat_text(part) for part in node.parts[0::2]]
+        separators = node.parts[1::2]
+        content_widths = [display_width(text) for text in contents]
+        separator_widths = [display_width(separator.flat) for separator in separators]
+        # clauses[k]: k番目の Line から次の句読点の Line までの幅
+        clauses = [0] * len(separators)
+        for k in range(len(separators) - 1, -1, -1):
+            clauses[k] = separator_widths[k] + content_widths[k + 1]
+            if k + 1 < len(separators) and separators[k + 1].priority == PRIORITY_SPACE:
+                clauses[k] += clauses[k + 1]
+
+        continuation = levels * self.indent_width
+        state.write(out, contents[0])
+        for k, separator in enumerate(separators):
+            following = separator_widths[k] + content_widths[k + 1]
+            if state.column + following > self.width:
+                # 次の行にも収まらない内容は折り返しても短くならないため、そのまま続ける
+                broken = continuation + content_widths[k + 1] <= self.width
+            elif (self.prioritize and separator.priority == PRIORITY_PUNCTUATION
+                  and state.column + clauses[k] > self.width and state.column * 2 > self.width):
+                broken = True
+            else:
+                broken = False
+            if broken:
+                state.newline(out, levels)
+            else:
+                state.write(out, separator.flat)
+            state.write(out, contents[k + 1])
+
+    def _flat_text(self, doc: Doc) -> str:
+        """改行を含まない文書の文字列"""
+        if isinstance(doc, Text):
+            return doc.text
+        if isinstance(doc, Line):
+            return doc.flat
+        if isinstance(doc, Nest):
+            return self._flat_text(doc.doc)
+        if isinstance(doc, (Concat, Fill)):
+            return ''.join(self._flat_text(part) for part in doc.parts)
+        return ''
+
+
+class _RenderState:
+    """描画中の桁位置（インデントは次の文字を書くときまで遅延し、空行に空白を残さない）"""
+
+    def __init__(self, printer: PrettyPrinter):
+        self.printer = printer
+        self.column = 0
+        self.pending: Optional[int] = None
+
+    def write(self, out: List[str], text: str) -> None:
+        if not text:
+            return
+        if self.pending is not None:
+            out.append(self.printer.indent_unit * self.pending)
+            self.pending = None
+        out.append(text)
+        self.column += display_width(text)
+
+    def newline(self, out: List[str], levels: int) -> None:
+        out.append('\n')
+        self.pending = levels
+        self.column = levels * self.printer.indent_width
+
+
+# グローバルインスタンス
+pretty_printer = PrettyPrinter()
@@ -0,0 +1,210 @@
+"""
+表の変換
+
+`tabular`・`tabular*`・`tabularx`・`longtable` をTypstの `#table(columns: ..., ...)` に変換する。
+
+列指定から列数・列幅・配置を求め、本文は字句の走査器で先頭から1行ずつ読み出す
+（`&`・`\\\\` は波括弧と入れ子の環境の外側のものだけを区切りとし、行全体を先に分割しない）。
+セルは行を出力するときに1つずつ変換し、出力も1行ずつ生成する。
+`\\hline`・booktabsの罫線・`\\cline`・`\\multicolumn` は `table.hline`・`table.cell` に変換し、
+元のコマンドはメタコメントに残す。
+"""
+
+import re
+from dataclasses import dataclass, field
+from typing import Callable, Iterator, List, Optional, Union
+
+
+# 列指定の配置 → Typstの配置
+ALIGNMENTS = {'l': 'left', 'c': 'center', 'r': 'right', 'p': 'left', 'm': 'left', 'b': 'left', 'X': 'left'}
+
+# 罫線（行の先頭に現れるコマンド）と longtable の見出し・脚の区切り
+RULES = ('hline', 'toprule', 'midrule', 'bottomrule', 'cline', 'cmidrule', 'addlinespace')
+MARKS = ('endfirsthead', 'endhead', 'endfoot', 'endlastfoot')
+
+# 列指定の字句（*{n}{spec} は展開してから読む）
+_COLUMN = re.compile(r'([lcrX])|([pmb])\{([^{}]*(?:\{[^{}]*\}[^{}]*)*)\}|(\|)|[@!<>]\{(?:[^{}]|\{[^{}]*\})*\}')
+_REPEAT = re.compile(r'\*\{(\d+)\}\{((?:[^{}]|\{[^{}]*\})*)\}')
+# 本文の字句（行区切り・罫線・区切り・環境の開始と終了・エスケープ・波括弧・セル区切り）
+_BODY_TOKEN = re.compile(
+    r'\\\\\*?(?:\s*\[[^\]]*\])?|\\tabularnewline(?![a-zA-Z])'
+    r'|\\(' + '|'.join(RULES + MARKS) + r')(?![a-zA-Z])(?:\(([^)]*)\))?(?:\[[^\]]*\])?(?:\{([^}]*)\})?'
+    r'|\\begin\{[^}]*\}|\\end\{[^}]*\}|\\.|[{}&]'
+)
+_MULTICOLUMN = re.compile(r'\\multicolumn\{(\d+)\}\{((?:[^{}]|\{[^{}]*\})*)\}\{(.*)\}\s*$', re.DOTALL)
+_COLUMN_RANGE = re.compile(r'(\d+)-(\d+)')
+# \linewidth などに対する割合（0.3\textwidth → 30%）
+_RELATIVE_WIDTH = re.compile(r'([\d.]*)\\(?:textwidth|linewidth|columnwidth|hsize)')
+_LENGTH = re.compile(r'\d*\.?\d+(?:pt|mm|cm|in|em)')
+
+
+@dataclass
+class ColumnSpec:
+    """列指定を読んだ結果"""
+    alignments: List[str] = field(default_factory=list)
+    widths: List[str] = field(default_factory=list)
+    # 縦線の位置（その前にある列の数）
+    vlines: List[int] = field(default_factory=list)
+
+
+@dataclass
+class TableRule:
+    """罫線・区切り（nameはコマンド名、columnsは \\cline{2-3} の範囲、trimは \\cmidrule(lr) の指定）"""
+    name: str
+    columns: Optional[str] = None
+    trim: Optional[str] = None
+
+
+def _length(width: str) -> str:
+    """TeXの長さをTypstの長さに（表せない場合は auto）"""
+    width = width.strip()
+    relative = _RELATIVE_WIDTH.fullmatch(width)
+    if relative:
+        return f"{float(relative.group(1) or 1) * 100:g}%"
+    return width if _LENGTH.fullmatch(width) else 'auto'
+
+
+def parse_columns(spec: str) -> ColumnSpec:
+    """列指定（l・c・r・p{..}・X・|・*{n}{..}・@{..}）を読む"""
+    while '*{' in spec:
+        expanded = _REPEAT.sub(lambda m: m.group(2) * int(m.group(1)), spec)
+        if expanded == spec:
+            break
+        spec = expanded
+    columns = ColumnSpec()
+    for match in _COLUMN.finditer(spec):
+        letter, boxed, width, bar = match.groups()
+        if bar:
+            columns.vlines.append(len(columns.alignments))
+        elif letter or boxed:
+            columns.alignments.append(ALIGNMENTS[letter or boxed])
+            columns.widths.append('1fr' if letter == 'X' else _length(width) if boxed else 'auto')
+    return columns
+
+
+def iter_rows(body: str) -> Iterator[Union[TableRule, List[str]]]:
+    """本文を先頭から読み、罫線（TableRule）と行（セルの列）を1つずつ返す"""
+    cells: List[str] = []
+    parts: List[str] = []
+    depth = 0
+    position = 0
+    for match in _BODY_TOKEN.finditer(body):
+        token = match.group(0)
+        char = token[0]
+        if char == '{' or token.startswith('\\begin{'):
+            depth += 1
+        elif char == '}' or token.startswith('\\end{'):
+            depth -= 1
+        elif depth:
+            continue
+        elif char == '&':
+            parts.append(body[position:match.start()])
+            cells.append(''.join(parts).strip())
+            parts = []
+            position = match.end()
+        elif token.startswith('\\\\') or token == '\\tabularnewline':
+            parts.append(body[position:match.start()])
+            cells.append(''.join(parts).strip())
+            yield cells
+            cells, parts = [], []
+            position = match.end()
+        elif match.group(1):
+            parts.append(body[position:match.start()])
+            position = match.end()
+            # 罫線は行の先頭のものだけ（セルの途中にあるものは取り除く）
+            if not cells and not ''.join(parts).strip():
+                yield TableRule(match.group(1), match.group(3), match.group(2))
+    parts.append(body[position:])
+    last = ''.join(parts).strip()
+    if cells or last:
+        yield cells + [last]
+
+
+def _meta_value(value: str) -> str:
+    """メタコメントの値（空白・カンマ・] を含まない形）"""
+    return re.sub(r'[\s,\]]+', '', value)
+
+
+def _cell_alignment(spec: str) -> Optional[str]:
+    alignments = parse_columns(spec).alignments
+    return alignments[0] if alignments else None
+
+
+class TableConverter:
+    """表の環境を #table(...) に変換（convert_cellはセル1つのTeXをTypstのマークアップに変換する関数）"""
+
+    def __init__(self, convert_cell: Callable[[str], str]):
+        self.convert_cell = convert_cell
+
+    def convert(self, environment: str, columns: str, body: str, width: Optional[str] = None) -> str:
+        return '\n'.join(self.lines(environment, columns, body, width))
+
+    def lines(self, environment: str, columns: str, body: str,
+              width: Optional[str] = None) -> Iterator[str]:
+        """#table(...) の行を1行ずつ生成"""
+        spec = parse_columns(columns)
+        count = max(len(spec.alignments), 1)
+        arguments = [f'columns: {count}' if all(w == 'auto' for w in spec.widths)
+                     else f"columns: ({', '.join(spec.widths)})"]
+        if len(set(spec.alignments)) == 1:
+            arguments.append(f'align: {spec.alignments[0]}')
+        elif spec.alignments:
+            arguments.append(f"align: ({', '.join(spec.alignments)})")
+        yield f"#table({', '.join(arguments)},"
+        for x in sorted(set(spec.vlines)):
+            yield f"\ttable.vline(x: {min(x, count)}),"
+        for item in iter_rows(body):
+            if isinstance(item, TableRule):
+                yield self._rule(item, count)
+            else:
+                yield self._row(item)
+        meta = f"//[table env:{environment} cols:{_meta_value(columns)}"
+        if width:
+            meta += f" width:{_meta_value(width)}"
+        yield f") {meta}]"
+
+    @staticmethod
+    def _rule(rule: TableRule, count: int) -> str:
+        """罫線を table.hline に（longtable の区切りはメタコメントだけ残す）"""
+        meta = f"//[table rule:{rule.name}"
+        if rule.trim:
+            meta += f" trim:{rule.trim}"
+        if rule.columns:
+            meta += f" columns:{_meta_value(rule.columns)}"
+        meta += "]"
+        if rule.name in MARKS or rule.name == 'addlinespace':
+            return f"\t{meta}"
+        span = _COLUMN_RANGE.fullmatch(rule.columns.strip()) if rule.columns else None
+        if span:
+            start, end = int(span.group(1)) - 1, min(int(span.group(2)), count)
+            return f"\ttable.hline(start: {start}, end: {end}), {meta}"
+        return f"\ttable.hline(), {meta}"
+
+    def _row(self, cells: List[str]) -> str:
+        """1行のセルを変換（\\multicolumn は table.cell(colspan: ..) にしてメタコメントに残す）"""
+        parts = []
+        spans = []
+        column = 0
+        for cell in cells:
+            multicolumn = _MULTICOLUMN.match(cell)
+            if multicolumn:
+                colspan, cell_spec, cell = multicolumn.groups()
+                alignment = _cell_alignment(cell_spec)
+                arguments = f"colspan: {colspan}" + (f", align: {alignment}" if alignment else '')
+                parts.append(f"table.cell({arguments}){self._content(cell)}")
+                spans.append(f"{column}/{colspan}/{_meta_value(cell_spec)}")
+                column += int(colspan)
+            else:
+                parts.append(self._content(cell))
+                column += 1
+        line = f"\t{', '.join(parts)},"
+        if spans:
+            line += f" //[table multicolumn:{';'.join(spans)}]"
+        return line
+
+    def _content(self, cell: str) -> str:
+        """セルの内容を [..] に（行末コメントを含む場合は ] を次の行に置く）"""
+        if not cell.strip():
+            return '[]'
+        content = self.convert_cell(cell.strip())
+        return f"[{content}\n]" if '//' in content else f"[{content}]"
@@ -3,22 +3,83 @@
 TeXからTypstへの変換器
 """
 
-from typing import List, Optional
+import re
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+from ..options import PrettyOptions
 from ..parser.ast import (
     ASTNode, DocumentNode, SectionNode, MathNode, TheoremNode, 
-    ReferenceNode, TextNode, NormNode, AbsNode, NodeType
+    ReferenceNode, TextNode, NormNode, AbsNode, TableNode, NodeType
 )
-from ..utils.meta_comments import MetaCommentGenerator
-from ..utils.labels import LabelManager
+from ..utils.meta_comments import MetaCommentGenerator, MetaSidecarEntry, meta_sidecar
+from ..utils.labels import LabelManager, LabelRecord, label_extractor
+from ..utils.patterns import patterns
+from .math_cache import DEFAULT_MATH_CACHE_SIZE, MathCache
+from .math_passes import INLINE_MATH_TEXT_PASSES, math_pass_manager
+from .matrices import MatrixConverter
+from .tables import TableConverter
+from .text_passes import TEXT_PASSES
+from .passes import PassStatistics
+from .pretty import Block, Concat, Doc, PrettyPrinter, lines, markup, pretty_printer
+
+
+# 表のセルの中のインライン数式（\$ は除く）と、テキストのメタコメント・角括弧
+_CELL_MATH = re.compile(r'(?<!\\)\$(.+?)(?<!\\)\$', re.DOTALL)
+_CELL_BRACKETS = re.compile(r'//\[[^\]]*\]|[\[\]]')
+# 変換で変わり得る文字（含まないセルはそのまま出力する）
+_CELL_SPECIAL = re.compile(r'[\\$\[\]\n\t]')
+# 参照の後の同じ行の内容（行頭の空白は除く）
+_LINE_REST = re.compile(r'[ \t]*([^\n])?')
 
 
 class TeXToTypstTransformer:
     """TeXからTypstへの変換器"""
     
-    def __init__(self):
+    # ノード種別ごとの変換メソッド（文書を返す。表にない種別は未知のノードとして出力）
+    NODE_HANDLERS: Dict[NodeType, str] = {
+        NodeType.SECTION: '_transform_section',
+        NodeType.SUBSECTION: '_transform_section',
+        NodeType.MATH_INLINE: '_transform_inline',
+        NodeType.MATH_DISPLAY: '_transform_math_display',
+        NodeType.MATH_ALIGN: '_transform_math_align',
+        NodeType.MATH_ALIGN_STAR: '_transform_math_align_star',
+        NodeType.THEOREM: '_transform_theorem',
+        NodeType.LEMMA: '_transform_theorem',
+        NodeType.PROPOSITION: '_transform_theorem',
+        NodeType.COROLLARY: '_transform_theorem',
+        NodeType.DEFINITION: '_transform_theorem',
+        NodeType.REMARK: '_transform_theorem',
+        NodeType.EXAMPLE: '_transform_theorem',
+        NodeType.PROOF: '_transform_theorem',
+        NodeType.REF: '_transform_reference',
+        NodeType.EQREF: '_transform_reference',
+        NodeType.CITE: '_transform_reference',
+        NodeType.TEXT: '_transform_text',
+        NodeType.NORM: '_transform_inline',
+        NodeType.ABS: '_transform_inline',
+        NodeType.TABLE: '_transform_table',
+    }
+    # 数式の中に現れるノードの変換メソッド（文字列を返す）
+    INLINE_HANDLERS: Dict[NodeType, str] = {
+        NodeType.MATH_INLINE: '_transform_math_inline',
+        NodeType.NORM: '_transform_norm',
+        NodeType.ABS: '_transform_abs',
+    }
+    
+    def __init__(self, meta_mode: str = "inline", split_variables: bool = True,
+                 pretty: Optional[PrettyOptions] = None,
+                 math_cache_size: int = DEFAULT_MATH_CACHE_SIZE, math_cache: Optional[MathCache] = None):
         self.meta_comment_generator = MetaCommentGenerator()
         self.label_manager = LabelManager()
         
+        # メタコメントの出力方式（inline: 行末コメント, sidecar: .typ.tyxmeta に退避）
+        self.meta_mode = meta_mode
+        # sidecarモードで直前のtransform()が退避したメタコメント
+        self.meta_entries: List[MetaSidecarEntry] = []
+        # 変数の空白分離（README §12 tokenSplit.variables）
+        self.split_variables = split_variables
+        # 出力の整形（README §10、設定が既定値の場合は共有のプリンター）
+        self.printer = PrettyPrinter(pretty) if pretty is not None else pretty_printer
+        
         # 数式記号のUnicodeマッピング
         self.math_symbols = {
             'alpha': 'α',
@@ -98,6 +159,19 @@ class TeXToTypstTransformer:
             'erf': 'erf',
         }
         
+        # 数式内容の書き換えパス（表と設定ごとに共有）と実行・省略の集計
+        self.math_passes = math_pass_manager(tuple(self.math_accents.items()),
+                                             tuple(self.math_functions.items()),
+                                             self.split_variables)
+        self.pass_stats = PassStatistics()
+        # 同じ数式の変換結果のキャッシュ（命中した数式は書き換えパスを実行しないため、pass_statsにも数えない）
+        # Converterから渡された場合は、同じ設定の変換器の間で共有する
+        self.math_cache = math_cache if math_cache is not None else MathCache(math_cache_size)
+        # 行列環境の変換（セルは1つずつ数式として変換）
+        self.matrices = MatrixConverter(self._transform_math_content)
+        # 表の変換（セルは行を出力するときに1つずつ変換）
+        self.tables = TableConverter(self._transform_table_cell)
+        
         # 数式演算子のUnicodeマッピング
         self.math_operators = {
             'sum': 'Σ',
@@ -110,155 +184,114 @@ class TeXToTypstTransformer:
             'inf': 'inf',
         }
     
+        # ノード種別 → 変換メソッドの表
+        self.node_handlers: Dict[NodeType, Callable[[ASTNode], Doc]] = {
+            node_type: getattr(self, method) for node_type, method in self.NODE_HANDLERS.items()
+        }
+        self.inline_handlers: Dict[NodeType, Callable[[ASTNode], str]] = {
+            node_type: getattr(self, method) for node_type, method in self.INLINE_HANDLERS.items()
+        }
+    
     def transform(self, ast: DocumentNode) -> str:
         """ASTをTypstに変換"""
-        typst_content = []
-        
-        # ドキュメント開始
-        typst_content.append("#import \"article.typ\": *")
-        typst_content.append("")
+        # ドキュメント開始と各子要素の文書
+        parts = [lines(line) for line in self.document_header()]
+        parts.extend(self._transform_node(child) for child in ast.children)
         
-        # 各子要素を変換
-        for child in ast.children:
-            typst_content.append(self._transform_node(child))
+        # インデント・空行・行長の規則を適用して描画
+        result = self.printer.render(Concat(tuple(parts)))
         
-        # 最後に統一的なインデント処理を実行
-        result = "\n".join(typst_content)
-        # result = self._normalize_indentation(result)
+        # sidecarモードではメタコメントを本文から取り除いて保持
+        if self.meta_mode == "sidecar":
+            result, self.meta_entries = meta_sidecar.split(result)
+        else:
+            self.meta_entries = []
         
         return result
     
-    def _normalize_indentation(self, content: str) -> str:
-        """統一的なインデント処理を実行"""
-        import re
-        
-        lines = content.split('\n')
-        normalized_lines = []
-        
-        for line in lines:
-            # 数式のインデントを正規化
-            if line.strip().startswith('$') and line.strip().endswith('$'):
-                # インライン数式はインデントなし
-                if '//[formula type:' not in line:
-                    normalized_lines.append(line.strip())
-                    continue
-            
-            # ディスプレイ数式のインデント正規化
-            if '//[formula type:display]' in line:
-                # 数式ブロック全体を1レベルインデント
-                if line.strip().startswith('$'):
-                    normalized_lines.append('\t' + line.strip())
-                elif line.strip().endswith('$'):
-                    normalized_lines.append('\t' + line.strip())
-                else:
-                    normalized_lines.append('\t' + line.strip())
-                continue
-            
-            # ディスプレイ数式の開始行（単独の$）も1レベルインデント
-            if line.strip() == '$' and not line.startswith('\t'):
-                # align環境の最初の$は既にインデントされているのでスキップ
-                current_index = len(normalized_lines)
-                if current_index + 1 < len(lines) and '//[formula type:align' in lines[current_index + 1]:
-                    normalized_lines.append(line.strip())
-                else:
-                    normalized_lines.append('\t' + line.strip())
-                continue
-            
-            
-            # cases環境のインデント正規化
-            if 'cases(' in line or '//[command type:cases]' in line:
-                # cases( は1レベルインデント
-                if line.strip().startswith('cases('):
-                    normalized_lines.append('\t' + line.strip())
-                # cases終了の ) //[command type:cases] は1レベルインデント
-                elif line.strip().endswith('//[command type:cases]'):
-                    normalized_lines.append('\t' + line.strip())
-                # cases内の各行は2レベルインデント
-                elif line.strip() and not line.strip().startswith(')'):
-                    normalized_lines.append('\t\t' + line.strip())
-                else:
-                    normalized_lines.append(line)
-                continue
-            
-            # その他の行はそのまま
-            normalized_lines.append(line)
-        
-        return '\n'.join(normalized_lines)
-    
-    def _transform_node(self, node: ASTNode) -> str:
-        """ノードをTypstに変換"""
-        if node.node_type == NodeType.SECTION:
-            return self._transform_section(node)
-        elif node.node_type == NodeType.SUBSECTION:
-            return self._transform_section(node)
-        elif node.node_type == NodeType.MATH_INLINE:
-            return self._transform_math_inline(node)
-        elif node.node_type == NodeType.MATH_DISPLAY:
-            return self._transform_math_display(node)
-        elif node.node_type == NodeType.MATH_ALIGN:
-            return self._transform_math_align(node)
-        elif node.node_type == NodeType.MATH_ALIGN_STAR:
-            return self._transform_math_align_star(node)
-        elif node.node_type == NodeType.THEOREM:
-            return self._transform_theorem(node)
-        elif node.node_type == NodeType.LEMMA:
-            return self._transform_theorem(node)
-        elif node.node_type == NodeType.PROPOSITION:
-            return self._transform_theorem(node)
-        elif node.node_type == NodeType.COROLLARY:
-            return self._transform_theorem(node)
-        elif node.node_type == NodeType.DEFINITION:
-            return self._transform_theorem(node)
-        elif node.node_type == NodeType.REMARK:
-            return self._transform_theorem(node)
-        elif node.node_type == NodeType.EXAMPLE:
-            return self._transform_theorem(node)
-        elif node.node_type == NodeType.PROOF:
-            return self._transform_theorem(node)
-        elif node.node_type == NodeType.REF:
-            return self._transform_reference(node)
-        elif node.node_type == NodeType.EQREF:
-            return self._transform_reference(node)
-        elif node.node_type == NodeType.CITE:
-            return self._transform_reference(node)
-        elif node.node_type == NodeType.TEXT:
-            return self._transform_text(node)
-        elif node.node_type == NodeType.NORM:
-            return self._transform_norm(node)
-        elif node.node_type == NodeType.ABS:
-            return self._transform_abs(node)
-        else:
-            return f"// Unknown node type: {node.node_type}"
+    def document_header(self) -> List[str]:
+        """文書先頭の行"""
+        return ["#import \"article.typ\": *", ""]
+    
+    def transform_body(self, ast: DocumentNode) -> str:
+        """文書先頭の行を付けずに子要素のみを変換（断片のプレビュー用）"""
+        return self.printer.render(Concat(tuple(self._transform_node(child) for child in ast.children)))
+    
+    def _transform_node(self, node: ASTNode) -> Doc:
+        """ノードを文書に変換（ノード種別から変換メソッドを引く）"""
+        handler = self.node_handlers.get(node.node_type)
+        if handler is None:
+            return lines(f"// Unknown node type: {node.node_type}")
+        return handler(node)
     
-    def _transform_section(self, node: SectionNode) -> str:
+    def _transform_section(self, node: SectionNode) -> Doc:
         """セクションを変換"""
         if node.level == 1:
-            return f"= {node.title}"
+            return lines(f"= {node.title}")
         elif node.level == 2:
-            return f"== {node.title}"
+            return lines(f"== {node.title}")
         elif node.level == 3:
-            return f"=== {node.title}"
+            return lines(f"=== {node.title}")
         else:
-            return f"= {node.title}"
+            return lines(f"= {node.title}")
+    
+    def _transform_inline(self, node: ASTNode) -> Doc:
+        """本文の間に置かれた数式のノードを変換"""
+        return lines(self.inline_handlers[node.node_type](node))
     
     def _transform_math_inline(self, node: MathNode) -> str:
-        """インライン数式を変換"""
-        # 子ノードがある場合は子ノードを変換
+        """インライン数式を変換（本文だけで結果が決まる数式はキャッシュする）"""
+        key = self._math_inline_key(node)
+        if key is None:
+            return self._convert_math_inline(node)
+        # キャッシュは正規化した本文を渡すため、ノードではなく本文から変換する
+        if key[0] == 'inline':
+            return self.math_cache.convert(
+                'inline', key[1], lambda content: self._finish_math_inline(self._convert_math_content(content)))
+        return self.math_cache.convert(key[0], key[1], lambda texts: self._finish_math_inline(''.join(
+            self.matrices.convert(text, self._transform_inline_math_text) for text in texts)))
+    
+    @staticmethod
+    def _math_inline_key(node: MathNode) -> Optional[Tuple[str, Hashable]]:
+        """キャッシュのキー（参照を含むなど、本文以外に依存する場合はNone）"""
+        if not node.children:
+            return 'inline', node.content
+        if all(child.node_type == NodeType.TEXT and not child.get_attribute('label_records')
+               for child in node.children):
+            return 'inline.text', tuple(child.content for child in node.children)
+        return None
+    
+    def _convert_math_inline(self, node: MathNode) -> str:
+        """インライン数式を変換（キャッシュを使わない）"""
         if node.children:
-            content_parts = []
-            # 特殊なノード（AbsNode、NormNode）がある場合は、それらのみを使用
-            special_nodes = [child for child in node.children if child.node_type in [NodeType.ABS, NodeType.NORM]]
-            if special_nodes:
-                for child in special_nodes:
-                    content_parts.append(self._transform_node(child))
-            else:
-                # 特殊なノードがない場合はすべての子ノードを使用
-                for child in node.children:
-                    content_parts.append(self._transform_node(child))
-            content = "".join(content_parts)
+            content = self._transform_math_children(node)
         else:
-            content = self._transform_math_content(node.content)
-        
+            content = self._convert_math_content(node.content)
+        return self._finish_math_inline(content)
+    
+    def _transform_math_children(self, node: MathNode) -> str:
+        """インライン数式の子ノードを変換"""
+        content_parts = []
+        # 特殊なノード（AbsNode、NormNode）がある場合は、それらのみを使用
+        special_nodes = [child for child in node.children if child.node_type in [NodeType.ABS, NodeType.NORM]]
+        if special_nodes:
+            for child in special_nodes:
+                content_parts.append(self.inline_handlers[child.node_type](child))
+        else:
+            # 特殊なノードがない場合はすべての子ノードを使用
+            for child in node.children:
+                if child.node_type == NodeType.TEXT:
+                    content_parts.append(self.matrices.convert(child.content, self._transform_inline_math_text))
+                else:
+                    content_parts.append(self.inline_handlers[child.node_type](child))
+        return "".join(content_parts)
+    
+    def _transform_inline_math_text(self, content: str) -> str:
+        """インライン数式のテキストの子ノードを変換（テキスト内容の変換と \\operatorname の変換）"""
+        return INLINE_MATH_TEXT_PASSES.run(self._transform_text_content(content), self.pass_stats)
+    
+    def _finish_math_inline(self, content: str) -> str:
+        """^と_の後の1文字の括弧を外して$で囲む"""
         # 最後の処理：^と_の後の(?)や{?}を?にする変換（1文字の場合のみ）
         import re
         content = re.sub(r'([\^_])\((.)\)', r'\1\2', content)
@@ -266,7 +299,7 @@ class TeXToTypstTransformer:
         
         return f"${content}$"
     
-    def _transform_math_display(self, node: MathNode) -> str:
+    def _transform_math_display(self, node: MathNode) -> Doc:
         """ディスプレイ数式を変換"""
         content = self._transform_math_content(node.content)
         
@@ -280,13 +313,13 @@ class TeXToTypstTransformer:
             
             # パーサーで抽出されたlabelを使用
             if hasattr(node, 'label') and node.label:
-                return f"\t$\n\t{content}\n\t$ {end_command}\n\t<{node.label}>"
+                return lines(f"\t$\n\t{content}\n\t$ {end_command}\n\t<{node.label}>")
             else:
-                return f"\t$\n\t{content}\n\t$ {end_command}"
+                return lines(f"\t$\n\t{content}\n\t$ {end_command}")
         else:
-            return f"\t$\n\t{content}\n\t$ //[formula type:display]\n"
+            return lines(f"\t$\n\t{content}\n\t$ //[formula type:display]\n")
     
-    def _transform_math_align(self, node: MathNode) -> str:
+    def _transform_math_align(self, node: MathNode) -> Doc:
         """align環境を変換"""
         # align環境の内容を解析してTypstのalign形式に変換
         content, _ = self._transform_align_content(node.content)
@@ -299,17 +332,17 @@ class TeXToTypstTransformer:
         
         # パーサーで抽出されたlabelを使用
         if hasattr(node, 'label') and node.label:
-            return f"\t$\n\t{content}\n\t$ {end_command}\n\t<{node.label}>"
+            return lines(f"\t$\n\t{content}\n\t$ {end_command}\n\t<{node.label}>")
         else:
-            return f"\t$\n\t{content}\n\t$ {end_command}"
+            return lines(f"\t$\n\t{content}\n\t$ {end_command}")
     
-    def _transform_math_align_star(self, node: MathNode) -> str:
+    def _transform_math_align_star(self, node: MathNode) -> Doc:
         """align*環境を変換"""
         # align*環境の内容を解析してTypstのalign形式に変換
         content, _ = self._transform_align_content(node.content)
-        return f"\t$\n{content}\n\t$ //[formula type:align*]"
+        return lines(f"\t$\n{content}\n\t$ //[formula type:align*]")
     
-    def _transform_theorem(self, node: TheoremNode) -> str:
+    def _transform_theorem(self, node: TheoremNode) -> Doc:
         """定理環境を変換"""
         # 定理タイプのマッピング
         theorem_type_map = {
@@ -350,28 +383,86 @@ class TeXToTypstTransformer:
             node.theorem_type
         )
         
-        if args_str:
-            return f"#{typst_type}({args_str})[\n{content}\n] {meta_comment}"
-        else:
-            return f"#{typst_type}[\n{content}\n] {meta_comment}"
+        opening = f"#{typst_type}({args_str})[" if args_str else f"#{typst_type}["
+        return Block(lines(opening), markup(content), lines(f"] {meta_comment}"))
     
-    def _transform_reference(self, node: ReferenceNode) -> str:
+    def _transform_reference(self, node: ReferenceNode) -> Doc:
         """参照を変換"""
-        if node.ref_type == "ref":
-            return f"@{node.target} //[ref type:ref]"
+        if node.ref_type == "cite":
+            return lines(self._format_reference("cite", node.get_attribute('keys') or [node.target]))
         elif node.ref_type == "eqref":
-            return f"@{node.target} //[ref type:eqref]"
-        elif node.ref_type == "cite":
-            return f"@{node.target} //[ref type:cite]"
+            return lines(self._format_reference("eqref", [node.target]))
         else:
-            return f"@{node.target} //[ref type:ref]"
+            return lines(self._format_reference("ref", [node.target]))
     
-    def _transform_text(self, node: TextNode) -> str:
+    def _format_reference(self, ref_type: str, targets: List[str]) -> str:
+        """参照を出力形式に整形（複数キーの引用は「,」の行で区切る）"""
+        return "\n,\n".join(f"@{target} //[ref type:{ref_type}]" for target in targets)
+    
+    def _transform_text(self, node: TextNode) -> Doc:
         """テキストを変換"""
-        return self._transform_text_content(node.content)
+        return markup(self._transform_text_content(node.content, node.get_attribute('label_records')))
+    
+    def _transform_table(self, node: TableNode) -> Doc:
+        """表の環境を #table(...) に変換（セルの内容はマークアップ）"""
+        return markup(self.tables.convert(node.environment, node.columns, node.content, node.width))
+    
+    def _transform_table_cell(self, content: str) -> str:
+        """表のセルを変換（$...$ は数式として、それ以外はテキストとして変換し、[ ] はエスケープ）"""
+        if not _CELL_SPECIAL.search(content):
+            return content
+        parts = []
+        position = 0
+        for match in _CELL_MATH.finditer(content):
+            parts.append(self._table_cell_text(content[position:match.start()]))
+            parts.append(self._finish_math_inline(self._transform_math_content(match.group(1))))
+            position = match.end()
+        parts.append(self._table_cell_text(content[position:]))
+        return ''.join(parts)
+    
+    def _table_cell_text(self, content: str) -> str:
+        if not content:
+            return content
+        content = self._transform_text_content(content)
+        
+        def escape(match: 're.Match') -> str:
+            # メタコメントはそのまま残し、続く内容は次の行に送る（行末コメントに含まれないよう）
+            if len(match.group(0)) > 1:
+                following = content[match.end():match.end() + 1]
+                return match.group(0) + ('\n' if following not in ('', '\n') else '')
+            return '\\' + match.group(0)
+        return _CELL_BRACKETS.sub(escape, content)
+    
+    def _replace_references(self, content: str, records: List[LabelRecord]) -> str:
+        """抽出済みのレコードを使って参照・引用を置換"""
+        parts = []
+        last_end = 0
+        index = 0
+        while index < len(records):
+            record = records[index]
+            if record.kind == 'label':
+                index += 1
+                continue
+            # 同じコマンドから得たレコード（複数キーの引用）をまとめる
+            targets = []
+            while index < len(records) and records[index].start == record.start:
+                targets.append(records[index].target)
+                index += 1
+            parts.append(content[last_end:record.start])
+            parts.append(self._format_reference(record.kind, targets))
+            last_end = record.end
+            # 続く内容は次の行に送る（行末コメントに含まれないよう）
+            following = _LINE_REST.match(content, last_end)
+            if following.group(1):
+                parts.append('\n')
+                last_end = following.start(1)
+        parts.append(content[last_end:])
+        return "".join(parts)
     
     def _transform_norm(self, node: NormNode) -> str:
         """ノルム記号を変換"""
+        import re
+        
         # 子ノードがある場合は、それらを置換してから残りの内容を処理
         if node.children:
             inner_content = node.content
@@ -379,9 +470,7 @@ class TeXToTypstTransformer:
             for child in node.children:
                 if child.node_type == NodeType.ABS:
                     # 絶対値記号のパターンを検索して置換
-                    import re
-                    abs_pattern = r'\\bigg\s*\|(.*?)\\bigg\s*\|'
-                    match = re.search(abs_pattern, inner_content, re.DOTALL)
+                    match = patterns['parser.abs_bigg'].search(inner_content)
                     if match and match.group(1).strip() == child.content:
                         replacement = self._transform_abs(child)
                         inner_content = inner_content[:match.start()] + replacement + inner_content[match.end():]
@@ -409,8 +498,6 @@ class TeXToTypstTransformer:
     
     def _transform_norm_content_iterative(self, content: str) -> str:
         """ノルム記号の内容を反復的に変換"""
-        import re
-        
         # 変換が起こらなくなるまで繰り返す
         prev_content = ""
         current_content = content
@@ -419,8 +506,7 @@ class TeXToTypstTransformer:
             prev_content = current_content
             
             # \| ... \|_{...} を norm(...)_(...) に変換
-            pattern = r'\\\|\s*([^|]+?)\s*\\\|\s*_\{\s*(.*?)\s*\}'
-            match = re.search(pattern, current_content, re.DOTALL)
+            match = patterns['math.norm_bars'].search(current_content)
             
             if match:
                 inner = match.group(1).strip()
@@ -443,8 +529,6 @@ class TeXToTypstTransformer:
     
     def _transform_abs_content_iterative(self, content: str) -> str:
         """絶対値記号の内容を反復的に変換"""
-        import re
-        
         # 変換が起こらなくなるまで繰り返す
         prev_content = ""
         current_content = content
@@ -453,8 +537,7 @@ class TeXToTypstTransformer:
             prev_content = current_content
             
             # \bigg| ... \bigg| を abs(...) に変換
-            pattern = r'\\bigg\s*\|(.*?)\\bigg\s*\|'
-            match = re.search(pattern, current_content, re.DOTALL)
+            match = patterns['parser.abs_bigg'].search(current_content)
             
             if match:
                 inner = match.group(1).strip()
@@ -466,49 +549,32 @@ class TeXToTypstTransformer:
         
         return current_content
     
-    def _transform_text_content(self, content: str) -> str:
-        """テキスト内容を変換"""
-        import re
+    def _transform_text_content(self, content: str,
+                                records: Optional[List[LabelRecord]] = None) -> str:
+        """テキスト内容を変換
         
+        recordsはパーサーが抽出したラベル・参照（未指定の場合はここで抽出）。
+        """
         # 参照の変換
-        content = re.sub(r'\\ref\{([^}]+)\}', r'@\1 //[ref type:ref]', content)
-        content = re.sub(r'\\eqref\{([^}]+)\}', r'@\1 //[ref type:eqref]', content)
-        content = re.sub(r'\\cite\{([^}]+)\}', r'@\1 //[ref type:cite]', content)
-        
-        # 残存するTeXコマンドの処理
-        content = re.sub(r'\\end\{[^}]+\}', '', content)  # \end{Lemma}等を除去
-        content = re.sub(r'\\noindent', '', content)  # \noindentを除去
-        
-        # 重複した内容を除去（同じ内容が連続している場合）
-        lines = content.split('\n')
-        cleaned_lines = []
-        prev_line = None
-        for line in lines:
-            if line.strip() != prev_line:
-                cleaned_lines.append(line)
-                prev_line = line.strip()
-        content = '\n'.join(cleaned_lines)
-        
-        # 基本的なエスケープ処理（必要最小限）
-        # content = content.replace("\\", "\\\\")  # コメントアウト：preambleで問題になる
-        
-        # タブ+スペースをタブに正規化（複数回適用）
-        while '\t ' in content:
-            content = re.sub(r'\t ', '\t', content)
-        
+        if records is None:
+            records = label_extractor.scan_tex(content)
+        content = self._replace_references(content, records)
         
+        # 残存するTeXコマンドの除去・重複行の除去・タブの正規化
         # 通常テキストでは変数の空白分離は行わない（数式のみで実施）
-        
-        return content
+        return TEXT_PASSES.run(content, self.pass_stats)
     
-    def _transform_align_content(self, content: str) -> str:
-        """align環境の内容を変換"""
+    def _transform_align_content(self, content: str) -> Tuple[str, Optional[str]]:
+        """align環境の内容を変換し、(内容, \\label の名前) を返す"""
         import re
         
+        # 行列環境を先に変換して保護（本文の & と \\ で行・列に分けないよう）
+        content, matrices = self.matrices.protect(content)
+        
         # \labelを最初に抽出して除去
-        label_match = re.search(r'\\label\{([^}]+)\}', content)
+        label_match = patterns['command.label'].search(content)
         label_name = label_match.group(1) if label_match else None
-        content = re.sub(r'\\label\{[^}]+\}', '', content)
+        content = patterns['command.label'].sub('', content)
         
         # 行を分割
         lines = content.split('\n')
@@ -558,9 +624,7 @@ class TeXToTypstTransformer:
         # Typstのalign形式に変換（README.mdの仕様に従う）
         if len(converted_lines) == 1:
             result = converted_lines[0]
-            # タブ+スペースをタブに正規化
-            result = re.sub(r'\t ', '\t', result)
-            return result, label_name
+            return self.matrices.restore(result, matrices), label_name
         else:
             # 各行にタブを追加し、\\を\に変換
             tabbed_lines = []
@@ -606,381 +670,13 @@ class TeXToTypstTransformer:
                     new_lines.append(line)
             
             result = '\n'.join(new_lines)
-            
-            # タブ+スペースをタブに正規化
-            result = re.sub(r'\t ', '\t', result)
-            
-            return result, label_name
+            return self.matrices.restore(result, matrices), label_name
     
     def _transform_math_content(self, content: str) -> str:
-        """数式内容を変換（記号変換は前処理で完了済み）"""
-        import re
-        
-        
-        # 数式アクセントの変換（最初に実行）
-        for tex_accent, typst_accent in self.math_accents.items():
-            pattern = r'\\' + re.escape(tex_accent) + r'\{([^}]+)\}'
-            replacement = typst_accent + r'(\1)'
-            content = re.sub(pattern, replacement, content)
-        
-        # 分数の変換は前処理で完了済み
-        
-        # 数式演算子の変換（前処理で完了済みのため不要）
-        # 残存するコマンドのみ処理
-        content = re.sub(r'\\int(?![a-zA-Z])', '∫', content)
-        content = re.sub(r'\\iint(?![a-zA-Z])', '∬', content)
-        content = re.sub(r'\\iiint(?![a-zA-Z])', '∭', content)
-        content = re.sub(r'\\oint(?![a-zA-Z])', '∮', content)
-        
-        # 特別な処理：∫_{ℂ dot.double(f) を ∫_(ℂ) dot.double(f) に変換（最初に処理）
-        if '∫_{' in content and 'dot.double(' in content:
-            # ∫_{ から dot.double( の前までを () で囲む
-            start = content.find('∫_{')
-            dot_start = content.find('dot.double(')
-            if start != -1 and dot_start != -1 and dot_start > start:
-                inner_content = content[start+3:dot_start-1]  # 空白を除く
-                content = content[:start+2] + '(' + inner_content + ') ' + content[dot_start:]
-        
-        # 積分記号の下付き・上付き文字の {} を () に変換（特別な処理の後は除外）
-        if '∫_{' not in content or 'dot.double(' not in content:
-            content = re.sub(r'∫_\{([^}]+)\}', r'∫_(\1)', content)
-        # 下付き文字の処理（数式アクセントの後）
-        # ∫_(ℂ) dot.double(f) の状態では処理をスキップ
-        if not (content.count('∫_(') == 1 and 'dot.double(' in content):
-            content = re.sub(r'∫_([^{}]+)', r'∫_(\1)', content)
-        
-        # 余分な括弧を修正：∫_((ℋ_+) hat(f)) → ∫_(ℋ_+) hat(f)
-        content = re.sub(r'∫_\(\(([^)]+)\)\s+([^)]+)\)', r'∫_(\1) \2', content)
-        # Σ_{𝔄} を Σ_(𝔄) に修正
-        content = re.sub(r'Σ_\{([^}]+)\}', r'Σ_(\1)', content)
-        # \| ... \|_{...} を norm(...)_(...) に変換（括弧バランス考慮）
-        def process_norm_balanced(text):
-            """ノルム記号を括弧バランスを考慮して処理"""
-            # 変換が起こらなくなるまで繰り返す
-            prev_text = ""
-            current_text = text
-            
-            while prev_text != current_text:
-                prev_text = current_text
-                
-                # ノルム記号の開始位置を検索
-                start_pos = current_text.find('\\|')
-                if start_pos == -1:
-                    break
-                
-                # ノルム記号の終了位置を検索（括弧のバランスを考慮）
-                norm_end = find_norm_end(current_text, start_pos)
-                if norm_end == -1:
-                    break
-                
-                # ノルム記号の内容を抽出
-                norm_content = current_text[start_pos:norm_end]
-                
-                # \| ... \|_{...} のパターンを解析
-                norm_match = re.match(r'\\\|\s*(.*?)\s*\\\|\s*_\{\s*(.*?)\s*\}', norm_content, re.DOTALL)
-                if norm_match:
-                    inner = norm_match.group(1).strip()
-                    subscript = norm_match.group(2).strip()
-                    
-                    # 置換を実行
-                    replacement = f'norm({inner})_({subscript})'
-                    current_text = current_text[:start_pos] + replacement + current_text[norm_end:]
-            
-            return current_text
-        
-        def find_norm_end(text, start_pos):
-            """ノルム記号の終了位置を検索（括弧のバランスを考慮）"""
-            pos = start_pos + 2  # \| の後
-            brace_count = 0
-            in_subscript = False
-            
-            while pos < len(text):
-                if text[pos:pos+2] == '\\|' and brace_count == 0:
-                    # ノルム記号の終了を発見
-                    pos += 2
-                    # 下付き文字の開始を検索
-                    while pos < len(text) and text[pos] in ' \t':
-                        pos += 1
-                    if pos < len(text) and text[pos] == '_':
-                        pos += 1
-                        while pos < len(text) and text[pos] in ' \t':
-                            pos += 1
-                        if pos < len(text) and text[pos] == '{':
-                            pos += 1
-                            brace_count = 1
-                            in_subscript = True
-                            while pos < len(text) and brace_count > 0:
-                                if text[pos] == '{':
-                                    brace_count += 1
-                                elif text[pos] == '}':
-                                    brace_count -= 1
-                                pos += 1
-                            return pos
-                    return pos
-                elif text[pos] == '{' and not in_subscript:
-                    brace_count += 1
-                elif text[pos] == '}' and not in_subscript:
-                    brace_count -= 1
-                pos += 1
-            
-            return -1
-        
-        content = process_norm_balanced(content)
-        # 残存する下付き文字の {} を () に変換（複雑な内容に対応）
-        content = re.sub(r'∫_\{([^{}]*(?:\([^)]*\)[^{}]*)*)\}', r'∫_(\1)', content)
-        # 下付き文字の処理を正しく修正
-        # ∫_{...} の { から } までを正しく抽出
-        content = re.sub(r'∫_\{([^}]+)\}', r'∫_(\1)', content)
-        # より直接的なアプローチ：∫_{ から最後の } までを () に変換
-        if '∫_{' in content:
-            start = content.find('∫_{')
-            if start != -1:
-                # 最後の } を見つける
-                end = content.rfind('}')
-                if end != -1 and end > start:
-                    inner_content = content[start+3:end]
-                    content = content[:start+2] + '(' + inner_content + ')' + content[end+1:]
-                else:
-                    # } がない場合は、∫_{ の後のすべてを () で囲む
-                    inner_content = content[start+3:]
-                    content = content[:start+2] + '(' + inner_content + ')'
-        content = re.sub(r'∬_\{([^}]+)\}', r'∬_(\1)', content)
-        content = re.sub(r'∭_\{([^}]+)\}', r'∭_(\1)', content)
-        content = re.sub(r'∮_\{([^}]+)\}', r'∮_(\1)', content)
-        # 単一文字の下付き文字も処理（Unicode文字を含む）
-        content = re.sub(r'∮_([A-Za-zΑ-Ωα-ω])', r'∮_(\1)', content)
-        # 単一文字の下付き文字も処理（Unicode文字を含む）
-        content = re.sub(r'∫_([A-Za-zΑ-Ωα-ω])', r'∫_(\1)', content)
-        # 上付き文字の処理（単一文字を先に処理）
-        content = re.sub(r'∫\^([a-zA-Z0-9∞])', r'∫^(\1)', content)
-        content = re.sub(r'∬\^([a-zA-Z0-9∞])', r'∬^(\1)', content)
-        content = re.sub(r'∭\^([a-zA-Z0-9∞])', r'∭^(\1)', content)
-        content = re.sub(r'∮\^([a-zA-Z0-9∞])', r'∮^(\1)', content)
-        content = re.sub(r'∫\^\{([^}]+)\}', r'∫^(\1)', content)
-        content = re.sub(r'∬\^\{([^}]+)\}', r'∬^(\1)', content)
-        content = re.sub(r'∭\^\{([^}]+)\}', r'∭^(\1)', content)
-        content = re.sub(r'∮\^\{([^}]+)\}', r'∮^(\1)', content)
-        # 一般的な上付き文字の {} を () に変換
-        content = re.sub(r'\^\{([^}]+)\}', r'^(\1)', content)
-        
-        # 数式アクセントの変換（下付き文字の処理より前に実行）
-        for tex_accent, typst_accent in self.math_accents.items():
-            pattern = r'\\' + re.escape(tex_accent) + r'\{([^}]+)\}'
-            replacement = typst_accent + r'(\1)'
-            content = re.sub(pattern, replacement, content)
-        
-        # 残存する\fracと\sqrtを処理
-        content = re.sub(r'\\frac\{([^}]+)\}\{([^}]+)\}', r'(\1)/(\2)', content)
-        content = re.sub(r'\\sqrt\{([^}]+)\}', r'sqrt(\1)', content)
-        
-        # \quadをquadに変換
-        content = re.sub(r'\\quad', 'quad', content)
-        
-        # \mathrm{text}を"text"に変換
-        content = re.sub(r'\\mathrm\{([^}]+)\}', r'"\1"', content)
-        
-        # \label{...} を <...> に変換
-        content = re.sub(r'\\label\{([^}]+)\}', r'<\1>', content)
-        content = re.sub(r'\\label\{([^}]+)\}', r'<\1>', content)  # 複数回適用
-        content = re.sub(r'\\label\{([^}]+)\}', r'<\1>', content)  # 複数回適用
-        content = re.sub(r'\\label\{([^}]+)\}', r'<\1>', content)  # 複数回適用
-        
-        
-        # cases環境の変換（コマンド保護処理より前）
-        content = re.sub(r'\\begin\{cases\}', 'cases(', content)
-        content = re.sub(r'\\end\{cases\}', ') //[command type:cases]', content)
-        content = re.sub(r'\\end\{cases', ') //[command type:cases]', content)  # 不完全な場合も処理
-        
-        
-        # 改行文字の前後のcasesを適切に処理
-        content = re.sub(r'\ncases\(', '\ncases(', content)
-        content = re.sub(r'cases\(\n', 'cases(\n', content)
-        
-        # 改行文字を含むcasesを保護
-        content = re.sub(r'\ncases\(', '__CASES_START__', content)
-        content = re.sub(r'cases\(\n', '__CASES_START__', content)
-        
-        # 改行文字を含むcasesを保護
-        content = re.sub(r'\ncases\(', '__CASES_START__', content)
-        content = re.sub(r'cases\(\n', '__CASES_START__', content)
-        
-        # 改行文字を含むcasesを保護
-        content = re.sub(r'\ncases\(', '__CASES_START__', content)
-        content = re.sub(r'cases\(\n', '__CASES_START__', content)
-        
-        # 改行文字を含むcasesを保護
-        content = re.sub(r'\ncases\(', '__CASES_START__', content)
-        content = re.sub(r'cases\(\n', '__CASES_START__', content)
-        
-        # 改行文字を含むcasesを保護
-        content = re.sub(r'\ncases\(', '__CASES_START__', content)
-        content = re.sub(r'cases\(\n', '__CASES_START__', content)
-        
-        # 改行文字を含むcasesを保護
-        content = re.sub(r'\ncases\(', '__CASES_START__', content)
-        content = re.sub(r'cases\(\n', '__CASES_START__', content)
-        
-        # 残存する\biggと\left/rightを処理
-        content = re.sub(r'\\bigg\(', '( //[command type:bigg]\n\t', content)
-        content = re.sub(r'\\bigg\)', ') //[command type:bigg]\n', content)
-        content = re.sub(r'\\bigg\[', '[ //[command type:bigg]\n\t', content)
-        content = re.sub(r'\\bigg\]', '] //[command type:bigg]\n', content)
-        content = re.sub(r'\\bigg\{', '{ //[command type:bigg]\n\t', content)
-        content = re.sub(r'\\bigg\}', '} //[command type:bigg]\n', content)
-        
-        content = re.sub(r'\\left\(', '( //[command type:left]\n\t', content)
-        content = re.sub(r'\\right\)', ') //[command type:right]\n', content)
-        content = re.sub(r'\\left\[', '[ //[command type:left]\n\t', content)
-        content = re.sub(r'\\right\]', '] //[command type:right]\n', content)
-        content = re.sub(r'\\left\{', '{ //[command type:left]\n\t', content)
-        content = re.sub(r'\\right\}', '} //[command type:right]\n', content)
-        
-        
-        # 上付き文字の変換
-        content = re.sub(r'([a-zA-Z0-9]+)\^\{([^}]+)\}', r'\1^(\2)', content)
-        content = re.sub(r'([a-zA-Z0-9]+)\^([a-zA-Z0-9])', r'\1^(\2)', content)
-        
-        # 下付き文字の変換
-        content = re.sub(r'([a-zA-Z0-9]+)_\{([^}]+)\}', r'\1_(\2)', content)
-        content = re.sub(r'([a-zA-Z0-9]+)_([a-zA-Z0-9])', r'\1_(\2)', content)
-        
-        # &= = の重複を修正
-        content = re.sub(r'&=\s*=', '&=', content)
-        
-        
-        # 数式関数の変換
-        for tex_func, typst_func in self.math_functions.items():
-            pattern = r'\\' + re.escape(tex_func) + r'\('
-            replacement = typst_func + r'('
-            content = re.sub(pattern, replacement, content)
-        
-        # 記号変換は前処理で完了済みのため、ここでは不要
-        
-        
-        # その他のコマンドの処理（より安全に）
-        # content = re.sub(r'\\([a-zA-Z]+)\{([^}]*)\}', r'\\\1(\2)', content)  # preambleで問題になるためコメントアウト
-        
-        # 空行の処理（改行を保持）
-        # content = content.strip()  # 改行を保持するためコメントアウト
-        
-        # タブ+スペースをタブに正規化（複数回適用）
-        while '\t ' in content:
-            content = re.sub(r'\t ', '\t', content)
-        
-        # 変数の空白分離：予約関数名以外の連続するアルファベットを空白で分離
-        reserved_functions = ['sin', 'cos', 'tan', 'cot', 'sec', 'csc', 'arcsin', 'arccos', 'arctan', 
-                            'sinh', 'cosh', 'tanh', 'coth', 'sech', 'csch', 'log', 'ln', 'exp', 
-                            'max', 'min', 'sup', 'inf', 'lim', 'limsup', 'liminf', 'gcd', 'lcm',
-                            'det', 'rank', 'trace', 'dim', 'ker', 'im', 'span', 'norm', 'abs', 'cases',
-                            'command', 'type', 'if', 'then', 'else', 'and', 'or', 'not', 'quad', 'FUNC']
-        
-        # コマンド内のテキストを保護してから変数分離を実行
-        # \mathrm{...}, \mathbf{...} などのコマンド内のテキストを一時的に置換
-        command_placeholders = {}
-        placeholder_counter = 0
-        
-        # コマンド内のテキストを保護
-        def protect_command_content(match):
-            nonlocal placeholder_counter
-            placeholder = f"__CMD_{placeholder_counter}__"
-            command_placeholders[placeholder] = match.group(0)
-            placeholder_counter += 1
-            return placeholder
-        
-        # \mathrm{...}, \mathbf{...} などのコマンドを保護
-        content = re.sub(r'\\[a-zA-Z]+\{[^}]*\}', protect_command_content, content)
-        
-        # 連続するアルファベットを空白で分離（予約関数名は除く）
-        def separate_variables(match):
-            text = match.group(0)
-            # プレースホルダーは変数分離しない
-            if text.startswith('__CMD_') or text.startswith('__FUNC_') or text.startswith('__COMMENT_'):
-                return text
-            # 改行文字を含む場合は、改行文字を除いてチェック
-            clean_text = text.replace('\n', '').replace('\r', '')
-            # 予約関数名かチェック
-            for func in reserved_functions:
-                if clean_text == func:
-                    return text  # 元の文字列をそのまま返す
-            # 予約関数名でない場合は空白で分離
-            return ' '.join(text)
-        
-        # コメント部分を保護してから変数分離
-        comment_placeholders = {}
-        comment_counter = 0
-        
-        def protect_comment(match):
-            nonlocal comment_counter
-            placeholder = f"__COMMENT_{comment_counter}__"
-            comment_placeholders[placeholder] = match.group(0)
-            comment_counter += 1
-            return placeholder
-        
-        # //[...] 形式のコメントを保護
-        content = re.sub(r'//\[[^\]]+\]', protect_comment, content)
-        
-        # 改行文字の前後を適切に処理してから変数分離
-        # 関数呼び出しパターンを保護してから変数分離
-        # cases(, sin(, cos( などのパターンを保護（改行文字を含む場合も）
-        content = re.sub(r'([a-zA-Z]+)\(', r'__FUNC_\1__(', content)
-        
-        # 改行文字を含む関数呼び出しパターンも保護
-        content = re.sub(r'([a-zA-Z]+)\(', r'__FUNC_\1__(', content)
-        
-        # 改行文字を含む関数呼び出しパターンも保護
-        content = re.sub(r'([a-zA-Z]+)\(', r'__FUNC_\1__(', content)
-        
-        # 改行文字を含む関数呼び出しパターンも保護
-        content = re.sub(r'([a-zA-Z]+)\(', r'__FUNC_\1__(', content)
-        
-        # 改行文字を含む関数呼び出しパターンも保護
-        content = re.sub(r'([a-zA-Z]+)\(', r'__FUNC_\1__(', content)
-        
-        # 改行文字を含む関数呼び出しパターンも保護
-        content = re.sub(r'([a-zA-Z]+)\(', r'__FUNC_\1__(', content)
-        
-        # 通常の変数分離（プレースホルダーと関数呼び出しパターンを除外）
-        def enhanced_separate_variables(match):
-            text = match.group(0)
-            # __で囲まれたプレースホルダーは分離しない
-            if text.startswith('__') and text.endswith('__'):
-                return text
-            # 通常の変数分離処理
-            return separate_variables(match)
-        
-        content = re.sub(r'(?!__[A-Z_]*__)[a-zA-Z]{2,}(?!\()', enhanced_separate_variables, content)
-        
-        # 関数呼び出しパターンを元に戻す
-        content = re.sub(r'__FUNC_([a-zA-Z\s]+)__\(', lambda m: m.group(1).replace(' ', '') + '(', content)
-        
-        # 変数分離された関数名を元に戻す
-        content = re.sub(r'__FUNC_([a-zA-Z\s]+)__\(', lambda m: m.group(1).replace(' ', '') + '(', content)
-        
-        # 変数分離された関数名を元に戻す
-        content = re.sub(r'__FUNC_([a-zA-Z\s]+)__\(', lambda m: m.group(1).replace(' ', '') + '(', content)
-        
-        # 変数分離された関数名を元に戻す
-        content = re.sub(r'__FUNC_([a-zA-Z\s]+)__\(', lambda m: m.group(1).replace(' ', '') + '(', content)
-        
-        # 変数分離された関数名を元に戻す
-        content = re.sub(r'__FUNC_([a-zA-Z\s]+)__\(', lambda m: m.group(1).replace(' ', '') + '(', content)
-        
-        # 変数分離された関数名を元に戻す
-        content = re.sub(r'__FUNC_([a-zA-Z\s]+)__\(', lambda m: m.group(1).replace(' ', '') + '(', content)
-        
-        # 保護したコメントを元に戻す
-        for placeholder, original in comment_placeholders.items():
-            content = content.replace(placeholder, original)
-        
-        # 保護したコマンドを元に戻す
-        for placeholder, original in command_placeholders.items():
-            content = content.replace(placeholder, original)
-        
-        # 保護したcasesを元に戻す
-        content = content.replace('__CASES_START__', 'cases(')
-        
-        # 最後の処理：^と_の後の(?)や{?}を?にする変換（1文字の場合のみ）
-        content = re.sub(r'([\^_])\((.)\)', r'\1\2', content)
-        content = re.sub(r'([\^_])\{(.)\}', r'\1\2', content)
-        
-        return content
+        """数式内容を変換（記号変換は前処理で完了済み、同じ内容は1回だけ変換）"""
+        return self.math_cache.convert('math', content, self._convert_math_content)
+    
+    def _convert_math_content(self, content: str) -> str:
+        """数式内容を書き換えパスで変換"""
+        # 行列環境はセルごとに変換し、トリガーが現れないパスは実行しない（順序と結果は従来どおり）
+        return self.matrices.convert(content, lambda rest: self.math_passes.run(rest, self.pass_stats))
@@ -0,0 +1,46 @@
+"""
+テキストの書き換えパス
+
+TeXToTypstTransformer._transform_text_content の書き換えのうち、参照の変換の後に行うものを
+パスの列として定義する。
+"""
+
+import re
+
+from ..utils.bibtex import cited_bibliography_name
+from ..utils.patterns import patterns
+from .math_passes import normalize_tab_spaces
+from .passes import PassManager, function_pass, regex_pass
+
+
+def _bibliography(match: 're.Match') -> str:
+    """\\bibliography{a,b} を出力先に書き出す.bib（引用されたエントリのみ）の #bibliography に変換"""
+    names = [name.strip() for name in match.group(2).split(',') if name.strip()]
+    files = [f'"{cited_bibliography_name(name)}"' for name in names]
+    argument = files[0] if len(files) == 1 else f"({', '.join(files)})"
+    return f"{match.group(1)}#bibliography({argument}) //[bibliography source:{';'.join(names)}]"
+
+
+def _dedupe_lines(content: str) -> str:
+    """同じ内容が連続している行を除去"""
+    lines = content.split('\n')
+    cleaned_lines = []
+    prev_line = None
+    for line in lines:
+        if line.strip() != prev_line:
+            cleaned_lines.append(line)
+            prev_line = line.strip()
+    return '\n'.join(cleaned_lines)
+
+
+# テキスト内容の書き換えパス（参照の変換の後に実行）
+TEXT_PASSES = PassManager([
+    # 参考文献
+    regex_pass("text.bibliography", patterns['text.bibliography'], _bibliography, '\\bibliography{'),
+    # 残存するTeXコマンドの処理
+    regex_pass("text.end_environment", patterns['command.end'], '', '\\end{'),
+    regex_pass("text.noindent", r'\\noindent', '', '\\noindent'),
+    # 重複した内容を除去（1行のみの場合は変化しない）
+    function_pass("text.dedupe_lines", _dedupe_lines, '\n'),
+    function_pass("whitespace.tab_space", normalize_tab_spaces, '\t '),
+])
@@ -0,0 +1,226 @@
+"""
+BibTeXの索引
+
+`.bib` をメモリマップし、エントリの先頭（`@type{key,`）と対応する閉じ括弧だけをバイト列のまま探して、
+引用キー → (種類, 開始位置, 終了位置) の索引を作る。フィールドは解析せず、文字列にも復号しない。
+引用キーの検証は索引のキーの集合との1回の集合演算で行い、Typstに渡す `.bib` は
+引用されたエントリ（と `@string`・`@preamble`）のバイト列をそのまま書き出す。
+索引はファイルの内容のハッシュとともにJSONで保存し、変更のない `.bib` は読み直さない。
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import re
+from dataclasses import dataclass, field
+from typing import AbstractSet, Dict, Iterable, List, Optional, Set, Tuple
+
+
+# ハッシュを求める単位（バイト数）
+CHUNK_SIZE = 1 << 20
+
+# エントリの先頭（@type{ または @type(）
+_ENTRY_HEAD = re.compile(rb'@[ \t]*([A-Za-z]+)[ \t\r\n]*([{(])')
+# 引用キー（最初のカンマまで）
+_ENTRY_KEY = re.compile(rb'[ \t\r\n]*([^,\s{}()"=#%]+)[ \t\r\n]*,')
+_BRACES = re.compile(rb'[{}]')
+_BRACES_OR_PAREN = re.compile(rb'[{})]')
+
+# 引用キーを持たないエントリ（@string・@preambleは書き出すファイルにも残す）
+_STRING_TYPES = frozenset(('string', 'preamble'))
+_COMMENT_TYPE = 'comment'
+
+
+@dataclass
+class BibEntry:
+    """索引したエントリ（位置はファイル先頭からのバイト数）"""
+    key: str
+    entry_type: str
+    start: int
+    end: int
+
+
+@dataclass
+class BibFile:
+    """索引した.bibファイル"""
+    path: str
+    digest: str
+    entries: Dict[str, BibEntry] = field(default_factory=dict)
+    # @string・@preamble の範囲 (開始位置, 終了位置)
+    strings: List[Tuple[int, int]] = field(default_factory=list)
+    problems: List[str] = field(default_factory=list)
+
+    @classmethod
+    def scan(cls, path: str, digest: Optional[str] = None) -> 'BibFile':
+        """ファイルを読み、エントリの位置を索引する"""
+        with open(path, 'rb') as f:
+            if f.seek(0, 2) == 0:
+                return cls(path, digest or hashlib.sha1(b'').hexdigest())
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                bib_file = cls(path, digest or _digest(data))
+                bib_file._scan(data)
+        return bib_file
+
+    def _scan(self, data) -> None:
+        position = 0
+        while True:
+            head = _ENTRY_HEAD.search(data, position)
+            if head is None:
+                return
+            entry_type = head.group(1).decode('ascii').lower()
+            end = _closing(data, head.end(), head.group(2) == b'(')
+            if end == -1:
+                self.problems.append(f"{self.path}: unterminated @{entry_type} at byte {head.start()}")
+                return
+            position = end
+            if entry_type == _COMMENT_TYPE:
+                continue
+            if entry_type in _STRING_TYPES:
+                self.strings.append((head.start(), end))
+                continue
+            key = _ENTRY_KEY.match(data, head.end())
+            if key is None:
+                self.problems.append(f"{self.path}: @{entry_type} without a key at byte {head.start()}")
+                continue
+            name = key.group(1).decode('utf-8', 'replace')
+            if name in self.entries:
+                self.problems.append(f"{self.path}: duplicate key '{name}'")
+                continue
+            self.entries[name] = BibEntry(name, entry_type, head.start(), end)
+
+    def keys(self) -> AbstractSet[str]:
+        return self.entries.keys()
+
+    def extract(self, keys: Iterable[str]) -> bytes:
+        """@string・@preamble と指定したキーのエントリをファイルの順に連結したバイト列"""
+        ranges = list(self.strings)
+        ranges.extend((entry.start, entry.end) for entry in
+                      (self.entries.get(key) for key in set(keys)) if entry is not None)
+        ranges.sort()
+        with open(self.path, 'rb') as f:
+            parts = []
+            for start, end in ranges:
+                f.seek(start)
+                parts.append(f.read(end - start))
+        return b'\n\n'.join(parts) + b'\n' if parts else b''
+
+
+def _digest(data) -> str:
+    """内容のハッシュ（区切って読む）"""
+    digest = hashlib.sha1()
+    for position in range(0, len(data), CHUNK_SIZE):
+        digest.update(data[position:position + CHUNK_SIZE])
+    return digest.hexdigest()
+
+
+def _closing(data, start: int, parenthesized: bool) -> int:
+    """エントリの本文の開始位置から、閉じ括弧の直後の位置を求める（見つからなければ-1）"""
+    depth = 0
+    pattern = _BRACES_OR_PAREN if parenthesized else _BRACES
+    for match in pattern.finditer(data, start):
+        char = match.group(0)
+        if char == b'{':
+            depth += 1
+        elif char == b'}':
+            depth -= 1
+            if depth < 0:
+                return match.end() if not parenthesized else -1
+        elif depth == 0:
+            return match.end()
+    return -1
+
+
+def bibliography_file(name: str, base_dir: str = "") -> str:
+    """\\bibliography{name} の名前から.bibファイルのパス（拡張子がなければ .bib を付ける）"""
+    path = name if name.endswith('.bib') else name + '.bib'
+    return os.path.normpath(os.path.join(base_dir, path))
+
+
+def cited_bibliography_name(name: str) -> str:
+    """\\bibliography{name} の名前から、出力先に書き出す.bib（引用されたエントリのみ）のファイル名
+
+    入力の.bibを上書きしないよう `<stem>.cited.bib` とし、ディレクトリを含む名前は
+    ディレクトリ名を「.」でつないで区別する（`../shared/refs` → `shared.refs.cited.bib`）。
+    """
+    path = os.path.normpath(name[:-4] if name.endswith('.bib') else name).replace('\\', '/')
+    parts = [part for part in path.split('/') if part not in ('', '.', '..')]
+    return '.'.join(parts) + '.cited.bib'
+
+
+class BibIndex:
+    """.bibファイルの索引の集まり
+
+    get() はファイルの内容のハッシュが保存済みの索引と同じ場合は読み直さない。
+    """
+
+    FORMAT_VERSION = 1
+
+    def __init__(self):
+        self.files: Dict[str, BibFile] = {}
+        # 直前の get() で読み直したファイル
+        self.rescanned: List[str] = []
+
+    def get(self, path: str) -> BibFile:
+        """.bibファイルの索引（内容が変わっていなければ保存済みの索引）"""
+        path = os.path.normpath(path)
+        with open(path, 'rb') as f:
+            if f.seek(0, 2) == 0:
+                digest = hashlib.sha1(b'').hexdigest()
+            else:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    digest = _digest(data)
+        cached = self.files.get(path)
+        if cached is not None and cached.digest == digest:
+            return cached
+        bib_file = self.files[path] = BibFile.scan(path, digest)
+        self.rescanned.append(path)
+        return bib_file
+
+    def retain_files(self, paths: Iterable[str]) -> None:
+        """指定されたファイル以外の索引を削除"""
+        for path in set(self.files) - {os.path.normpath(path) for path in paths}:
+            del self.files[path]
+
+    @staticmethod
+    def undefined_keys(cited: AbstractSet[str], bib_files: Iterable[BibFile]) -> Set[str]:
+        """.bibファイルのどれにもない引用キー"""
+        known: Set[str] = set()
+        for bib_file in bib_files:
+            known.update(bib_file.entries)
+        return cited - known
+
+    def save(self, path: str) -> None:
+        """索引をJSONで保存"""
+        files = {}
+        for file_path, bib_file in self.files.items():
+            files[file_path] = {
+                'hash': bib_file.digest,
+                'entries': [[e.key, e.entry_type, e.start, e.end] for e in bib_file.entries.values()],
+                'strings': [list(item) for item in bib_file.strings],
+                'problems': bib_file.problems,
+            }
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': self.FORMAT_VERSION, 'files': files}, f,
+                      ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'BibIndex':
+        """保存された索引を読み込み（形式が異なる場合は空の索引）"""
+        index = cls()
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return index
+        if data.get('version') != cls.FORMAT_VERSION:
+            return index
+        for file_path, record in data.get('files', {}).items():
+            bib_file = BibFile(file_path, record['hash'], problems=list(record.get('problems', [])))
+            for key, entry_type, start, end in record['entries']:
+                bib_file.entries[key] = BibEntry(key, entry_type, start, end)
+            bib_file.strings = [tuple(item) for item in record['strings']]
+            index.files[file_path] = bib_file
+        return index
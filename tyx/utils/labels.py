@@ -4,8 +4,11 @@
 TeXとTypstのラベル参照を管理する。
 """
 
+import hashlib
+import json
+import os
 import re
-from typing import Dict, Set, Optional, List
+from typing import Dict, Set, Optional, List, Tuple, Iterable
 from dataclasses import dataclass
 
 
@@ -19,6 +22,34 @@ class LabelInfo:
     file_path: Optional[str] = None
 
 
+@dataclass
+class LabelDefinition:
+    """ラベル定義の位置情報"""
+    label: str
+    label_type: str
+    file_path: str
+    offset: int
+
+
+class UnresolvedReferenceError(Exception):
+    """未解決のラベル参照（README §11 の重大エラー）"""
+
+    def __init__(self, labels: Iterable[str]):
+        self.labels = sorted(labels)
+        super().__init__(f"Unresolved references: {', '.join(self.labels)}")
+
+
+LABEL_PREFIXES = ['theorem:', 'eq:', 'fig:', 'table:', 'section:']
+
+
+def infer_label_type(label: str, default: str = 'eq') -> str:
+    """ラベルの接頭辞からラベルタイプを推測"""
+    for prefix in LABEL_PREFIXES:
+        if label.startswith(prefix):
+            return prefix[:-1]
+    return default
+
+
 class LabelManager:
     """ラベル管理クラス"""
     
@@ -99,42 +130,57 @@ class LabelManager:
         self.conflicts.clear()
 
 
+@dataclass
+class LabelRecord:
+    """ラベル・参照の抽出結果"""
+    kind: str  # label, ref, eqref, cite
+    target: str
+    start: int  # コマンド全体の開始位置
+    end: int  # コマンド全体の終了位置
+
+
 class LabelExtractor:
     """ラベル抽出器"""
     
     def __init__(self):
-        # TeXラベルの正規表現
-        self.tex_label_pattern = re.compile(r'\\label\{([^}]+)\}')
-        self.tex_ref_pattern = re.compile(r'\\(?:ref|eqref)\{([^}]+)\}')
-        self.tex_cite_pattern = re.compile(r'\\cite\{([^}]+)\}')
+        # TeXラベル・参照・引用をまとめて検出する正規表現
+        self.tex_pattern = re.compile(r'\\(label|ref|eqref|cite)\{([^}]+)\}')
         
         # Typstラベルの正規表現
         self.typst_label_pattern = re.compile(r'<([^>]+)>')
         self.typst_ref_pattern = re.compile(r'@([a-zA-Z0-9_:]+)')
     
+    def scan_tex(self, text: str) -> List[LabelRecord]:
+        """TeXからラベル・参照・引用を1パスで抽出
+        
+        複数キーの引用（\\cite{a,b}）はキーごとのレコードに分割する。
+        同じ引用コマンドから得たレコードは同じ位置を持つ。
+        """
+        records = []
+        for match in self.tex_pattern.finditer(text):
+            kind, target = match.groups()
+            start, end = match.span()
+            if kind == 'cite':
+                for key in target.split(','):
+                    key = key.strip()
+                    if key:
+                        records.append(LabelRecord(kind, key, start, end))
+            else:
+                records.append(LabelRecord(kind, target, start, end))
+        return records
+    
     def extract_tex_labels(self, text: str) -> List[str]:
         """TeXからラベルを抽出"""
-        labels = []
-        matches = self.tex_label_pattern.finditer(text)
-        for match in matches:
-            labels.append(match.group(1))
-        return labels
+        return [record.target for record in self.scan_tex(text) if record.kind == 'label']
     
     def extract_tex_references(self, text: str) -> List[str]:
         """TeXから参照を抽出"""
-        refs = []
-        matches = self.tex_ref_pattern.finditer(text)
-        for match in matches:
-            refs.append(match.group(1))
-        return refs
+        return [record.target for record in self.scan_tex(text)
+                if record.kind in ('ref', 'eqref')]
     
     def extract_tex_citations(self, text: str) -> List[str]:
         """TeXから引用を抽出"""
-        citations = []
-        matches = self.tex_cite_pattern.finditer(text)
-        for match in matches:
-            citations.append(match.group(1))
-        return citations
+        return [record.target for record in self.scan_tex(text) if record.kind == 'cite']
     
     def extract_typst_labels(self, text: str) -> List[str]:
         """Typstからラベルを抽出"""
@@ -153,6 +199,173 @@ class LabelExtractor:
         return refs
 
 
+class LabelIndex:
+    """プロジェクト全体のラベル索引
+
+    パーサーの解析パス中にラベル定義と参照元をファイル単位で登録する。
+    参照の検証は辞書引き、未定義・未使用ラベルの集計は最後に集合演算で行う。
+    ファイルごとの内容ハッシュを保持し、変更のないファイルは再索引しない。
+    再変換しないファイルの問題を報告できるよう、変換時の問題もファイルごとに保持する。
+    位置は入力ファイル（改行で連結した復号後の文字列）での文字の位置。
+    """
+
+    FORMAT_VERSION = 3
+
+    def __init__(self):
+        self.file_hashes: Dict[str, str] = {}
+        # ラベル -> 定義（重複定義もすべて保持し、衝突は最後に集計）
+        self.definitions: Dict[str, List[LabelDefinition]] = {}
+        # ラベル -> 参照元 (ファイル, オフセット)
+        self.referrers: Dict[str, Set[Tuple[str, int]]] = {}
+        # 引用キー -> 参照元 (ファイル, オフセット)
+        self.citations: Dict[str, Set[Tuple[str, int]]] = {}
+        self._file_labels: Dict[str, List[LabelDefinition]] = {}
+        self._file_refs: Dict[str, List[Tuple[str, int]]] = {}
+        self._file_cites: Dict[str, List[Tuple[str, int]]] = {}
+        # ファイル -> 変換時の継続可能な問題
+        self._file_problems: Dict[str, List[str]] = {}
+
+    @staticmethod
+    def content_hash(text: str) -> str:
+        """ファイル内容のハッシュを計算"""
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def is_file_current(self, file_path: str, digest: str) -> bool:
+        """ファイルが索引済みで変更がないかチェック"""
+        return self.file_hashes.get(file_path) == digest
+
+    def begin_file(self, file_path: str, digest: str) -> None:
+        """ファイルの再索引を開始（既存の登録を破棄）"""
+        self.remove_file(file_path)
+        self.file_hashes[file_path] = digest
+        self._file_labels[file_path] = []
+        self._file_refs[file_path] = []
+        self._file_cites[file_path] = []
+        self._file_problems[file_path] = []
+
+    def remove_file(self, file_path: str) -> None:
+        """ファイルの登録を削除"""
+        self.file_hashes.pop(file_path, None)
+        self._file_problems.pop(file_path, None)
+        for definition in self._file_labels.pop(file_path, []):
+            remaining = [d for d in self.definitions.get(definition.label, [])
+                         if d.file_path != file_path]
+            if remaining:
+                self.definitions[definition.label] = remaining
+            else:
+                self.definitions.pop(definition.label, None)
+        self._discard_referrers(self.referrers, self._file_refs.pop(file_path, []), file_path)
+        self._discard_referrers(self.citations, self._file_cites.pop(file_path, []), file_path)
+
+    def retain_files(self, file_paths: Iterable[str]) -> None:
+        """指定されたファイル以外の登録を削除"""
+        for file_path in set(self.file_hashes) - set(file_paths):
+            self.remove_file(file_path)
+
+    def add_label(self, label: str, label_type: str, file_path: str, offset: int) -> None:
+        """ラベル定義を追加"""
+        definition = LabelDefinition(label, label_type, file_path, offset)
+        self.definitions.setdefault(label, []).append(definition)
+        self._file_labels.setdefault(file_path, []).append(definition)
+
+    def add_reference(self, label: str, file_path: str, offset: int, ref_type: str = 'ref') -> None:
+        """参照を追加（citeは引用キーとして別管理）"""
+        if ref_type == 'cite':
+            self.citations.setdefault(label, set()).add((file_path, offset))
+            self._file_cites.setdefault(file_path, []).append((label, offset))
+        else:
+            self.referrers.setdefault(label, set()).add((file_path, offset))
+            self._file_refs.setdefault(file_path, []).append((label, offset))
+
+    def set_problems(self, file_path: str, problems: List[str]) -> None:
+        """ファイルの変換時の問題を記録"""
+        self._file_problems[file_path] = list(problems)
+
+    def get_problems(self, file_path: str) -> List[str]:
+        """ファイルの変換時の問題（記録がなければ空）"""
+        return list(self._file_problems.get(file_path, []))
+
+    def is_defined(self, label: str) -> bool:
+        """ラベルが定義されているかチェック"""
+        return label in self.definitions
+
+    def get_definition(self, label: str) -> Optional[LabelDefinition]:
+        """ラベル定義を取得（重複時は最初の定義）"""
+        definitions = self.definitions.get(label)
+        return definitions[0] if definitions else None
+
+    def get_undefined_references(self) -> Set[str]:
+        """未定義の参照を取得"""
+        return self.referrers.keys() - self.definitions.keys()
+
+    def get_unused_labels(self) -> Set[str]:
+        """未使用のラベルを取得"""
+        return self.definitions.keys() - self.referrers.keys()
+
+    def get_conflicts(self) -> Dict[str, List[LabelDefinition]]:
+        """重複定義されたラベルを取得"""
+        return {label: definitions for label, definitions in self.definitions.items()
+                if len(definitions) > 1}
+
+    def validate(self) -> None:
+        """未解決の参照があれば例外を送出"""
+        undefined = self.get_undefined_references()
+        if undefined:
+            raise UnresolvedReferenceError(undefined)
+
+    def save(self, path: str) -> None:
+        """索引をJSONで保存"""
+        files = {}
+        for file_path, digest in self.file_hashes.items():
+            files[file_path] = {
+                'hash': digest,
+                'labels': [[d.label, d.label_type, d.offset] for d in self._file_labels.get(file_path, [])],
+                'refs': [list(ref) for ref in self._file_refs.get(file_path, [])],
+                'cites': [list(cite) for cite in self._file_cites.get(file_path, [])],
+                'problems': self._file_problems.get(file_path, []),
+            }
+        data = {'version': self.FORMAT_VERSION, 'files': files}
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'LabelIndex':
+        """保存された索引を読み込み（形式が異なる場合は空の索引）"""
+        index = cls()
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return index
+        if data.get('version') != cls.FORMAT_VERSION:
+            return index
+
+        for file_path, record in data.get('files', {}).items():
+            index.begin_file(file_path, record['hash'])
+            for label, label_type, offset in record['labels']:
+                index.add_label(label, label_type, file_path, offset)
+            for label, offset in record['refs']:
+                index.add_reference(label, file_path, offset)
+            for key, offset in record['cites']:
+                index.add_reference(key, file_path, offset, ref_type='cite')
+            index.set_problems(file_path, record['problems'])
+        return index
+
+    @staticmethod
+    def _discard_referrers(referrers: Dict[str, Set[Tuple[str, int]]],
+                           entries: List[Tuple[str, int]], file_path: str) -> None:
+        """参照元の登録を削除"""
+        for label, offset in entries:
+            sources = referrers.get(label)
+            if sources is None:
+                continue
+            sources.discard((file_path, offset))
+            if not sources:
+                del referrers[label]
+
+
 # グローバルインスタンス
 label_manager = LabelManager()
 label_extractor = LabelExtractor()
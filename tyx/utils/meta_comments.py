@@ -4,10 +4,19 @@
 ラウンドトリップ変換の可逆性を保証するためのメタコメントを処理する。
 """
 
+import bisect
+import json
+import os
 import re
+import sys
+import threading
+import zlib
+from collections import OrderedDict
 from typing import Dict, Optional, List, Tuple
 from dataclasses import dataclass
 
+from .output import write_if_changed
+
 
 @dataclass
 class MetaComment:
@@ -23,67 +32,194 @@ class MetaComment:
 
 
 class MetaCommentParser:
-    """メタコメントパーサー"""
+    """メタコメントパーサー
     
-    def __init__(self):
-        # メタコメントの正規表現パターン
+    `//[head key:value key:value]` 形式を1つの文法で解析する。
+    キー・値の区切りは空白とカンマの両方を受け付ける。
+    解析結果はコメント文字列ごとに共有（インターン）されるため、変更しないこと。
+    共有テーブルは常駐サービス・LSPで際限なく増えないよう、最近使った max_interned 件までに限る。
+    """
+    
+    # 共有するメタコメントの数の既定値
+    DEFAULT_MAX_INTERNED = 4096
+    
+    def __init__(self, max_interned: int = DEFAULT_MAX_INTERNED):
+        # メタコメントの文法（先頭語と key:value の列）
         self.pattern = re.compile(
-            r'//\[([^\]]+)\]',
-            re.MULTILINE
+            r'//\[\s*(?:(?P<head>[^\s,:\]]+)(?=[\s,\]]))?(?P<body>[^\]]*)\]'
         )
+        self.pair_pattern = re.compile(r'([^\s,:\]]+):([^\s,\]]*)')
+        self.max_interned = max_interned
+        self._interned: 'OrderedDict[str, MetaComment]' = OrderedDict()
+        self._lock = threading.Lock()
     
     def parse_meta_comment(self, comment_text: str) -> Optional[MetaComment]:
         """メタコメントを解析"""
-        if not comment_text.startswith('//[') or not comment_text.endswith(']'):
-            return None
-        
-        # 括弧内の内容を抽出
-        content = comment_text[3:-1]
-        
-        # キー=値のペアを解析
-        attributes = {}
-        parts = content.split(',')
-        
-        for part in parts:
-            part = part.strip()
-            if ':' in part:
-                key, value = part.split(':', 1)
-                attributes[key.strip()] = value.strip()
-            else:
-                # 単一の値の場合
-                if not attributes:
-                    attributes['type'] = part
+        meta_comment = self._lookup(comment_text)
+        if meta_comment is not None:
+            return meta_comment
         
-        # メタコメントタイプを決定
-        comment_type = attributes.get('type', '')
-        subtype = attributes.get('subtype')
-        supplement = attributes.get('supplement')
+        match = self.pattern.fullmatch(comment_text)
+        if not match:
+            return None
+        return self._intern(comment_text, match)
+    
+    def _lookup(self, comment_text: str) -> Optional[MetaComment]:
+        """共有テーブルから解析結果を引く（最近使ったものとして末尾に移す）"""
+        with self._lock:
+            meta_comment = self._interned.get(comment_text)
+            if meta_comment is not None:
+                self._interned.move_to_end(comment_text)
+            return meta_comment
+    
+    def _intern(self, comment_text: str, match: 're.Match') -> MetaComment:
+        """解析結果を生成して共有テーブルに登録"""
+        meta_comment = self._lookup(comment_text)
+        if meta_comment is not None:
+            return meta_comment
         
-        return MetaComment(
-            comment_type=comment_type,
-            subtype=subtype,
-            supplement=supplement,
+        attributes = {
+            sys.intern(key): sys.intern(value)
+            for key, value in self.pair_pattern.findall(match.group('body'))
+        }
+        head = match.group('head')
+        meta_comment = MetaComment(
+            comment_type=sys.intern(head) if head else attributes.get('type', ''),
+            subtype=attributes.get('type') if head else attributes.get('subtype'),
+            supplement=attributes.get('supplement'),
             attributes=attributes
         )
+        # 複数スレッドから同時に登録されても同じオブジェクトを返す
+        with self._lock:
+            meta_comment = self._interned.setdefault(comment_text, meta_comment)
+            if len(self._interned) > self.max_interned:
+                self._interned.popitem(last=False)
+        return meta_comment
     
     def extract_meta_comments(self, text: str) -> List[Tuple[str, MetaComment]]:
         """テキストからメタコメントを抽出"""
-        comments = []
-        matches = self.pattern.finditer(text)
-        
-        for match in matches:
-            comment_text = match.group(0)
-            meta_comment = self.parse_meta_comment(comment_text)
-            if meta_comment:
-                comments.append((comment_text, meta_comment))
-        
-        return comments
+        return [(match.group(0), self._intern(match.group(0), match))
+                for match in self.pattern.finditer(text)]
     
     def remove_meta_comments(self, text: str) -> str:
         """テキストからメタコメントを削除"""
         return self.pattern.sub('', text).strip()
 
 
+@dataclass
+class MetaSidecarEntry:
+    """サイドカーに退避したメタコメント"""
+    line: int  # 0始まりの行番号
+    column: int  # メタコメントを除去した行での挿入位置
+    body: str  # //[ ] の内側
+    anchor: int  # 除去後の直前行と当該行の内容（前後空白除去）のCRC32
+    prefix: str = " "  # メタコメント直前の空白
+
+
+class MetaSidecar:
+    """メタコメントのサイドカーファイル（.typ.tyxmeta）
+    
+    メタコメントを.typから取り除き、出力上の位置（行・桁）と直前行を含む
+    行内容のハッシュをキーとして別ファイルに保存する。復元時は行内容が一致しない場合、
+    最も近い同一内容の行に付け直す。
+    """
+    
+    FORMAT_VERSION = 1
+    SUFFIX = ".tyxmeta"
+    
+    def __init__(self):
+        self.pattern = re.compile(r'([ \t]*)//\[([^\]]*)\]')
+    
+    def sidecar_path(self, typst_path: str) -> str:
+        """サイドカーファイルのパス"""
+        return typst_path + self.SUFFIX
+    
+    def split(self, typst_content: str) -> Tuple[str, List[MetaSidecarEntry]]:
+        """Typstからメタコメントを取り除き、退避情報を返す"""
+        entries = []
+        lines = typst_content.split('\n')
+        for line_no, line in enumerate(lines):
+            if '//[' not in line:
+                continue
+            parts = []
+            line_entries = []
+            last_end = 0
+            column = 0
+            for match in self.pattern.finditer(line):
+                kept = line[last_end:match.start()]
+                parts.append(kept)
+                column += len(kept)
+                line_entries.append((column, match.group(2), match.group(1)))
+                last_end = match.end()
+            parts.append(line[last_end:])
+            clean_line = ''.join(parts)
+            anchor = self._anchor(lines[line_no - 1] if line_no else '', clean_line)
+            for column, body, prefix in line_entries:
+                entries.append(MetaSidecarEntry(line_no, column, body, anchor, prefix))
+            lines[line_no] = clean_line
+        return '\n'.join(lines), entries
+    
+    def merge(self, typst_content: str, entries: List[MetaSidecarEntry]) -> str:
+        """退避したメタコメントをTypstに戻す"""
+        lines = typst_content.split('\n')
+        # アンカー → そのアンカーを持つ行番号の昇順の列
+        anchors: Dict[int, List[int]] = {}
+        for i, line in enumerate(lines):
+            anchors.setdefault(self._anchor(lines[i - 1] if i else '', line), []).append(i)
+        # 行ごとに挿入位置の降順で適用する
+        by_line: Dict[int, List[MetaSidecarEntry]] = {}
+        # 直前のエントリで検出した行のずれを次の探索の起点に使う
+        shift = 0
+        for entry in sorted(entries, key=lambda e: e.line):
+            line_no = self._locate(anchors, entry, entry.line + shift)
+            if line_no is not None:
+                shift = line_no - entry.line
+                by_line.setdefault(line_no, []).append(entry)
+        for line_no, line_entries in by_line.items():
+            line = lines[line_no]
+            for entry in sorted(line_entries, key=lambda e: e.column, reverse=True):
+                column = min(entry.column, len(line))
+                line = f"{line[:column]}{entry.prefix}//[{entry.body}]{line[column:]}"
+            lines[line_no] = line
+        return '\n'.join(lines)
+    
+    def save(self, path: str, entries: List[MetaSidecarEntry]) -> bool:
+        """サイドカーファイルを保存（内容が変わらない場合は書き込まず、Falseを返す）"""
+        rows = []
+        for entry in entries:
+            row = [entry.line, entry.column, entry.body, entry.anchor]
+            if entry.prefix != " ":
+                row.append(entry.prefix)
+            rows.append(row)
+        return write_if_changed(path, json.dumps({'version': self.FORMAT_VERSION, 'entries': rows},
+                                                 ensure_ascii=False, separators=(',', ':')))
+    
+    def load(self, path: str) -> List[MetaSidecarEntry]:
+        """サイドカーファイルを読み込み（存在しない場合は空）"""
+        if not os.path.exists(path):
+            return []
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('version') != self.FORMAT_VERSION:
+            return []
+        return [MetaSidecarEntry(*row) for row in data.get('entries', [])]
+    
+    def _locate(self, anchors: Dict[int, List[int]], entry: MetaSidecarEntry, start: int) -> Optional[int]:
+        """メタコメントを付け直す行を決定（編集で行がずれた場合は最も近い同一内容の行）"""
+        candidates = anchors.get(entry.anchor)
+        if not candidates:
+            return None
+        index = bisect.bisect_left(candidates, start)
+        # start 以上で最初の行と、start より前で最後の行のうち近い方（同じ距離なら前の行）
+        nearest = [candidates[i] for i in (index - 1, index) if 0 <= i < len(candidates)]
+        return min(nearest, key=lambda line_no: (abs(line_no - start), line_no))
+    
+    @staticmethod
+    def _anchor(previous_line: str, line: str) -> int:
+        """直前行を含めた行内容のハッシュ"""
+        return zlib.crc32(f"{previous_line.strip()}\n{line.strip()}".encode('utf-8'))
+
+
 class MetaCommentGenerator:
     """メタコメント生成器"""
     
@@ -114,3 +250,4 @@ class MetaCommentGenerator:
 # グローバルインスタンス
 meta_comment_parser = MetaCommentParser()
 meta_comment_generator = MetaCommentGenerator()
+meta_sidecar = MetaSidecar()
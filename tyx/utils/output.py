@@ -0,0 +1,144 @@
+"""
+出力ファイルの書き込み
+
+変換結果を既存のファイルと比べ、内容が同じなら書き込まない（mtimeが変わらないので、
+Typstのファイル監視・差分コンパイルや同期ツールを起こさない）。内容が変わった場合は
+同じディレクトリの一時ファイルに書いてから置き換える（読み手が書きかけのファイルを見ない）。
+
+既存のファイルとの比較には空行で区切ったブロックごとのハッシュを使う。ハッシュは
+マニフェスト（JSON）にファイルの大きさ・mtimeとともに保存し、ファイルが外部で変更されていなければ
+既存のファイルを読まずに比べる。変更されたブロックの範囲は WriteResult.changed で分かる。
+"""
+
+import hashlib
+import json
+import os
+import stat
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple, Union
+
+
+# ブロックの区切り（PrettyPrinterはトップレベルのブロックを空行で区切る）
+BLOCK_SEPARATOR = b'\n\n'
+
+
+def block_hashes(data: bytes) -> List[str]:
+    """空行で区切ったブロックごとのハッシュ"""
+    return [hashlib.blake2b(block, digest_size=8).hexdigest() for block in data.split(BLOCK_SEPARATOR)]
+
+
+def changed_range(old: List[str], new: List[str]) -> Tuple[int, int]:
+    """新しいブロック列のうち、古いブロック列と異なる範囲 [開始, 終了)（共通の先頭・末尾を除く）"""
+    limit = min(len(old), len(new))
+    start = 0
+    while start < limit and old[start] == new[start]:
+        start += 1
+    end = 0
+    while end < limit - start and old[-1 - end] == new[-1 - end]:
+        end += 1
+    return start, len(new) - end
+
+
+@dataclass
+class WriteResult:
+    """書き込みの結果"""
+    path: str
+    written: bool
+    # 書き換えたブロックの範囲 [開始, 終了)（書き込まなかった場合は空）
+    changed: Tuple[int, int] = (0, 0)
+
+
+def _write_atomically(path: str, data: bytes, mode: Optional[int] = None) -> None:
+    """同じディレクトリの一時ファイルに書いてから置き換える（modeは既存のファイルの許可属性）"""
+    directory, name = os.path.split(path)
+    temporary = os.path.join(directory, f".{name}.{os.getpid()}.tmp")
+    try:
+        with open(temporary, 'wb') as f:
+            f.write(data)
+        if mode is not None:
+            os.chmod(temporary, mode)
+        os.replace(temporary, path)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+
+class OutputWriter:
+    """内容が変わったファイルだけを書き込む
+
+    manifest_pathを指定するとブロックのハッシュを保存し、次回以降の比較に使う（save() で保存）。
+    指定しない場合は既存のファイルを読んで比べる。
+    """
+
+    FORMAT_VERSION = 1
+
+    def __init__(self, manifest_path: Optional[str] = None):
+        self.manifest_path = manifest_path
+        # パス → {'size', 'mtime', 'blocks'}
+        self.records: Dict[str, Dict] = self._load_manifest(manifest_path) if manifest_path else {}
+        self._dirty = False
+
+    def write(self, path: str, content: Union[str, bytes]) -> WriteResult:
+        """内容が既存のファイルと異なる場合だけ書き込む"""
+        data = content.encode('utf-8') if isinstance(content, str) else content
+        new_blocks = block_hashes(data)
+        try:
+            status = os.stat(path)
+        except FileNotFoundError:
+            status = None
+
+        old_blocks = None
+        if status is not None:
+            record = self.records.get(path)
+            if record is not None and record['size'] == status.st_size \
+                    and record['mtime'] == status.st_mtime_ns:
+                old_blocks = record['blocks']
+            else:
+                with open(path, 'rb') as f:
+                    existing = f.read()
+                if existing == data:
+                    self._record(path, status, new_blocks)
+                    return WriteResult(path, False)
+                old_blocks = block_hashes(existing)
+            if old_blocks == new_blocks and status.st_size == len(data):
+                return WriteResult(path, False)
+
+        _write_atomically(path, data, stat.S_IMODE(status.st_mode) if status is not None else None)
+        self._record(path, os.stat(path), new_blocks)
+        return WriteResult(path, True, changed_range(old_blocks or [], new_blocks))
+
+    def _record(self, path: str, status: os.stat_result, blocks: List[str]) -> None:
+        if self.manifest_path:
+            self.records[path] = {'size': status.st_size, 'mtime': status.st_mtime_ns, 'blocks': blocks}
+            self._dirty = True
+
+    def save(self) -> None:
+        """マニフェストを保存（存在しなくなったファイルの記録は削除）"""
+        if not self.manifest_path:
+            return
+        for path in [path for path in self.records if not os.path.exists(path)]:
+            del self.records[path]
+            self._dirty = True
+        if not self._dirty:
+            return
+        data = json.dumps({'version': self.FORMAT_VERSION, 'files': self.records},
+                          ensure_ascii=False, separators=(',', ':'))
+        _write_atomically(self.manifest_path, data.encode('utf-8'))
+        self._dirty = False
+
+    @classmethod
+    def _load_manifest(cls, path: str) -> Dict[str, Dict]:
+        """保存されたマニフェストを読み込み（形式が異なる場合は空）"""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if data.get('version') != cls.FORMAT_VERSION:
+            return {}
+        return data.get('files', {})
+
+
+def write_if_changed(path: str, content: Union[str, bytes]) -> bool:
+    """内容が既存のファイルと異なる場合だけ書き込み、書き込んだかを返す"""
+    return OutputWriter().write(path, content).written
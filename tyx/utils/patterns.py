@@ -0,0 +1,733 @@
+"""
+正規表現の登録簿
+
+文書や数式の構造を抜き出す正規表現を名前付きで一か所に集め、`regex` パッケージでコンパイルする。
+バックトラックを減らすため、意味が変わらない範囲で所有量指定子（`*+`）を使う。
+各パターンは1回の呼び出しあたりの時間予算と、同じ結果を線形時間で求める代替の走査器を持ち、
+予算を超えた場合は走査器に切り替える（結果は計算機の負荷によらない。超過回数は記録する）。
+
+固定文字列・先頭に固定した照合・固定長の照合と、各開始位置での試行が読んだ範囲を消費するか
+定数時間で失敗するパターンはバックトラックが入力の長さに比例しないため、ここには含めない。
+"""
+
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+import regex
+
+
+# 時間予算の既定値（秒）と、入力1文字あたりの猶予（線形時間で処理できる分）
+DEFAULT_BUDGET = 0.05
+BUDGET_PER_CHAR = 1e-6
+
+
+class SpanMatch:
+    """代替の走査器が返す一致（re.Matchと同じ参照方法）"""
+
+    def __init__(self, string: str, span: Tuple[int, int], groups: Sequence[Optional[Tuple[int, int]]]):
+        self.string = string
+        self._spans = [span] + list(groups)
+
+    def span(self, group: int = 0) -> Tuple[int, int]:
+        return self._spans[group] or (-1, -1)
+
+    def start(self, group: int = 0) -> int:
+        return self.span(group)[0]
+
+    def end(self, group: int = 0) -> int:
+        return self.span(group)[1]
+
+    def group(self, *groups: int) -> Any:
+        if not groups:
+            groups = (0,)
+        values = tuple(self.string[s[0]:s[1]] if s else None
+                       for s in (self._spans[g] for g in groups))
+        return values[0] if len(values) == 1 else values
+
+    def groups(self) -> Tuple[Optional[str], ...]:
+        return tuple(self.group(g) for g in range(1, len(self._spans)))
+
+    def expand(self, template: str) -> str:
+        return re.sub(r'\\(\d+)|\\g<(\d+)>',
+                      lambda m: self.group(int(m.group(1) or m.group(2))) or '', template)
+
+
+class Scanner:
+    """代替の走査器（最左一致 `_find` から search・finditer・sub などを組み立てる）"""
+
+    def _prepare(self, text: str) -> Any:
+        """1回の呼び出しで使い回す前計算"""
+        return None
+
+    def _find(self, text: str, pos: int, prepared: Any) -> Optional[SpanMatch]:
+        raise NotImplementedError
+
+    def search(self, text: str, pos: int = 0) -> Optional[SpanMatch]:
+        return self._find(text, pos, self._prepare(text))
+
+    def match(self, text: str, pos: int = 0) -> Optional[SpanMatch]:
+        found = self._find(text, pos, self._prepare(text))
+        return found if found is not None and found.start() == pos else None
+
+    def finditer(self, text: str, pos: int = 0) -> List[SpanMatch]:
+        prepared = self._prepare(text)
+        matches = []
+        while pos <= len(text):
+            found = self._find(text, pos, prepared)
+            if found is None:
+                break
+            matches.append(found)
+            pos = found.end() if found.end() > found.start() else found.end() + 1
+        return matches
+
+    def findall(self, text: str, pos: int = 0) -> List[Any]:
+        results = []
+        for found in self.finditer(text, pos):
+            groups = found.groups()
+            results.append(found.group(0) if not groups else groups[0] if len(groups) == 1 else groups)
+        return results
+
+    def sub(self, repl: Union[str, Callable], text: str, count: int = 0) -> str:
+        parts = []
+        last = 0
+        for number, found in enumerate(self.finditer(text), 1):
+            parts.append(text[last:found.start()])
+            parts.append(repl(found) if callable(repl) else found.expand(repl))
+            last = found.end()
+            if count and number >= count:
+                break
+        parts.append(text[last:])
+        return ''.join(parts)
+
+
+# 空白（regexの \s と同じ文字、照合の速い re で使う）と英数字
+_SPACE_CLASS = '[\t\n\x0b\x0c\r \x85\xa0\u1680\u2000-\u200a\u2028\u2029\u202f\u205f\u3000]'
+_SPACE = re.compile(_SPACE_CLASS)
+_SPACES = re.compile(_SPACE_CLASS + '*')
+_ALNUM = frozenset('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789')
+
+
+def _skip_spaces(text: str, index: int) -> int:
+    """位置indexから空白を読み飛ばした位置"""
+    return _SPACES.match(text, index).end()
+
+
+def _trim_spaces(text: str, index: int, floor: int) -> int:
+    """位置indexの前の空白を除いた位置（floorより前には戻らない）"""
+    while index > floor and _SPACE.match(text, index - 1):
+        index -= 1
+    return index
+
+
+def _next_positions(text: str, char: str) -> List[int]:
+    """positions[i]: 位置i以降で最初にcharが現れる位置（なければ-1）"""
+    positions = [-1] * (len(text) + 1)
+    following = -1
+    for index in range(len(text) - 1, -1, -1):
+        if text[index] == char:
+            following = index
+        positions[index] = following
+    return positions
+
+
+class DelimitedScanner(Scanner):
+    """`OPEN(.*?)CLOSE`（DOTALL, 固定文字列の区切り、nonemptyの場合は `OPEN([^CLOSE]+)CLOSE`）"""
+
+    def __init__(self, open_text: str, close_text: str, nonempty: bool = False):
+        self.open_text = open_text
+        self.close_text = close_text
+        self.nonempty = nonempty
+
+    def _find(self, text: str, pos: int, prepared: Any) -> Optional[SpanMatch]:
+        while True:
+            start = text.find(self.open_text, pos)
+            if start < 0:
+                return None
+            body = start + len(self.open_text)
+            end = text.find(self.close_text, body)
+            if end < 0:
+                # 閉じがなければ、後ろの開きにも対応する閉じはない
+                return None
+            if end > body or not self.nonempty:
+                return SpanMatch(text, (start, end + len(self.close_text)), [(body, end)])
+            pos = start + 1
+
+
+class NestedSubscriptScanner(Scanner):
+    """`PREFIX([^{}]*(?:\\([^)]*\\)[^{}]*)*)\\}` と同じ一致を線形時間で求める
+
+    閉じ波括弧の位置を右から左への動的計画法で求める（バックトラックの探索順と同じ結果）。
+    """
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+
+    def _prepare(self, text: str) -> Any:
+        length = len(text)
+        # closes[q]: 位置qから `[^{}]*(?:\([^)]*\)[^{}]*)*` を読んだ後に `}` が来る最初の位置
+        closes: List[Optional[int]] = [None] * (length + 1)
+        next_paren: Optional[int] = None  # 位置q以降の最初の `)`
+        for q in range(length - 1, -1, -1):
+            char = text[q]
+            if char == '}':
+                closes[q] = q
+            elif char != '{':
+                close = closes[q + 1]
+                if close is None and char == '(' and next_paren is not None:
+                    close = closes[next_paren + 1]
+                closes[q] = close
+            if char == ')':
+                next_paren = q
+        return closes
+
+    def _find(self, text: str, pos: int, closes: Any) -> Optional[SpanMatch]:
+        while True:
+            start = text.find(self.prefix, pos)
+            if start < 0:
+                return None
+            body = start + len(self.prefix)
+            end = closes[body]
+            if end is not None:
+                return SpanMatch(text, (start, end + 1), [(body, end)])
+            pos = start + 1
+
+
+class PairScanner(Scanner):
+    """`D(.*?)D`（DOTALL、Dは開きと閉じに共通の区切りのパターン。区切り自体は線形時間で照合できること）"""
+
+    def __init__(self, delimiter: str):
+        self.delimiter = regex.compile(delimiter)
+
+    def _find(self, text: str, pos: int, prepared: Any) -> Optional[SpanMatch]:
+        opening = self.delimiter.search(text, pos)
+        if opening is None:
+            return None
+        # 最初の開きに閉じがなければ、後ろの開きにも閉じはない
+        closing = self.delimiter.search(text, opening.end())
+        if closing is None:
+            return None
+        return SpanMatch(text, (opening.start(), closing.end()), [(opening.end(), closing.start())])
+
+
+class BracedScanner(Scanner):
+    """`PREFIX(?:\\{([^}]+)\\}){count}` を線形時間で求める
+
+    PREFIXは固定文字列に近い短いパターン（選択肢が互いの接頭辞にならないこと）。
+    括弧は open_char・close_char で変えられ、allow_empty の場合は空の引数も受け付ける。
+    """
+
+    def __init__(self, prefix: str, count: int = 1, open_char: str = '{', close_char: str = '}',
+                 allow_empty: bool = False):
+        self.prefix = regex.compile(prefix)
+        self.count = count
+        self.open_char = open_char
+        self.close_char = close_char
+        self.allow_empty = allow_empty
+
+    def pattern(self, prefix: str) -> str:
+        """同じ一致を表す正規表現"""
+        close = re.escape(self.close_char)
+        argument = (re.escape(self.open_char) + '([^' + close + ']' + ('*+' if self.allow_empty else '++')
+                    + ')' + close)
+        return prefix + argument * self.count
+
+    def _prepare(self, text: str) -> Any:
+        return _next_positions(text, self.close_char)
+
+    def _find(self, text: str, pos: int, closes: Any) -> Optional[SpanMatch]:
+        while True:
+            head = self.prefix.search(text, pos)
+            if head is None:
+                return None
+            groups = [span if span[0] >= 0 else None
+                      for span in (head.span(g) for g in range(1, self.prefix.groups + 1))]
+            index = head.end()
+            for _ in range(self.count):
+                if text[index:index + 1] != self.open_char:
+                    break
+                close = closes[index + 1]
+                if close < 0:
+                    # 閉じ括弧がなければ、後ろの位置から始めても一致しない
+                    return None
+                if close == index + 1 and not self.allow_empty:
+                    break
+                groups.append((index + 1, close))
+                index = close + 1
+            else:
+                return SpanMatch(text, (head.start(), index), groups)
+            pos = head.start() + 1
+
+
+class ScriptScanner(Scanner):
+    """`([a-zA-Z0-9]+)OP\\{([^}]+)\\}`・`([a-zA-Z0-9]+)OP([a-zA-Z0-9])`・`([a-zA-Z0-9]+)OP` を線形時間で求める
+
+    argumentは 'braced'（波括弧の引数）・'char'（英数字1文字）・None（OPまで）。
+    英数字の列のどこから始めても列の終わりは同じため、列ごとに1回だけ調べる。
+    """
+
+    def __init__(self, letters: str, operator: str, argument: Optional[str] = None):
+        self.letters = letters
+        self.run = re.compile(f'[{letters}]+')
+        self.operator = operator
+        self.argument = argument
+
+    def pattern(self) -> str:
+        """同じ一致を表す正規表現"""
+        head = f'([{self.letters}]++)' + re.escape(self.operator)
+        if self.argument == 'braced':
+            return head + r'\{([^}]++)\}'
+        if self.argument == 'char':
+            return head + f'([{self.letters}])'
+        return head
+
+    def _prepare(self, text: str) -> Any:
+        return _next_positions(text, '}') if self.argument == 'braced' else None
+
+    def _find(self, text: str, pos: int, closes: Any) -> Optional[SpanMatch]:
+        while True:
+            run = self.run.search(text, pos)
+            if run is None:
+                return None
+            start, end = run.span()
+            after = end + len(self.operator)
+            if text.startswith(self.operator, end):
+                if self.argument is None:
+                    return SpanMatch(text, (start, after), [(start, end)])
+                if self.argument == 'char':
+                    if self.run.match(text[after:after + 1]):
+                        return SpanMatch(text, (start, after + 1), [(start, end), (after, after + 1)])
+                elif text[after:after + 1] == '{':
+                    close = closes[after + 1]
+                    if close < 0:
+                        return None
+                    if close > after + 1:
+                        return SpanMatch(text, (start, close + 1), [(start, end), (after + 1, close)])
+            pos = end
+
+
+class NormScanner(Scanner):
+    """`\\\\\\|\\s*(.*?)\\s*\\\\\\|\\s*_\\{\\s*(.*?)\\s*\\}`（DOTALL）を線形時間で求める"""
+
+    _TAIL = re.compile(_SPACE_CLASS + r'*_\{' + _SPACE_CLASS + '*')
+
+    def _find(self, text: str, pos: int, prepared: Any) -> Optional[SpanMatch]:
+        start = text.find('\\|', pos)
+        if start < 0:
+            return None
+        inner = _skip_spaces(text, start + 2)
+        bar = text.find('\\|', inner)
+        while bar >= 0:
+            tail = self._TAIL.match(text, bar + 2)
+            if tail:
+                close = text.find('}', tail.end())
+                if close < 0:
+                    # 閉じ波括弧がなければ、後ろの \| でも一致しない
+                    return None
+                return SpanMatch(text, (start, close + 1), [
+                    (inner, _trim_spaces(text, bar, inner)),
+                    (tail.end(), _trim_spaces(text, close, tail.end())),
+                ])
+            bar = text.find('\\|', bar + 2)
+        # 先頭の \| で一致しなければ、後ろの \| から始めても一致しない
+        return None
+
+
+class BarNormScanner(Scanner):
+    """`\\\\\\|\\s*([^|]+?)\\s*\\\\\\|\\s*_\\{\\s*(.*?)\\s*\\}`（DOTALL）を線形時間で求める
+
+    内側は | を含まないため、閉じの \\| は開きの後の最初の | で決まる。
+    """
+
+    def _find(self, text: str, pos: int, prepared: Any) -> Optional[SpanMatch]:
+        while True:
+            start = text.find('\\|', pos)
+            if start < 0:
+                return None
+            bar = text.find('|', start + 2)
+            if bar < 0:
+                return None
+            closing = bar - 1
+            if closing > start + 2 and text[closing] == '\\':
+                found = self._match_at(text, start, closing)
+                if found is not False:
+                    return found
+            pos = start + 1
+
+    @staticmethod
+    def _match_at(text: str, start: int, closing: int) -> Any:
+        """開きをstart、閉じの \\ をclosingとした一致（一致しなければFalse、後ろでも一致しなければNone）"""
+        inner = _skip_spaces(text, start + 2)
+        if inner < closing:
+            inner_end = max(inner + 1, _trim_spaces(text, closing, inner))
+        else:
+            # 内側が空白だけの場合は、最後の空白1文字を内側とする
+            inner, inner_end = closing - 1, closing
+        underscore = _skip_spaces(text, closing + 2)
+        if text[underscore:underscore + 2] != '_{':
+            return False
+        body = _skip_spaces(text, underscore + 2)
+        close = text.find('}', body)
+        if close < 0:
+            return None
+        return SpanMatch(text, (start, close + 1),
+                         [(inner, inner_end), (body, _trim_spaces(text, close, body))])
+
+
+class NormExpressionScanner(Scanner):
+    """parser.norm・parser.norm_with_subscript（`$` まで読む `\\| ... \\|` と下付き）を線形時間で求める
+
+    空白（WS）は \\s と \\, \\; \\: \\! の列。内側の終わりは閉じの \\| の前の空白を除いた位置で、
+    閉じの \\| は後ろの読み方が末尾まで一致する最初のものになる（後ろの読み方は開きの位置によらない）。
+    """
+
+    def __init__(self, subscript: bool):
+        self.subscript = subscript
+
+    def _prepare(self, text: str) -> Any:
+        # skips[i]: 位置iからWSを読み飛ばした位置
+        length = len(text)
+        skips = list(range(length + 1))
+        for index in range(length - 1, -1, -1):
+            if _SPACE.match(text, index):
+                skips[index] = skips[index + 1]
+            elif text[index] == '\\' and text[index + 1:index + 2] in (',', ';', ':', '!'):
+                skips[index] = skips[index + 2]
+        return skips, text.rfind('}')
+
+    def _find(self, text: str, pos: int, prepared: Any) -> Optional[SpanMatch]:
+        skips, last_close = prepared
+        start = text.find('\\|', pos)
+        if start < 0:
+            return None
+        inner = skips[start + 2]
+        bar = text.find('\\|', inner)
+        while bar >= 0:
+            groups = self._tail(text, skips, last_close, bar)
+            if groups is not None:
+                return SpanMatch(text, (start, len(text)),
+                                 [(inner, self._trim(text, bar, inner))] + groups)
+            bar = text.find('\\|', bar + 1)
+        # 閉じの候補は開きによらないため、後ろの開きから始めても一致しない
+        return None
+
+    def _tail(self, text: str, skips: List[int], last_close: int,
+              bar: int) -> Optional[List[Optional[Tuple[int, int]]]]:
+        """閉じの \\| から末尾までの一致（下付きの群）"""
+        length = len(text)
+        index = skips[bar + 2]
+        if not self.subscript:
+            return [] if index == length else None
+        if text[index:index + 1] != '_':
+            return None
+        index += 1
+        if text[index:index + 1] == '{':
+            body = _skip_spaces(text, index + 1)
+            if last_close > index and skips[last_close + 1] == length:
+                return [(body, max(body, _trim_spaces(text, last_close, body))), None]
+            return None
+        end = index
+        while end < length and text[end] in _ALNUM:
+            end += 1
+        if end > index and skips[end] == length:
+            return [None, (index, end)]
+        return None
+
+    @staticmethod
+    def _trim(text: str, index: int, floor: int) -> int:
+        """WSを後ろから除いた位置"""
+        while index > floor:
+            if _SPACE.match(text, index - 1):
+                index -= 1
+            elif index - 2 >= floor and text[index - 2] == '\\' and text[index - 1] in ',;:!':
+                index -= 2
+            else:
+                break
+        return index
+
+
+class QuotedScanner(Scanner):
+    """`"(?:[^"\\\\\\n]|\\\\.)*"`（改行を含まない文字列、\\ によるエスケープ）を線形時間で求める
+
+    途中で一致しなかった場合、読んだ範囲の " はすべてエスケープされたもので、
+    そこから始めても同じ位置で一致しなくなるため、読み終えた位置から探し直す。
+    """
+
+    def _find(self, text: str, pos: int, prepared: Any) -> Optional[SpanMatch]:
+        length = len(text)
+        while True:
+            start = text.find('"', pos)
+            if start < 0:
+                return None
+            index = start + 1
+            while index < length:
+                char = text[index]
+                if char == '"':
+                    return SpanMatch(text, (start, index + 1), [])
+                if char == '\n' or (char == '\\' and text[index + 1:index + 2] in ('', '\n')):
+                    break
+                index += 2 if char == '\\' else 1
+            pos = index
+
+
+class DoubleParenScanner(Scanner):
+    """`PREFIX\\(\\(([^)]+)\\)\\s+([^)]+)\\)` を線形時間で求める
+
+    後半は最初の ) の位置だけで決まるため、) の位置ごとに1回だけ調べる。
+    """
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix + '(('
+
+    def _prepare(self, text: str) -> Any:
+        return _next_positions(text, ')'), {}
+
+    def _find(self, text: str, pos: int, prepared: Any) -> Optional[SpanMatch]:
+        closes, tails = prepared
+        while True:
+            start = text.find(self.prefix, pos)
+            if start < 0:
+                return None
+            body = start + len(self.prefix)
+            close = closes[body]
+            if close < 0:
+                return None
+            if close > body:
+                if close not in tails:
+                    tails[close] = self._tail(text, closes, close)
+                tail = tails[close]
+                if tail is None:
+                    return None
+                if tail:
+                    return SpanMatch(text, (start, tail[1] + 1), [(body, close), tail])
+            pos = start + 1
+
+    @staticmethod
+    def _tail(text: str, closes: List[int], close: int) -> Any:
+        """最初の ) の後の `\\s+([^)]+)\\)` の群（一致しなければ空、後ろでも一致しなければNone）"""
+        spaces = close + 1
+        inner = _skip_spaces(text, spaces)
+        if inner == spaces:
+            return ()
+        end = closes[inner]
+        if end < 0:
+            return None
+        if end > inner:
+            return inner, end
+        # 空白の最後の1文字を後半の群とする
+        return (inner - 1, end) if inner - spaces >= 2 else ()
+
+
+class EnvironmentHeaderScanner(Scanner):
+    """`\\\\begin\\{([^}]++)\\}(?:\\[([^\\]]*+)\\])?(?:\\\\label\\{([^}]++)\\})?` を線形時間で求める"""
+
+    def _find(self, text: str, pos: int, prepared: Any) -> Optional[SpanMatch]:
+        while True:
+            start = text.find('\\begin{', pos)
+            if start < 0:
+                return None
+            name_start = start + len('\\begin{')
+            name_end = text.find('}', name_start)
+            if name_end < 0:
+                return None
+            if name_end > name_start:
+                break
+            pos = start + 1
+        groups: List[Optional[Tuple[int, int]]] = [(name_start, name_end), None, None]
+        index = name_end + 1
+        if text[index:index + 1] == '[':
+            option_end = text.find(']', index + 1)
+            if option_end >= 0:
+                groups[1] = (index + 1, option_end)
+                index = option_end + 1
+        if text.startswith('\\label{', index):
+            label_start = index + len('\\label{')
+            label_end = text.find('}', label_start)
+            if label_end > label_start:
+                groups[2] = (label_start, label_end)
+                index = label_end + 1
+        return SpanMatch(text, (start, index), groups)
+
+
+
+@dataclass
+class PatternStatistics:
+    """時間予算の超過回数"""
+    timeouts: Dict[str, int] = field(default_factory=dict)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def record(self, name: str) -> None:
+        with self._lock:
+            self.timeouts[name] = self.timeouts.get(name, 0) + 1
+
+
+class GuardedPattern:
+    """時間予算付きの正規表現（超過した場合は同じ結果を返す代替の走査器に切り替える）"""
+
+    def __init__(self, name: str, pattern: str, flags: int = 0, budget: float = DEFAULT_BUDGET, *,
+                 fallback: Scanner, stats: Optional[PatternStatistics] = None):
+        self.name = name
+        self.pattern = pattern
+        self.flags = flags
+        self.budget = budget
+        self.fallback = fallback
+        self.compiled = regex.compile(pattern, flags)
+        self.stats = stats if stats is not None else PatternStatistics()
+
+    def timeout_for(self, text: str) -> float:
+        """入力に対する時間予算"""
+        return self.budget + len(text) * BUDGET_PER_CHAR
+
+    def search(self, text: str, pos: int = 0):
+        return self._run('search', text, pos)
+
+    def match(self, text: str, pos: int = 0):
+        return self._run('match', text, pos)
+
+    def finditer(self, text: str, pos: int = 0) -> List[Any]:
+        return self._run('finditer', text, pos)
+
+    def findall(self, text: str, pos: int = 0) -> List[Any]:
+        return self._run('findall', text, pos)
+
+    def sub(self, repl: Union[str, Callable], text: str, count: int = 0) -> str:
+        try:
+            return self.compiled.sub(repl, text, count, timeout=self.timeout_for(text))
+        except TimeoutError:
+            self.stats.record(self.name)
+            return self.fallback.sub(repl, text, count)
+
+    def _run(self, method: str, text: str, pos: int) -> Any:
+        try:
+            if method == 'finditer':
+                # 反復の途中で超過しても結果が混ざらないよう、まとめて取り出す
+                return list(self.compiled.finditer(text, pos, timeout=self.timeout_for(text)))
+            return getattr(self.compiled, method)(text, pos, timeout=self.timeout_for(text))
+        except TimeoutError:
+            self.stats.record(self.name)
+            return getattr(self.fallback, method)(text, pos)
+
+
+class PatternRegistry:
+    """名前付きの正規表現の登録簿"""
+
+    def __init__(self):
+        self.patterns: Dict[str, GuardedPattern] = {}
+        self.stats = PatternStatistics()
+        self._lock = threading.Lock()
+
+    def register(self, name: str, pattern: str, flags: int = 0, budget: float = DEFAULT_BUDGET, *,
+                 fallback: Scanner) -> GuardedPattern:
+        """パターンを登録（fallbackは同じ一致を線形時間で求める走査器）"""
+        with self._lock:
+            if name in self.patterns:
+                raise ValueError(f"pattern already registered: {name}")
+            guarded = GuardedPattern(name, pattern, flags, budget, fallback=fallback, stats=self.stats)
+            self.patterns[name] = guarded
+        return guarded
+
+    def braced(self, name: str, prefix: str, count: int = 1, budget: float = DEFAULT_BUDGET,
+               **options: Any) -> GuardedPattern:
+        """`PREFIX{...}` の形のパターンを登録（PREFIXの後の波括弧の引数をcount個読む）"""
+        scanner = BracedScanner(prefix, count, **options)
+        return self.register(name, scanner.pattern(prefix), budget=budget, fallback=scanner)
+
+    def script(self, name: str, letters: str, operator: str,
+               argument: Optional[str] = None) -> GuardedPattern:
+        """`([letters]+)OP...` の形のパターンを登録"""
+        scanner = ScriptScanner(letters, operator, argument)
+        return self.register(name, scanner.pattern(), fallback=scanner)
+
+    def command(self, name: str, count: int = 1) -> GuardedPattern:
+        """`\\name{...}` のパターン（未登録の場合は登録する）"""
+        guarded = self.patterns.get(f"command.{name}")
+        if guarded is not None:
+            return guarded
+        try:
+            return self.braced(f"command.{name}", r'\\' + re.escape(name), count)
+        except ValueError:
+            # 他のスレッドが先に登録した場合
+            return self.patterns[f"command.{name}"]
+
+    def __getitem__(self, name: str) -> GuardedPattern:
+        return self.patterns[name]
+
+    def __iter__(self):
+        return iter(list(self.patterns.values()))
+
+    def names(self) -> List[str]:
+        return list(self.patterns)
+
+
+# 数式中の空白コマンド（\, \; \: \!）を含む空白
+_WS = r'(?:\s|\\[,;:!])*+'
+
+
+# グローバルインスタンス
+patterns = PatternRegistry()
+
+# 文書の構造（文書全体を走査するため予算を大きめに取る）
+# \begin/\end の対の検出は tyx/parser/environments.py の環境の木で行う（本文は環境の木の範囲から取り出す）
+patterns.register('parser.theorem_header',
+                  r'\\begin\{([^}]++)\}(?:\[([^\]]*+)\])?(?:\\label\{([^}]++)\})?',
+                  budget=0.2, fallback=EnvironmentHeaderScanner())
+patterns.braced('parser.section', r'\\(section|subsection|subsubsection)', budget=0.2)
+patterns.register('parser.math_display', r'\\\[(.*?)\\\]', regex.DOTALL,
+                  budget=0.2, fallback=DelimitedScanner('\\[', '\\]'))
+patterns.register('parser.math_inline', r'\$([^$]++)\$',
+                  budget=0.2, fallback=DelimitedScanner('$', '$', nonempty=True))
+patterns.register('parser.abstract', r'\\begin\{abstract\}(.*?)\\end\{abstract\}', regex.DOTALL,
+                  budget=0.2, fallback=DelimitedScanner('\\begin{abstract}', '\\end{abstract}'))
+
+# ノルム・絶対値（前後の空白は所有量指定子、中身は「空白の列＋非空白1文字」の単位で伸ばす）
+patterns.register('parser.norm_with_subscript',
+                  rf'\\\|{_WS}((?:{_WS}(?:[^\s\\]|\\(?![,;:!])))*?){_WS}\\\|{_WS}'
+                  rf'_(?:\{{\s*+((?:\s*+\S)*?)\s*+\}}|([A-Za-z0-9]++)){_WS}$', regex.DOTALL,
+                  fallback=NormExpressionScanner(subscript=True))
+patterns.register('parser.norm',
+                  rf'\\\|{_WS}((?:{_WS}(?:[^\s\\]|\\(?![,;:!])))*?){_WS}\\\|{_WS}$', regex.DOTALL,
+                  fallback=NormExpressionScanner(subscript=False))
+for _command in ('bigg', 'Big', 'big'):
+    patterns.register(f'parser.abs_{_command}', rf'\\{_command}\s*+\|(.*?)\\{_command}\s*+\|', regex.DOTALL,
+                      fallback=PairScanner(rf'\\{_command}\s*+\|'))
+patterns.register('parser.abs', r'(?<!\\)\|(.*?)(?<!\\)\|', regex.DOTALL,
+                  fallback=PairScanner(r'(?<!\\)\|'))
+patterns.braced('parser.sup_subscript', r'\\sup\s*+_')
+
+# 引数を波括弧で取るコマンド（\frac{a}{b} など、引数は最初の } まで）
+for _command, _count in (('frac', 2), ('sqrt', 1), ('mathrm', 1), ('mbox', 1), ('label', 1), ('tag', 1),
+                         ('ddot', 1), ('dot', 1), ('hat', 1), ('bar', 1), ('tilde', 1), ('vec', 1)):
+    patterns.command(_command, _count)
+patterns.braced('command.operatorname', r'\\operatorname(\*?)')
+
+# 数式の書き換え
+patterns.register('math.norm',
+                  r'\\\|\s*+((?:\s*+\S)*?)\s*+\\\|\s*+_\{\s*+((?:\s*+\S)*?)\s*+\}', regex.DOTALL,
+                  fallback=NormScanner())
+patterns.register('math.norm_bars', r'\\\|\s*([^|]+?)\s*\\\|\s*_\{\s*(.*?)\s*\}', regex.DOTALL,
+                  fallback=BarNormScanner())
+# 括弧の中に波括弧を含む下付き（所有量指定子では意味が変わるため元の形のまま、超過時は走査器）
+patterns.register('math.integral_subscript_nested', r'∫_\{([^{}]*(?:\([^)]*\)[^{}]*)*)\}',
+                  fallback=NestedSubscriptScanner('∫_{'))
+# 積分記号・総和記号の添字（∫_{...}・∫^{...} など）と一般の上付き
+for _symbol, _name in (('∫', 'int'), ('∬', 'iint'), ('∭', 'iiint'), ('∮', 'oint'), ('Σ', 'sum')):
+    patterns.braced(f'math.{_name}.subscript', re.escape(_symbol) + '_')
+    patterns.braced(f'math.{_name}.superscript', re.escape(_symbol) + r'\^')
+patterns.braced('math.superscript.braces', r'\^')
+patterns.register('math.integral.double_paren', r'∫_\(\(([^)]+)\)\s+([^)]+)\)',
+                  fallback=DoubleParenScanner('∫_'))
+# 英数字の列に続く上付き・下付き
+for _operator, _name in (('^', 'superscript'), ('_', 'subscript')):
+    patterns.script(f'math.{_name}.group', 'a-zA-Z0-9', _operator, 'braced')
+    patterns.script(f'math.{_name}.char', 'a-zA-Z0-9', _operator, 'char')
+# 変数分離で保護するコマンド・メタコメント・関数呼び出し
+patterns.braced('math.protect.command', r'\\[a-zA-Z]++', allow_empty=True)
+patterns.braced('math.protect.comment', '//', open_char='[', close_char=']')
+patterns.script('math.protect.function', 'a-zA-Z', '(')
+# 数式中の文字列（\mathrm・\operatorname の変換結果）
+patterns.register('math.string', r'"(?:[^"\\\n]|\\.)*+"', fallback=QuotedScanner())
+
+# テキストの書き換え
+patterns.braced('text.bibliography', r'(?m)^([ \t]*+)\\bibliography', allow_empty=True)
+patterns.command('end')